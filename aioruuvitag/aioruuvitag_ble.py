@@ -12,11 +12,15 @@ import asyncio
 import time
 import json
 from collections import defaultdict
-from datetime import datetime as _dt, timezone as _tz
+from datetime import datetime as _dt, timedelta as _td
 
 from .ruuvitag_decode import ruuvitag_decode as _tagdecode
 from .ruuvitag_calc import ruuvitag_calc as _tagcalc
-from .ruuvitag_misc import get_ms as _get_ms
+from .ruuvitag_misc import get_ms as _get_ms, int_to_mac
+from .ruuvitag_registry import ruuvitag_registry
+from .ruuvitag_seqtable import ruuvitag_seqtable
+from .ruuvitag_memo import ruuvitag_memo
+from .ruuvitag_sample import ruuvitag_sample
 
 from .ruuvitag_df3 import ruuvitag_df3 as _df3
 from .ruuvitag_df5 import ruuvitag_df5 as _df5
@@ -28,10 +32,14 @@ import platform
 
 from .aioruuvitag_dummy import ruuvitag_dummy
 from .aioruuvitag_bleak import ruuvitag_bleak
+from .aioruuvitag_replay import ruuvitag_replay
+from .aioruuvitag_synth import ruuvitag_synth
 if platform.system() == 'Windows':
     from .aioruuvitag_file import ruuvitag_file
 elif platform.system() == 'Linux':
     from .aioruuvitag_socket import ruuvitag_socket
+    from .aioruuvitag_multi import ruuvitag_multi
+    from .ble_emulator import hci_emulator
 
 DEFAULT_MINMAX = {
     "temperature": {
@@ -58,8 +66,9 @@ class aioruuvitag_ble(object):
     calls async callback(json=data)
     See consumer.py and callback.py
 
+     mac is the 48bit mac int (0xCBD71826DAB4), it is rendered to the string only by the sinks
      sample json data (calc_in_datas:False): {
-        'mac': 'CB:D7:18:26:DA:B4',
+        'mac': 224124683606708,
         'datas': {
             '_df': 5, 'humidity': 52.62, 'temperature': 29.34, 'pressure': 1005.48, 'acceleration': 1014.101, 'acceleration_x': -796, 'acceleration_y': -628, 'acceleration_z': -20, 'tx_power': 4, 'battery': 2827, 'movement_counter': 154, 'sequence_number': 25121, 'tagid': 'CB:D7:18:26:DA:B4', 'rssi': -68, 'tagname': '102livingroom', 'time': '2019-11-16T11:32:36.636133+0000'
         },
@@ -68,13 +77,15 @@ class aioruuvitag_ble(object):
         }
     }
     sample json data (calc_in_datas:True): {
-        'mac': 'CB:D7:18:26:DA:B4',
+        'mac': 224124683606708,
         'datas': {
             '_df': 5, 'humidity': 52.62, 'temperature': 29.34, 'pressure': 1005.48, 'acceleration': 1014.101, 'acceleration_x': -796, 'acceleration_y': -628, 'acceleration_z': -20, 'tx_power': 4, 'battery': 2827, 'movement_counter': 154, 'sequence_number': 25121, 'tagid': 'CB:D7:18:26:DA:B4', 'rssi': -68, 'tagname': '102livingroom', 'time': '2019-11-16T11:35:23.481096+0000', 'equilibriumVaporPressure': 4087.045, 'absoluteHumidity': 15.409, 'dewPoint': 18.666, 'airDensity': 0.221
         }
     }
     """
     _timefmt='%Y-%m-%dT%H:%M:%S.%f%z'
+    SCHEDULER_MAX_INSTANCES = 5
+    STATS_INTERVAL = 60
 # -------------------------------------------------------------------------------
     def __init__(self, *,
         loop,
@@ -86,6 +97,7 @@ class aioruuvitag_ble(object):
         whtlist=[],
         blklist=[],
         adjustment={},
+        keys=None,
         tags={},
         sample_interval=1.0,   
         calc=False,
@@ -95,12 +107,40 @@ class aioruuvitag_ble(object):
         device_timeout=10000,   # ms
         whtlist_from_tags=True,
         minmax=DEFAULT_MINMAX,
-        device='hci0'
+        device='hci0',
+        recv_batch=0,
+        bpf_filter=False,
+        bpf_whtlist=False,
+        accept_list=False,
+        scan_type='active',
+        scan_interval=10.0,
+        scan_window=10.0,
+        scan_adaptive=False,
+        devices=None,
+        merge_hold=0.2,
+        seq_dedup=True,
+        seq_table_size=1024,
+        memo_size=1024,
+        fields=None,
+        record=None,
+        record_size=10,
+        record_files=5,
+        replay_file=None,
+        replay_speed=0,
+        replay_loops=1,
+        synth_tags=100,
+        synth_rate=100.0,
+        synth_df3=0.0,
+        synth_rebroadcasts=2,
+        ingest_thread=False,
+        ingest_ring=1024,
+        outdict=False,
+        outsample=False
     ):
         """
         loop - asyncio.loop (Required)
         scheduler - AsyncIOScheduler to schedule periodical tasks
-        collector - 'socket' or 'bleak' or 'hcidump'
+        collector - 'socket' or 'bleak' or 'hcidump' or 'replay' or 'synth' or 'emulator'
         outqueue - output queue (Default: None)
         fbqueue - feedback queue for parent (Default: None)
         callback - async callback(json=data) function to handle data in case other handling than put to the queue is needed
@@ -110,6 +150,8 @@ class aioruuvitag_ble(object):
             ['D2:C2:5E:F0:11:D1', 'CB:D7:18:26:DA:B4']
         adjustment - tag value adjustments (default: {})
             {"D2:C2:5E:F0:11:D1": {"temperature": 1.0, "humidity": -10.0}, "CB:D7:18:26:DA:B4": {"pressure": 5.0}}
+        keys - DF8 AES keys (default: None - ruuvitag_df8.PASSWORD for all tags)
+            {"D2:C2:5E:F0:11:D1": "5275757669636f6d5275757669546167"}
         tags -  ruuvitag mac/name mapping(default:{}). Keys used as whtlist if whtlist not defined
             { 'D2:C2:5E:F0:11:D1': '102bedroom',
               'CB:D7:18:26:DA:B4': '102livingroom' }
@@ -122,14 +164,89 @@ class aioruuvitag_ble(object):
         whtlist_from_tags - use tags as whitelist in case whtlist not given (Default: True)
         minmax - min and max values
         device - hcidevice (for socket)
+        recv_batch - max frames drained per socket wakeup (for socket) (Default: 0 - disabled)
+        bpf_filter - kernel drops advertisements without ruuvi manufacturer id (for socket) (Default: False)
+        bpf_whtlist - kernel filter checks also the whitelist macs (for socket) (Default: False)
+        accept_list - program whitelist to the controller filter accept list (for socket) (Default: False)
+        scan_type - 'active' or 'passive' (for socket) (Default: active)
+        scan_interval - scan interval in ms (for socket) (Default: 10.0)
+        scan_window - scan window in ms (for socket) (Default: 10.0)
+        scan_adaptive - adapt scan duty cycle to the whitelisted tag coverage (for socket) (Default: False)
+        devices - several hcidevices (for socket) (Default: None - device used)
+            ['hci0', 'hci1'], advertisements received by several devices are merged (best rssi)
+        merge_hold - seconds to wait copies of the advertisement from the other devices (Default: 0.2)
+        seq_dedup - suppress rebroadcasts (same DF5 sequence number) before decoding (Default: True)
+        seq_table_size - max tags in the sequence number table (Default: 1024)
+        memo_size - max tags in the decode memo, same payload as the previous one of the tag is not decoded again,
+            0 disables (Default: 1024)
+        fields - fields used by the consumers, decoders may leave out the others (Default: None - all fields)
+            ['_df', 'humidity', 'pressure', 'tagname', 'temperature'], limits are checked always
+        record - btsnoop capture file of the received frames (for socket and bleak) (Default: None - not recorded)
+        record_size - capture file size (MB) to rotate the file (Default: 10)
+        record_files - rotated capture files kept (Default: 5)
+        replay_file - btsnoop or hcidump text capture replayed by the replay collector (Default: None)
+        replay_speed - 0: as fast as possible, N: N times the captured rate (Default: 0)
+        replay_loops - times the capture is replayed, 0: forever (Default: 1)
+        synth_tags - virtual tags of the synth collector and emulator (Default: 100)
+        synth_rate - target advertisements/sec of all virtual tags (Default: 100.0)
+        synth_df3 - share of DF3 virtual tags 0.0 ... 1.0 (Default: 0.0)
+        synth_rebroadcasts - advertisements per measurement of virtual tags (Default: 2)
+        ingest_thread - socket read, parse and decode run in a dedicated thread (for socket and emulator) (Default: False)
+            decoded samples are put to the outqueue without waiting, oldest is dropped if the outqueue is full
+        ingest_ring - max batches waiting for the loop, ingest thread drops batches if the ring is full (Default: 1024)
+        outdict - outdata dict is put to the outqueue instead of the json string (Default: False)
+            used when the outqueue encodes the data itself (shm ring of the process topology)
+        outsample - immutable ruuvitag_sample is put to the outqueue instead of the json string (Default: False)
+            passed by reference to the consumer, sample.outdata() is the outdata dict
         """
 
+        # mac lists are needed by the collector filters
+        self._registry = ruuvitag_registry(
+            tags=tags,
+            whtlist=whtlist,
+            blklist=blklist,
+            adjustment=adjustment,
+            whtlist_from_tags=whtlist_from_tags
+        )
+        l_df8 = _tagdecode.decoder(df=_tagdecode.DF_8)
+        if keys and hasattr(l_df8, 'set_keys'):
+            l_df8.set_keys(keys=keys)
+
         # select collector
         logger.info(f'>>> collector:{collector}')
         logger.info(f'>>> platform:{sys.platform}')
         # l_minlen = min(_df3.DATALEN, _df5.DATALEN)
         self._collector = None
-        if platform.system() == 'Windows':
+        if collector.startswith('replay'):    # any platform / load testing
+            try:
+                self._collector = ruuvitag_replay(
+                    loop=loop,
+                    filename=replay_file,
+                    speed=replay_speed,
+                    loops=replay_loops,
+                    mfids=DEFAULT_MFIDS,
+                    callback = self._handle_bledata,
+                    batch_callback = self._handle_bledatas
+                )
+                logger.info(f'>>> collector:ruuvitag_replay')
+            except Exception:
+                logger.exception(f'>>> replay')
+        elif collector.startswith('synth'):     # any platform / load testing
+            try:
+                self._collector = ruuvitag_synth(
+                    loop=loop,
+                    scheduler=scheduler,
+                    tags=synth_tags,
+                    rate=synth_rate,
+                    df3=synth_df3,
+                    rebroadcasts=synth_rebroadcasts,
+                    callback = self._handle_bledata,
+                    batch_callback = self._handle_bledatas
+                )
+                logger.info(f'>>> collector:ruuvitag_synth')
+            except Exception:
+                logger.exception(f'>>> synth')
+        elif platform.system() == 'Windows':
             if collector.startswith('file'):    # need to be exclusively defined / just for testing
                 try:
                     self._collector = ruuvitag_file(
@@ -150,25 +267,67 @@ class aioruuvitag_ble(object):
                         mfids=DEFAULT_MFIDS,
                         device_reset=device_reset,
                         device_timeout=device_timeout,
+                        record=record,
+                        record_size=record_size,
+                        record_files=record_files,
                         callback = self._handle_bledata
                     )
                     logger.info(f'>>> collector:ruuvitag_bleak')
                 except Exception:
                     logger.exception(f'>>> bleak')
         elif platform.system() == 'Linux':
-            if collector.startswith('socket'):
+            if collector.startswith('socket') or collector.startswith('emulator'):
                 try:
-                    from socket import AF_BLUETOOTH
-                    self._collector = ruuvitag_socket(
+                    l_emulator = None
+                    if collector.startswith('emulator'):    # socket collector without bluetooth hardware / testing
+                        l_emulator = hci_emulator(
+                            tags=synth_tags,
+                            rate=synth_rate,
+                            df3=synth_df3,
+                            rebroadcasts=synth_rebroadcasts
+                        )
+                    else:
+                        from socket import AF_BLUETOOTH
+                    l_socket_kwargs = dict(
                         loop=loop,
-                        callback = self._handle_bledata,
                         scheduler=scheduler,
-                        device=device,
                         mfids=DEFAULT_MFIDS,
                         device_reset=device_reset,
-                        device_timeout=device_timeout
+                        device_timeout=device_timeout,
+                        recv_batch=recv_batch,
+                        bpf_filter=bpf_filter,
+                        bpf_macs=self._registry.whtlist if bpf_whtlist else None,
+                        accept_list=self._registry.whtlist if accept_list else None,
+                        scan_type=scan_type,
+                        scan_interval=scan_interval,
+                        scan_window=scan_window,
+                        scan_adaptive=scan_adaptive,
+                        scan_macs=self._registry.whtlist,
+                        scan_coverage=sample_interval,
+                        record=record,
+                        record_size=record_size,
+                        record_files=record_files,
+                        emulator=l_emulator
                     )
-                    logger.info (f'>>> collector:ruuvitag_socket')
+                    if devices and len(devices) > 1 and not l_emulator:
+                        self._collector = ruuvitag_multi(
+                            callback = self._handle_bledatas,
+                            devices=devices,
+                            merge_hold=merge_hold,
+                            **l_socket_kwargs
+                        )
+                        logger.info (f'>>> collector:ruuvitag_multi')
+                    else:
+                        self._collector = ruuvitag_socket(
+                            callback = self._handle_bledata,
+                            batch_callback = self._handle_bledatas,
+                            device=devices[0] if devices else device,
+                            ingest = self._decode_bledata if ingest_thread else None,
+                            ingest_callback = self._handle_samples,
+                            ingest_ring=ingest_ring,
+                            **l_socket_kwargs
+                        )
+                        logger.info (f'>>> collector:ruuvitag_socket')
                 except Exception:
                     logger.info(f'>>> fallback to the ruuvitag_bleak')
                     logger.exception(f'>>> socket')
@@ -182,6 +341,9 @@ class aioruuvitag_ble(object):
                         mfids=DEFAULT_MFIDS,
                         device_reset=device_reset,
                         device_timeout=device_timeout,
+                        record=record,
+                        record_size=record_size,
+                        record_files=record_files,
                         callback = self._handle_bledata
                     )
                     logger.info(f'>>> collector:ruuvitag_bleak')
@@ -197,37 +359,194 @@ class aioruuvitag_ble(object):
         self._outqueue = outqueue
         # self._fbqueue = fbqueue        
         self._callback = callback
-        self._whtlist = whtlist
-        self._blklist = blklist
-        self._adjustment = adjustment
-        self._tags = tags
         self._sample_interval = sample_interval
         self._calc = calc
         self._calc_in_datas = calc_in_datas
         self._debug = debug
         self._minmax = minmax
+        self._fields = frozenset(fields) if fields is not None else None
+        self._outdict = outdict
+        self._outsample = outsample
 
         self._cnt = defaultdict(int)
         self._lasttime = defaultdict(float)
-        if not self._blklist:
+        self._seqtable = ruuvitag_seqtable(maxsize=seq_table_size) if seq_dedup else None
+        self._memo = ruuvitag_memo(maxsize=memo_size) if memo_size else None
+        self._ingest_thread = bool(ingest_thread) and hasattr(self._collector, 'ingest_stats')
+        if ingest_thread and not self._ingest_thread:
+            logger.warning(f'>>> ingest_thread not supported by the collector')
+        self._pipeline_stats = self._new_pipeline_stats()
+        self._scheduler = scheduler
+        self._schedule()
+        if not self._registry.blklist:
             logger.info(f'>>> blacklist empty')
-            self._blklist = []
-        if not self._whtlist:
+        if not self._registry.whtlist:
             logger.info(f'>>> whitelist empty')
-            self._whtlist = []
-        if tags and not len(self._whtlist) and whtlist_from_tags:   # if no whtlist generate it from the tags if exists
-            self._whtlist = tags.keys()
-            logger.info(f'>>> whitelist from tags')
-        if not self._tags:
+        if not self._registry.tags:
             logger.info(f'>>> tags empty')
-            self._tags = {}
 
         logger.debug(f'>>> aioruuvitag_ble {self}')
         logger.info(f'>>> aioruuvitag_ble initialized')
 
 # -------------------------------------------------------------------------------
     def __repr__(self):
-        return f'interval:{self._sample_interval}sec calc:{str(self._calc)} calc_in_datas:{str(self._calc_in_datas)} whtlist:{self._whtlist} blklist:{self._blklist} tags:{self._tags} minmax:{self._minmax} callback:{self._callback} outqueue:{self._outqueue} debug:{self._debug}'
+        return f'interval:{self._sample_interval}sec calc:{str(self._calc)} calc_in_datas:{str(self._calc_in_datas)} {self._registry} minmax:{self._minmax} fields:{sorted(self._fields) if self._fields is not None else None} callback:{self._callback} outqueue:{self._outqueue} debug:{self._debug} seqtable:{self._seqtable} memo:{self._memo} ingest_thread:{self._ingest_thread}'
+
+#-------------------------------------------------------------------------------
+    def _schedule(self):
+        """
+        Initializes scheduler for sequence number table, decode memo, ingest and decode statistics
+        """
+        if not self._scheduler:
+            return
+
+        l_jobid = f'decode_stats'
+        try:
+            self._scheduler.add_job(
+                self._do_decode_stats,
+                'interval',
+                seconds = self.STATS_INTERVAL,
+                kwargs = {
+                    'jobid': l_jobid
+                },
+                id = l_jobid,
+                replace_existing = True,
+                max_instances = self.SCHEDULER_MAX_INSTANCES,
+                coalesce = True,
+                next_run_time = _dt.now()+_td(seconds=self.STATS_INTERVAL)
+            )
+            logger.info(f'>>> jobid:{l_jobid} scheduled')
+        except:
+            logger.exception(f'>>> jobid:{l_jobid}')
+
+        if self._seqtable:
+            l_jobid = f'seqtable_stats'
+            try:
+                self._scheduler.add_job(
+                    self._do_seqtable_stats,
+                    'interval',
+                    seconds = self.STATS_INTERVAL,
+                    kwargs = {
+                        'jobid': l_jobid
+                    },
+                    id = l_jobid,
+                    replace_existing = True,
+                    max_instances = self.SCHEDULER_MAX_INSTANCES,
+                    coalesce = True,
+                    next_run_time = _dt.now()+_td(seconds=self.STATS_INTERVAL)
+                )
+                logger.info(f'>>> jobid:{l_jobid} scheduled')
+            except:
+                logger.exception(f'>>> jobid:{l_jobid}')
+
+        if self._memo:
+            l_jobid = f'memo_stats'
+            try:
+                self._scheduler.add_job(
+                    self._do_memo_stats,
+                    'interval',
+                    seconds = self.STATS_INTERVAL,
+                    kwargs = {
+                        'jobid': l_jobid
+                    },
+                    id = l_jobid,
+                    replace_existing = True,
+                    max_instances = self.SCHEDULER_MAX_INSTANCES,
+                    coalesce = True,
+                    next_run_time = _dt.now()+_td(seconds=self.STATS_INTERVAL)
+                )
+                logger.info(f'>>> jobid:{l_jobid} scheduled')
+            except:
+                logger.exception(f'>>> jobid:{l_jobid}')
+
+        if self._ingest_thread:
+            l_jobid = f'ingest_stats'
+            try:
+                self._scheduler.add_job(
+                    self._do_ingest_stats,
+                    'interval',
+                    seconds = self.STATS_INTERVAL,
+                    kwargs = {
+                        'jobid': l_jobid
+                    },
+                    id = l_jobid,
+                    replace_existing = True,
+                    max_instances = self.SCHEDULER_MAX_INSTANCES,
+                    coalesce = True,
+                    next_run_time = _dt.now()+_td(seconds=self.STATS_INTERVAL)
+                )
+                logger.info(f'>>> jobid:{l_jobid} scheduled')
+            except:
+                logger.exception(f'>>> jobid:{l_jobid}')
+
+#-------------------------------------------------------------------------------
+    async def _do_seqtable_stats(self, *,
+        jobid
+    ):
+        """
+        Logs and resets sequence number table statistics
+        """
+        l_stats = self._seqtable.stats()
+        self._seqtable.reset_stats()
+        logger.info(f'>>> jobid:{jobid} tags:{l_stats["size"]} suppressed:{l_stats["suppressed"]} evicted:{l_stats["evicted"]}')
+
+#-------------------------------------------------------------------------------
+    async def _do_memo_stats(self, *,
+        jobid
+    ):
+        """
+        Logs and resets decode memo statistics
+        """
+        l_stats = self._memo.stats()
+        self._memo.reset_stats()
+        logger.info(f'>>> jobid:{jobid} tags:{l_stats["size"]} hits:{l_stats["hits"]} misses:{l_stats["misses"]} hit_ratio:{l_stats["hit_ratio"]} evicted:{l_stats["evicted"]}')
+
+#-------------------------------------------------------------------------------
+    def _new_pipeline_stats(self):
+        return {
+            'samples': 0,           # samples put to the outqueue or to the callback
+            'dropped': 0            # oldest samples dropped from the full outqueue
+        }
+
+#-------------------------------------------------------------------------------
+    def stats(self):
+        """
+        Returns ingest thread (ingest), loop side (pipeline), decoder (decode) and decode memo (memo) statistics since the previous stats interval
+        """
+        return {
+            'ingest': self._collector.ingest_stats() if self._ingest_thread else {},
+            'pipeline': dict(self._pipeline_stats),
+            'decode': _tagdecode.stats(),
+            'memo': self._memo.stats() if self._memo else {}
+        }
+
+#-------------------------------------------------------------------------------
+    async def _do_ingest_stats(self, *,
+        jobid
+    ):
+        """
+        Logs and resets ingest statistics, ingest drops are samples lost before the loop
+        and pipeline drops samples lost because the sinks did not keep up
+        """
+        l_ingest = self._collector.ingest_stats(reset=True)
+        l_pipeline = self._pipeline_stats
+        self._pipeline_stats = self._new_pipeline_stats()
+        logger.info(f'>>> jobid:{jobid} ingest batches:{l_ingest["batches"]} samples:{l_ingest["samples"]} wakeups:{l_ingest["wakeups"]} max_ring:{l_ingest["max_ring"]} dropped:{l_ingest["dropped"]} pipeline samples:{l_pipeline["samples"]} dropped:{l_pipeline["dropped"]}')
+
+#-------------------------------------------------------------------------------
+    async def _do_decode_stats(self, *,
+        jobid
+    ):
+        """
+        Logs and resets decode statistics per dataformat
+        """
+        l_stats = _tagdecode.stats()
+        _tagdecode.reset_stats()
+        for (l_df, l_dfstats) in l_stats.items():
+            if l_df != 'unknown' and (l_dfstats['decoded'] or l_dfstats['invalid']):
+                logger.info(f'>>> jobid:{jobid} df:{l_df} decoded:{l_dfstats["decoded"]} invalid:{l_dfstats["invalid"]} avg:{l_dfstats["avg_us"]}us')
+        if l_stats['unknown']:
+            logger.info(f'>>> jobid:{jobid} unknown dataformat:{l_stats["unknown"]}')
 
 # -------------------------------------------------------------------------------
     def _update_cnt(self, *, mac):
@@ -261,19 +580,8 @@ class aioruuvitag_ble(object):
 
 # -------------------------------------------------------------------------------
     def _checkmaclists(self, *, mac):
-        """ Checks mac lists"""
-        # check if blacklisted
-        if mac in self._blklist:
-            logger.debug(f'>>> {mac} blacklisted')
-            return False
-        # check if not whitelisted
-        if len(self._whtlist) and mac not in self._whtlist:
-            # add to blklist for faster blocking
-            self._blklist.append(mac)
-            logger.debug(f'>>> {mac} added to blklist (mac not in whtlist) size:{len(self._blklist)} blklist:{self._blklist}')
-            return False
-
-        return True
+        """ Checks mac lists (mac int) """
+        return self._registry.allowed(mac)
 
 # -------------------------------------------------------------------------------
     async def _handle_bledata(self, *, bledata):
@@ -281,57 +589,113 @@ class aioruuvitag_ble(object):
         Handles received bledata from hcidump/socket.
         Puts json formated result to the outqueue or calls callback function with it
         """
-        l_mac = bledata.mac
+        l_jsondata = self._decode_bledata(bledata=bledata)
+        if l_jsondata:
+            if self._callback:
+                await self._callback(jsondata=l_jsondata)
+            else:
+                await self.queue_put(outqueue=self._outqueue, data=l_jsondata)
+
+# -------------------------------------------------------------------------------
+    def _decode_bledata(self, *, bledata):
+        """
+        Checks and decodes received bledata, called also in the socket ingest thread
+        Returns json formated result (dict if outdict, ruuvitag_sample if outsample) or None
+        """
+        l_mac = bledata.macint
         l_mfdata = bledata.mfdata(mfid=0x499)
-        if l_mac and l_mfdata:
-            l_ruuvidata = {}
-            l_outdata = {}
+        if l_mac is not None and l_mfdata:
             # logger.debug(f'>>> {bledata}')
             # check if mac listed
             if not self._checkmaclists(mac=l_mac):
                 return
+            # check if rebroadcast of the previous measurement
+            if self._seqtable and self._seqtable.duplicate(mac=l_mac, mfdata=l_mfdata):
+                return
             # check if it is sample time
             if not self._checkinterval(mac=l_mac, interval=(self._sample_interval*1000)):   # sec --> ms
                 return
 
-            try:
-                l_tagadjustsment = self._adjustment[l_mac]
-            except:
-                l_tagadjustsment = None
-            l_datas = _tagdecode.decode(mfdata=l_mfdata, minmax=self._minmax, tagadjustsment=l_tagadjustsment)
+            # same payload as the previous one of the tag is not decoded again
+            l_memo = self._memo
+            l_hit = False
+            if l_memo:
+                (l_hit, l_datas) = l_memo.get(mac=l_mac, mfdata=l_mfdata)
+            if not l_hit:
+                l_tagadjustsment = self._registry.adjustment(l_mac)
+                l_datas = _tagdecode.decode(mfdata=l_mfdata, minmax=self._minmax, tagadjustsment=l_tagadjustsment, fields=self._fields)
+                if l_memo:
+                    l_datas = l_memo.put(mac=l_mac, mfdata=l_mfdata, datas=l_datas)
             if l_datas:
-                try:
-                    l_datas['tagname'] = self._tags[l_mac]
-                except:
-                    pass
-                l_datas['time'] = _dt.utcfromtimestamp(bledata.time).replace(tzinfo=_tz.utc).strftime(aioruuvitag_ble._timefmt)
-                if bledata.rssi:
-                    l_datas['rssi'] = bledata.rssi
-                l_outdata = {'mac': l_mac, 'datas':l_datas}
+                # decoded fields are referenced by the sample (and the memo), not copied
+                l_calcs = None
                 if self._calc:
+                    l_calcs = {}
+                    _tagcalc.calc(datas=l_datas, out=l_calcs)
                     if self._calc_in_datas:
-                        _tagcalc.calc(datas=l_datas, out=l_outdata['datas'])
-                    else:
-                        l_outdata['calcs'] = {}
-                        _tagcalc.calc(datas=l_datas, out=l_outdata['calcs'])
+                        l_datas = {**l_datas, **l_calcs}
+                        l_calcs = None
+                l_ruuvidata = None
                 if self._debug:
-                    l_ruuvidata.clear()
-                    l_ruuvidata['blklist'] = self._blklist
-                    l_ruuvidata['count'] = self._update_cnt(mac=l_mac)
-                    l_ruuvidata['interval'] = self._update_ms(mac=l_mac)
-                    l_ruuvidata['recvtime'] = bledata.time*1000
-                    l_outdata['_aioruuvitag'] = l_ruuvidata
+                    l_ruuvidata = {
+                        'blklist': [int_to_mac(l_item) for l_item in self._registry.blklist],
+                        'count': self._update_cnt(mac=l_mac),
+                        'interval': self._update_ms(mac=l_mac),
+                        'recvtime': bledata.time*1000
+                    }
                 else:
                     self._update_cnt(mac=l_mac)
                     self._update_ms(mac=l_mac)
+                l_sample = ruuvitag_sample(
+                    mac=l_mac,
+                    fields=l_datas,
+                    time=bledata.time,
+                    rssi=bledata.rssi,
+                    tagname=self._registry.tagname(l_mac),
+                    calcs=l_calcs,
+                    debug=l_ruuvidata
+                )
 
-                logger.debug(f'>>> {l_mac} outdata:{l_outdata}')
-                if self._callback:
-                    await self._callback(jsondata=json.dumps(l_outdata))
-                else:
-                    await self.queue_put(outqueue=self._outqueue, data=json.dumps(l_outdata))
+                if logger.isEnabledFor(logging.DEBUG):   # repr formats the time
+                    logger.debug(f'>>> {bledata.mac} sample:{l_sample}')
+                if self._outsample:
+                    return l_sample
+                return l_sample.outdata() if self._outdict else json.dumps(l_sample.outdata())
             else:
                 logger.debug(f'>>> empty datas')
+        return None
+
+# -------------------------------------------------------------------------------
+    async def _handle_bledatas(self, *, bledatas):
+        """
+        Handles batch of received bledatas from the collector
+        """
+        for l_bledata in bledatas:
+            await self._handle_bledata(bledata=l_bledata)
+
+# -------------------------------------------------------------------------------
+    async def _handle_samples(self, *, samples):
+        """
+        Handles batch of json formated samples decoded by the socket ingest thread
+        Outqueue is not waited, the ingest ring keeps the samples while the loop is busy
+        """
+        l_stats = self._pipeline_stats
+        l_stats['samples'] += len(samples)
+        if self._callback:
+            for l_jsondata in samples:
+                await self._callback(jsondata=l_jsondata)
+            return
+        l_outqueue = self._outqueue
+        if not l_outqueue:
+            return
+        for l_jsondata in samples:
+            try:
+                l_outqueue.put_nowait(l_jsondata)
+            except asyncio.QueueFull:
+                # remove oldest from the queue
+                l_outqueue.get_nowait()
+                l_outqueue.put_nowait(l_jsondata)
+                l_stats['dropped'] += 1
 
 # -------------------------------------------------------------------------------
     async def queue_put(self, *,
@@ -348,6 +712,8 @@ class aioruuvitag_ble(object):
                 # remove oldest from the queue
                 await outqueue.get()
                 await self.queue_put(outqueue=outqueue, data=data)
+            except asyncio.CancelledError:
+                raise
             except Exception:
                 logger.exception(f'>>> exception')
         return False
@@ -17,18 +17,21 @@ from datetime import datetime as _dt, timedelta as _td
 
 import platform
 if platform.system() == 'Windows':
-    from .scanner_windows import scanner as _scanner
+    from .scanner_windows import scanner as _scanner, QUEUE_SIZE
 elif platform.system() == 'Linux':
-    from .scanner_linux import scanner as _scanner
+    from .scanner_linux import scanner as _scanner, new_stats as _new_scanner_stats, QUEUE_SIZE
 
 from .ruuvitag_misc import hex_string, get_sec
 from .ble_data import BLEData
+from .ble_hci import build_le_adv_report, build_manufacturer_data
+from .ble_btsnoop import btsnoop_writer
 
 
 # ===============================================================================
 class ruuvitag_bleak(object):
     SCHEDULER_MAX_INSTANCES     = 5
     HCICONFIG_CMD               = '/bin/hciconfig'
+    STATS_INTERVAL              = 60
 
 #-------------------------------------------------------------------------------
     def __init__(self,*,
@@ -39,8 +42,24 @@ class ruuvitag_bleak(object):
         mfids=None,
         device_reset=False,
         device_timeout=10.0,
+        record=None,
+        record_size=10,
+        record_files=5,
         **kwargs
     ):
+        """
+        loop - asyncio.loop (Required)
+        callback - async callback(bledata=BLEData) called for each received data (Required)
+        scheduler - AsyncIOScheduler to schedule periodical tasks
+        device - hci device (Default: hci0)
+        mfids - accepted manufacturer ids (Default: None - all)
+        device_reset - reset hci device in case of failure
+        device_timeout - timeout (sec) to restart device if no data received
+        record - btsnoop capture file (Default: None - not recorded)
+            bleak doesn't provide HCI frames, LE Advertising Report frames are built from the received data
+        record_size - capture file size (MB) to rotate the file (Default: 10)
+        record_files - rotated capture files kept (Default: 5)
+        """
         logger.info(f'>>> device:{device}')
 
         if not loop:
@@ -58,15 +77,17 @@ class ruuvitag_bleak(object):
 
         self._device = device
         self._data_ts = 0
-        self._inqueue = asyncio.Queue()
+        self._inqueue = asyncio.Queue(maxsize=QUEUE_SIZE)
+        self._scanner_stats = _new_scanner_stats() if platform.system() == 'Linux' else None
         self._scanner_stop = None
         self._scanner_task = None
+        self._recorder = btsnoop_writer(filename=record, max_size=record_size, max_files=record_files) if record else None
 
         logger.info(f'>>> {self} initialized')
 
 # -------------------------------------------------------------------------------
     def __repr__(self):
-        return f'ruuvitag_bleak device:{self._device} mfids:{self._mfids} reset:{self._device_reset} timeout:{self._device_timeout}'
+        return f'ruuvitag_bleak device:{self._device} mfids:{self._mfids} reset:{self._device_reset} timeout:{self._device_timeout} record:{self._recorder}'
 
 #-------------------------------------------------------------------------------
     def _schedule(self):
@@ -99,6 +120,59 @@ class ruuvitag_bleak(object):
             except:
                 logger.exception(f'>>> jobid:{l_jobid}')
 
+        if self._scanner_stats is not None:
+            l_jobid = f'bleak_stats'
+            try:
+                self._scheduler.add_job(
+                    self._do_bleak_stats,
+                    'interval',
+                    seconds = self.STATS_INTERVAL,
+                    kwargs = {
+                        'jobid': l_jobid
+                    },
+                    id = l_jobid,
+                    replace_existing = True,
+                    max_instances = self.SCHEDULER_MAX_INSTANCES,
+                    coalesce = True,
+                    next_run_time = _dt.now()+_td(seconds=self.STATS_INTERVAL)
+                )
+                logger.info(f'>>> jobid:{l_jobid} scheduled')
+            except:
+                logger.exception(f'>>> jobid:{l_jobid}')
+
+#-------------------------------------------------------------------------------
+    def stats(self):
+        """
+        Returns scanner statistics since the previous stats interval
+        devices is the current count of the tracked devices
+        """
+        return dict(self._scanner_stats or {})
+
+#-------------------------------------------------------------------------------
+    async def _do_bleak_stats(self, *,
+        jobid
+    ):
+        """
+        Logs and resets scanner statistics
+        overflow are devices dropped because the collector did not keep up
+        """
+        l_stats = self.stats()
+        l_devices = l_stats['devices']
+        self._scanner_stats.update(_new_scanner_stats())
+        self._scanner_stats['devices'] = l_devices
+        logger.info(f'>>> jobid:{jobid} device:{self._device} messages:{l_stats["messages"]} forwarded:{l_stats["forwarded"]} unchanged:{l_stats["unchanged"]} overflow:{l_stats["overflow"]} evicted:{l_stats["evicted"]} devices:{l_devices}')
+
+#-------------------------------------------------------------------------------
+    def _start_scanner(self):
+        self._scanner_task = self._loop.create_task(_scanner(
+            device=self._device,
+            loop=self._loop,
+            outqueue=self._inqueue,
+            stopevent=self._scanner_stop,
+            mfids=self._mfids,
+            stats=self._scanner_stats
+        ))
+
 #-------------------------------------------------------------------------------
     async def _do_bleak_timeout(self, *,
         jobid,
@@ -115,8 +189,8 @@ class ruuvitag_bleak(object):
             try:
                 logger.info(f'>>> jobid:{jobid} restarting device:{self._device}')
                 try:
-                    self._reset()
-                    self._scanner_task = self._loop.create_task(_scanner(device=self._device, loop=self._loop, outqueue=self._inqueue, stopevent=self._scanner_stop))
+                    await self._reset()
+                    self._start_scanner()
                 except:
                     logger.exception(f'>>> exception')
                     pass
@@ -164,6 +238,8 @@ class ruuvitag_bleak(object):
         self._data_ts = get_sec()
         try:
             l_mdata = data.metadata['manufacturer_data']
+            if self._recorder:
+                self._record(data=data, mdata=l_mdata)
             for l_mfid in list(l_mdata.keys()):
                 if not self._mfids or l_mfid in self._mfids:
                     l_mfdata = l_mdata[l_mfid]
@@ -183,13 +259,24 @@ class ruuvitag_bleak(object):
             logger.exception(f'>>> exception')
             pass
 
+# ------------------------------------------------------------------------------
+    def _record(self, *, data, mdata):
+        """
+        Records the received data as LE Advertising Report frame
+        """
+        try:
+            l_addata = b''.join(build_manufacturer_data(mfid=l_mfid, mfdata=l_mfdata) for l_mfid, l_mfdata in mdata.items())
+            self._recorder.write(data=build_le_adv_report(address=data.address, addata=l_addata, rssi=data.rssi or 0))
+        except:
+            logger.exception(f'>>> exception')
+
 # -------------------------------------------------------------------------------
     async def run(self):
         logger.info(f'>>> starting...')
 
         try:
             self._scanner_stop = asyncio.Event()
-            self._scanner_task = self._loop.create_task(_scanner(device=self._device, loop=self._loop, outqueue=self._inqueue, stopevent=self._scanner_stop))
+            self._start_scanner()
             self._schedule()
         except:
             logger.exception(f'>>> exception')
@@ -218,6 +305,8 @@ class ruuvitag_bleak(object):
 
         self._scanner_stop.set()
         await asyncio.sleep(0.2)
+        if self._recorder:
+            self._recorder.close()
         logger.info('>>> bleak completed')
         return True
 
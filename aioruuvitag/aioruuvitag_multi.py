@@ -0,0 +1,171 @@
+# coding=utf-8
+# !/usr/bin/python3
+# Name:         ruuvitag_multi - several bluetooth adapters
+# Copyright:    (c) 2020 TK
+# Licence:      MIT
+#
+# Runs ruuvitag_socket collector for every device concurrently and merges
+# their streams with the ruuvitag_merge (best rssi copy of each advertisement)
+# ------------------------------------------------------------------------------
+import logging
+logger = logging.getLogger('ruuvitag')
+
+import os
+import asyncio
+from functools import partial
+from contextlib import suppress
+from datetime import datetime as _dt, timedelta as _td
+
+from .aioruuvitag_socket import ruuvitag_socket
+from .ruuvitag_merge import ruuvitag_merge
+
+# ==============================================================================
+# ruuvitag_multi class
+# ==============================================================================
+class ruuvitag_multi(object):
+    SCHEDULER_MAX_INSTANCES     = 5
+    STATS_INTERVAL              = 60
+# ------------------------------------------------------------------------------
+    def __init__(self, *,
+        loop,
+        callback,
+        scheduler=None,
+        devices=None,
+        merge_hold=0.2,
+        **kwargs
+    ):
+        """
+        loop - asyncio.loop (Required)
+        callback - async callback(bledatas=[BLEData]) called with the merged bledatas (Required)
+        scheduler - AsyncIOScheduler to schedule periodical tasks
+        devices - hci devices (Required) ['hci0', 'hci1']
+        merge_hold - seconds to wait copies of the advertisement from the other devices (Default: 0.2)
+        kwargs - passed to the ruuvitag_socket collectors
+            record capture file name gets device suffix (ruuvigw.snoop --> ruuvigw_hci0.snoop)
+        """
+        logger.info(f'>>> devices:{devices}')
+
+        if not loop:
+            raise ValueError(f'loop is None')
+        self._loop = loop
+        if not callback:
+            raise ValueError(f'callback is None')
+        if not devices:
+            raise ValueError(f'devices is empty')
+        self._scheduler = scheduler
+        self._stopevent = asyncio.Event()
+
+        self._merge = ruuvitag_merge(callback=callback, hold=merge_hold)
+        self._collectors = []
+        l_record = kwargs.pop('record', None)
+        for l_device in devices:
+            l_put = partial(self._merge.put, device=l_device)
+            l_put_batch = partial(self._merge.put_batch, device=l_device)
+            if l_record:
+                (l_root, l_ext) = os.path.splitext(l_record)
+                kwargs['record'] = f'{l_root}_{l_device}{l_ext}'
+            self._collectors.append(ruuvitag_socket(
+                loop=loop,
+                callback=l_put,
+                batch_callback=l_put_batch,
+                scheduler=scheduler,
+                device=l_device,
+                **kwargs
+            ))
+
+        logger.info(f'>>> {self} initialized')
+
+# -------------------------------------------------------------------------------
+    def __repr__(self):
+        return f'ruuvitag_multi {self._merge} collectors:{self._collectors}'
+
+#-------------------------------------------------------------------------------
+    def _schedule(self):
+        """
+        Initializes scheduler for merge statistics
+        """
+        if not self._scheduler:
+            return
+
+        l_jobid = f'multi_stats'
+        try:
+            self._scheduler.add_job(
+                self._do_multi_stats,
+                'interval',
+                seconds = self.STATS_INTERVAL,
+                kwargs = {
+                    'jobid': l_jobid
+                },
+                id = l_jobid,
+                replace_existing = True,
+                max_instances = self.SCHEDULER_MAX_INSTANCES,
+                coalesce = True,
+                next_run_time = _dt.now()+_td(seconds=self.STATS_INTERVAL)
+            )
+            logger.info(f'>>> jobid:{l_jobid} scheduled')
+        except:
+            logger.exception(f'>>> jobid:{l_jobid}')
+
+#-------------------------------------------------------------------------------
+    def stats(self):
+        """
+        Returns per device statistics since the previous stats interval
+        """
+        return self._merge.stats()
+
+#-------------------------------------------------------------------------------
+    async def _do_multi_stats(self, *,
+        jobid
+    ):
+        """
+        Logs and resets per device statistics
+        """
+        l_stats = self.stats()
+        self._merge.reset_stats()
+        logger.info(f'>>> jobid:{jobid} forwarded:{l_stats["forwarded"]} duplicates:{l_stats["duplicates"]}')
+        for l_device, l_tags in l_stats['devices'].items():
+            l_received = sum(l_cnt['received'] for l_cnt in l_tags.values())
+            l_forwarded = sum(l_cnt['forwarded'] for l_cnt in l_tags.values())
+            logger.info(f'>>> jobid:{jobid} device:{l_device} tags:{len(l_tags)} received:{l_received} forwarded:{l_forwarded}')
+            for l_mac, l_cnt in sorted(l_tags.items()):
+                logger.info(f'>>> jobid:{jobid} device:{l_device} {l_mac} received:{l_cnt["received"]} forwarded:{l_cnt["forwarded"]}')
+
+# -------------------------------------------------------------------------------
+    async def _run_merge(self):
+        """
+        Forwards merged bledatas after their hold period
+        """
+        while not self._stopevent.is_set():
+            try:
+                await asyncio.sleep(self._merge.hold/2)
+                await self._merge.flush()
+            except asyncio.CancelledError:
+                break
+            except:
+                logger.exception(f'>>> exception')
+        with suppress(Exception):
+            await self._merge.flush(force=True)
+
+# -------------------------------------------------------------------------------
+    async def run(self):
+        logger.info(f'>>> starting...')
+
+        self._schedule()
+        l_merge = self._loop.create_task(self._run_merge())
+        try:
+            await asyncio.gather(*[l_collector.run() for l_collector in self._collectors])
+        finally:
+            self._stopevent.set()
+            l_merge.cancel()
+            with suppress(asyncio.CancelledError):
+                await l_merge
+
+        logger.info('>>> multi completed')
+        return True
+
+# -------------------------------------------------------------------------------
+    def stop(self):
+        logger.info(f'>>> multi')
+        self._stopevent.set()
+        for l_collector in self._collectors:
+            l_collector.stop()
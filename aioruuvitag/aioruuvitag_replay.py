@@ -0,0 +1,260 @@
+# coding=utf-8
+# !/usr/bin/python3
+# Name:         ruuvitag_replay - replays captured HCI frames
+# Copyright:    (c) 2020 TK
+# Licence:      MIT
+#
+# Supported capture formats (detected from the file content):
+# - btsnoop (see ble_btsnoop.py), datalink H4 (1002) or HCI (1001)
+# - hcidump text: hcidump --raw [-t]
+#     > 04 3E 2B 02 01 03 01 B4 DA 26 18 D7 CB 1F 02 01 06 1B FF 99 04 05
+#       16 EC 52 38 ...
+#   with -t each frame line starts with the timestamp: 2020-01-01 12:00:00.123456 > 04 3E ...
+#
+# The file is memory mapped, frames are parsed from the map without reading it.
+# speed 0 replays as fast as possible, speed N follows the original
+# timestamps N times faster (hcidump without timestamps: TEXT_INTERVAL per frame)
+# ------------------------------------------------------------------------------
+import logging
+logger = logging.getLogger('ruuvitag')
+
+import re
+import mmap
+import time
+import asyncio
+from datetime import datetime as _dt
+
+from .ble_data import BLEData
+from .ble_hci import le_adv_reports, manufacturer_data
+from .ble_btsnoop import BTSNOOP_MAGIC, BTSNOOP_HEADER, BTSNOOP_RECORD, BTSNOOP_EPOCH_DELTA
+from .ble_btsnoop import BTSNOOP_DATALINK_H4, BTSNOOP_DATALINK_HCI, BTSNOOP_FLAG_RECEIVED, BTSNOOP_FLAG_CMD_EVT
+
+HCI_EVENT_PKT_BYTE      = b'\x04'
+
+# ==============================================================================
+# ruuvitag_replay class
+# ==============================================================================
+class ruuvitag_replay(object):
+    TEXT_INTERVAL   = 0.1       # sec between frames of hcidump text without timestamps
+    BATCH_SIZE      = 64        # bledatas per batch_callback
+    YIELD_FRAMES    = 64        # frames parsed between the loop yields, also without any bledata
+    _text_ts = re.compile(rb'^(\d{4}-\d\d-\d\d \d\d:\d\d:\d\d\.\d+)\s+>')
+# ------------------------------------------------------------------------------
+    def __init__(self, *,
+        loop,
+        callback,
+        batch_callback=None,
+        filename=None,
+        speed=0,
+        loops=1,
+        mfids=None,
+        **kwargs
+    ):
+        """
+        loop - asyncio.loop (Required)
+        callback - async callback(bledata=BLEData) called for each replayed data (Required)
+        batch_callback - async callback(bledatas=[BLEData]) called with max BATCH_SIZE datas (Default: None)
+        filename - btsnoop or hcidump text capture (Required)
+        speed - 0: as fast as possible, N: N times the original rate (Default: 0)
+        loops - number of times the capture is replayed, 0: forever (Default: 1)
+        mfids - accepted manufacturer ids (Default: None - all)
+        """
+        logger.info(f'>>> filename:{filename}')
+
+        if not loop:
+            raise ValueError(f'loop is None')
+        self._loop = loop
+        if not callback:
+            raise ValueError(f'callback is None')
+        if not filename:
+            raise ValueError(f'filename is None')
+        self._callback = callback
+        self._batch_callback = batch_callback
+        self._filename = filename
+        self._speed = float(speed or 0)
+        self._loops = int(loops or 0)
+        self._mfids = mfids
+        self._stopevent = asyncio.Event()
+
+        logger.info(f'>>> {self} initialized')
+
+# -------------------------------------------------------------------------------
+    def __repr__(self):
+        return f'ruuvitag_replay filename:{self._filename} speed:{self._speed or "max"} loops:{self._loops or "forever"} mfids:{self._mfids}'
+
+# -------------------------------------------------------------------------------
+    @staticmethod
+    def _btsnoop_frames(*, data):
+        """
+        Yields (timestamp, frame) of the received events in the btsnoop capture
+        timestamp - unix timestamp (sec), frame - memoryview to the capture
+        """
+        (_, _, l_datalink) = BTSNOOP_HEADER.unpack_from(data, 0)
+        if l_datalink not in (BTSNOOP_DATALINK_H4, BTSNOOP_DATALINK_HCI):
+            raise ValueError(f'unsupported btsnoop datalink:{l_datalink}')
+        l_view = memoryview(data)
+        l_len = len(data)
+        l_off = BTSNOOP_HEADER.size
+        while l_off + BTSNOOP_RECORD.size <= l_len:
+            (_, l_incl, l_flags, _, l_ts) = BTSNOOP_RECORD.unpack_from(data, l_off)
+            l_off += BTSNOOP_RECORD.size
+            if l_off + l_incl > l_len:
+                break
+            l_frame = l_view[l_off:l_off+l_incl]
+            l_off += l_incl
+            l_ts = (l_ts - BTSNOOP_EPOCH_DELTA) / 1000000
+            if l_datalink == BTSNOOP_DATALINK_H4:
+                yield (l_ts, l_frame)
+            elif (l_flags & 0x03) == (BTSNOOP_FLAG_RECEIVED|BTSNOOP_FLAG_CMD_EVT):
+                # HCI datalink doesn't include the packet type, received event
+                yield (l_ts, HCI_EVENT_PKT_BYTE + bytes(l_frame))
+
+# -------------------------------------------------------------------------------
+    @staticmethod
+    def _text_frames(*, data):
+        """
+        Yields (timestamp or None, frame) of the received frames in the hcidump text capture
+        """
+        l_ts = None
+        l_hex = None
+        l_off = 0
+        l_len = len(data)
+        while l_off < l_len:
+            l_end = data.find(b'\n', l_off)
+            if l_end < 0:
+                l_end = l_len
+            l_line = data[l_off:l_end].strip()
+            l_off = l_end + 1
+            if not l_line:
+                continue
+            l_match = ruuvitag_replay._text_ts.match(l_line)
+            if l_match or l_line.startswith(b'> ') or l_line.startswith(b'< ') or b' < ' in l_line[:32]:
+                if l_hex:
+                    try:
+                        yield (l_ts, bytes.fromhex(l_hex.decode()))
+                    except ValueError:
+                        pass
+                l_hex = None
+                if l_match:
+                    l_ts = _dt.strptime(l_match.group(1).decode(), '%Y-%m-%d %H:%M:%S.%f').timestamp()
+                    l_hex = l_line[l_match.end():]
+                elif l_line.startswith(b'> '):
+                    l_hex = l_line[2:]
+            elif l_hex is not None:
+                l_hex += b' ' + l_line
+        if l_hex:
+            try:
+                yield (l_ts, bytes.fromhex(l_hex.decode()))
+            except ValueError:
+                pass
+
+# -------------------------------------------------------------------------------
+    def _frames(self, *, data):
+        if data[:len(BTSNOOP_MAGIC)] == BTSNOOP_MAGIC:
+            return self._btsnoop_frames(data=data)
+        return self._text_frames(data=data)
+
+# -------------------------------------------------------------------------------
+    def _parse_data(self, *, data):
+        """
+        Yields BLEData for every accepted manufacturer data of the frame
+        """
+        for (_, _, l_addr, l_addata, l_rssi) in le_adv_reports(data=data):
+            for (l_mfid, l_mfdata) in manufacturer_data(addata=l_addata):
+                if not self._mfids or l_mfid in self._mfids:
+                    yield BLEData(
+                        macraw = l_addr,
+                        rssi = l_rssi,
+                        mfid = l_mfid,
+                        mfdata = l_mfdata,
+                        rawdata = data
+                    )
+
+# -------------------------------------------------------------------------------
+    async def _emit(self, *, bledatas):
+        if not bledatas:
+            return
+        try:
+            if self._batch_callback:
+                await self._batch_callback(bledatas=bledatas)
+            else:
+                for l_bledata in bledatas:
+                    await self._callback(bledata=l_bledata)
+        except asyncio.CancelledError:
+            raise
+        except:
+            logger.exception(f'>>> exception')
+
+# -------------------------------------------------------------------------------
+    async def _replay(self, *, data):
+        """
+        Replays the capture once
+        Returns (frames, bledatas)
+        """
+        l_frames = 0
+        l_cnt = 0
+        l_batch = []
+        l_first = None
+        l_start = time.monotonic()
+        l_text_ts = 0.0
+        for (l_ts, l_frame) in self._frames(data=data):
+            if self._stopevent.is_set():
+                break
+            l_frames += 1
+            if self._speed:
+                if l_ts is None:
+                    l_ts = l_text_ts
+                    l_text_ts += ruuvitag_replay.TEXT_INTERVAL
+                if l_first is None:
+                    l_first = l_ts
+                l_delay = l_start + (l_ts - l_first) / self._speed - time.monotonic()
+                if l_delay > 0:
+                    await self._emit(bledatas=l_batch)
+                    l_batch = []
+                    await asyncio.sleep(l_delay)
+            for l_bledata in self._parse_data(data=l_frame):
+                l_batch.append(l_bledata)
+                l_cnt += 1
+            if len(l_batch) >= ruuvitag_replay.BATCH_SIZE:
+                await self._emit(bledatas=l_batch)
+                l_batch = []
+            if not l_frames % ruuvitag_replay.YIELD_FRAMES:
+                await asyncio.sleep(0)
+        await self._emit(bledatas=l_batch)
+        # capture without frames replayed forever does not block the loop either
+        await asyncio.sleep(0)
+        return (l_frames, l_cnt)
+
+# -------------------------------------------------------------------------------
+    async def run(self):
+        logger.info(f'>>> starting...')
+
+        l_loop = 0
+        try:
+            with open(self._filename, 'rb') as l_fh:
+                l_map = mmap.mmap(l_fh.fileno(), 0, access=mmap.ACCESS_READ)
+                try:
+                    while not self._stopevent.is_set() and (not self._loops or l_loop < self._loops):
+                        l_loop += 1
+                        l_start = time.monotonic()
+                        (l_frames, l_cnt) = await self._replay(data=l_map)
+                        l_elapsed = max(time.monotonic() - l_start, 0.000001)
+                        logger.info(f'>>> loop:{l_loop} frames:{l_frames} bledatas:{l_cnt} elapsed:{l_elapsed:.2f}sec rate:{int(l_frames/l_elapsed)} frames/sec')
+                finally:
+                    try:
+                        l_map.close()
+                    except BufferError:
+                        # bledatas still referring to the map, closed when released
+                        pass
+        except asyncio.CancelledError:
+            logger.warning(f'>>> CanceledError')
+        except:
+            logger.exception(f'>>> {self._filename}')
+
+        logger.info('>>> replay completed')
+        return True
+
+# -------------------------------------------------------------------------------
+    def stop(self):
+        logger.info(f'>>> replay')
+        self._stopevent.set()
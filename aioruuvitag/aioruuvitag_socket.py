@@ -6,22 +6,34 @@
 # Thanks to: https://github.com/TheCellule/python-bleson
 #
 # AF_BLUETOOTH socket scanner
+#
+# ingest mode: HCI read, frame parse and decode run in a dedicated thread, decoded
+# samples are handed to the loop in batches through a bounded deque and one wakeup
+# per batch, so slow sinks on the loop do not delay the socket reads
 # ------------------------------------------------------------------------------
 import logging
 logger = logging.getLogger('ruuvitag')
 
+import os
 import time
 import array
 import fcntl
 import socket
 import struct
+import select
 import asyncio
 import platform
-from contextlib import suppress
+import threading
+from collections import deque
+from contextlib import suppress, contextmanager
 from datetime import datetime as _dt, timedelta as _td
 
 from .ruuvitag_misc import hex_string, get_sec
 from .ble_data import BLEData
+from .ble_hci import le_adv_reports, manufacturer_data
+from .ble_bpf import ruuvitag_bpf, bpf_fprog, SO_ATTACH_FILTER
+from .ble_scan import scan_profiles
+from .ble_btsnoop import btsnoop_writer
 
 # ==============================================================================
 # ruuvitag_socket class
@@ -39,24 +51,89 @@ class ruuvitag_socket(object):
     OGF_LE_CTL                  = 0x08
     OCF_LE_SET_SCAN_PARAMETERS  = 0x000B
     OCF_LE_SET_SCAN_ENABLE      = 0x000C
+    OCF_LE_READ_WHITE_LIST_SIZE = 0x000F
+    OCF_LE_CLEAR_WHITE_LIST     = 0x0010
+    OCF_LE_ADD_DEVICE_TO_WHITE_LIST = 0x0011
     LE_SET_SCAN_PARAMETERS_CMD  = OCF_LE_SET_SCAN_PARAMETERS | OGF_LE_CTL << 10
     LE_SET_SCAN_ENABLE_CMD      = OCF_LE_SET_SCAN_ENABLE | OGF_LE_CTL << 10
-    SCAN_TYPE_ACTIVE            = 0x01
+    LE_READ_WHITE_LIST_SIZE_CMD = OCF_LE_READ_WHITE_LIST_SIZE | OGF_LE_CTL << 10
+    LE_CLEAR_WHITE_LIST_CMD     = OCF_LE_CLEAR_WHITE_LIST | OGF_LE_CTL << 10
+    LE_ADD_DEVICE_TO_WHITE_LIST_CMD = OCF_LE_ADD_DEVICE_TO_WHITE_LIST | OGF_LE_CTL << 10
     LE_PUBLIC_ADDRESS           = 0x00
+    LE_RANDOM_ADDRESS           = 0x01
     FILTER_POLICY_NO_WHITELIST  = 0x00
+    FILTER_POLICY_WHITELIST     = 0x01
+    HCI_REQUEST_TIMEOUT         = 2.0
     SCHEDULER_MAX_INSTANCES     = 5
     HCICONFIG_CMD               = '/bin/hciconfig'
+    RECV_BUFFER_SIZE            = 1024
+    STATS_INTERVAL              = 60
+    SCAN_CHECK_INTERVAL         = 10
+    SOL_HCI                     = 0
+    HCI_TIME_STAMP              = 3
+    HCI_CMSG_TSTAMP             = 0x0002
+    TIMEVAL                     = struct.Struct('@ll')
+    INGEST_POLL                 = 0.1         # sec, ingest thread socket wait
 # ------------------------------------------------------------------------------
     def __init__(self, *,
         loop,
         callback,
+        batch_callback=None,
         scheduler=None,
         device='hci0',
         mfids=None,
         device_reset=False,
         device_timeout=10.0,
+        recv_batch=0,
+        bpf_filter=False,
+        bpf_macs=None,
+        accept_list=None,
+        scan_type='active',
+        scan_interval=10.0,
+        scan_window=10.0,
+        scan_adaptive=False,
+        scan_macs=None,
+        scan_coverage=10.0,
+        record=None,
+        record_size=10,
+        record_files=5,
+        emulator=None,
+        ingest=None,
+        ingest_callback=None,
+        ingest_ring=1024,
         **kwargs
     ):
+        """
+        loop - asyncio.loop (Required)
+        callback - async callback(bledata=BLEData) called for each received frame (Required)
+        batch_callback - async callback(bledatas=[BLEData]) called once per drained batch (Default: None)
+        scheduler - AsyncIOScheduler to schedule periodical tasks
+        device - hci device (Default: hci0)
+        mfids - accepted manufacturer ids (Default: None - all)
+        device_reset - reset hci device in case of failure
+        device_timeout - timeout (sec) to restart device if no data received
+        recv_batch - max frames drained per socket wakeup (Default: 0 - one recv per frame)
+        bpf_filter - attach kernel socket filter dropping advertisements without accepted mfid (Default: False)
+        bpf_macs - 48bit mac ints also checked by the kernel socket filter (Default: None - mac not checked)
+        accept_list - 48bit mac ints programmed to the controller filter accept list (Default: None - not used)
+            falls back to the software filtering if the list does not fit to the controller
+        scan_type - 'active' or 'passive' (Default: active)
+        scan_interval - scan interval in ms (Default: 10.0)
+        scan_window - scan window in ms (Default: 10.0)
+        scan_adaptive - lower scan duty cycle while all scan_macs are heard (Default: False)
+        scan_macs - 48bit mac ints of the expected tags for the adaptive scan
+        scan_coverage - tag is covered if heard within scan_coverage seconds (Default: 10.0)
+        record - btsnoop capture file for all received frames (Default: None - not recorded)
+            frames are received with the kernel timestamps, recording uses the batched receive
+        record_size - capture file size (MB) to rotate the file (Default: 10)
+        record_files - rotated capture files kept (Default: 5)
+        emulator - hci_emulator used instead of the AF_BLUETOOTH socket (Default: None)
+            device ioctls and HCI_FILTER are routed to the emulator, kernel timestamps are not available
+        ingest - callback(bledata=BLEData) returning decoded sample or None (Default: None - no ingest thread)
+            called in the ingest thread which owns the socket reads, callback and batch_callback are not used
+        ingest_callback - async callback(samples=[sample]) called in the loop once per handed batch (Required with ingest)
+        ingest_ring - max batches waiting for the loop, batches are dropped if the ring is full (Default: 1024)
+        """
         logger.info(f'>>> device:{device}')
 
         if not loop:
@@ -65,6 +142,7 @@ class ruuvitag_socket(object):
         if not callback:
             raise ValueError(f'callback is None')
         self._callback = callback
+        self._batch_callback = batch_callback
         self._stopevent = asyncio.Event()
 
         self._scheduler = scheduler
@@ -74,7 +152,51 @@ class ruuvitag_socket(object):
 
         self._task = None
         self._socket = None
+        self._readfut = None
+        self._readfd = None
         self._data_ts = 0
+        self._emulator = emulator
+
+        self._recorder = btsnoop_writer(filename=record, max_size=record_size, max_files=record_files) if record else None
+        self._ancsize = socket.CMSG_SPACE(ruuvitag_socket.TIMEVAL.size)
+
+        # preallocated receive buffers for the batched receive
+        self._recv_batch = max(int(recv_batch or 0), 1 if (self._recorder or ingest) else 0)
+        self._pool = [memoryview(bytearray(ruuvitag_socket.RECV_BUFFER_SIZE)) for _ in range(self._recv_batch)]
+        self._stats = self._new_stats()
+        self._stats_lock = threading.Lock()
+        self._bpf = self._bpf_program(mfids=mfids, macs=bpf_macs) if bpf_filter else None
+        self._accept_list = sorted(accept_list) if accept_list else []
+        self._accept_list_active = False
+        self._filter_policy = ruuvitag_socket.FILTER_POLICY_NO_WHITELIST
+        self._scan = scan_profiles(
+            scan_type=scan_type,
+            interval=scan_interval,
+            window=scan_window,
+            adaptive=scan_adaptive,
+            macs=scan_macs,
+            coverage=max(scan_coverage, ruuvitag_socket.SCAN_CHECK_INTERVAL)
+        )
+
+        # ingest thread and its ring, thread is started by run
+        if ingest and not ingest_callback:
+            raise ValueError(f'ingest_callback is None')
+        self._ingest = ingest
+        self._ingest_callback = ingest_callback
+        self._ingest_ring = max(int(ingest_ring or 0), 1)
+        self._ingest_thread = None
+        self._ring = deque()
+        self._ring_wakeup = False
+        self._ring_event = asyncio.Event()
+        self._ingest_stop = threading.Event()
+        self._ingest_hold = threading.Event()
+        self._ingest_lock = threading.Lock()
+        self._exclusive_held = False
+        self._reset_lock = asyncio.Lock()
+        self._ingest_wakeup = None
+        self._ingest_broken = None
+        self._ingest_stats = self._new_ingest_stats()
+
         self._device = device
         self._device_id = 0
         if device:
@@ -86,7 +208,7 @@ class ruuvitag_socket(object):
 
 # -------------------------------------------------------------------------------
     def __repr__(self):
-        return f'ruuvitag_socket device:{self._device} mfids:{self._mfids} device_reset:{self._device_reset} device_timeout:{self._device_timeout}'
+        return f'ruuvitag_socket device:{self._device} mfids:{self._mfids} device_reset:{self._device_reset} device_timeout:{self._device_timeout} recv_batch:{self._recv_batch} bpf:{len(self._bpf) if self._bpf else None} accept_list:{len(self._accept_list)} {self._scan} record:{self._recorder} emulator:{self._emulator} ingest:{bool(self._ingest)} ingest_ring:{self._ingest_ring}'
 
 #-------------------------------------------------------------------------------
     def _schedule(self):
@@ -99,7 +221,7 @@ class ruuvitag_socket(object):
             return
 
         if self._device_timeout:
-            l_jobid = f'socket_timeout'
+            l_jobid = f'socket_timeout_{self._device}'
             try:
                 self._scheduler.add_job(
                     self._do_socket_timeout,
@@ -119,6 +241,171 @@ class ruuvitag_socket(object):
             except:
                 logger.exception(f'>>> jobid:{l_jobid}')
 
+        if self._recv_batch:
+            l_jobid = f'socket_stats_{self._device}'
+            try:
+                self._scheduler.add_job(
+                    self._do_socket_stats,
+                    'interval',
+                    seconds = self.STATS_INTERVAL,
+                    kwargs = {
+                        'jobid': l_jobid
+                    },
+                    id = l_jobid,
+                    replace_existing = True,
+                    max_instances = self.SCHEDULER_MAX_INSTANCES,
+                    coalesce = True,
+                    next_run_time = _dt.now()+_td(seconds=self.STATS_INTERVAL)
+                )
+                logger.info(f'>>> jobid:{l_jobid} scheduled')
+            except:
+                logger.exception(f'>>> jobid:{l_jobid}')
+
+        if self._scan.adaptive:
+            l_jobid = f'socket_scan_{self._device}'
+            try:
+                self._scheduler.add_job(
+                    self._do_socket_scan,
+                    'interval',
+                    seconds = self.SCAN_CHECK_INTERVAL,
+                    kwargs = {
+                        'jobid': l_jobid
+                    },
+                    id = l_jobid,
+                    replace_existing = True,
+                    max_instances = self.SCHEDULER_MAX_INSTANCES,
+                    coalesce = True,
+                    next_run_time = _dt.now()+_td(seconds=self.SCAN_CHECK_INTERVAL)
+                )
+                logger.info(f'>>> jobid:{l_jobid} scheduled')
+            except:
+                logger.exception(f'>>> jobid:{l_jobid}')
+
+            l_jobid = f'socket_scan_stats_{self._device}'
+            try:
+                self._scheduler.add_job(
+                    self._do_socket_scan_stats,
+                    'interval',
+                    seconds = self.STATS_INTERVAL,
+                    kwargs = {
+                        'jobid': l_jobid
+                    },
+                    id = l_jobid,
+                    replace_existing = True,
+                    max_instances = self.SCHEDULER_MAX_INSTANCES,
+                    coalesce = True,
+                    next_run_time = _dt.now()+_td(seconds=self.STATS_INTERVAL)
+                )
+                logger.info(f'>>> jobid:{l_jobid} scheduled')
+            except:
+                logger.exception(f'>>> jobid:{l_jobid}')
+
+#-------------------------------------------------------------------------------
+    def scan_stats(self):
+        """
+        Returns coverage statistics per scan profile since the previous stats interval
+        """
+        return self._scan.stats()
+
+#-------------------------------------------------------------------------------
+    async def _do_socket_scan(self, *,
+        jobid
+    ):
+        """
+        Checks tag coverage and re-issues scan parameters if adaptive scan changed the profile
+        """
+        try:
+            # scan parameters are not changed in the middle of the accept list requests
+            if self._scan.check(now=get_sec()) and self._socket and not self._exclusive_held:
+                self._enable_scan(enabled=False)
+                self._set_scan_parameters(filter_policy=self._filter_policy)
+                self._enable_scan(enabled=True, filter_duplicates=False)
+        except:
+            logger.exception(f'>>> jobid:{jobid}')
+
+#-------------------------------------------------------------------------------
+    async def _do_socket_scan_stats(self, *,
+        jobid
+    ):
+        """
+        Logs and resets scan profile coverage statistics
+        """
+        for l_stats in self.scan_stats():
+            logger.info(f'>>> jobid:{jobid} device:{self._device} profile:{l_stats["profile"]} duty:{l_stats["duty"]} seconds:{l_stats["seconds"]} checks:{l_stats["checks"]} covered:{l_stats["covered"]} coverage:{l_stats["coverage"]}')
+        self._scan.reset_stats()
+
+#-------------------------------------------------------------------------------
+    def _new_stats(self):
+        return {
+            'wakeups': 0,           # socket readiness events
+            'frames': 0,            # frames drained
+            'max_frames': 0,        # max frames drained per wakeup
+            'pool_full': 0,         # wakeups which used all preallocated buffers
+            'drain_us': 0,          # total drain time (us)
+            'max_drain_us': 0       # max drain time per wakeup (us)
+        }
+
+#-------------------------------------------------------------------------------
+    def stats(self, *, reset=False):
+        """
+        Returns batched receive statistics since the previous stats interval
+        Statistics are updated by the ingest thread too, so they are read and reset under the stats lock
+            reset - starts new interval (Default: False)
+        """
+        with self._stats_lock:
+            l_stats = self._stats
+            if reset:
+                self._stats = self._new_stats()
+            else:
+                l_stats = dict(l_stats)
+        l_wakeups = l_stats['wakeups']
+        l_stats['frames_per_wakeup'] = round(l_stats['frames']/l_wakeups, 2) if l_wakeups else 0
+        l_stats['avg_drain_us'] = int(l_stats['drain_us']/l_wakeups) if l_wakeups else 0
+        return l_stats
+
+#-------------------------------------------------------------------------------
+    async def _do_socket_stats(self, *,
+        jobid
+    ):
+        """
+        Logs and resets batched receive statistics
+        """
+        l_stats = self.stats(reset=True)
+        logger.info(f'>>> jobid:{jobid} device:{self._device} wakeups:{l_stats["wakeups"]} frames:{l_stats["frames"]} frames/wakeup:{l_stats["frames_per_wakeup"]} max:{l_stats["max_frames"]} pool_full:{l_stats["pool_full"]} drain avg:{l_stats["avg_drain_us"]}us max:{l_stats["max_drain_us"]}us')
+
+#-------------------------------------------------------------------------------
+    def _new_ingest_stats(self):
+        return {
+            'batches': 0,           # batches handed to the loop
+            'samples': 0,           # samples handed to the loop
+            'wakeups': 0,           # loop wakeups, one per batch at most
+            'dropped': 0,           # samples dropped by the ingest thread, ring full
+            'max_ring': 0           # max batches waiting in the ring
+        }
+
+#-------------------------------------------------------------------------------
+    def reset_stats(self):
+        with self._stats_lock:
+            self._stats = self._new_stats()
+
+#-------------------------------------------------------------------------------
+    def ingest_stats(self, *, reset=False):
+        """
+        Returns ingest thread statistics since the previous reset
+            reset - starts new interval, no count updated by the ingest thread in between is lost (Default: False)
+        """
+        with self._stats_lock:
+            l_stats = self._ingest_stats
+            if reset:
+                self._ingest_stats = self._new_ingest_stats()
+                return l_stats
+            return dict(l_stats)
+
+#-------------------------------------------------------------------------------
+    def reset_ingest_stats(self):
+        with self._stats_lock:
+            self._ingest_stats = self._new_ingest_stats()
+
 #-------------------------------------------------------------------------------
     async def _do_socket_timeout(self, *,
         jobid,
@@ -138,6 +425,50 @@ class ruuvitag_socket(object):
             except:
                 logger.exception(f'>>> jobid:{jobid}')
 
+# ------------------------------------------------------------------------------
+    @staticmethod
+    def _bpf_program(*, mfids, macs):
+        """
+        Generates kernel socket filter program
+        Falls back to the mfid only program if macs do not fit to the kernel limits
+        """
+        if macs:
+            try:
+                return ruuvitag_bpf(mfids=mfids, macs=macs)
+            except ValueError:
+                logger.warning(f'>>> bpf_filter {len(macs)} macs do not fit, filtering mfids only')
+        try:
+            return ruuvitag_bpf(mfids=mfids)
+        except ValueError:
+            logger.exception(f'>>> bpf_filter')
+        return None
+
+# ------------------------------------------------------------------------------
+    def _set_bpf_filter(self):
+        """
+        Attaches kernel socket filter, frames dropped by it are never copied to the user space
+        Frames are parsed in the same way without the filter, so failure is not fatal
+        """
+        if self._socket and self._bpf:
+            logger.debug(f'>>> device:{self._device} instructions:{len(self._bpf)}')
+            try:
+                (l_fprog, l_buffer) = bpf_fprog(prog=self._bpf)
+                self._socket.setsockopt(socket.SOL_SOCKET, SO_ATTACH_FILTER, l_fprog)
+                logger.info(f'>>> device:{self._device} bpf_filter attached')
+            except:
+                logger.exception(f'>>> device:{self._device} bpf_filter')
+
+# ------------------------------------------------------------------------------
+    def _set_time_stamp(self):
+        """
+        Enables kernel receive timestamps for the recording
+        """
+        if self._socket and self._recorder and not self._emulator:
+            try:
+                self._socket.setsockopt(ruuvitag_socket.SOL_HCI, ruuvitag_socket.HCI_TIME_STAMP, 1)
+            except:
+                logger.exception(f'>>> device:{self._device} time stamp')
+
 # ------------------------------------------------------------------------------
     def _open(self):
         logger.debug(f'>>> device:{self._device}')
@@ -146,12 +477,18 @@ class ruuvitag_socket(object):
             self._close()
 
         try:
-            self._socket = socket.socket(family=socket.AF_BLUETOOTH, type=socket.SOCK_RAW, proto=socket.BTPROTO_HCI)
-            self._socket.setblocking(False)
-            self._socket.bind((self._device_id,))
+            if self._emulator:
+                self._socket = self._emulator.open()
+                self._socket.setblocking(False)
+            else:
+                self._socket = socket.socket(family=socket.AF_BLUETOOTH, type=socket.SOCK_RAW, proto=socket.BTPROTO_HCI)
+                self._socket.setblocking(False)
+                self._socket.bind((self._device_id,))
         except:
             self._socket = None
             logger.exception(f'>>> exception')
+        self._set_bpf_filter()
+        self._set_time_stamp()
 
         logger.debug(f'>>> socket:{self._socket}')
 
@@ -159,32 +496,38 @@ class ruuvitag_socket(object):
     def _close(self):
         logger.debug(f'>>> device:{self._device}')
 
-        try:
-            if self._socket:
-                self._socket.close()
-                self._socket = None
-        except:
-            logger.exception(f'>>> exception')
+        self._cancel_wait()
+        with self._exclusive():
+            try:
+                if self._socket:
+                    self._socket.close()
+                    self._socket = None
+            except:
+                logger.exception(f'>>> exception')
 
 # ------------------------------------------------------------------------------
     async def _reset(self):
         logger.debug(f'>>> device:{self._device}')
 
-        self._close()
-        await asyncio.sleep(0.5)
-        if self._device_reset:
-            self._device_off()
-            await asyncio.sleep(0.5)
-            await self._shell_cmd(cmd=f'{self.HCICONFIG_CMD} {self._device} down')
-            await asyncio.sleep(1.0)
-            await self._shell_cmd(cmd=f'{self.HCICONFIG_CMD} {self._device} up')
+        # supervision and the receive may both reset the device, one at a time
+        async with self._reset_lock:
+            self._close()
             await asyncio.sleep(0.5)
-            self._device_on()
-        self._open()
+            if self._device_reset:
+                self._device_off()
+                await asyncio.sleep(0.5)
+                await self._shell_cmd(cmd=f'{self.HCICONFIG_CMD} {self._device} down')
+                await asyncio.sleep(1.0)
+                await self._shell_cmd(cmd=f'{self.HCICONFIG_CMD} {self._device} up')
+                await asyncio.sleep(0.5)
+                self._device_on()
+            self._open()
+            # new socket has no HCI filter and the device reset disables scanning
+            await self._start_scanning()
 
 # ------------------------------------------------------------------------------
     async def _shell_cmd(self, *, cmd):
-        if platform.system() == 'Linux':
+        if platform.system() == 'Linux' and not self._emulator:
             logger.info(f'>>> {cmd!r}')
             l_proc = await asyncio.create_subprocess_shell(
                 cmd,
@@ -232,6 +575,9 @@ class ruuvitag_socket(object):
         if self._socket:
             logger.debug(f'>>> device:{self._device} data:{data}')
             try:
+                if self._emulator:
+                    self._emulator.set_filter(data=data)
+                    return
                 self._socket.setsockopt(socket.SOL_HCI, socket.HCI_FILTER, data)
             except:
                 logger.exception(f'>>> exception')
@@ -239,11 +585,17 @@ class ruuvitag_socket(object):
 # ------------------------------------------------------------------------------
     def _device_on(self):
         logger.debug(f'>>> device:{self._device}')
+        if self._emulator:
+            self._emulator.device_up()
+            return
         self._send_cmd_value(cmd=ruuvitag_socket.HCIDEVUP, value=self._device_id)
 
 # ------------------------------------------------------------------------------
     def _device_off(self):
         logger.debug(f'>>> device:{self._device}')
+        if self._emulator:
+            self._emulator.device_down()
+            return
         self._send_cmd_value(cmd=ruuvitag_socket.HCIDEVDOWN, value=self._device_id)
 
 # ------------------------------------------------------------------------------
@@ -259,15 +611,115 @@ class ruuvitag_socket(object):
         self._set_filter(data=l_filter)
 
 # ------------------------------------------------------------------------------
-    def _set_scan_parameters(self):
-        logger.debug(f'>>> device:{self._device}')
+    async def _hci_request(self, *, cmd, data=b'', timeout=HCI_REQUEST_TIMEOUT):
+        """
+        Sends HCI command and waits for its Command Complete/Status event, the loop is not blocked meanwhile
+        Caller holds _exclusive so the receive and the ingest thread do not consume the event
+        Returns return parameters of the command (first byte is the status) or None in case of timeout
+        """
+        if not self._socket:
+            return None
+        logger.debug(f'>>> device:{self._device} cmd:{cmd:#06x} data:{hex_string(data=data)}')
+        try:
+            self._socket.send(struct.pack("<BHB", ruuvitag_socket.HCI_COMMAND_PKT, cmd, len(data)) + data)
+            return await asyncio.wait_for(self._hci_response(cmd=cmd), timeout)
+        except asyncio.TimeoutError:
+            logger.warning(f'>>> device:{self._device} cmd:{cmd:#06x} timeout')
+        except asyncio.CancelledError:
+            raise
+        except:
+            logger.exception(f'>>> exception')
+        return None
+
+# ------------------------------------------------------------------------------
+    async def _hci_response(self, *, cmd):
+        """
+        Waits for Command Complete/Status event of the cmd
+        Other received frames are ignored (scanning is disabled during the requests)
+        Returns return parameters of the command or None if the socket was closed while waiting
+        """
+        while await self._wait_readable():
+            while True:
+                try:
+                    l_data = self._socket.recv(ruuvitag_socket.RECV_BUFFER_SIZE)
+                except (BlockingIOError, InterruptedError):
+                    break
+                if not l_data:
+                    return None
+                if len(l_data) < 3 or l_data[0] != ruuvitag_socket.HCI_EVENT_PKT:
+                    continue
+                # 04 0E plen ncmd opcode(2) return parameters
+                if l_data[1] == ruuvitag_socket.EVT_CMD_COMPLETE and len(l_data) >= 7:
+                    if struct.unpack_from("<H", l_data, 4)[0] == cmd:
+                        return l_data[6:]
+                # 04 0F plen status ncmd opcode(2)
+                elif l_data[1] == ruuvitag_socket.EVT_CMD_STATUS and len(l_data) >= 7:
+                    if struct.unpack_from("<H", l_data, 5)[0] == cmd:
+                        return l_data[3:4]
+        return None
+
+# ------------------------------------------------------------------------------
+    async def _read_accept_list_size(self):
+        """ Returns size of the controller filter accept list or None """
+        l_resp = await self._hci_request(cmd=ruuvitag_socket.LE_READ_WHITE_LIST_SIZE_CMD)
+        if l_resp and len(l_resp) >= 2 and not l_resp[0]:
+            return l_resp[1]
+        return None
+
+# ------------------------------------------------------------------------------
+    async def _clear_accept_list(self):
+        l_resp = await self._hci_request(cmd=ruuvitag_socket.LE_CLEAR_WHITE_LIST_CMD)
+        return bool(l_resp) and not l_resp[0]
+
+# ------------------------------------------------------------------------------
+    async def _add_accept_list(self, *, mac):
+        """ Adds 48bit mac int to the controller filter accept list, ruuvitags use random static address """
+        l_data = struct.pack("<B", ruuvitag_socket.LE_RANDOM_ADDRESS) + mac.to_bytes(6, 'little')
+        l_resp = await self._hci_request(cmd=ruuvitag_socket.LE_ADD_DEVICE_TO_WHITE_LIST_CMD, data=l_data)
+        return bool(l_resp) and not l_resp[0]
+
+# ------------------------------------------------------------------------------
+    async def _set_accept_list(self):
+        """
+        Programs configured macs to the controller filter accept list
+        Returns scan filter policy, FILTER_POLICY_NO_WHITELIST in case accept list can not be used
+        """
+        self._accept_list_active = False
+        if not self._accept_list:
+            return ruuvitag_socket.FILTER_POLICY_NO_WHITELIST
+        logger.debug(f'>>> device:{self._device} macs:{len(self._accept_list)}')
+
+        l_size = await self._read_accept_list_size()
+        if l_size is None:
+            logger.warning(f'>>> device:{self._device} accept list size not available, using software filtering')
+            return ruuvitag_socket.FILTER_POLICY_NO_WHITELIST
+        if len(self._accept_list) > l_size:
+            logger.warning(f'>>> device:{self._device} accept list size:{l_size} < macs:{len(self._accept_list)}, using software filtering')
+            return ruuvitag_socket.FILTER_POLICY_NO_WHITELIST
+
+        if await self._clear_accept_list():
+            for l_mac in self._accept_list:
+                if not await self._add_accept_list(mac=l_mac):
+                    logger.warning(f'>>> device:{self._device} accept list add failed, using software filtering')
+                    await self._clear_accept_list()
+                    return ruuvitag_socket.FILTER_POLICY_NO_WHITELIST
+            self._accept_list_active = True
+            logger.info(f'>>> device:{self._device} accept list:{len(self._accept_list)}/{l_size} macs')
+            return ruuvitag_socket.FILTER_POLICY_WHITELIST
+
+        logger.warning(f'>>> device:{self._device} accept list clear failed, using software filtering')
+        return ruuvitag_socket.FILTER_POLICY_NO_WHITELIST
+
+# ------------------------------------------------------------------------------
+    def _set_scan_parameters(self, *, filter_policy=FILTER_POLICY_NO_WHITELIST):
+        logger.debug(f'>>> device:{self._device} filter_policy:{filter_policy} scan_type:{self._scan.scan_type} interval:{self._scan.interval} window:{self._scan.window}')
 
         l_len = 7
-        l_type = ruuvitag_socket.SCAN_TYPE_ACTIVE
-        l_internal = 0x0010   #  ms * 1.6
-        l_window = 0x0010     #  ms * 1.6
+        l_type = self._scan.scan_type
+        l_internal = self._scan.interval    #  ms * 1.6
+        l_window = self._scan.window        #  ms * 1.6
         l_own_addr  = ruuvitag_socket.LE_PUBLIC_ADDRESS
-        l_filter = ruuvitag_socket.FILTER_POLICY_NO_WHITELIST
+        l_filter = filter_policy
         l_cmd = struct.pack("<BHBBHHBB", ruuvitag_socket.HCI_COMMAND_PKT, ruuvitag_socket.LE_SET_SCAN_PARAMETERS_CMD,
                             l_len, l_type, l_internal, l_window, l_own_addr, l_filter )
         self._send_data(data=l_cmd)
@@ -284,13 +736,16 @@ class ruuvitag_socket(object):
         self._send_data(data=l_cmd)
 
 # ------------------------------------------------------------------------------
-    def _start_scanning(self):
+    async def _start_scanning(self):
         logger.debug(f'>>> device:{self._device}')
 
-        self._enable_scan(enabled=False)
-        self._set_scan_filter()
-        self._set_scan_parameters()
-        self._enable_scan(enabled=True, filter_duplicates=False)
+        # accept list requests wait for their Command Complete events from the socket
+        with self._exclusive():
+            self._enable_scan(enabled=False)
+            self._set_scan_filter()
+            self._filter_policy = await self._set_accept_list()
+            self._set_scan_parameters(filter_policy=self._filter_policy)
+            self._enable_scan(enabled=True, filter_duplicates=False)
 
 # ------------------------------------------------------------------------------
     def _stop_scanning(self):
@@ -299,20 +754,32 @@ class ruuvitag_socket(object):
         self._enable_scan(enabled=False)
 
 # -------------------------------------------------------------------------------
-    async def _get_data(self, *, data):
+    def _parse_data(self, *, data):
         """
-        Gets data from the received socket data
+        Parses received socket data
+        Yields BLEData for every accepted manufacturer data of every advertising report
+        BLEData address and data are memoryviews to the received data (no copies)
         """
-        # logger.debug(f'>>> device:{self._device} data:{hex_string(data=data)}')
         try:
-            if data[0] == ruuvitag_socket.HCI_EVENT_PKT and data[1] == ruuvitag_socket.EVT_LE_META_EVENT:
-                _, _, l_len = struct.unpack("<BBB", data[:3])
-                return (data[3:], l_len)
-        #     else:
-        #         logger.debug(f'>>> Unhandled HCI event packet, subtype={data[1]} data:{hex_string(data=data)}')
+            for (_, _, l_addr, l_addata, l_rssi) in le_adv_reports(data=data):
+                self._data_ts = get_sec()
+                for (l_mfid, l_mfdata) in manufacturer_data(addata=l_addata):
+                    if not self._mfids or l_mfid in self._mfids:
+                        if self._scan.adaptive:
+                            self._scan.seen(mac=int.from_bytes(l_addr, 'little'), now=self._data_ts)
+                        # mac string is formatted by BLEData only when needed
+                        l_bledata = BLEData(
+                            macraw = l_addr,
+                            rssi = l_rssi,
+                            mfid = l_mfid,
+                            mfdata = l_mfdata,
+                            rawdata = data
+                        )
+                        if logger.isEnabledFor(logging.DEBUG):
+                            logger.debug(f'''>>> device:{self._device} mac:{l_bledata.mac} rssi:{l_rssi} mfid:{l_mfid} mflen:{len(l_mfdata)} mfdata:{hex_string(data=l_mfdata,filler='')}''')
+                        yield l_bledata
         except:
-            pass
-        return (None, 0)
+            logger.exception(f'>>> exception')
 
 # -------------------------------------------------------------------------------
     async def _handle_data(self, *, data):
@@ -320,35 +787,342 @@ class ruuvitag_socket(object):
         Handles received data from the socket
         """
         # logger.debug(f'>>> device:{self._device} data:{hex_string(data=data)}')
-        (l_data, l_len) = await self._get_data(data=data)
+        for l_bledata in self._parse_data(data=data):
+            try:
+                await self._callback(bledata=l_bledata)
+            except:
+                logger.exception(f'>>> exception')
+
+        return None
+
+# -------------------------------------------------------------------------------
+    def _cancel_wait(self):
+        """
+        Releases pending socket readiness wait
+        """
+        if self._readfut:
+            with suppress(Exception):
+                self._loop.remove_reader(self._readfd)
+            if not self._readfut.done():
+                self._readfut.set_result(False)
+            self._readfut = None
+
+# -------------------------------------------------------------------------------
+    async def _wait_readable(self):
+        """
+        Waits until socket has data to read
+        Returns False if socket was closed while waiting
+        """
+        def _readable(fut):
+            if not fut.done():
+                fut.set_result(True)
+
+        l_fut = self._loop.create_future()
+        self._readfd = self._socket.fileno()
+        self._readfut = l_fut
+        self._loop.add_reader(self._readfd, _readable, l_fut)
+        try:
+            return await l_fut
+        finally:
+            if self._readfut is l_fut:
+                self._cancel_wait()
+
+# -------------------------------------------------------------------------------
+    def _closed(self, *, frames):
+        """
+        Zero length read, HCI frames are never empty so the other end is gone
+        Raised as BrokenPipeError like the unregistered hci device, frames already drained are handled first
+        """
+        if not frames:
+            raise BrokenPipeError(f'device:{self._device} closed')
+
+# -------------------------------------------------------------------------------
+    def _drain(self):
+        """
+        Drains all queued frames from the socket into the preallocated buffers
+        Returns list of memoryviews (valid until the next drain)
+        """
+        l_frames = []
+        for l_buffer in self._pool:
+            try:
+                l_len = self._socket.recv_into(l_buffer)
+            except (BlockingIOError, InterruptedError):
+                break
+            if not l_len:
+                self._closed(frames=l_frames)
+                break
+            l_frames.append(l_buffer[:l_len])
+        return l_frames
+
+# -------------------------------------------------------------------------------
+    def _drain_record(self):
+        """
+        Drains all queued frames with their kernel timestamps and records them
+        Returns list of memoryviews (valid until the next drain)
+        """
+        l_frames = []
+        l_timestamps = []
+        for l_buffer in self._pool:
+            try:
+                (l_len, l_ancdata, _, _) = self._socket.recvmsg_into([l_buffer], self._ancsize)
+            except (BlockingIOError, InterruptedError):
+                break
+            if not l_len:
+                self._closed(frames=l_frames)
+                break
+            l_ts = None
+            for (l_level, l_type, l_data) in l_ancdata:
+                if l_level == ruuvitag_socket.SOL_HCI and l_type == ruuvitag_socket.HCI_CMSG_TSTAMP and len(l_data) >= ruuvitag_socket.TIMEVAL.size:
+                    (l_sec, l_usec) = ruuvitag_socket.TIMEVAL.unpack_from(l_data)
+                    l_ts = l_sec + l_usec/1000000
+            l_frames.append(l_buffer[:l_len])
+            l_timestamps.append(l_ts or time.time())
+        if l_frames:
+            self._recorder.write_batch(frames=l_frames, timestamps=l_timestamps)
+        return l_frames
+
+# -------------------------------------------------------------------------------
+    async def _receive_one(self):
+        """
+        Waits for socket readiness and receives one frame
+        Wait is released by _close, so the reset socket is not waited for
+        Returns received frame or None if nothing was received
+        """
+        if not await self._wait_readable():
+            return None
+        try:
+            l_data = self._socket.recv(ruuvitag_socket.RECV_BUFFER_SIZE)
+        except (BlockingIOError, InterruptedError):
+            return None
         if not l_data:
+            self._closed(frames=[])
+        return l_data
+
+# -------------------------------------------------------------------------------
+    async def _receive_batch(self):
+        """
+        Waits for socket readiness and drains all queued frames
+        Returns list of received frames
+        """
+        if not await self._wait_readable():
+            return []
+        return self._drain_batch()
+
+# -------------------------------------------------------------------------------
+    def _drain_batch(self):
+        """
+        Drains all queued frames and updates the batched receive statistics
+        Returns list of received frames
+        """
+        l_start = time.perf_counter()
+        l_frames = self._drain_record() if self._recorder else self._drain()
+        l_us = int((time.perf_counter()-l_start)*1000000)
+
+        l_cnt = len(l_frames)
+        with self._stats_lock:
+            l_stats = self._stats
+            l_stats['wakeups'] += 1
+            l_stats['frames'] += l_cnt
+            l_stats['drain_us'] += l_us
+            if l_cnt > l_stats['max_frames']:
+                l_stats['max_frames'] = l_cnt
+            if l_us > l_stats['max_drain_us']:
+                l_stats['max_drain_us'] = l_us
+            if l_cnt == self._recv_batch:
+                l_stats['pool_full'] += 1
+        return l_frames
+
+# -------------------------------------------------------------------------------
+    async def _handle_batch(self, *, frames):
+        """
+        Handles batch of received frames
+        Frames are views to the receive buffers and are valid only during this call
+        """
+        if not frames:
             return
 
-        self._data_ts = get_sec()
-        l_mfid = 0xFFFF
+        if self._batch_callback:
+            l_bledatas = []
+            for l_frame in frames:
+                l_bledatas.extend(self._parse_data(data=l_frame))
+            if l_bledatas:
+                try:
+                    await self._batch_callback(bledatas=l_bledatas)
+                except:
+                    logger.exception(f'>>> exception')
+        else:
+            for l_frame in frames:
+                await self._handle_data(data=l_frame)
+
+# -------------------------------------------------------------------------------
+    @contextmanager
+    def _exclusive(self):
+        """
+        Keeps the receive of the loop and the ingest thread off the socket while the loop uses or closes it
+        Thread waiting in select is woken up through the wakeup pipe, loop waits only for the batch in progress
+        Held across the awaits of the HCI requests, nested use (socket closed meanwhile) passes through
+        """
+        if self._exclusive_held:
+            yield
+            return
+        self._exclusive_held = True
         try:
-            l_mac = ":".join(reversed(["{:02X}".format(x) for x in l_data[4:][:6]]))
-            l_rssi = l_data[l_len-1] & 0xFF
-            l_rssi = l_rssi-256 if l_rssi>127 else l_rssi
-            l_mfid = (l_data[16] & 0xFF) + ((l_data[17] & 0xFF) * 256)
-            if not self._mfids or l_mfid in self._mfids:
-                l_mfdata = l_data[18:l_len-1]
-                logger.debug(f'''>>> device:{self._device} mac:{l_mac} rssi:{l_rssi} mfid:{l_mfid} mflen:{len(l_mfdata)} mfdata:{hex_string(data=l_mfdata,filler='')}''')
+            if not self._ingest_thread:
+                yield
+                return
+            self._ingest_hold.set()
+            self._ingest_wake()
+            try:
+                with self._ingest_lock:
+                    yield
+            finally:
+                self._ingest_hold.clear()
+        finally:
+            self._exclusive_held = False
+
+# -------------------------------------------------------------------------------
+    def _ingest_wake(self):
+        """
+        Wakes the ingest thread from select, pending wakeup is enough if the pipe is full
+        """
+        if self._ingest_wakeup:
+            with suppress(BlockingIOError, OSError):
+                os.write(self._ingest_wakeup[1], b'\x00')
+
+# -------------------------------------------------------------------------------
+    def _ingest_woken(self, *, fd):
+        """
+        Empties the wakeup pipe (ingest thread)
+        """
+        with suppress(BlockingIOError, OSError):
+            while os.read(fd, 64):
+                pass
+
+# -------------------------------------------------------------------------------
+    def _ingest_put(self, *, samples):
+        """
+        Hands batch of samples to the loop (ingest thread)
+        Loop is woken up only if it has not been woken up since it emptied the ring
+        """
+        l_ring = self._ring
+        l_wakeup = False
+        with self._stats_lock:
+            l_stats = self._ingest_stats
+            if len(l_ring) >= self._ingest_ring:
+                l_stats['dropped'] += len(samples)
+                return
+            l_ring.append(samples)
+            l_stats['batches'] += 1
+            l_stats['samples'] += len(samples)
+            if len(l_ring) > l_stats['max_ring']:
+                l_stats['max_ring'] = len(l_ring)
+            if not self._ring_wakeup:
+                self._ring_wakeup = True
+                l_stats['wakeups'] += 1
+                l_wakeup = True
+        if l_wakeup:
+            self._loop.call_soon_threadsafe(self._ring_event.set)
+
+# -------------------------------------------------------------------------------
+    def _ingest_frames(self, *, frames):
+        """
+        Parses and decodes received frames (ingest thread)
+        Returns list of decoded samples
+        """
+        l_samples = []
+        for l_frame in frames:
+            for l_bledata in self._parse_data(data=l_frame):
                 try:
-                    await self._callback(bledata=BLEData(
-                        mac = l_mac,
-                        rssi = l_rssi,
-                        mfid = l_mfid,
-                        mfdata = l_mfdata,
-                        rawdata = data
-                    ))
+                    l_sample = self._ingest(bledata=l_bledata)
+                    if l_sample is not None:
+                        l_samples.append(l_sample)
                 except:
                     logger.exception(f'>>> exception')
-        except:
-            # logger.exception(f'>>> exception')
-            pass
+        return l_samples
 
-        return None
+# -------------------------------------------------------------------------------
+    def _ingest_run(self):
+        """
+        Ingest thread, reads the socket opened and closed by the loop
+        Waits for the socket and the wakeup pipe, the loop wakes it up to get the socket
+        Broken socket is reported to the loop which resets it
+        """
+        logger.info(f'>>> device:{self._device} ingest thread started')
+        l_wakeup = self._ingest_wakeup[0]
+        while not self._ingest_stop.is_set():
+            if self._ingest_hold.is_set():
+                time.sleep(0.001)
+                continue
+            l_frames = []
+            with self._ingest_lock:
+                l_socket = self._socket
+                if l_socket and l_socket is not self._ingest_broken:
+                    try:
+                        (l_readable, _, _) = select.select([l_socket, l_wakeup], [], [], ruuvitag_socket.INGEST_POLL)
+                        if l_wakeup in l_readable:
+                            self._ingest_woken(fd=l_wakeup)
+                        if l_socket in l_readable:
+                            l_frames = self._drain_batch()
+                    except (OSError, ValueError):
+                        # closed by the other end or unregistered hci device
+                        self._ingest_broken = l_socket
+                        self._loop.call_soon_threadsafe(self._ring_event.set)
+                    except:
+                        logger.exception(f'>>> exception')
+            if l_frames:
+                l_samples = self._ingest_frames(frames=l_frames)
+                if l_samples:
+                    self._ingest_put(samples=l_samples)
+            elif not l_socket or l_socket is self._ingest_broken:
+                self._ingest_stop.wait(ruuvitag_socket.INGEST_POLL)
+        logger.info(f'>>> device:{self._device} ingest thread stopped')
+
+# -------------------------------------------------------------------------------
+    def _ingest_start(self):
+        self._ingest_stop.clear()
+        self._ingest_wakeup = os.pipe()
+        for l_fd in self._ingest_wakeup:
+            os.set_blocking(l_fd, False)
+        self._ingest_thread = threading.Thread(target=self._ingest_run, name=f'ingest_{self._device}', daemon=True)
+        self._ingest_thread.start()
+
+# -------------------------------------------------------------------------------
+    def _ingest_join(self):
+        if self._ingest_thread:
+            self._ingest_stop.set()
+            self._ingest_wake()
+            self._ingest_thread.join(timeout=5*ruuvitag_socket.INGEST_POLL)
+            # left open if the thread did not stop, it may still select on it
+            if not self._ingest_thread.is_alive():
+                for l_fd in self._ingest_wakeup:
+                    with suppress(OSError):
+                        os.close(l_fd)
+            self._ingest_wakeup = None
+            self._ingest_thread = None
+
+# -------------------------------------------------------------------------------
+    async def _ingest_deliver(self):
+        """
+        Waits for the ingest thread wakeup and delivers all waiting batches to the ingest_callback
+        Raises BrokenPipeError if the ingest thread found the socket broken
+        """
+        await self._ring_event.wait()
+        self._ring_event.clear()
+        # cleared before emptying the ring, batches appended after this wake the loop again
+        self._ring_wakeup = False
+        l_ring = self._ring
+        while l_ring:
+            try:
+                await self._ingest_callback(samples=l_ring.popleft())
+            except asyncio.CancelledError:
+                raise
+            except:
+                logger.exception(f'>>> exception')
+        l_broken = self._ingest_broken
+        if l_broken is not None:
+            self._ingest_broken = None
+            if l_broken is self._socket:
+                self._closed(frames=[])
 
 # -------------------------------------------------------------------------------
     async def run(self):
@@ -362,16 +1136,25 @@ class ruuvitag_socket(object):
 
         logger.info(f'>>> starting to receive from the AF_BLUETOOTH socket')
         self._open()
-        self._start_scanning()
+        await self._start_scanning()
 
         self._schedule()
+        if self._ingest:
+            self._ingest_start()
 
         while not self._stopevent.is_set():
             try:
-                if self._socket:
-                    await self._handle_data(data=await self._loop.sock_recv(self._socket, 1024))
+                if self._ingest:
+                    await self._ingest_deliver()
+                elif self._socket and not self._exclusive_held:
+                    if self._recv_batch:
+                        await self._handle_batch(frames=await self._receive_batch())
+                    else:
+                        l_data = await self._receive_one()
+                        if l_data:
+                            await self._handle_data(data=l_data)
                 else:
-                    await asyncio.sleep(10)
+                    await asyncio.sleep(1.0)
             except GeneratorExit:
                 logger.error(f'>>> GeneratorExit')
                 self._stopevent.set()
@@ -387,8 +1170,11 @@ class ruuvitag_socket(object):
                 logger.exception(f'>>> exception')
                 pass
 
+        self._ingest_join()
         self._stop_scanning()
         self._close()
+        if self._recorder:
+            self._recorder.close()
 
         logger.info('>>> socket completed')
 
@@ -398,6 +1184,9 @@ class ruuvitag_socket(object):
     def stop(self):
         logger.info(f'>>> socket')
         self._stopevent.set()
+        self._ring_event.set()
+        # receive waiting for the socket returns without data
+        self._cancel_wait()
 
 # -------------------------------------------------------------------------------
     # def task(self):
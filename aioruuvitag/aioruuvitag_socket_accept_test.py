@@ -0,0 +1,191 @@
+# coding=utf-8
+# !/usr/bin/python3
+# Name:         aioruuvitag_socket_accept_test - controller filter accept list checks
+# Copyright:    (c) 2020 TK
+# Licence:      MIT
+#
+# python3 -m aioruuvitag.aioruuvitag_socket_accept_test
+#
+# Runs the ruuvitag_socket collector with accept_list against the hci_emulator
+# (fake HCI socket), with and without the ingest thread:
+# - programming: 3 macs are programmed with 0x200F, 0x2010 and 0x2011 x3 before
+#   the scan is enabled with the accept list policy, only those tags come through
+# - capacity overflow: 20 macs don't fit to the list of 16, nothing is programmed
+#   and all the tags come through (software filtering)
+# - add failure: controller rejects the second add, the list is cleared and all
+#   the tags come through
+# - hung controller: the unanswered requests do not block the loop
+# Exits with 1 if a check fails.
+# -------------------------------------------------------------------------------
+import sys
+import time
+import asyncio
+
+from .aioruuvitag_socket import ruuvitag_socket
+from .aioruuvitag_synth import SYNTH_MAC_BASE, SYNTH_MFID
+from .ble_emulator import hci_emulator, OP_LE_ADD_DEVICE_TO_WHITE_LIST, STATUS_MEMORY_EXCEEDED
+from .ruuvitag_misc import mac_to_int
+
+TAGS = 20
+RATE = 400.0                # advertisements/sec, every tag 20 times/sec
+ACCEPT_LIST_SIZE = 16
+RECEIVE_TIME = 1.0          # sec
+MACS = [SYNTH_MAC_BASE + l_idx for l_idx in range(TAGS)]
+ACCEPT_OPCODES = (0x200F, 0x2010, 0x2011)
+SCAN_OPCODES = (0x200B, 0x200C)
+
+# ===============================================================================
+class _failing_emulator(hci_emulator):
+    """ Controller rejecting the second accept list add """
+# -------------------------------------------------------------------------------
+    def __init__(self, **kwargs):
+        self._adds = 0
+        super().__init__(**kwargs)
+
+# -------------------------------------------------------------------------------
+    def _command(self, *, opcode, params):
+        if opcode == OP_LE_ADD_DEVICE_TO_WHITE_LIST:
+            self._adds += 1
+            if self._adds == 2:
+                return bytes((STATUS_MEMORY_EXCEEDED,))
+        return super()._command(opcode=opcode, params=params)
+
+# -------------------------------------------------------------------------------
+async def _collect(*, loop, emulator, accept_list, ingest, seconds=RECEIVE_TIME):
+    """ Returns (received macs, collector, max loop stall sec) """
+    l_macs = set()
+
+    async def _bledatas(*, bledatas):
+        l_macs.update(mac_to_int(l_bledata.mac) for l_bledata in bledatas)
+
+    async def _samples(*, samples):
+        l_macs.update(samples)
+
+    l_collector = ruuvitag_socket(
+        loop=loop,
+        callback=_bledatas,
+        batch_callback=_bledatas,
+        mfids=[SYNTH_MFID],
+        device_timeout=0,
+        recv_batch=16,
+        accept_list=accept_list,
+        emulator=emulator,
+        ingest=(lambda *, bledata: mac_to_int(bledata.mac)) if ingest else None,
+        ingest_callback=_samples
+    )
+    l_task = loop.create_task(l_collector.run())
+    l_stall = 0.0
+    l_end = time.monotonic() + seconds
+    l_last = time.monotonic()
+    while l_last < l_end:
+        await asyncio.sleep(0.01)
+        l_now = time.monotonic()
+        l_stall = max(l_stall, l_now - l_last - 0.01)
+        l_last = l_now
+    l_collector.stop()
+    await asyncio.wait([l_task], timeout=5.0)
+    return (l_macs, l_collector, l_stall)
+
+# -------------------------------------------------------------------------------
+def _run(*, emulator, accept_list, ingest, seconds=RECEIVE_TIME):
+    """ Runs the collector in a new loop, returns (received macs, collector, max loop stall sec, commands) """
+    l_loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(l_loop)
+    try:
+        l_result = l_loop.run_until_complete(_collect(loop=l_loop, emulator=emulator, accept_list=accept_list, ingest=ingest, seconds=seconds))
+    finally:
+        emulator.close()
+        l_loop.close()
+    return l_result + (emulator.commands,)
+
+# -------------------------------------------------------------------------------
+def _opcodes(*, commands):
+    """ Returns accept list and scan opcodes of the start sequence, up to the scan enable """
+    l_opcodes = []
+    for (l_opcode, l_params) in commands:
+        if l_opcode in ACCEPT_OPCODES + SCAN_OPCODES:
+            l_opcodes.append(l_opcode)
+            if l_opcode == 0x200C and l_params[:1] == b'\x01':
+                break
+    return l_opcodes
+
+# -------------------------------------------------------------------------------
+def _filter_policy(*, commands):
+    """ Returns filter policy of the last LE Set Scan Parameters """
+    return [l_params for (l_opcode, l_params) in commands if l_opcode == 0x200B][-1][6]
+
+# -------------------------------------------------------------------------------
+def test_programming():
+    for l_ingest in (False, True):
+        l_accept = MACS[5:8]
+        (l_macs, l_collector, _, l_commands) = _run(
+            emulator=hci_emulator(tags=TAGS, rate=RATE, seed=1, accept_list_size=ACCEPT_LIST_SIZE),
+            accept_list=l_accept,
+            ingest=l_ingest
+        )
+        l_opcodes = _opcodes(commands=l_commands)
+        assert l_opcodes == [0x200C, 0x200F, 0x2010, 0x2011, 0x2011, 0x2011, 0x200B, 0x200C], f'ingest:{l_ingest} commands:{[hex(l_op) for l_op in l_opcodes]}'
+        l_added = [bytes(l_params) for (l_opcode, l_params) in l_commands if l_opcode == 0x2011]
+        assert l_added == [b'\x01' + l_mac.to_bytes(6, 'little') for l_mac in l_accept], f'ingest:{l_ingest} added:{l_added}'
+        assert _filter_policy(commands=l_commands) == ruuvitag_socket.FILTER_POLICY_WHITELIST, f'ingest:{l_ingest}'
+        assert l_collector._accept_list_active, f'ingest:{l_ingest}'
+        assert l_macs == set(l_accept), f'ingest:{l_ingest} received:{sorted(l_macs)}'
+
+# -------------------------------------------------------------------------------
+def test_capacity_overflow():
+    for l_ingest in (False, True):
+        (l_macs, l_collector, _, l_commands) = _run(
+            emulator=hci_emulator(tags=TAGS, rate=RATE, seed=1, accept_list_size=ACCEPT_LIST_SIZE),
+            accept_list=MACS,
+            ingest=l_ingest
+        )
+        l_opcodes = _opcodes(commands=l_commands)
+        assert l_opcodes == [0x200C, 0x200F, 0x200B, 0x200C], f'ingest:{l_ingest} commands:{[hex(l_op) for l_op in l_opcodes]}'
+        assert _filter_policy(commands=l_commands) == ruuvitag_socket.FILTER_POLICY_NO_WHITELIST, f'ingest:{l_ingest}'
+        assert not l_collector._accept_list_active, f'ingest:{l_ingest}'
+        assert l_macs == set(MACS), f'ingest:{l_ingest} received:{len(l_macs)}'
+
+# -------------------------------------------------------------------------------
+def test_add_failure():
+    for l_ingest in (False, True):
+        (l_macs, l_collector, _, l_commands) = _run(
+            emulator=_failing_emulator(tags=TAGS, rate=RATE, seed=1, accept_list_size=ACCEPT_LIST_SIZE),
+            accept_list=MACS[:3],
+            ingest=l_ingest
+        )
+        l_opcodes = _opcodes(commands=l_commands)
+        assert l_opcodes == [0x200C, 0x200F, 0x2010, 0x2011, 0x2011, 0x2010, 0x200B, 0x200C], f'ingest:{l_ingest} commands:{[hex(l_op) for l_op in l_opcodes]}'
+        assert _filter_policy(commands=l_commands) == ruuvitag_socket.FILTER_POLICY_NO_WHITELIST, f'ingest:{l_ingest}'
+        assert not l_collector._accept_list_active, f'ingest:{l_ingest}'
+        assert l_macs == set(MACS), f'ingest:{l_ingest} received:{len(l_macs)}'
+
+# -------------------------------------------------------------------------------
+def test_hung_controller():
+    l_emulator = hci_emulator(tags=TAGS, rate=RATE, seed=1, accept_list_size=ACCEPT_LIST_SIZE)
+    l_emulator.hang()
+    (l_macs, l_collector, l_stall, l_commands) = _run(
+        emulator=l_emulator,
+        accept_list=MACS[:3],
+        ingest=False,
+        seconds=ruuvitag_socket.HCI_REQUEST_TIMEOUT + 0.5
+    )
+    assert _opcodes(commands=l_commands) == [0x200C, 0x200F, 0x200B, 0x200C], f'commands:{l_commands}'
+    assert not l_collector._accept_list_active
+    assert l_stall < 0.2, f'loop stalled {l_stall:.3f}sec'
+
+# -------------------------------------------------------------------------------
+if __name__ == '__main__':
+    l_failed = 0
+    for (l_name, l_test) in (
+        ('programming', test_programming),
+        ('capacity overflow', test_capacity_overflow),
+        ('add failure', test_add_failure),
+        ('hung controller', test_hung_controller)
+    ):
+        try:
+            l_test()
+            print(f'{l_name}: ok')
+        except AssertionError as l_e:
+            l_failed += 1
+            print(f'FAILED {l_name}: {l_e}')
+    sys.exit(1 if l_failed else 0)
@@ -0,0 +1,78 @@
+# coding=utf-8
+# !/usr/bin/python3
+# Name:         aioruuvitag_socket_bench - socket collector frame path micro-benchmark
+# Copyright:    (c) 2020 TK
+# Licence:      MIT
+#
+# python3 -m aioruuvitag.aioruuvitag_socket_bench [packets]
+#
+# Compares the previous copying frame path (slices, eager mac string) with the
+# memoryview frame path of the ruuvitag_socket. Reports time per packet and
+# objects/bytes allocated per packet which stay alive with the BLEData.
+# -------------------------------------------------------------------------------
+import sys
+import time
+import asyncio
+import tracemalloc
+
+from .aioruuvitag_socket import ruuvitag_socket
+from .ble_data import BLEData
+
+RAWDATA = bytes.fromhex('043E2B02010301B4DA2618D7CB1F0201061BFF99040516EC5238C574FCE4FD8CFFEC99769A6221CBD71826DAB4BC')
+MFIDS = [1177]
+
+# -------------------------------------------------------------------------------
+def _copy_path(*, data):
+    """ frame path before the memoryview change """
+    if data[0] == 0x04 and data[1] == 0x3e:
+        l_len = data[2]
+        l_data = data[3:]
+        l_mac = ":".join(reversed(["{:02X}".format(x) for x in l_data[4:][:6]]))
+        l_rssi = l_data[l_len-1] & 0xFF
+        l_rssi = l_rssi-256 if l_rssi>127 else l_rssi
+        l_mfid = (l_data[16] & 0xFF) + ((l_data[17] & 0xFF) * 256)
+        if l_mfid in MFIDS:
+            l_mfdata = l_data[18:l_len-1]
+            return [BLEData(mac=l_mac, rssi=l_rssi, mfid=l_mfid, mfdata=l_mfdata, rawdata=data)]
+    return []
+
+# -------------------------------------------------------------------------------
+def _measure(*, name, func, packets):
+    # time
+    l_start = time.perf_counter()
+    for _ in range(packets):
+        func(data=RAWDATA)
+    l_us = (time.perf_counter()-l_start)*1000000/packets
+
+    # allocations which stay alive with the results
+    l_keep = []
+    tracemalloc.start()
+    l_before = tracemalloc.take_snapshot()
+    for _ in range(packets):
+        l_keep.append(func(data=RAWDATA))
+    l_after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    l_stats = l_after.compare_to(l_before, 'filename')
+    l_blocks = sum(l_s.count_diff for l_s in l_stats)
+    l_bytes = sum(l_s.size_diff for l_s in l_stats)
+    # list holding the results is not part of the frame path
+    l_blocks -= 1
+    l_bytes -= sys.getsizeof(l_keep)
+
+    print(f'{name:12s} {l_us:8.2f} us/packet {l_blocks/packets:6.1f} allocations/packet {l_bytes/packets:8.1f} bytes/packet')
+
+# -------------------------------------------------------------------------------
+if __name__ == '__main__':
+    l_packets = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+
+    l_loop = asyncio.new_event_loop()
+    async def _callback(*, bledata):
+        pass
+    l_socket = ruuvitag_socket(loop=l_loop, callback=_callback, mfids=MFIDS)
+    def _view_path(*, data):
+        return list(l_socket._parse_data(data=data))
+
+    print(f'packets: {l_packets}')
+    _measure(name='copy', func=_copy_path, packets=l_packets)
+    _measure(name='memoryview', func=_view_path, packets=l_packets)
+    l_loop.close()
@@ -0,0 +1,156 @@
+# coding=utf-8
+# !/usr/bin/python3
+# Name:         aioruuvitag_socket_emulator - socket collector scenarios with the emulated HCI device
+# Copyright:    (c) 2020 TK
+# Licence:      MIT
+#
+# python3 -m aioruuvitag.aioruuvitag_socket_emulator [rate] [recv_batch] [ingest]
+#
+# Runs the ruuvitag_socket collector against the hci_emulator (no bluetooth
+# hardware or root needed) and measures:
+#   scan        HCI commands sent by the collector at start
+#   throughput  bledatas/sec received at the given advertisement rate
+#   unplug      device removed for UNPLUG sec, time to the first bledata after it
+#   hang        controller hung, time until the device_timeout supervision recovers it
+# ingest 1 runs the collector with the ingest thread
+# unplug and hang are run also with recv_batch 0 (one recv per frame) if recv_batch is given
+# -------------------------------------------------------------------------------
+import sys
+import time
+import asyncio
+from apscheduler.schedulers.asyncio import AsyncIOScheduler
+
+from .aioruuvitag_socket import ruuvitag_socket
+from .ble_emulator import hci_emulator
+
+MFIDS = [1177]
+TAGS = 100
+THROUGHPUT_TIME = 5.0       # sec
+UNPLUG = 2.0                # sec
+DEVICE_TIMEOUT = 3.0        # sec
+INGEST = False
+
+# ===============================================================================
+class _scenario(object):
+# -------------------------------------------------------------------------------
+    def __init__(self, *, loop, rate, recv_batch, device_reset=False):
+        self.count = 0
+        self.last = 0.0
+        self._loop = loop
+        self.scheduler = AsyncIOScheduler(event_loop=loop)
+        self.scheduler.start()
+        self.emulator = hci_emulator(tags=TAGS, rate=rate, seed=1)
+        self.collector = ruuvitag_socket(
+            loop=loop,
+            callback=self._bledata,
+            batch_callback=self._bledatas if recv_batch else None,
+            scheduler=self.scheduler,
+            mfids=MFIDS,
+            device_reset=device_reset,
+            device_timeout=DEVICE_TIMEOUT,
+            recv_batch=recv_batch,
+            emulator=self.emulator,
+            ingest=self._ingest if INGEST else None,
+            ingest_callback=self._samples
+        )
+        self._task = loop.create_task(self.collector.run())
+
+# -------------------------------------------------------------------------------
+    async def _bledata(self, *, bledata):
+        self.count += 1
+        self.last = time.monotonic()
+
+# -------------------------------------------------------------------------------
+    async def _bledatas(self, *, bledatas):
+        self.count += len(bledatas)
+        self.last = time.monotonic()
+
+# -------------------------------------------------------------------------------
+    def _ingest(self, *, bledata):
+        return bledata.rssi
+
+# -------------------------------------------------------------------------------
+    async def _samples(self, *, samples):
+        self.count += len(samples)
+        self.last = time.monotonic()
+
+# -------------------------------------------------------------------------------
+    async def wait_data(self, *, after, timeout):
+        """ Returns seconds from after to the first bledata received after it or None """
+        l_end = time.monotonic() + timeout
+        while time.monotonic() < l_end:
+            if self.last > after:
+                return self.last - after
+            await asyncio.sleep(0.01)
+        return None
+
+# -------------------------------------------------------------------------------
+    async def close(self):
+        self.collector.stop()
+        await asyncio.wait([self._task], timeout=5.0)
+        self.scheduler.shutdown(wait=False)
+        self.emulator.close()
+
+# -------------------------------------------------------------------------------
+async def _scan(*, loop, recv_batch):
+    l_scenario = _scenario(loop=loop, rate=100.0, recv_batch=recv_batch)
+    await asyncio.sleep(0.5)
+    l_cmds = ' '.join(f'{l_opcode:#06x}:{bytes(l_params).hex()}' for l_opcode, l_params in l_scenario.emulator.commands)
+    l_stats = l_scenario.emulator.stats()
+    await l_scenario.close()
+    print(f'scan        commands:{l_cmds} scan_enabled:{l_stats["scan_enabled"]}')
+
+# -------------------------------------------------------------------------------
+async def _throughput(*, loop, rate, recv_batch):
+    l_scenario = _scenario(loop=loop, rate=rate, recv_batch=recv_batch)
+    await asyncio.sleep(0.5)
+    l_count = l_scenario.count
+    l_cpu = time.process_time()
+    l_start = time.monotonic()
+    await asyncio.sleep(THROUGHPUT_TIME)
+    l_elapsed = time.monotonic() - l_start
+    l_cpu = time.process_time() - l_cpu
+    l_count = l_scenario.count - l_count
+    l_stats = l_scenario.emulator.stats()
+    await l_scenario.close()
+    print(f'throughput  rate:{rate:.0f}/sec received:{l_count/l_elapsed:.0f}/sec dropped:{l_stats["dropped"]} cpu:{100.0*l_cpu/l_elapsed:.0f}% (emulator included)')
+
+# -------------------------------------------------------------------------------
+async def _unplug(*, loop, recv_batch):
+    l_scenario = _scenario(loop=loop, rate=100.0, recv_batch=recv_batch)
+    await asyncio.sleep(0.5)
+    l_scenario.emulator.unplug(seconds=UNPLUG)
+    l_start = time.monotonic()
+    l_reconnect = await l_scenario.wait_data(after=l_start+UNPLUG, timeout=UNPLUG+3*DEVICE_TIMEOUT)
+    l_stats = l_scenario.emulator.stats()
+    await l_scenario.close()
+    l_reconnect = f'{l_reconnect:.2f}sec' if l_reconnect is not None else 'failed'
+    print(f'unplug      recv_batch:{recv_batch} unplugged:{UNPLUG}sec reconnect after replug:{l_reconnect} connections:{l_stats["connections"]}')
+
+# -------------------------------------------------------------------------------
+async def _hang(*, loop, recv_batch, device_reset):
+    l_scenario = _scenario(loop=loop, rate=100.0, recv_batch=recv_batch, device_reset=device_reset)
+    await asyncio.sleep(0.5)
+    l_scenario.emulator.hang()
+    l_start = time.monotonic()
+    l_recovery = await l_scenario.wait_data(after=l_start, timeout=3*DEVICE_TIMEOUT+5.0)
+    l_stats = l_scenario.emulator.stats()
+    await l_scenario.close()
+    l_recovery = f'{l_recovery:.2f}sec' if l_recovery is not None else 'not recovered'
+    print(f'hang        recv_batch:{recv_batch} device_reset:{device_reset} device_timeout:{DEVICE_TIMEOUT}sec recovery:{l_recovery} resets:{l_stats["resets"]}')
+
+# -------------------------------------------------------------------------------
+if __name__ == '__main__':
+    l_rate = float(sys.argv[1]) if len(sys.argv) > 1 else 5000.0
+    l_recv_batch = int(sys.argv[2]) if len(sys.argv) > 2 else 32
+    INGEST = bool(int(sys.argv[3])) if len(sys.argv) > 3 else False
+
+    l_loop = asyncio.get_event_loop()
+    print(f'tags: {TAGS} recv_batch: {l_recv_batch} ingest: {INGEST}')
+    l_loop.run_until_complete(_scan(loop=l_loop, recv_batch=l_recv_batch))
+    l_loop.run_until_complete(_throughput(loop=l_loop, rate=l_rate, recv_batch=l_recv_batch))
+    for l_batch in sorted({l_recv_batch, 0}, reverse=True):
+        l_loop.run_until_complete(_unplug(loop=l_loop, recv_batch=l_batch))
+        l_loop.run_until_complete(_hang(loop=l_loop, recv_batch=l_batch, device_reset=False))
+        l_loop.run_until_complete(_hang(loop=l_loop, recv_batch=l_batch, device_reset=True))
+    l_loop.close()
@@ -0,0 +1,356 @@
+# coding=utf-8
+# !/usr/bin/python3
+# Name:         ruuvitag_synth - synthetic ruuvitag fleet
+# Copyright:    (c) 2020 TK
+# Licence:      MIT
+#
+# Generates DF3/DF5 advertisements of the virtual tags to find out how many
+# tags the gateway can handle. Every tag has its own slowly drifting sensor
+# values with measurement noise, rssi and advertising jitter. DF5 sequence
+# number is incremented once per measurement, the measurement is advertised
+# rebroadcasts times like the real tag does.
+#
+# Advertisements are scheduled to the target aggregate rate. If the pipeline
+# can't keep up the achieved rate falls behind the target and the lag grows,
+# both are logged every STATS_INTERVAL.
+# ------------------------------------------------------------------------------
+import logging
+logger = logging.getLogger('ruuvitag')
+
+import time
+import heapq
+import random
+import struct
+import asyncio
+from datetime import datetime as _dt, timedelta as _td
+
+from .ble_data import BLEData
+
+SYNTH_MFID          = 0x0499
+SYNTH_MAC_BASE      = 0xC0DE00000000        # random static address range
+DF5_STRUCT          = struct.Struct('>BhHHhhhHBH6s')
+DF3_STRUCT          = struct.Struct('>BBBBHhhhH')
+
+# -------------------------------------------------------------------------------
+def df5_mfdata(*, temperature, humidity, pressure, acc_x, acc_y, acc_z, battery, tx_power, movement, sequence, mac):
+    """
+    Returns DF5 manufacturer data (24 bytes)
+    temperature °C, humidity %, pressure hPa, acc mG, battery mV, tx_power dBm, mac int
+    """
+    return DF5_STRUCT.pack(
+        5,
+        max(-32767, min(32767, int(round(temperature * 200)))),
+        max(0, min(40000, int(round(humidity * 400)))),
+        max(0, min(65534, int(round(pressure * 100)) - 50000)),
+        max(-32767, min(32767, int(acc_x))),
+        max(-32767, min(32767, int(acc_y))),
+        max(-32767, min(32767, int(acc_z))),
+        (max(0, min(2046, int(battery) - 1600)) << 5) | max(0, min(30, (int(tx_power) + 40) // 2)),
+        movement & 0xFF,
+        sequence & 0xFFFF,
+        mac.to_bytes(6, 'big')
+    )
+
+# -------------------------------------------------------------------------------
+def df3_mfdata(*, temperature, humidity, pressure, acc_x, acc_y, acc_z, battery):
+    """
+    Returns DF3 manufacturer data (14 bytes)
+    temperature °C, humidity %, pressure hPa, acc mG, battery mV
+    """
+    l_temp = max(-127.99, min(127.99, temperature))
+    l_hundredths = int(round(abs(l_temp) * 100))
+    return DF3_STRUCT.pack(
+        3,
+        max(0, min(200, int(round(humidity * 2)))),
+        (l_hundredths // 100) | (0x80 if l_temp < 0 else 0),
+        l_hundredths % 100,
+        max(0, min(65535, int(round(pressure * 100)) - 50000)),
+        max(-32767, min(32767, int(acc_x))),
+        max(-32767, min(32767, int(acc_y))),
+        max(-32767, min(32767, int(acc_z))),
+        max(0, min(65535, int(battery)))
+    )
+
+# ==============================================================================
+# synth_tag class - one virtual tag, also used by ble_emulator
+# ==============================================================================
+class synth_tag(object):
+    __slots__ = ('mac', 'macraw', 'df', 'rebroadcasts', 'interval', 'jitter', 'rssi',
+        'temperature', 'temperature_base', 'humidity', 'humidity_base', 'pressure',
+        'battery', 'movement', 'sequence', 'adv_count', 'mfdata', '_rnd')
+# -------------------------------------------------------------------------------
+    def __init__(self, *, mac, df, rebroadcasts, interval, jitter, rnd):
+        """
+        mac - 48bit mac int
+        df - dataformat 3 or 5
+        rebroadcasts - advertisements per measurement
+        interval - advertising interval (sec)
+        jitter - relative jitter of the interval
+        rnd - random.Random of the fleet (values are reproducible with the seed)
+        """
+        self.mac = mac
+        self.macraw = mac.to_bytes(6, 'little')
+        self.df = df
+        self.rebroadcasts = max(1, rebroadcasts)
+        self.interval = interval
+        self.jitter = jitter
+        self.rssi = rnd.uniform(-95.0, -45.0)
+        self.temperature_base = rnd.uniform(-5.0, 30.0)
+        self.temperature = self.temperature_base
+        self.humidity_base = rnd.uniform(25.0, 75.0)
+        self.humidity = self.humidity_base
+        self.pressure = rnd.uniform(985.0, 1035.0)
+        self.battery = rnd.uniform(2700.0, 3100.0)
+        self.movement = rnd.randrange(256)
+        self.sequence = rnd.randrange(65535)
+        self.adv_count = 0
+        self.mfdata = None
+        self._rnd = rnd
+
+# -------------------------------------------------------------------------------
+    def _measure(self):
+        """ Drifts the sensor values and encodes the new measurement """
+        l_rnd = self._rnd
+        self.temperature += 0.01 * (self.temperature_base - self.temperature) + l_rnd.gauss(0.0, 0.02)
+        self.humidity += 0.01 * (self.humidity_base - self.humidity) + l_rnd.gauss(0.0, 0.05)
+        self.humidity = max(0.0, min(100.0, self.humidity))
+        self.pressure = max(880.0, min(1080.0, self.pressure + l_rnd.gauss(0.0, 0.01)))
+        self.battery = max(1800.0, self.battery - l_rnd.random() * 0.001)
+        if l_rnd.random() < 0.01:
+            self.movement += 1
+        self.sequence = (self.sequence + 1) % 65535
+        l_values = dict(
+            temperature = self.temperature + l_rnd.gauss(0.0, 0.05),
+            humidity = max(0.0, min(100.0, self.humidity + l_rnd.gauss(0.0, 0.2))),
+            pressure = self.pressure + l_rnd.gauss(0.0, 0.02),
+            acc_x = l_rnd.gauss(0.0, 15.0),
+            acc_y = l_rnd.gauss(0.0, 15.0),
+            acc_z = 1000.0 + l_rnd.gauss(0.0, 15.0),
+            battery = self.battery
+        )
+        if self.df == 3:
+            self.mfdata = df3_mfdata(**l_values)
+        else:
+            self.mfdata = df5_mfdata(tx_power=4, movement=self.movement, sequence=self.sequence, mac=self.mac, **l_values)
+
+# -------------------------------------------------------------------------------
+    def advertise(self):
+        """
+        Returns (BLEData, new measurement)
+        """
+        l_new = not (self.adv_count % self.rebroadcasts)
+        if l_new:
+            self._measure()
+        self.adv_count += 1
+        return (BLEData(
+            macraw = self.macraw,
+            rssi = max(-127, min(20, int(self.rssi + self._rnd.gauss(0.0, 3.0)))),
+            mfid = SYNTH_MFID,
+            mfdata = self.mfdata
+        ), l_new)
+
+# -------------------------------------------------------------------------------
+    def next_interval(self):
+        """ Advertising interval with the relative jitter and the 0...10ms advDelay of BLE """
+        return self.interval * (1.0 + self._rnd.uniform(-self.jitter, self.jitter)) + self._rnd.random() * 0.01
+
+# ==============================================================================
+# ruuvitag_synth class
+# ==============================================================================
+class ruuvitag_synth(object):
+    SCHEDULER_MAX_INSTANCES     = 5
+    STATS_INTERVAL              = 60
+    BATCH_SIZE                  = 256       # max bledatas per batch_callback
+    MAX_LAG                     = 1.0       # sec, tag rescheduled from now if behind more
+# ------------------------------------------------------------------------------
+    def __init__(self, *,
+        loop,
+        callback,
+        batch_callback=None,
+        scheduler=None,
+        tags=100,
+        rate=100.0,
+        df3=0.0,
+        rebroadcasts=2,
+        jitter=0.1,
+        seed=None,
+        **kwargs
+    ):
+        """
+        loop - asyncio.loop (Required)
+        callback - async callback(bledata=BLEData) called for each generated data (Required)
+        batch_callback - async callback(bledatas=[BLEData]) called with max BATCH_SIZE datas (Default: None)
+        scheduler - AsyncIOScheduler to schedule periodical tasks
+        tags - number of virtual tags (Default: 100)
+        rate - target aggregate advertisements/sec of all tags (Default: 100.0)
+        df3 - share of DF3 tags 0.0 ... 1.0, others are DF5 (Default: 0.0)
+        rebroadcasts - advertisements per measurement (Default: 2)
+        jitter - relative advertising interval jitter (Default: 0.1)
+        seed - random seed for repeatable fleet (Default: None)
+        """
+        logger.info(f'>>> tags:{tags} rate:{rate}')
+
+        if not loop:
+            raise ValueError(f'loop is None')
+        self._loop = loop
+        if not callback:
+            raise ValueError(f'callback is None')
+        if not tags or tags < 1:
+            raise ValueError(f'invalid tags:{tags}')
+        if not rate or rate <= 0:
+            raise ValueError(f'invalid rate:{rate}')
+        self._callback = callback
+        self._batch_callback = batch_callback
+        self._scheduler = scheduler
+        self._rate = float(rate)
+        self._stopevent = asyncio.Event()
+
+        l_rnd = random.Random(seed)
+        l_interval = tags / self._rate
+        l_df3 = int(round(tags * max(0.0, min(1.0, df3 or 0.0))))
+        self._tags = [
+            synth_tag(
+                mac = SYNTH_MAC_BASE + l_idx,
+                df = 3 if l_idx < l_df3 else 5,
+                rebroadcasts = rebroadcasts,
+                interval = l_interval,
+                jitter = jitter,
+                rnd = l_rnd
+            ) for l_idx in range(tags)
+        ]
+        self._rnd = l_rnd
+        self._stats = self._new_stats()
+
+        logger.info(f'>>> {self} initialized')
+
+# -------------------------------------------------------------------------------
+    def __repr__(self):
+        return f'ruuvitag_synth tags:{len(self._tags)} rate:{self._rate}/sec interval:{len(self._tags)/self._rate:.3f}sec'
+
+#-------------------------------------------------------------------------------
+    def _schedule(self):
+        """
+        Initializes scheduler for the rate statistics
+        """
+        if not self._scheduler:
+            return
+
+        l_jobid = f'synth_stats'
+        try:
+            self._scheduler.add_job(
+                self._do_synth_stats,
+                'interval',
+                seconds = self.STATS_INTERVAL,
+                kwargs = {
+                    'jobid': l_jobid
+                },
+                id = l_jobid,
+                replace_existing = True,
+                max_instances = self.SCHEDULER_MAX_INSTANCES,
+                coalesce = True,
+                next_run_time = _dt.now()+_td(seconds=self.STATS_INTERVAL)
+            )
+            logger.info(f'>>> jobid:{l_jobid} scheduled')
+        except:
+            logger.exception(f'>>> jobid:{l_jobid}')
+
+#-------------------------------------------------------------------------------
+    def _new_stats(self):
+        return {
+            'start': time.monotonic(),
+            'advertisements': 0,    # bledatas delivered
+            'measurements': 0,      # new measurements, others are rebroadcasts
+            'late': 0,              # advertisements rescheduled because of MAX_LAG
+            'max_lag_ms': 0         # max delay from the scheduled time
+        }
+
+#-------------------------------------------------------------------------------
+    def stats(self):
+        """
+        Returns target and achieved rate since the previous stats interval
+        """
+        l_stats = dict(self._stats)
+        l_elapsed = max(time.monotonic() - l_stats.pop('start'), 0.000001)
+        l_stats['seconds'] = round(l_elapsed, 1)
+        l_stats['target_rate'] = self._rate
+        l_stats['achieved_rate'] = round(l_stats['advertisements'] / l_elapsed, 1)
+        l_stats['achieved'] = round(l_stats['achieved_rate'] / self._rate, 3)
+        return l_stats
+
+#-------------------------------------------------------------------------------
+    async def _do_synth_stats(self, *,
+        jobid
+    ):
+        """
+        Logs and resets rate statistics
+        """
+        l_stats = self.stats()
+        self._stats = self._new_stats()
+        logger.info(f'>>> jobid:{jobid} tags:{len(self._tags)} target:{l_stats["target_rate"]}/sec achieved:{l_stats["achieved_rate"]}/sec ({l_stats["achieved"]*100:.1f}%) measurements:{l_stats["measurements"]} late:{l_stats["late"]} max lag:{l_stats["max_lag_ms"]}ms')
+
+# -------------------------------------------------------------------------------
+    async def _emit(self, *, bledatas):
+        try:
+            if self._batch_callback:
+                await self._batch_callback(bledatas=bledatas)
+            else:
+                for l_bledata in bledatas:
+                    await self._callback(bledata=l_bledata)
+        except asyncio.CancelledError:
+            raise
+        except:
+            logger.exception(f'>>> exception')
+
+# -------------------------------------------------------------------------------
+    async def run(self):
+        logger.info(f'>>> starting...')
+
+        self._schedule()
+        self._stats = self._new_stats()
+        l_tags = self._tags
+        l_now = time.monotonic()
+        # tags start at random phase of their interval
+        l_heap = [(l_now + self._rnd.random() * l_tag.interval, l_idx) for l_idx, l_tag in enumerate(l_tags)]
+        heapq.heapify(l_heap)
+        l_stats = self._stats
+        try:
+            while not self._stopevent.is_set():
+                l_now = time.monotonic()
+                l_batch = []
+                l_maxlag = 0.0
+                while l_heap[0][0] <= l_now and len(l_batch) < ruuvitag_synth.BATCH_SIZE:
+                    (l_due, l_idx) = l_heap[0]
+                    l_tag = l_tags[l_idx]
+                    (l_bledata, l_new) = l_tag.advertise()
+                    l_batch.append(l_bledata)
+                    if l_new:
+                        l_stats['measurements'] += 1
+                    l_lag = l_now - l_due
+                    if l_lag > l_maxlag:
+                        l_maxlag = l_lag
+                    if l_lag > ruuvitag_synth.MAX_LAG:
+                        l_stats['late'] += 1
+                        l_due = l_now
+                    heapq.heapreplace(l_heap, (l_due + l_tag.next_interval(), l_idx))
+
+                if l_batch:
+                    await self._emit(bledatas=l_batch)
+                    # stats may have been reset by the stats job meanwhile
+                    l_stats = self._stats
+                    l_stats['advertisements'] += len(l_batch)
+                    l_stats['max_lag_ms'] = max(l_stats['max_lag_ms'], int(l_maxlag * 1000))
+
+                l_delay = l_heap[0][0] - time.monotonic()
+                await asyncio.sleep(l_delay if l_delay > 0 else 0)
+        except asyncio.CancelledError:
+            logger.warning(f'>>> CanceledError')
+        except:
+            logger.exception(f'>>> exception')
+
+        logger.info('>>> synth completed')
+        return True
+
+# -------------------------------------------------------------------------------
+    def stop(self):
+        logger.info(f'>>> synth')
+        self._stopevent.set()
@@ -0,0 +1,355 @@
+# coding=utf-8
+# !/usr/bin/python3
+# Name:         ble_bpf - classic BPF socket filter for the HCI socket
+# Copyright:    (c) 2020 TK
+# Licence:      MIT
+#
+# Generates classic BPF program (SO_ATTACH_FILTER) which lets the kernel drop
+# LE advertising reports not having accepted manufacturer id (and mac)
+# before they are copied to the user space.
+#
+# Frame offsets (see ble_hci.py), first report of the event:
+# 0 packet type, 1 event code, 2 parameter length, 3 subevent, 4 num reports
+# 5 event type, 6 address type, 7-12 address (little endian), 13 data length
+# 14... advertising data (AD structures)
+#
+# The filter is conservative, frames it can not judge are passed:
+# - other than LE advertising report events (command complete/status...)
+# - events with more than one report
+# Passed frames are always checked again by the socket collector.
+#
+# bpf_run() is a pure python interpreter for the generated programs, it allows
+# to verify the filter against captured frames without radio, see ble_bpf_test:
+#   python3 -m aioruuvitag.ble_bpf_test
+# -------------------------------------------------------------------------------
+import ctypes
+import struct
+
+from .ble_hci import HCI_EVENT_PKT, EVT_LE_META_EVENT, EVT_LE_ADVERTISING_REPORT, AD_TYPE_MANUFACTURER_DATA
+
+SO_ATTACH_FILTER    = 26
+SO_DETACH_FILTER    = 27
+BPF_MAXINSNS        = 4096
+BPF_MEMWORDS        = 16
+BPF_ACCEPT          = 0xFFFF    # snap length, HCI event is max 258 bytes
+BPF_DROP            = 0
+
+# instruction classes
+BPF_LD      = 0x00
+BPF_LDX     = 0x01
+BPF_ST      = 0x02
+BPF_STX     = 0x03
+BPF_ALU     = 0x04
+BPF_JMP     = 0x05
+BPF_RET     = 0x06
+BPF_MISC    = 0x07
+# ld/ldx sizes
+BPF_W       = 0x00
+BPF_H       = 0x08
+BPF_B       = 0x10
+# ld/ldx modes
+BPF_IMM     = 0x00
+BPF_ABS     = 0x20
+BPF_IND     = 0x40
+BPF_MEM     = 0x60
+BPF_LEN     = 0x80
+BPF_MSH     = 0xA0
+# alu/jmp operations
+BPF_ADD     = 0x00
+BPF_SUB     = 0x10
+BPF_MUL     = 0x20
+BPF_DIV     = 0x30
+BPF_OR      = 0x40
+BPF_AND     = 0x50
+BPF_LSH     = 0x60
+BPF_RSH     = 0x70
+BPF_NEG     = 0x80
+BPF_MOD     = 0x90
+BPF_XOR     = 0xA0
+BPF_JA      = 0x00
+BPF_JEQ     = 0x10
+BPF_JGT     = 0x20
+BPF_JGE     = 0x30
+BPF_JSET    = 0x40
+# sources
+BPF_K       = 0x00
+BPF_X       = 0x08
+BPF_A       = 0x10
+# misc
+BPF_TAX     = 0x00
+BPF_TXA     = 0x80
+
+# scratch memory usage of the generated program
+_MEM_ADLEN  = 0     # length of the current AD structure
+_MEM_ADEND  = 1     # end offset of the advertising data
+
+_ADDR_OFFSET    = 7
+_DLEN_OFFSET    = 13
+_ADDATA_OFFSET  = 14
+# max AD structures walked, legacy advertising data (31 bytes) fits max 15 structures
+MAX_AD_STRUCTURES = 15
+# max macs in the program, socket filter size is limited by net.core.optmem_max (default 20kB, 8 bytes/instruction)
+MAX_MACS = 256
+
+# -------------------------------------------------------------------------------
+def bpf_stmt(code, k):
+    return (code, 0, 0, k & 0xFFFFFFFF)
+
+# -------------------------------------------------------------------------------
+def bpf_jump(code, k, jt, jf):
+    return (code, jt, jf, k & 0xFFFFFFFF)
+
+# -------------------------------------------------------------------------------
+def _mac_words(mac):
+    """ 48bit mac int --> (word at offset 7, half word at offset 11) as loaded by the BPF (network order) """
+    l_raw = mac.to_bytes(6, 'little')
+    return (int.from_bytes(l_raw[0:4], 'big'), int.from_bytes(l_raw[4:6], 'big'))
+
+# -------------------------------------------------------------------------------
+def _mac_block(*, macs):
+    """
+    Accepts frames from the given macs, drops others
+    Every mac takes 5 instructions, match jumps over the remaining macs with 'ja'
+    """
+    l_prog = []
+    l_macs = sorted(macs)
+    l_cnt = len(l_macs)
+    for l_idx, l_mac in enumerate(l_macs):
+        (l_word, l_half) = _mac_words(l_mac)
+        l_rest = (l_cnt - l_idx - 1) * 5 + 1   # remaining macs and the final drop
+        l_prog += [
+            bpf_stmt(BPF_LD|BPF_W|BPF_ABS, _ADDR_OFFSET),
+            bpf_jump(BPF_JMP|BPF_JEQ|BPF_K, l_word, 0, 3),
+            bpf_stmt(BPF_LD|BPF_H|BPF_ABS, _ADDR_OFFSET+4),
+            bpf_jump(BPF_JMP|BPF_JEQ|BPF_K, l_half, 0, 1),
+            bpf_stmt(BPF_JMP|BPF_JA, l_rest),
+        ]
+    l_prog.append(bpf_stmt(BPF_RET|BPF_K, BPF_DROP))
+    return l_prog
+
+# -------------------------------------------------------------------------------
+def _mfid_step(*, mfids):
+    """
+    One unrolled step of the AD structure walk, X is the offset of the AD structure
+    Step ends with the 'ja' over its own accept/drop returns to the next step
+    """
+    l_cnt = len(mfids)
+    # offsets are counted from the instruction following the jump
+    # [0]ld M[end] [1]jgt x [2]ldb [x] [3]jeq 0 [4]st M[len] [5]ldb [x+1] [6]jeq FF [7]ldh [x+2]
+    # [8..8+cnt-1]jeq mfid [8+cnt]ld M[len] [+1]add 1 [+2]add x [+3]tax [+4]ja 2 [+5]ret accept [+6]ret drop
+    l_next = 8 + l_cnt          # index of the 'ld M[len]'
+    l_accept = l_next + 5
+    l_drop = l_next + 6
+    l_prog = [
+        bpf_stmt(BPF_LD|BPF_MEM, _MEM_ADEND),
+        bpf_jump(BPF_JMP|BPF_JGT|BPF_X, 0, 0, l_drop-2),                        # end > x
+        bpf_stmt(BPF_LD|BPF_B|BPF_IND, 0),
+        bpf_jump(BPF_JMP|BPF_JEQ|BPF_K, 0, l_drop-4, 0),                        # padding, no more structures
+        bpf_stmt(BPF_ST, _MEM_ADLEN),
+        bpf_stmt(BPF_LD|BPF_B|BPF_IND, 1),
+        bpf_jump(BPF_JMP|BPF_JEQ|BPF_K, AD_TYPE_MANUFACTURER_DATA, 0, l_next-7),
+        bpf_stmt(BPF_LD|BPF_H|BPF_IND, 2),                                      # mfid, little endian in the frame
+    ]
+    for l_idx, l_mfid in enumerate(mfids):
+        l_swapped = ((l_mfid & 0xFF) << 8) | ((l_mfid >> 8) & 0xFF)
+        l_prog.append(bpf_jump(BPF_JMP|BPF_JEQ|BPF_K, l_swapped, l_accept-(8+l_idx)-1, 0))
+    l_prog += [
+        bpf_stmt(BPF_LD|BPF_MEM, _MEM_ADLEN),
+        bpf_stmt(BPF_ALU|BPF_ADD|BPF_K, 1),
+        bpf_stmt(BPF_ALU|BPF_ADD|BPF_X, 0),
+        bpf_stmt(BPF_MISC|BPF_TAX, 0),
+        bpf_stmt(BPF_JMP|BPF_JA, 2),
+        bpf_stmt(BPF_RET|BPF_K, BPF_ACCEPT),
+        bpf_stmt(BPF_RET|BPF_K, BPF_DROP),
+    ]
+    return l_prog
+
+# -------------------------------------------------------------------------------
+def ruuvitag_bpf(*, mfids=None, macs=None):
+    """
+    Generates filter program
+    mfids - accepted manufacturer ids (None - not checked)
+    macs - accepted 48bit mac ints (None - not checked)
+    Returns list of (code, jt, jf, k) instructions or None if there is nothing to filter
+    Raises ValueError if program does not fit to the kernel limits
+    """
+    l_mfids = sorted(set(mfids)) if mfids else []
+    l_macs = sorted(set(macs)) if macs else []
+    if not l_mfids and not l_macs:
+        return None
+    if len(l_macs) > MAX_MACS:
+        raise ValueError(f'too many macs:{len(l_macs)} max:{MAX_MACS}')
+
+    # header: pass everything else than single LE advertising report
+    l_prog = [
+        bpf_stmt(BPF_LD|BPF_B|BPF_ABS, 0),
+        bpf_jump(BPF_JMP|BPF_JEQ|BPF_K, HCI_EVENT_PKT, 0, 6),
+        bpf_stmt(BPF_LD|BPF_B|BPF_ABS, 1),
+        bpf_jump(BPF_JMP|BPF_JEQ|BPF_K, EVT_LE_META_EVENT, 0, 4),
+        bpf_stmt(BPF_LD|BPF_B|BPF_ABS, 3),
+        bpf_jump(BPF_JMP|BPF_JEQ|BPF_K, EVT_LE_ADVERTISING_REPORT, 0, 2),
+        bpf_stmt(BPF_LD|BPF_B|BPF_ABS, 4),
+        bpf_jump(BPF_JMP|BPF_JEQ|BPF_K, 1, 1, 0),
+        bpf_stmt(BPF_RET|BPF_K, BPF_ACCEPT),
+    ]
+    if l_macs:
+        # last instruction of the block drops, matches jump over it
+        l_prog += _mac_block(macs=l_macs)
+    if l_mfids:
+        # X = start, M[end] = start + data length
+        l_prog += [
+            bpf_stmt(BPF_LD|BPF_B|BPF_ABS, _DLEN_OFFSET),
+            bpf_stmt(BPF_ALU|BPF_ADD|BPF_K, _ADDATA_OFFSET),
+            bpf_stmt(BPF_ST, _MEM_ADEND),
+            bpf_stmt(BPF_LDX|BPF_W|BPF_IMM, _ADDATA_OFFSET),
+        ]
+        for _ in range(MAX_AD_STRUCTURES):
+            l_prog += _mfid_step(mfids=l_mfids)
+        l_prog.append(bpf_stmt(BPF_RET|BPF_K, BPF_DROP))
+    else:
+        l_prog.append(bpf_stmt(BPF_RET|BPF_K, BPF_ACCEPT))
+
+    bpf_check(prog=l_prog)
+    return l_prog
+
+# -------------------------------------------------------------------------------
+def bpf_check(*, prog):
+    """
+    Checks the program the same way as the kernel does (sk_chk_filter)
+    Raises ValueError
+    """
+    l_len = len(prog)
+    if not l_len or l_len > BPF_MAXINSNS:
+        raise ValueError(f'invalid program length:{l_len}')
+    for l_pc, (l_code, l_jt, l_jf, l_k) in enumerate(prog):
+        l_class = l_code & 0x07
+        if l_class == BPF_JMP:
+            if (l_code & 0xF0) == BPF_JA:
+                l_targets = (l_pc + 1 + l_k,)
+            else:
+                if l_jt > 255 or l_jf > 255:
+                    raise ValueError(f'pc:{l_pc} jump offset out of range')
+                l_targets = (l_pc + 1 + l_jt, l_pc + 1 + l_jf)
+            for l_target in l_targets:
+                if l_target >= l_len:
+                    raise ValueError(f'pc:{l_pc} jump out of program')
+        elif l_class in (BPF_ST, BPF_STX) or (l_class in (BPF_LD, BPF_LDX) and (l_code & 0xE0) == BPF_MEM):
+            if l_k >= BPF_MEMWORDS:
+                raise ValueError(f'pc:{l_pc} invalid memory word:{l_k}')
+    if (prog[-1][0] & 0x07) != BPF_RET:
+        raise ValueError(f'program does not end with return')
+
+# -------------------------------------------------------------------------------
+def bpf_run(*, prog, data):
+    """
+    Runs classic BPF program against the data
+    Returns the return value of the program (0 - dropped, >0 - accepted bytes)
+    Out of bounds load returns 0 as in the kernel
+    """
+    l_len = len(data)
+    l_mem = [0] * BPF_MEMWORDS
+    l_a = 0
+    l_x = 0
+    l_pc = 0
+
+    def _load(offset, size):
+        if offset < 0 or offset + size > l_len:
+            return None
+        return int.from_bytes(data[offset:offset+size], 'big')
+
+    while l_pc < len(prog):
+        (l_code, l_jt, l_jf, l_k) = prog[l_pc]
+        l_pc += 1
+        l_class = l_code & 0x07
+        if l_class in (BPF_LD, BPF_LDX):
+            l_mode = l_code & 0xE0
+            l_size = {BPF_W: 4, BPF_H: 2, BPF_B: 1}[l_code & 0x18]
+            if l_mode == BPF_IMM:
+                l_val = l_k
+            elif l_mode == BPF_ABS:
+                l_val = _load(l_k, l_size)
+            elif l_mode == BPF_IND:
+                l_val = _load(l_x + l_k, l_size)
+            elif l_mode == BPF_MEM:
+                l_val = l_mem[l_k]
+            elif l_mode == BPF_LEN:
+                l_val = l_len
+            elif l_mode == BPF_MSH:
+                l_val = _load(l_k, 1)
+                l_val = None if l_val is None else (l_val & 0x0F) << 2
+            else:
+                raise ValueError(f'pc:{l_pc-1} invalid load mode:{l_mode:#x}')
+            if l_val is None:
+                return 0
+            if l_class == BPF_LD:
+                l_a = l_val
+            else:
+                l_x = l_val
+        elif l_class == BPF_ST:
+            l_mem[l_k] = l_a
+        elif l_class == BPF_STX:
+            l_mem[l_k] = l_x
+        elif l_class == BPF_ALU:
+            l_op = l_code & 0xF0
+            l_src = l_x if (l_code & BPF_X) else l_k
+            if l_op == BPF_ADD:
+                l_a = l_a + l_src
+            elif l_op == BPF_SUB:
+                l_a = l_a - l_src
+            elif l_op == BPF_MUL:
+                l_a = l_a * l_src
+            elif l_op in (BPF_DIV, BPF_MOD):
+                if not l_src:
+                    return 0
+                l_a = l_a // l_src if l_op == BPF_DIV else l_a % l_src
+            elif l_op == BPF_OR:
+                l_a = l_a | l_src
+            elif l_op == BPF_AND:
+                l_a = l_a & l_src
+            elif l_op == BPF_LSH:
+                l_a = l_a << (l_src & 0x1F)
+            elif l_op == BPF_RSH:
+                l_a = l_a >> (l_src & 0x1F)
+            elif l_op == BPF_NEG:
+                l_a = -l_a
+            elif l_op == BPF_XOR:
+                l_a = l_a ^ l_src
+            else:
+                raise ValueError(f'pc:{l_pc-1} invalid alu operation:{l_op:#x}')
+            l_a &= 0xFFFFFFFF
+        elif l_class == BPF_JMP:
+            l_op = l_code & 0xF0
+            if l_op == BPF_JA:
+                l_pc += l_k
+                continue
+            l_src = l_x if (l_code & BPF_X) else l_k
+            if l_op == BPF_JEQ:
+                l_cond = l_a == l_src
+            elif l_op == BPF_JGT:
+                l_cond = l_a > l_src
+            elif l_op == BPF_JGE:
+                l_cond = l_a >= l_src
+            elif l_op == BPF_JSET:
+                l_cond = bool(l_a & l_src)
+            else:
+                raise ValueError(f'pc:{l_pc-1} invalid jump operation:{l_op:#x}')
+            l_pc += l_jt if l_cond else l_jf
+        elif l_class == BPF_RET:
+            return l_a if (l_code & 0x18) == BPF_A else l_k
+        elif l_class == BPF_MISC:
+            if (l_code & 0xF8) == BPF_TXA:
+                l_a = l_x
+            else:
+                l_x = l_a
+
+    raise ValueError(f'program ended without return')
+
+# -------------------------------------------------------------------------------
+def bpf_fprog(*, prog):
+    """
+    Packs the program to the struct sock_fprog for setsockopt(SO_ATTACH_FILTER)
+    Returns (fprog bytes, filter buffer), buffer must be kept alive during the setsockopt call
+    """
+    l_insns = b''.join(struct.pack('HBBI', *l_insn) for l_insn in prog)
+    l_buffer = ctypes.create_string_buffer(l_insns)
+    return (struct.pack('HL', len(prog), ctypes.addressof(l_buffer)), l_buffer)
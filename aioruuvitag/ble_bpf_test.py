@@ -0,0 +1,183 @@
+# coding=utf-8
+# !/usr/bin/python3
+# Name:         ble_bpf_test - socket filter checks
+# Copyright:    (c) 2020 TK
+# Licence:      MIT
+#
+# python3 -m aioruuvitag.ble_bpf_test [mutations]
+#
+# Runs the generated filter programs with the bpf_run interpreter over HCI
+# frames of ruuvitags and of the usual neighbours (Apple, Microsoft, Samsung,
+# Eddystone, Xiaomi service data, scan responses, command events) and over
+# their seeded mutations, with and without the mac whitelist:
+# - every frame the python path (le_adv_reports + manufacturer_data, mfid and
+#   mac checks) accepts must be accepted by the filter
+# - well formed single report frames without accepted mfid (or mac) must be
+#   dropped, frames the filter can't judge (other events, several reports)
+#   must be passed
+# Exits with 1 if a check fails.
+# -------------------------------------------------------------------------------
+import sys
+import random
+
+from .ble_bpf import ruuvitag_bpf, bpf_run
+from .ble_hci import le_adv_reports, manufacturer_data, ad_structures, build_le_adv_report, AD_TYPE_MANUFACTURER_DATA
+
+SEED = 20200326
+MUTATIONS = 200
+MFIDS = (0x0499,)
+# ruuvitag frames, DF5 and DF3 payloads of ruuvitag_df5 and ruuvitag_decode_golden
+RUUVI_FRAMES = (
+    ('ruuvi df5', '043E2B02010301B4DA2618D7CB1F0201061BFF99040516EC5238C574FCE4FD8CFFEC99769A6221CBD71826DAB4BC'),
+    ('ruuvi df3', '043E210201000125E0C86EA3D21502010611FF990403291A1ECE1EFC18F94202CA0B53B3'),
+    ('ruuvi df5 nonconn', '043E2802010301114B2C1F40E81C1BFF99040516EC5238C574FCE4FD8CFFEC99769A6221E8401F2C4B11AD'),
+    ('ruuvi df5 after name', '043E3102010001B4DA2618D7CB250201060509527575761BFF99040516EC5238C574FCE4FD8CFFEC99769A6221CBD71826DAB4BA'),
+)
+FOREIGN_FRAMES = (
+    ('ruuvi scan response name', '043E1802010401B4DA2618D7CB0C0B0952757576692044414234BB'),
+    ('apple ibeacon', '043E2702010001A1B2C3D4E5F61B1AFF4C000215E2C56DB5DFFB48D2B060D0F5A71096E000000000C5B8'),
+    ('apple nearby', '043E1A02010001012A8170F35C0E0201060AFF4C0010051B1C0D1E7FC4'),
+    ('microsoft cdp', '043E2A0201030155443322114A1E0201061AFF06000109200247C7E7A3B1F1B5D3A4D1F3B8C3A0E1A3D0A6C4A8'),
+    ('samsung', '043E1902010000030201D52A700D02010609FF7500420401806670A5'),
+    ('eddystone uid', '043E2A02010301102B664405C11E0201060303AAFE1716AAFE00E8EDD5E2C6E4C51A66E20000000000000000B1'),
+    ('xiaomi service data', '043E23020100019E3C0B38C1A4170201061216951E20AA01AB9E3C0B38C1A40D100400E500B6'),
+)
+OTHER_FRAMES = (
+    ('command complete', '040E0401050C00'),
+    ('command status', '040F0400010B20'),
+    ('le connection complete', '043E13010000400001B4DA2618D7CB2800000048000001'),
+)
+FRAMES = RUUVI_FRAMES + FOREIGN_FRAMES + OTHER_FRAMES
+
+# -------------------------------------------------------------------------------
+def _reports(*, data):
+    return [(int.from_bytes(l_addr, 'little'), bytes(l_addata), l_rssi) for (_, _, l_addr, l_addata, l_rssi) in le_adv_reports(data=data)]
+
+# -------------------------------------------------------------------------------
+def _python_accepts(*, data, macs):
+    """ True if the socket collector yields any manufacturer data of the frame """
+    for (l_mac, l_addata, _) in _reports(data=data):
+        if macs and l_mac not in macs:
+            continue
+        for (l_mfid, _) in manufacturer_data(addata=l_addata):
+            if l_mfid in MFIDS:
+                return True
+    return False
+
+# -------------------------------------------------------------------------------
+def _judgeable(*, data):
+    """
+    True if the frame is a complete LE advertising report event with a single report
+    and well formed AD structures (filter doesn't check the AD lengths, it passes malformed ones)
+    """
+    if len(data) < 5 or data[:2] != b'\x04\x3e' or data[3] != 0x02 or data[4] != 1 or data[2] != len(data)-3:
+        return False
+    l_reports = _reports(data=data)
+    if len(l_reports) != 1 or 14 + len(l_reports[0][1]) + 1 != len(data):
+        return False
+    l_addata = l_reports[0][1]
+    l_len = 0
+    for (l_type, l_ad) in ad_structures(addata=l_addata):
+        if l_type == AD_TYPE_MANUFACTURER_DATA and len(l_ad) < 2:
+            return False
+        l_len += 2 + len(l_ad)
+    # zero padding after the last structure is allowed
+    return not any(l_addata[l_len:])
+
+# -------------------------------------------------------------------------------
+def _check(*, name, prog, data, macs):
+    l_result = bpf_run(prog=prog, data=data)
+    l_accepts = _python_accepts(data=data, macs=macs)
+    if l_accepts:
+        assert l_result, f'{name} macs:{bool(macs)} dropped:{data.hex()}'
+    elif _judgeable(data=data):
+        assert not l_result, f'{name} macs:{bool(macs)} passed:{data.hex()}'
+    elif len(data) >= 5 and (data[:2] != b'\x04\x3e' or data[3] != 0x02 or data[4] != 1):
+        # other events and several reports
+        assert l_result, f'{name} macs:{bool(macs)} not judged but dropped:{data.hex()}'
+    return l_accepts
+
+# -------------------------------------------------------------------------------
+def _programs():
+    l_ruuvi_macs = {_reports(data=bytes.fromhex(l_hex))[0][0] for (_, l_hex) in RUUVI_FRAMES}
+    # whitelist without 'ruuvi df5 nonconn', its frames must be dropped
+    l_macs = l_ruuvi_macs - {0xE8401F2C4B11}
+    return (
+        (ruuvitag_bpf(mfids=MFIDS), None),
+        (ruuvitag_bpf(mfids=MFIDS, macs=l_macs), l_macs),
+    )
+
+# -------------------------------------------------------------------------------
+def test_frames():
+    for (l_prog, l_macs) in _programs():
+        for (l_name, l_hex) in FRAMES:
+            _check(name=l_name, prog=l_prog, data=bytes.fromhex(l_hex), macs=l_macs)
+        for (l_name, l_hex) in RUUVI_FRAMES:
+            l_data = bytes.fromhex(l_hex)
+            l_mac = _reports(data=l_data)[0][0]
+            assert bool(bpf_run(prog=l_prog, data=l_data)) == (not l_macs or l_mac in l_macs), f'{l_name} macs:{bool(l_macs)}'
+        for (l_name, l_hex) in FOREIGN_FRAMES:
+            assert not bpf_run(prog=l_prog, data=bytes.fromhex(l_hex)), f'{l_name} macs:{bool(l_macs)} not dropped'
+        for (l_name, l_hex) in OTHER_FRAMES:
+            assert bpf_run(prog=l_prog, data=bytes.fromhex(l_hex)), f'{l_name} macs:{bool(l_macs)} not passed'
+
+# -------------------------------------------------------------------------------
+def _rebuild(*, data, address=None, ads=None):
+    """ Returns single report frame of the first report with the address and/or AD structures replaced """
+    (_, _, l_addr, l_addata, l_rssi) = next(le_adv_reports(data=data))
+    if ads is None:
+        ads = [bytes((len(l_ad)+1, l_type)) + bytes(l_ad) for (l_type, l_ad) in ad_structures(addata=l_addata)]
+    return build_le_adv_report(address=address or bytes(l_addr), addata=b''.join(ads), rssi=l_rssi, evt_type=data[5], addr_type=data[6])
+
+# -------------------------------------------------------------------------------
+def _variants(*, rnd, data):
+    """ Yields (mutation, frame) """
+    l_ads = [bytes((len(l_ad)+1, l_type)) + bytes(l_ad) for (l_type, l_ad) in ad_structures(addata=next(le_adv_reports(data=data))[3])]
+    for l_len in range(len(data)):
+        yield (f'truncated:{l_len}', data[:l_len])
+    for _ in range(MUTATIONS):
+        l_mutated = bytearray(data)
+        l_mutated[rnd.randrange(len(data))] = rnd.randrange(256)
+        yield ('byte', bytes(l_mutated))
+    l_shuffled = list(l_ads)
+    rnd.shuffle(l_shuffled)
+    yield ('reordered', _rebuild(data=data, ads=l_shuffled))
+    yield ('flags removed', _rebuild(data=data, ads=[l_ad for l_ad in l_ads if l_ad[1] != 0x01]))
+    yield ('padded', _rebuild(data=data, ads=l_ads + [b'\x00\x00']))
+    yield ('mac', _rebuild(data=data, address=bytes(rnd.randrange(256) for _ in range(6))))
+    l_swapped = []
+    for l_ad in l_ads:
+        if l_ad[1] == AD_TYPE_MANUFACTURER_DATA and len(l_ad) >= 4:
+            l_mfid = int.from_bytes(l_ad[2:4], 'little')
+            l_ad = l_ad[:2] + (0x004C if l_mfid in MFIDS else MFIDS[0]).to_bytes(2, 'little') + l_ad[4:]
+        l_swapped.append(l_ad)
+    yield ('mfid swapped', _rebuild(data=data, ads=l_swapped))
+    # two reports, not judged by the filter
+    l_other = bytes.fromhex(rnd.choice(RUUVI_FRAMES + FOREIGN_FRAMES)[1])
+    l_body = data[5:] + l_other[5:]
+    if len(l_body) + 2 <= 0xFF:
+        yield ('two reports', bytes((0x04, 0x3E, len(l_body)+2, 0x02, 2)) + l_body)
+
+# -------------------------------------------------------------------------------
+def test_mutations():
+    l_rnd = random.Random(SEED)
+    l_accepted = 0
+    for (l_prog, l_macs) in _programs():
+        for (l_name, l_hex) in RUUVI_FRAMES + FOREIGN_FRAMES:
+            for (l_mutation, l_data) in _variants(rnd=l_rnd, data=bytes.fromhex(l_hex)):
+                l_accepted += _check(name=f'{l_name} {l_mutation}', prog=l_prog, data=l_data, macs=l_macs)
+    assert l_accepted, 'no mutated frame accepted'
+
+# -------------------------------------------------------------------------------
+if __name__ == '__main__':
+    if len(sys.argv) > 1:
+        MUTATIONS = int(sys.argv[1])
+    l_failed = 0
+    for (l_name, l_test) in (('frames', test_frames), ('mutations', test_mutations)):
+        try:
+            l_test()
+            print(f'{l_name}: ok')
+        except AssertionError as l_e:
+            l_failed += 1
+            print(f'FAILED {l_name}: {l_e}')
+    sys.exit(1 if l_failed else 0)
@@ -0,0 +1,181 @@
+# coding=utf-8
+# !/usr/bin/python3
+# Name:         ble_btsnoop - btsnoop capture file writer
+# Copyright:    (c) 2020 TK
+# Licence:      MIT
+#
+# btsnoop format (RFC 1761 based, readable by wireshark and btmon -r)
+# header:   'btsnoop\0' version(4) datalink(4)                  big endian
+# record:   original length(4) included length(4) flags(4)
+#           cumulative drops(4) timestamp(8) data               big endian
+# timestamp is microseconds since 0000-01-01 (BTSNOOP_EPOCH_DELTA from unix epoch)
+# datalink 1002 (HCI UART H4), data starts with the HCI packet type as
+# received from the HCI socket
+#
+# Writes are done by the background thread, write() only appends to the queue
+# so the event loop is never blocked by the file io. If the queue is full the
+# frame is dropped and counted to the cumulative drops of the next record.
+# Dropped count is updated by the loop and taken by the writer thread under
+# the lock, the queue itself is a thread safe deque.
+# -------------------------------------------------------------------------------
+import logging
+logger = logging.getLogger('ruuvitag')
+
+import os
+import time
+import struct
+import threading
+from collections import deque
+
+BTSNOOP_MAGIC           = b'btsnoop\x00'
+BTSNOOP_VERSION         = 1
+BTSNOOP_DATALINK_HCI    = 1001
+BTSNOOP_DATALINK_H4     = 1002
+BTSNOOP_EPOCH_DELTA     = 0x00DCDDB30F2F8000    # us from 0000-01-01 to 1970-01-01
+BTSNOOP_FLAG_RECEIVED   = 0x01
+BTSNOOP_FLAG_CMD_EVT    = 0x02
+BTSNOOP_HEADER          = struct.Struct('>8sII')
+BTSNOOP_RECORD          = struct.Struct('>IIIIq')
+
+# -------------------------------------------------------------------------------
+def btsnoop_header():
+    return BTSNOOP_HEADER.pack(BTSNOOP_MAGIC, BTSNOOP_VERSION, BTSNOOP_DATALINK_H4)
+
+# -------------------------------------------------------------------------------
+def btsnoop_record(*, data, ts, drops=0):
+    """
+    Returns record of the received HCI event
+    ts - unix timestamp (sec, float)
+    """
+    l_len = len(data)
+    return BTSNOOP_RECORD.pack(l_len, l_len, BTSNOOP_FLAG_RECEIVED|BTSNOOP_FLAG_CMD_EVT, drops, int(ts*1000000)+BTSNOOP_EPOCH_DELTA) + bytes(data)
+
+# ===============================================================================
+class btsnoop_writer(object):
+    FLUSH_INTERVAL  = 0.5       # sec
+    BUFFER_SIZE     = 65536
+# -------------------------------------------------------------------------------
+    def __init__(self, *,
+        filename,
+        max_size=10,
+        max_files=5,
+        max_queue=10000
+    ):
+        """
+        filename - capture file (Required)
+        max_size - file size (MB) to rotate the file (Default: 10)
+        max_files - rotated files kept, filename.1 ... filename.max_files (Default: 5)
+        max_queue - max frames waiting for the writer thread (Default: 10000)
+        """
+        if not filename:
+            raise ValueError(f'filename is None')
+        self._filename = filename
+        self._max_size = int(max_size * 1024 * 1024)
+        self._max_files = max_files
+        self._max_queue = max_queue
+
+        self._queue = deque()
+        self._drops = 0             # cumulative drops, written to the records
+        self._dropped = 0           # dropped since the previous record, _lock
+        self._lock = threading.Lock()
+        self._file = None
+        self._size = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name=f'btsnoop', daemon=True)
+        self._thread.start()
+        logger.info(f'>>> {self} started')
+
+# -------------------------------------------------------------------------------
+    def __repr__(self):
+        return f'btsnoop_writer filename:{self._filename} max_size:{self._max_size} max_files:{self._max_files}'
+
+# -------------------------------------------------------------------------------
+    def write(self, *, data, ts=None):
+        """
+        Queues received frame, data is copied
+        ts - unix timestamp (Default: None - now)
+        """
+        if len(self._queue) >= self._max_queue:
+            with self._lock:
+                self._dropped += 1
+            return False
+        self._queue.append((time.time() if ts is None else ts, bytes(data)))
+        return True
+
+# -------------------------------------------------------------------------------
+    def write_batch(self, *, frames, timestamps=None):
+        """ Queues received frames, timestamps list in the same order or None """
+        if timestamps:
+            for l_frame, l_ts in zip(frames, timestamps):
+                self.write(data=l_frame, ts=l_ts)
+        else:
+            l_ts = time.time()
+            for l_frame in frames:
+                self.write(data=l_frame, ts=l_ts)
+
+# -------------------------------------------------------------------------------
+    def close(self):
+        """ Writes queued frames and closes the file """
+        self._stop.set()
+        if self._thread.is_alive():
+            self._thread.join()
+        with self._lock:
+            l_drops = self._drops + self._dropped
+        logger.info(f'>>> {self} closed drops:{l_drops}')
+
+# -------------------------------------------------------------------------------
+    def _open(self):
+        self._file = open(self._filename, 'wb', buffering=btsnoop_writer.BUFFER_SIZE)
+        self._file.write(btsnoop_header())
+        self._size = BTSNOOP_HEADER.size
+
+# -------------------------------------------------------------------------------
+    def _close(self):
+        if self._file:
+            self._file.close()
+            self._file = None
+
+# -------------------------------------------------------------------------------
+    def _rotate(self):
+        self._close()
+        if self._max_files:
+            for l_idx in range(self._max_files-1, 0, -1):
+                l_src = f'{self._filename}.{l_idx}'
+                if os.path.exists(l_src):
+                    os.replace(l_src, f'{self._filename}.{l_idx+1}')
+            os.replace(self._filename, f'{self._filename}.1')
+        self._open()
+        logger.debug(f'>>> {self._filename} rotated')
+
+# -------------------------------------------------------------------------------
+    def _take_dropped(self):
+        """ Adds the frames dropped since the previous record to the cumulative drops """
+        with self._lock:
+            self._drops += self._dropped
+            self._dropped = 0
+
+# -------------------------------------------------------------------------------
+    def _write_queued(self):
+        l_queue = self._queue
+        while l_queue:
+            (l_ts, l_data) = l_queue.popleft()
+            if self._dropped:
+                self._take_dropped()
+            l_record = btsnoop_record(data=l_data, ts=l_ts, drops=self._drops)
+            if self._size + len(l_record) > self._max_size and self._size > BTSNOOP_HEADER.size:
+                self._rotate()
+            self._file.write(l_record)
+            self._size += len(l_record)
+
+# -------------------------------------------------------------------------------
+    def _run(self):
+        try:
+            self._open()
+            while not self._stop.wait(btsnoop_writer.FLUSH_INTERVAL):
+                self._write_queued()
+                self._file.flush()
+            self._write_queued()
+        except:
+            logger.exception(f'>>> {self._filename}')
+        finally:
+            self._close()
@@ -6,10 +6,14 @@ import re
 from time import time as _time
 from datetime import datetime as _dt
 from datetime import timezone as _tz
-from .ruuvitag_misc import hex_string
+from .ruuvitag_misc import hex_string, mac_to_int
 
 class BLEData(object):
     """A simple wrapper class representing a BLE data from collectors
+
+    mfdata and rawdata can be memoryviews to the collector's receive buffer.
+    They are valid only during the collector callback, copy them (bytes()) if
+    they need to be stored.
     """
     # _allowed_mac = re.compile(r"""(
     #         ^([0-9A-F]{2}[-]){5}([0-9A-F]{2})$
@@ -21,19 +25,23 @@ class BLEData(object):
         )""",
         re.VERBOSE|re.IGNORECASE)
 
+    __slots__ = ('_time', '_mac', '_macraw', '_macint', '_rssi', '_mfid', '_mfdata', '_rawdata')
+
     def __init__(self, *,
         mac = None,        # device mac address
+        macraw = None,     # device mac address as received (6 bytes, little endian)
         rssi = None,       # rssi
         mfid = None,       # manufacturer id
         mfdata = None,     # manufacturer data
         rawdata = None     # raw data
     ):
         self._time = _time()
+        self._mac = None
+        self._macraw = macraw
+        self._macint = None
         if mac:
             if self._allowed_mac.match(mac.upper()):
                 self._mac = mac.upper()
-            else:
-                self._mac = None
         self._rssi = rssi
         self._mfid = mfid
         self._mfdata = mfdata
@@ -45,8 +53,21 @@ class BLEData(object):
 
     @property
     def mac(self):
+        """ mac address string, formatted from the raw address on first use """
+        if not self._mac and self._macraw:
+            self._mac = ':'.join('{:02X}'.format(x) for x in reversed(self._macraw))
         return self._mac
 
+    @property
+    def macint(self):
+        """ mac address as 48bit int """
+        if self._macint is None:
+            if self._macraw:
+                self._macint = int.from_bytes(self._macraw, 'little')
+            elif self._mac:
+                self._macint = mac_to_int(self._mac)
+        return self._macint
+
     @property
     def rssi(self):
         return self._rssi
@@ -64,5 +85,19 @@ class BLEData(object):
             return self._mfdata
         return None
 
+    def copy(self):
+        """ Returns copy not referring to the collector's receive buffer """
+        l_copy = BLEData(
+            macraw = bytes(self._macraw) if self._macraw is not None else None,
+            rssi = self._rssi,
+            mfid = self._mfid,
+            mfdata = bytes(self._mfdata) if self._mfdata is not None else None,
+            rawdata = bytes(self._rawdata) if self._rawdata is not None else None
+        )
+        l_copy._time = self._time
+        l_copy._mac = self._mac
+        l_copy._macint = self._macint
+        return l_copy
+
     def __str__(self):
-        return f'''{self._time} mac:{self._mac} rssi:{self._rssi} mfid:{hex(self._mfid if self._mfid else 0xFFFF)} mfdata:{hex_string(data=self._mfdata, filler='')}'''
\ No newline at end of file
+        return f'''{self._time} mac:{self.mac} rssi:{self._rssi} mfid:{hex(self._mfid if self._mfid else 0xFFFF)} mfdata:{hex_string(data=self._mfdata, filler='')}'''
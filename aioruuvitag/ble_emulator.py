@@ -0,0 +1,383 @@
+# coding=utf-8
+# !/usr/bin/python3
+# Name:         ble_emulator - loopback HCI device emulator
+# Copyright:    (c) 2020 TK
+# Licence:      MIT
+#
+# Emulates the kernel HCI socket and the controller behind it, so the
+# ruuvitag_socket collector can be run without bluetooth hardware and root:
+#   ruuvitag_socket(loop=loop, callback=callback, emulator=hci_emulator(tags=100, rate=100.0))
+#
+# The collector gets one end of the AF_UNIX SOCK_SEQPACKET socketpair (frame
+# boundaries are kept like in the raw HCI socket), the emulator thread serves
+# the other end:
+# - HCI Reset, LE Set Scan Parameters/Enable and the filter accept list commands
+#   are answered with the Command Complete event, others with status 0x01
+# - HCIDEVUP/HCIDEVDOWN ioctls and the HCI_FILTER socket option of the collector
+#   are routed to device_up(), device_down() and set_filter()
+# - LE Advertising Reports of the synth tags (see aioruuvitag_synth) are injected
+#   at the configured rate while scanning is enabled
+# - hang() stops the controller (no events, no command responses) until the device reset
+# - unplug() closes the connection (collector gets EOF/BrokenPipeError), open()
+#   fails with ENODEV for the given time
+# Reports not fitting to the socket buffer are dropped and counted like the kernel does.
+# -------------------------------------------------------------------------------
+import logging
+logger = logging.getLogger('ruuvitag')
+
+import os
+import time
+import errno
+import heapq
+import random
+import select
+import socket
+import struct
+import threading
+from collections import deque
+
+from .ble_hci import HCI_EVENT_PKT, EVT_LE_META_EVENT, build_le_adv_report, build_manufacturer_data
+from .aioruuvitag_synth import synth_tag, SYNTH_MAC_BASE, SYNTH_MFID
+
+HCI_COMMAND_PKT             = 0x01
+EVT_CMD_COMPLETE            = 0x0E
+OP_RESET                    = 0x0C03
+OP_LE_SET_SCAN_PARAMETERS   = 0x200B
+OP_LE_SET_SCAN_ENABLE       = 0x200C
+OP_LE_READ_WHITE_LIST_SIZE  = 0x200F
+OP_LE_CLEAR_WHITE_LIST      = 0x2010
+OP_LE_ADD_DEVICE_TO_WHITE_LIST = 0x2011
+STATUS_SUCCESS              = 0x00
+STATUS_UNKNOWN_COMMAND      = 0x01
+STATUS_MEMORY_EXCEEDED      = 0x07
+STATUS_COMMAND_DISALLOWED   = 0x0C
+FILTER_POLICY_WHITELIST     = 0x01
+AD_FLAGS                    = b'\x02\x01\x06'   # LE general discoverable, BR/EDR not supported
+
+# ==============================================================================
+# hci_emulator class
+# ==============================================================================
+class hci_emulator(object):
+    POLL_INTERVAL       = 0.05      # sec, max select timeout of the emulator thread
+    MAX_LAG             = 1.0       # sec, advertisement missed if behind more
+    MAX_REPORTS         = 1024      # max reports sent per thread iteration
+    COMMAND_LOG         = 1024      # received commands kept for inspection
+# -------------------------------------------------------------------------------
+    def __init__(self, *,
+        tags=100,
+        rate=100.0,
+        df3=0.0,
+        rebroadcasts=2,
+        jitter=0.1,
+        seed=None,
+        accept_list_size=16
+    ):
+        """
+        tags - number of virtual tags (Default: 100)
+        rate - aggregate advertisements/sec of all tags while scanning (Default: 100.0)
+        df3 - share of DF3 tags 0.0 ... 1.0, others are DF5 (Default: 0.0)
+        rebroadcasts - advertisements per measurement (Default: 2)
+        jitter - relative advertising interval jitter (Default: 0.1)
+        seed - random seed for repeatable fleet (Default: None)
+        accept_list_size - controller filter accept list size (Default: 16)
+        """
+        if not tags or tags < 1:
+            raise ValueError(f'invalid tags:{tags}')
+        if not rate or rate <= 0:
+            raise ValueError(f'invalid rate:{rate}')
+        self._rate = float(rate)
+        self._accept_list_size = accept_list_size
+
+        l_rnd = random.Random(seed)
+        l_interval = tags / self._rate
+        l_df3 = int(round(tags * max(0.0, min(1.0, df3 or 0.0))))
+        self._tags = [
+            synth_tag(
+                mac = SYNTH_MAC_BASE + l_idx,
+                df = 3 if l_idx < l_df3 else 5,
+                rebroadcasts = rebroadcasts,
+                interval = l_interval,
+                jitter = jitter,
+                rnd = l_rnd
+            ) for l_idx in range(tags)
+        ]
+        self._rnd = l_rnd
+
+        self._lock = threading.Lock()
+        self._conn = None               # emulator end of the current connection
+        self._filter = None             # (type mask, event mask) of the current connection, None passes all
+        self._up = True
+        self._hung_until = 0.0
+        self._unplugged_until = 0.0
+        self._scan_enabled = False
+        self._scan_parameters = None
+        self._filter_policy = 0
+        self._accept_list = set()
+        self._commands = deque(maxlen=hci_emulator.COMMAND_LOG)
+        self._stats = self._new_stats()
+
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name=f'hci_emulator', daemon=True)
+        self._thread.start()
+        logger.info(f'>>> {self} started')
+
+# -------------------------------------------------------------------------------
+    def __repr__(self):
+        return f'hci_emulator tags:{len(self._tags)} rate:{self._rate}/sec accept_list_size:{self._accept_list_size}'
+
+# -------------------------------------------------------------------------------
+    def _new_stats(self):
+        return {
+            'connections': 0,       # open() calls served
+            'commands': 0,          # HCI commands received
+            'resets': 0,            # controller resets (HCI Reset, device down/up, unplug)
+            'reports': 0,           # advertising reports sent
+            'filtered': 0,          # advertising reports filtered by the accept list
+            'dropped': 0            # advertising reports dropped, socket buffer full
+        }
+
+# -------------------------------------------------------------------------------
+    def stats(self):
+        """ Returns emulator statistics and the controller state """
+        l_stats = dict(self._stats)
+        l_stats['connected'] = self._conn is not None
+        l_stats['up'] = self._up
+        l_stats['hung'] = self._hung(now=time.monotonic())
+        l_stats['scan_enabled'] = self._scan_enabled
+        l_stats['filter_policy'] = self._filter_policy
+        l_stats['accept_list'] = len(self._accept_list)
+        return l_stats
+
+# -------------------------------------------------------------------------------
+    @property
+    def commands(self):
+        """ [(opcode, parameters)] of the received HCI commands, oldest first """
+        return list(self._commands)
+
+# -------------------------------------------------------------------------------
+    def open(self):
+        """
+        Returns collector end of the new connection, the previous connection is closed
+        Raises OSError ENODEV while unplugged
+        """
+        with self._lock:
+            if time.monotonic() < self._unplugged_until:
+                raise OSError(errno.ENODEV, os.strerror(errno.ENODEV))
+            self._disconnect()
+            (l_emu, l_conn) = socket.socketpair(socket.AF_UNIX, socket.SOCK_SEQPACKET)
+            l_emu.setblocking(False)
+            self._conn = l_emu
+            self._filter = None
+            self._stats['connections'] += 1
+        logger.debug(f'>>> connection:{self._stats["connections"]}')
+        return l_conn
+
+# -------------------------------------------------------------------------------
+    def close(self):
+        """ Stops the emulator thread and closes the connection """
+        self._stop.set()
+        if self._thread.is_alive():
+            self._thread.join()
+        with self._lock:
+            self._disconnect()
+        logger.info(f'>>> {self} closed')
+
+# -------------------------------------------------------------------------------
+    def set_filter(self, *, data):
+        """ HCI_FILTER socket option of the current connection (struct hci_filter) """
+        (l_type_mask, l_event_mask1, l_event_mask2, _) = struct.unpack('<LLLH', data)
+        self._filter = (l_type_mask, l_event_mask1 | (l_event_mask2 << 32))
+
+# -------------------------------------------------------------------------------
+    def device_up(self):
+        """ HCIDEVUP, kernel resets the controller when the device is brought up """
+        with self._lock:
+            self._reset_controller()
+            self._up = True
+        logger.debug(f'>>> up')
+
+# -------------------------------------------------------------------------------
+    def device_down(self):
+        """ HCIDEVDOWN """
+        with self._lock:
+            self._reset_controller()
+            self._up = False
+        logger.debug(f'>>> down')
+
+# -------------------------------------------------------------------------------
+    def hang(self, *, seconds=None):
+        """
+        Controller stops sending events and answering commands
+        seconds - hang time (Default: None - until the device is reset)
+        """
+        self._hung_until = (time.monotonic() + seconds) if seconds else float('inf')
+        logger.info(f'>>> hang:{seconds}')
+
+# -------------------------------------------------------------------------------
+    def unplug(self, *, seconds=0.0):
+        """
+        Closes the connection, open() fails for seconds
+        Controller is reset like after the power cycle
+        """
+        with self._lock:
+            self._unplugged_until = time.monotonic() + seconds
+            self._disconnect()
+            self._reset_controller()
+        logger.info(f'>>> unplug:{seconds}')
+
+# -------------------------------------------------------------------------------
+    def _disconnect(self):
+        if self._conn:
+            try:
+                self._conn.close()
+            except OSError:
+                pass
+            self._conn = None
+
+# -------------------------------------------------------------------------------
+    def _reset_controller(self):
+        self._hung_until = 0.0
+        self._scan_enabled = False
+        self._scan_parameters = None
+        self._filter_policy = 0
+        self._accept_list.clear()
+        self._stats['resets'] += 1
+
+# -------------------------------------------------------------------------------
+    def _hung(self, *, now):
+        return now < self._hung_until
+
+# -------------------------------------------------------------------------------
+    def _passes(self, *, event):
+        """ Checks HCI_FILTER of the connection """
+        if self._filter is None:
+            return True
+        (l_type_mask, l_event_mask) = self._filter
+        return bool(l_type_mask & (1 << HCI_EVENT_PKT)) and bool(l_event_mask & (1 << event))
+
+# -------------------------------------------------------------------------------
+    def _send_event(self, *, conn, event, params):
+        if self._passes(event=event):
+            try:
+                conn.send(bytes((HCI_EVENT_PKT, event, len(params))) + params)
+            except (BlockingIOError, OSError):
+                pass
+
+# -------------------------------------------------------------------------------
+    def _command(self, *, opcode, params):
+        """ Executes HCI command, returns Command Complete return parameters (status first) """
+        if opcode == OP_RESET:
+            self._reset_controller()
+        elif opcode == OP_LE_SET_SCAN_PARAMETERS:
+            if self._scan_enabled:
+                return bytes((STATUS_COMMAND_DISALLOWED,))
+            self._scan_parameters = struct.unpack_from('<BHHBB', params)
+            self._filter_policy = self._scan_parameters[4]
+        elif opcode == OP_LE_SET_SCAN_ENABLE:
+            self._scan_enabled = bool(params[0])
+        elif opcode == OP_LE_READ_WHITE_LIST_SIZE:
+            return bytes((STATUS_SUCCESS, self._accept_list_size))
+        elif opcode == OP_LE_CLEAR_WHITE_LIST:
+            if self._scan_enabled and self._filter_policy == FILTER_POLICY_WHITELIST:
+                return bytes((STATUS_COMMAND_DISALLOWED,))
+            self._accept_list.clear()
+        elif opcode == OP_LE_ADD_DEVICE_TO_WHITE_LIST:
+            if len(self._accept_list) >= self._accept_list_size:
+                return bytes((STATUS_MEMORY_EXCEEDED,))
+            self._accept_list.add(int.from_bytes(params[1:7], 'little'))
+        else:
+            return bytes((STATUS_UNKNOWN_COMMAND,))
+        return bytes((STATUS_SUCCESS,))
+
+# -------------------------------------------------------------------------------
+    def _receive(self, *, conn, now):
+        """ Handles commands sent by the collector """
+        while True:
+            try:
+                l_data = conn.recv(1024)
+            except (BlockingIOError, InterruptedError):
+                return
+            except OSError:
+                l_data = b''
+            if not l_data:
+                # collector closed its end
+                with self._lock:
+                    if conn is self._conn:
+                        self._disconnect()
+                return
+            if l_data[0] != HCI_COMMAND_PKT or len(l_data) < 4:
+                continue
+            (l_opcode, l_len) = struct.unpack_from('<HB', l_data, 1)
+            l_params = l_data[4:4+l_len]
+            self._commands.append((l_opcode, l_params))
+            self._stats['commands'] += 1
+            if not self._up or self._hung(now=now):
+                continue
+            with self._lock:
+                l_status = self._command(opcode=l_opcode, params=l_params)
+            self._send_event(conn=conn, event=EVT_CMD_COMPLETE, params=struct.pack('<BH', 1, l_opcode) + l_status)
+
+# -------------------------------------------------------------------------------
+    def _advertise(self, *, conn, heap, now):
+        """ Sends reports of the tags which are due """
+        l_tags = self._tags
+        l_stats = self._stats
+        l_send = self._passes(event=EVT_LE_META_EVENT)
+        l_accept = self._accept_list if self._filter_policy == FILTER_POLICY_WHITELIST else None
+        l_cnt = 0
+        while heap[0][0] <= now and l_cnt < hci_emulator.MAX_REPORTS:
+            (l_due, l_idx) = heap[0]
+            l_tag = l_tags[l_idx]
+            if now - l_due > hci_emulator.MAX_LAG:
+                # not scanned meanwhile (scan disabled, hang), tags continue from random phase
+                heapq.heapreplace(heap, (now + self._rnd.random() * l_tag.interval, l_idx))
+                continue
+            (l_bledata, _) = l_tag.advertise()
+            heapq.heapreplace(heap, (l_due + l_tag.next_interval(), l_idx))
+            l_cnt += 1
+            if l_accept is not None and l_tag.mac not in l_accept:
+                l_stats['filtered'] += 1
+                continue
+            if not l_send:
+                continue
+            l_frame = build_le_adv_report(
+                address=l_tag.macraw,
+                addata=AD_FLAGS + build_manufacturer_data(mfid=SYNTH_MFID, mfdata=l_tag.mfdata),
+                rssi=l_bledata.rssi
+            )
+            try:
+                conn.send(l_frame)
+                l_stats['reports'] += 1
+            except BlockingIOError:
+                l_stats['dropped'] += 1
+            except OSError:
+                return
+
+# -------------------------------------------------------------------------------
+    def _run(self):
+        l_now = time.monotonic()
+        l_heap = [(l_now + self._rnd.random() * l_tag.interval, l_idx) for l_idx, l_tag in enumerate(self._tags)]
+        heapq.heapify(l_heap)
+        try:
+            while not self._stop.is_set():
+                l_conn = self._conn
+                if not l_conn:
+                    self._stop.wait(hci_emulator.POLL_INTERVAL)
+                    continue
+                l_now = time.monotonic()
+                l_scanning = self._up and self._scan_enabled and not self._hung(now=l_now)
+                l_timeout = hci_emulator.POLL_INTERVAL
+                if l_scanning:
+                    l_timeout = max(0.0, min(l_timeout, l_heap[0][0] - l_now))
+                try:
+                    (l_readable, _, _) = select.select([l_conn], [], [], l_timeout)
+                except (OSError, ValueError):
+                    # connection closed by open() or unplug() meanwhile
+                    continue
+                l_now = time.monotonic()
+                if l_readable:
+                    self._receive(conn=l_conn, now=l_now)
+                if self._up and self._scan_enabled and not self._hung(now=l_now) and l_conn is self._conn:
+                    self._advertise(conn=l_conn, heap=l_heap, now=l_now)
+        except:
+            logger.exception(f'>>> exception')
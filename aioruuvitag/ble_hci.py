@@ -0,0 +1,124 @@
+# coding=utf-8
+# !/usr/bin/python3
+# Name:         ble_hci - HCI event parsing
+# Copyright:    (c) 2020 TK
+# Licence:      MIT
+#
+# LE Advertising Report event (Bluetooth Core Spec Vol 4, Part E, 7.7.65.2)
+# 04            HCI event packet                    0
+# 3E            LE meta event                       1
+# xx            parameter length                    2
+# 02            subevent (LE advertising report)    3
+# xx            num reports                         4
+# --- repeated num reports times ---
+# xx            event type                          +0
+# xx            address type                        +1
+# xxxxxxxxxxxx  address (little endian)             +2
+# xx            data length                         +8
+# ...           advertising data (AD structures)    +9
+# xx            rssi                                +9+data length
+#
+# AD structure: length(1) type(1) data(length-1)
+# manufacturer specific data (type FF): mfid(2, little endian) mfdata(length-3)
+#
+# All returned data are memoryview windows into the given packet (no copies)
+# -------------------------------------------------------------------------------
+HCI_EVENT_PKT               = 0x04
+EVT_LE_META_EVENT           = 0x3E
+EVT_LE_ADVERTISING_REPORT   = 0x02
+AD_TYPE_MANUFACTURER_DATA   = 0xFF
+
+_EVENT_HEADER_LEN   = 5     # packet type, event code, parameter length, subevent, num reports
+_REPORT_HEADER_LEN  = 9     # event type, address type, address, data length
+
+# -------------------------------------------------------------------------------
+def le_adv_reports(*, data):
+    """
+    Walks all reports of the LE Advertising Report meta event
+    data - complete hci event packet (bytes, bytearray or memoryview)
+    Yields (evt_type, addr_type, address, addata, rssi) for every report
+        address - 6 byte memoryview (little endian)
+        addata - memoryview of the advertising data
+    Truncated or malformed reports end the walk
+    """
+    l_view = data if isinstance(data, memoryview) else memoryview(data)
+    l_datalen = len(l_view)
+    if l_datalen < _EVENT_HEADER_LEN:
+        return
+    if l_view[0] != HCI_EVENT_PKT or l_view[1] != EVT_LE_META_EVENT or l_view[3] != EVT_LE_ADVERTISING_REPORT:
+        return
+
+    l_end = min(l_datalen, 3 + l_view[2])
+    l_off = _EVENT_HEADER_LEN
+    for _ in range(l_view[4]):
+        if l_off + _REPORT_HEADER_LEN > l_end:
+            return
+        l_adstart = l_off + _REPORT_HEADER_LEN
+        l_adend = l_adstart + l_view[l_off+8]
+        if l_adend >= l_end:    # rssi byte after the advertising data
+            return
+        l_rssi = l_view[l_adend]
+        yield (
+            l_view[l_off],
+            l_view[l_off+1],
+            l_view[l_off+2:l_off+8],
+            l_view[l_adstart:l_adend],
+            l_rssi-256 if l_rssi>127 else l_rssi
+        )
+        l_off = l_adend + 1
+
+# -------------------------------------------------------------------------------
+def ad_structures(*, addata):
+    """
+    Walks AD structures of the advertising data
+    Yields (ad_type, ad_data) for every AD structure, ad_data is a memoryview
+    Zero length structure (padding) or truncated structure ends the walk
+    """
+    l_view = addata if isinstance(addata, memoryview) else memoryview(addata)
+    l_len = len(l_view)
+    l_off = 0
+    while l_off < l_len:
+        l_adlen = l_view[l_off]
+        if not l_adlen or (l_off + 1 + l_adlen) > l_len:
+            return
+        yield (l_view[l_off+1], l_view[l_off+2:l_off+1+l_adlen])
+        l_off += 1 + l_adlen
+
+# -------------------------------------------------------------------------------
+def manufacturer_data(*, addata):
+    """
+    Walks manufacturer specific AD structures of the advertising data
+    Yields (mfid, mfdata) for every manufacturer specific AD structure, mfdata is a memoryview
+    Other AD structures are skipped without creating views
+    """
+    l_view = addata if isinstance(addata, memoryview) else memoryview(addata)
+    l_len = len(l_view)
+    l_off = 0
+    while l_off < l_len:
+        l_adlen = l_view[l_off]
+        l_next = l_off + 1 + l_adlen
+        if not l_adlen or l_next > l_len:
+            return
+        if l_view[l_off+1] == AD_TYPE_MANUFACTURER_DATA and l_adlen >= 3:
+            yield (l_view[l_off+2] | (l_view[l_off+3] << 8), l_view[l_off+4:l_next])
+        l_off = l_next
+
+# -------------------------------------------------------------------------------
+def build_manufacturer_data(*, mfid, mfdata):
+    """ Returns manufacturer specific AD structure """
+    return bytes((len(mfdata)+3, AD_TYPE_MANUFACTURER_DATA, mfid & 0xFF, (mfid >> 8) & 0xFF)) + bytes(mfdata)
+
+# -------------------------------------------------------------------------------
+def build_le_adv_report(*, address, addata, rssi, evt_type=0x00, addr_type=0x01):
+    """
+    Returns LE Advertising Report event packet with single report
+    Used to produce HCI frames for collectors which don't receive them (bleak)
+    address - 6 bytes (little endian) or 'AA:BB:CC:DD:EE:FF'
+    evt_type - 0x00 ADV_IND
+    addr_type - 0x01 random (ruuvitags use random static address)
+    """
+    if isinstance(address, str):
+        address = bytes.fromhex(address.replace(':', '').replace('-', ''))[::-1]
+    l_addata = bytes(addata)
+    l_report = bytes((evt_type, addr_type)) + bytes(address) + bytes((len(l_addata),)) + l_addata + bytes((rssi & 0xFF,))
+    return bytes((HCI_EVENT_PKT, EVT_LE_META_EVENT, len(l_report)+2, EVT_LE_ADVERTISING_REPORT, 1)) + l_report
@@ -0,0 +1,131 @@
+# coding=utf-8
+# !/usr/bin/python3
+# Name:         ble_hci_test - HCI event parsing checks
+# Copyright:    (c) 2020 TK
+# Licence:      MIT
+#
+# python3 -m aioruuvitag.ble_hci_test [iterations]
+#
+# corpus - events of ble_hci_corpus.json (multi-report events, reordered AD
+#   structures, truncated and oversized AD lengths, zero length elements,
+#   other events) must yield exactly the recorded (mac, mfid, mfdata, rssi)
+#   tuples, given as bytes, bytearray and memoryview.
+# fuzz - random events of 1...5 reports with shuffled AD structures must yield
+#   the tuples they were built of, every truncation of an event yields a prefix
+#   of them and randomly corrupted events raise nothing. Seeded, reproducible.
+# Exits with 1 if a check fails.
+# -------------------------------------------------------------------------------
+import os
+import sys
+import json
+import random
+
+from .ble_hci import le_adv_reports, manufacturer_data, build_manufacturer_data, build_le_adv_report
+
+CORPUS = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'ble_hci_corpus.json')
+SEED = 20200326
+ITERATIONS = 2000
+AD_FLAGS = bytes.fromhex('020106')
+AD_NAME = bytes((5, 0x09)) + b'Ruuv'
+
+# -------------------------------------------------------------------------------
+def _walk(*, data):
+    """ Returns [(mac, mfid, mfdata hex, rssi)] of the event as the collectors see it """
+    l_result = []
+    for (_, _, l_addr, l_addata, l_rssi) in le_adv_reports(data=data):
+        l_mac = ':'.join(f'{l_byte:02X}' for l_byte in bytes(l_addr)[::-1])
+        for (l_mfid, l_mfdata) in manufacturer_data(addata=l_addata):
+            l_result.append((l_mac, l_mfid, bytes(l_mfdata).hex(), l_rssi))
+    return l_result
+
+# -------------------------------------------------------------------------------
+def test_corpus():
+    with open(CORPUS) as l_file:
+        l_cases = json.load(l_file)['cases']
+    assert l_cases
+    for l_case in l_cases:
+        l_event = bytes.fromhex(l_case['event'])
+        l_expected = [tuple(l_item) for l_item in l_case['expected']]
+        for l_data in (l_event, bytearray(l_event), memoryview(l_event)):
+            l_result = _walk(data=l_data)
+            assert l_result == l_expected, f'''{l_case['name']} {type(l_data).__name__}: {l_result} != {l_expected}'''
+
+# -------------------------------------------------------------------------------
+def _random_report(*, rnd):
+    """ Returns (report, expected tuples), AD structures in random order """
+    l_address = bytes(rnd.randrange(256) for _ in range(6))
+    l_mac = ':'.join(f'{l_byte:02X}' for l_byte in l_address[::-1])
+    l_rssi = rnd.randrange(-128, 128)
+    l_ads = []
+    if rnd.random() < 0.8:
+        l_ads.append((AD_FLAGS, None))
+    if rnd.random() < 0.3:
+        l_ads.append((AD_NAME, None))
+    for _ in range(rnd.randrange(3)):
+        l_mfid = rnd.choice((0x0499, 0x004C, 0x0006, rnd.randrange(0x10000)))
+        l_mfdata = bytes(rnd.randrange(256) for _ in range(rnd.randrange(26)))
+        l_ads.append((build_manufacturer_data(mfid=l_mfid, mfdata=l_mfdata), (l_mac, l_mfid, l_mfdata.hex(), l_rssi)))
+    rnd.shuffle(l_ads)
+    l_addata = b''.join(l_ad for (l_ad, _) in l_ads)
+    l_report = build_le_adv_report(address=l_address, addata=l_addata, rssi=l_rssi, evt_type=rnd.randrange(5), addr_type=rnd.randrange(2))[5:]
+    return (l_report, [l_expected for (_, l_expected) in l_ads if l_expected])
+
+# -------------------------------------------------------------------------------
+def _random_event(*, rnd):
+    """ Returns (event, expected tuples, expected tuples of every report) """
+    l_reports = []
+    for _ in range(rnd.randrange(1, 6)):
+        l_report = _random_report(rnd=rnd)
+        if sum(len(l_item) for (l_item, _) in l_reports) + len(l_report[0]) + 2 > 0xFF:     # parameter length is one byte
+            break
+        l_reports.append(l_report)
+    l_body = b''.join(l_report for (l_report, _) in l_reports)
+    l_event = bytes((0x04, 0x3E, len(l_body)+2, 0x02, len(l_reports))) + l_body
+    return (l_event, [l_item for (_, l_items) in l_reports for l_item in l_items], [l_items for (_, l_items) in l_reports])
+
+# -------------------------------------------------------------------------------
+def _corrupt(*, rnd, data):
+    l_data = bytearray(data)
+    for _ in range(rnd.randrange(1, 4)):
+        l_pos = rnd.randrange(len(l_data))
+        l_mode = rnd.randrange(3)
+        if l_mode == 0:         # any byte, also length bytes
+            l_data[l_pos] = rnd.randrange(256)
+        elif l_mode == 1:       # zero length element
+            l_data[l_pos] = 0
+        else:                   # oversized length
+            l_data[l_pos] = rnd.randrange(0xF0, 0x100)
+    return bytes(l_data)
+
+# -------------------------------------------------------------------------------
+def test_fuzz(*, iterations=ITERATIONS):
+    l_rnd = random.Random(SEED)
+    for l_idx in range(iterations):
+        (l_event, l_expected, l_per_report) = _random_event(rnd=l_rnd)
+        assert _walk(data=l_event) == l_expected, f'fuzz:{l_idx} event:{l_event.hex()}'
+
+        # truncated: complete reports only, in order
+        l_prefixes = [[]]
+        for l_items in l_per_report:
+            l_prefixes.append(l_prefixes[-1] + l_items)
+        for l_len in range(len(l_event)):
+            l_result = _walk(data=l_event[:l_len])
+            assert l_result in l_prefixes, f'fuzz:{l_idx} truncated:{l_len} event:{l_event.hex()}'
+
+        # corrupted: no exception, sane values
+        l_corrupted = _corrupt(rnd=l_rnd, data=l_event)
+        for (l_mac, l_mfid, l_mfdata, l_rssi) in _walk(data=l_corrupted):
+            assert 0 <= l_mfid <= 0xFFFF and -128 <= l_rssi <= 127 and len(l_mfdata)//2 < len(l_corrupted), f'fuzz:{l_idx} corrupted:{l_corrupted.hex()}'
+
+# -------------------------------------------------------------------------------
+if __name__ == '__main__':
+    l_iterations = int(sys.argv[1]) if len(sys.argv) > 1 else ITERATIONS
+    l_failed = 0
+    for (l_name, l_test) in (('corpus', test_corpus), ('fuzz', lambda: test_fuzz(iterations=l_iterations))):
+        try:
+            l_test()
+            print(f'{l_name}: ok')
+        except AssertionError as l_e:
+            l_failed += 1
+            print(f'FAILED {l_name}: {l_e}')
+    sys.exit(1 if l_failed else 0)
@@ -0,0 +1,187 @@
+# coding=utf-8
+# !/usr/bin/python3
+# Name:         ble_scan - LE scan profiles
+# Copyright:    (c) 2020 TK
+# Licence:      MIT
+#
+# Scan type, interval and window used for the LE Set Scan Parameters command.
+# Adaptive mode lowers the scan duty cycle (window/interval) step by step
+# while all expected tags are heard within the coverage window and returns
+# to the highest duty cycle as soon as any of them goes quiet.
+#
+# Interval and window are given in ms, controller uses 0.625ms units
+# (0x0004 - 0x4000, 2.5ms - 10.24s).
+# -------------------------------------------------------------------------------
+import logging
+logger = logging.getLogger('ruuvitag')
+
+SCAN_TYPE_PASSIVE   = 0x00
+SCAN_TYPE_ACTIVE    = 0x01
+SCAN_TYPES          = {'passive': SCAN_TYPE_PASSIVE, 'active': SCAN_TYPE_ACTIVE}
+
+# -------------------------------------------------------------------------------
+def scan_units(ms):
+    """ ms --> 0.625ms units used by the controller """
+    return max(0x0004, min(0x4000, int(round(ms * 1.6))))
+
+# ===============================================================================
+class scan_profiles(object):
+    """
+    Scan profile levels, level 0 is the configured (highest duty cycle) profile
+    Adaptive mode derives lower levels by doubling the interval with the same window
+    """
+    ADAPTIVE_LEVELS     = 4     # 100% --> 50% --> 25% --> 12.5% with the default 10ms/10ms
+    STEP_DOWN_CHECKS    = 2     # consecutive fully covered checks needed to lower the duty cycle
+# -------------------------------------------------------------------------------
+    def __init__(self, *,
+        scan_type='active',
+        interval=10.0,
+        window=10.0,
+        adaptive=False,
+        macs=None,
+        coverage=10.0
+    ):
+        """
+        scan_type - 'active' or 'passive' (Default: active)
+        interval - scan interval in ms (Default: 10.0)
+        window - scan window in ms, max interval (Default: 10.0)
+        adaptive - adapt duty cycle to the tag coverage (Default: False)
+        macs - 48bit mac ints of the expected tags, required by the adaptive mode
+        coverage - tag is covered if heard within coverage seconds (Default: 10.0)
+        """
+        if scan_type not in SCAN_TYPES:
+            raise ValueError(f'invalid scan_type:{scan_type}')
+        self._scan_type = scan_type
+        l_interval = scan_units(interval)
+        l_window = min(scan_units(window), l_interval)
+
+        self._macs = frozenset(macs) if macs else frozenset()
+        self._adaptive = bool(adaptive)
+        if self._adaptive and not self._macs:
+            logger.warning(f'>>> adaptive scan requires whitelist or tags, disabled')
+            self._adaptive = False
+        self._coverage = coverage
+
+        self._levels = [(l_interval, l_window)]
+        if self._adaptive:
+            for _ in range(1, scan_profiles.ADAPTIVE_LEVELS):
+                l_interval = min(l_interval * 2, 0x4000)
+                if l_interval == self._levels[-1][0]:
+                    break
+                self._levels.append((l_interval, l_window))
+        self._level = 0
+        self._covered_checks = 0
+        self._lastseen = {}
+        self._lastcheck = None
+        self._stats = self._new_stats()
+
+# -------------------------------------------------------------------------------
+    def __repr__(self):
+        return f'scan_type:{self._scan_type} adaptive:{self._adaptive} profiles:{[self._profile_name(level=l_level) for l_level in range(len(self._levels))]} macs:{len(self._macs)} coverage:{self._coverage}sec'
+
+# -------------------------------------------------------------------------------
+    def _profile_name(self, *, level):
+        (l_interval, l_window) = self._levels[level]
+        return f'{l_interval/1.6:g}/{l_window/1.6:g}ms'
+
+# -------------------------------------------------------------------------------
+    def _new_stats(self):
+        return [
+            {
+                'seconds': 0.0,     # time in this profile
+                'checks': 0,        # coverage checks
+                'covered': 0,       # checks with all tags heard
+                'heard': 0          # sum of tags heard over the checks
+            } for _ in self._levels
+        ]
+
+# -------------------------------------------------------------------------------
+    @property
+    def adaptive(self):
+        return self._adaptive
+
+# -------------------------------------------------------------------------------
+    @property
+    def scan_type(self):
+        """ scan type code for the LE Set Scan Parameters """
+        return SCAN_TYPES[self._scan_type]
+
+# -------------------------------------------------------------------------------
+    @property
+    def interval(self):
+        """ scan interval in 0.625ms units """
+        return self._levels[self._level][0]
+
+# -------------------------------------------------------------------------------
+    @property
+    def window(self):
+        """ scan window in 0.625ms units """
+        return self._levels[self._level][1]
+
+# -------------------------------------------------------------------------------
+    @property
+    def duty(self):
+        return self.window / self.interval
+
+# -------------------------------------------------------------------------------
+    def seen(self, *, mac, now):
+        """ Records received expected tag """
+        if mac in self._macs:
+            self._lastseen[mac] = now
+
+# -------------------------------------------------------------------------------
+    def check(self, *, now):
+        """
+        Checks tag coverage and selects the profile level
+        Returns True if the profile was changed
+        """
+        if not self._adaptive:
+            return False
+
+        l_stats = self._stats[self._level]
+        if self._lastcheck is not None:
+            l_stats['seconds'] += now - self._lastcheck
+        self._lastcheck = now
+
+        l_heard = sum(1 for l_mac in self._macs if (now - self._lastseen.get(l_mac, -self._coverage-1)) <= self._coverage)
+        l_stats['checks'] += 1
+        l_stats['heard'] += l_heard
+
+        l_level = self._level
+        if l_heard == len(self._macs):
+            l_stats['covered'] += 1
+            self._covered_checks += 1
+            if self._covered_checks >= scan_profiles.STEP_DOWN_CHECKS and self._level < len(self._levels)-1:
+                self._level += 1
+                self._covered_checks = 0
+        else:
+            self._covered_checks = 0
+            self._level = 0
+
+        if l_level != self._level:
+            logger.info(f'>>> profile:{self._profile_name(level=l_level)} --> {self._profile_name(level=self._level)} heard:{l_heard}/{len(self._macs)}')
+            return True
+        return False
+
+# -------------------------------------------------------------------------------
+    def stats(self):
+        """
+        Returns coverage statistics per profile since the previous reset
+        coverage - average share of the expected tags heard per check
+        """
+        l_result = []
+        for l_level, l_stats in enumerate(self._stats):
+            l_checks = l_stats['checks']
+            l_result.append({
+                'profile': self._profile_name(level=l_level),
+                'duty': round(self._levels[l_level][1]/self._levels[l_level][0], 3),
+                'seconds': int(l_stats['seconds']),
+                'checks': l_checks,
+                'covered': l_stats['covered'],
+                'coverage': round(l_stats['heard']/(l_checks*len(self._macs)), 3) if (l_checks and self._macs) else 0
+            })
+        return l_result
+
+# -------------------------------------------------------------------------------
+    def reset_stats(self):
+        self._stats = self._new_stats()
@@ -0,0 +1,258 @@
+# coding=utf-8
+# !/usr/bin/python3
+# Name:         ruuvitag_batch - columnar DF5/DF3 decoding with numpy
+# Copyright:    (c) 2020 TK
+# Licence:      MIT
+#
+# For backfill of the captured traffic and for the replay benchmarks, not used
+# by the gateway. numpy is optional, available() tells if it is installed.
+#
+# Payloads of one dataformat are viewed as a structured array (no copy) and
+# every field is decoded for the whole batch at once. Same MINMAX limits and
+# ADJUSTMENT as ruuvitag_decode, rows it would discard are False in 'valid'.
+# Values are float64/int64 columns, bit identical to ruuvitag_decode. numpy.round
+# scales before rounding and differs from the python round near half way values
+# (DF5 humidity has a half way value every other step), _round is exact.
+#
+# payloads, times, macs = ruuvitag_batch.load_capture(filename='ruuvi.btsnoop', df=5)
+# columns = ruuvitag_batch.decode(payloads=payloads, times=times, macs=macs, minmax=MINMAX, adjustment=ADJUSTMENT)
+# -------------------------------------------------------------------------------
+import logging
+logger = logging.getLogger('ruuvitag')
+
+import mmap
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from .ruuvitag_df3 import ruuvitag_df3 as _df3
+from .ruuvitag_df5 import ruuvitag_df5 as _df5
+from .ruuvitag_df5 import ROUND_TEMPERATURE as _DF5_ROUND_TEMPERATURE, ROUND_PRESSURE as _DF5_ROUND_PRESSURE, ROUND_ACCELERATION
+from .ruuvitag_df3 import ROUND_TEMPERATURE as _DF3_ROUND_TEMPERATURE, ROUND_HUMIDITY as _DF3_ROUND_HUMIDITY, ROUND_PRESSURE as _DF3_ROUND_PRESSURE
+from .ruuvitag_misc import get_field_limits
+from .ruuvitag_registry import ruuvitag_registry
+from .aioruuvitag_replay import ruuvitag_replay
+from .ble_hci import le_adv_reports, manufacturer_data
+from .ble_btsnoop import BTSNOOP_MAGIC
+
+# big endian payload layouts, same as the struct formats of the decoders
+_DTYPES = {
+    _df5.DF: [
+        ('df', 'u1'), ('temperature', '>i2'), ('humidity', '>u2'), ('pressure', '>u2'),
+        ('acceleration_x', '>i2'), ('acceleration_y', '>i2'), ('acceleration_z', '>i2'),
+        ('power', '>u2'), ('movement_counter', 'u1'), ('sequence_number', '>u2'), ('mac', 'u1', (6,))
+    ],
+    _df3.DF: [
+        ('df', 'u1'), ('humidity', 'u1'), ('temperature', 'u1'), ('temperature_frac', 'u1'), ('pressure', '>u2'),
+        ('acceleration_x', '>i2'), ('acceleration_y', '>i2'), ('acceleration_z', '>i2'), ('battery', '>u2')
+    ]
+}
+_DECODERS = {
+    _df5.DF: _df5,
+    _df3.DF: _df3
+}
+MFID = 0x499
+
+# ===============================================================================
+class ruuvitag_batch(object):
+# -------------------------------------------------------------------------------
+    @staticmethod
+    def available():
+        """ Returns True if numpy is installed """
+        return np is not None
+
+# -------------------------------------------------------------------------------
+    @staticmethod
+    def _DATALEN(*, df):
+        """ Returns payload length of the dataformat """
+        return _DECODERS[df].DATALEN
+
+# -------------------------------------------------------------------------------
+    @staticmethod
+    def _require():
+        if np is None:
+            raise RuntimeError('numpy not installed (pip3 install numpy)')
+
+# -------------------------------------------------------------------------------
+    @staticmethod
+    def _view(*, payloads, df):
+        """ Returns structured array view of the payloads """
+        l_decoder = _DECODERS.get(df, None)
+        if not l_decoder:
+            raise ValueError(f'dataformat:{df} not supported')
+        l_dtype = np.dtype(_DTYPES[df])
+        if isinstance(payloads, np.ndarray):
+            if payloads.ndim != 2 or payloads.shape[1] < l_decoder.DATALEN:
+                raise ValueError(f'payloads shape:{payloads.shape} not (N, >={l_decoder.DATALEN})')
+            l_rows = np.ascontiguousarray(payloads[:, :l_decoder.DATALEN], dtype=np.uint8)
+            return l_rows.view(l_dtype).reshape(-1)
+        if len(payloads) % l_decoder.DATALEN:
+            raise ValueError(f'payloads length:{len(payloads)} not multiple of {l_decoder.DATALEN}')
+        return np.frombuffer(payloads, dtype=l_dtype)
+
+# -------------------------------------------------------------------------------
+    @staticmethod
+    def _adjustments(*, macs, adjustment):
+        """ Returns {field: float64 column} of the per tag adjustments """
+        l_columns = {}
+        if macs is None or not adjustment:
+            return l_columns
+        if not isinstance(adjustment, ruuvitag_registry):
+            adjustment = ruuvitag_registry(adjustment=adjustment)
+        (l_unique, l_inverse) = np.unique(np.asarray(macs, dtype=np.uint64), return_inverse=True)
+        for l_field in ('humidity', 'temperature', 'pressure'):
+            l_values = np.zeros(len(l_unique), dtype=np.float64)
+            for (l_idx, l_mac) in enumerate(l_unique):
+                l_adj = adjustment.adjustment(int(l_mac))
+                if l_adj:
+                    l_values[l_idx] = l_adj.get(l_field, 0)
+            if l_values.any():
+                l_columns[l_field] = l_values[l_inverse]
+        return l_columns
+
+# -------------------------------------------------------------------------------
+    @staticmethod
+    def _round(values, ndigits):
+        """
+        Rounds as the python round: exact value of the double to the nearest decimal, ties to even
+        Scaled value and its rounding error are computed exactly (Dekker product)
+        """
+        l_scale = 10.0 ** ndigits
+        l_scaled = values * l_scale
+        l_split = values * 134217729.0
+        l_hi = l_split - (l_split - values)
+        l_lo = values - l_hi
+        l_shi = l_scale * 134217729.0
+        l_shi = l_shi - (l_shi - l_scale)
+        l_slo = l_scale - l_shi
+        l_error = ((l_hi * l_shi - l_scaled) + l_hi * l_slo + l_lo * l_shi) + l_lo * l_slo
+        l_floor = np.floor(l_scaled)
+        # exact: fraction of the scaled double and 0.5 are multiples of its ulp
+        l_diff = (l_scaled - l_floor) - 0.5
+        l_up = (l_diff > 0) | ((l_diff == 0) & ((l_error > 0) | ((l_error == 0) & (np.fmod(l_floor, 2) != 0))))
+        return (l_floor + l_up) / l_scale
+
+# -------------------------------------------------------------------------------
+    @staticmethod
+    def _limits(*, column, minmax, field, default_min, default_max):
+        (l_min, l_max) = get_field_limits(minmax, field, default_min, default_max)
+        return (column >= l_min) & (column <= l_max)
+
+# -------------------------------------------------------------------------------
+    @staticmethod
+    def decode(*,
+        payloads,
+        times=None,
+        macs=None,
+        df=None,
+        minmax=None,
+        adjustment=None
+    ):
+        """
+        payloads - uint8 array (N, >=DATALEN) or buffer of N concatenated payloads, starting with the dataformat byte
+        times - N timestamps, returned as 'time' (Default: None)
+        macs - N 48bit mac ints (Default: None - DF5 mac field, DF3 no adjustments)
+        df - dataformat 3 or 5 (Default: None - from the first payload)
+        minmax - MINMAX configuration {'temperature': {'min': -50.0, 'max': 100.0}}
+        adjustment - ADJUSTMENT configuration {'D2:C2:5E:F0:11:D1': {'temperature': 1.0}} or ruuvitag_registry
+        Returns {column name: array}, 'valid' is False for the rows ruuvitag_decode returns None
+        """
+        ruuvitag_batch._require()
+        minmax = minmax or {}
+        if df is None:
+            if not len(payloads):
+                return {}
+            df = int(payloads[0][0]) if isinstance(payloads, np.ndarray) else payloads[0]
+        l_rows = ruuvitag_batch._view(payloads=payloads, df=df)
+        if macs is None and df == _df5.DF:
+            macs = l_rows['mac'].astype(np.uint64) @ (np.uint64(1) << np.arange(40, -8, -8, dtype=np.uint64))
+        l_adjust = ruuvitag_batch._adjustments(macs=macs, adjustment=adjustment)
+        (l_hum_limits, l_temp_limits, l_pres_limits) = _DECODERS[df].LIMITS
+
+        l_acc_x = l_rows['acceleration_x'].astype(np.int64)
+        l_acc_y = l_rows['acceleration_y'].astype(np.int64)
+        l_acc_z = l_rows['acceleration_z'].astype(np.int64)
+        l_pres = ruuvitag_batch._round((l_rows['pressure'].astype(np.float64) + 50000) / 100, 3)
+        if df == _df5.DF:
+            l_hum = l_rows['humidity'] / 400
+            l_temp = l_rows['temperature'] / 200
+            l_power = l_rows['power'].astype(np.int64)
+            l_battery = l_power >> 5
+            l_txpower = l_power & 0b11111
+        else:
+            l_hum = ruuvitag_batch._round(l_rows['humidity'] * 0.5, 1)
+            l_temp = (l_rows['temperature'] & 0x7F) + (l_rows['temperature_frac'] / 100)
+            l_temp = np.where(l_rows['temperature'] & 0x80, -l_temp, l_temp)
+        l_hum = l_hum + l_adjust.get('humidity', 0)
+        l_temp = l_temp + l_adjust.get('temperature', 0)
+        l_pres = l_pres + l_adjust.get('pressure', 0)
+
+        l_valid = (l_rows['df'] == df)
+        l_valid &= ruuvitag_batch._limits(column=l_hum, minmax=minmax, field=l_hum_limits[0], default_min=l_hum_limits[1], default_max=l_hum_limits[2])
+        l_valid &= ruuvitag_batch._limits(column=l_temp, minmax=minmax, field=l_temp_limits[0], default_min=l_temp_limits[1], default_max=l_temp_limits[2])
+        l_valid &= ruuvitag_batch._limits(column=l_pres, minmax=minmax, field=l_pres_limits[0], default_min=l_pres_limits[1], default_max=l_pres_limits[2])
+
+        l_columns = {}
+        if times is not None:
+            l_columns['time'] = np.asarray(times, dtype=np.float64)
+        if macs is not None:
+            l_columns['mac'] = np.asarray(macs, dtype=np.uint64)
+        l_columns['valid'] = l_valid
+        l_columns['acceleration'] = ruuvitag_batch._round(np.sqrt(l_acc_x * l_acc_x + l_acc_y * l_acc_y + l_acc_z * l_acc_z), ROUND_ACCELERATION)
+        l_columns['acceleration_x'] = l_acc_x
+        l_columns['acceleration_y'] = l_acc_y
+        l_columns['acceleration_z'] = l_acc_z
+        if df == _df5.DF:
+            l_valid &= (l_battery != 0b11111111111) & (l_txpower != 0b11111)
+            l_columns['humidity'] = ruuvitag_batch._round(l_hum, _DF5_ROUND_TEMPERATURE)
+            l_columns['temperature'] = ruuvitag_batch._round(l_temp, _DF5_ROUND_TEMPERATURE)
+            l_columns['pressure'] = ruuvitag_batch._round(l_pres, _DF5_ROUND_PRESSURE)
+            l_columns['battery'] = l_battery + 1600
+            l_columns['tx_power'] = l_txpower * 2 - 40
+            l_columns['movement_counter'] = l_rows['movement_counter'].astype(np.int64)
+            l_columns['sequence_number'] = l_rows['sequence_number'].astype(np.int64)
+        else:
+            l_columns['humidity'] = ruuvitag_batch._round(l_hum, _DF3_ROUND_HUMIDITY)
+            l_columns['temperature'] = ruuvitag_batch._round(l_temp, _DF3_ROUND_TEMPERATURE)
+            l_columns['pressure'] = ruuvitag_batch._round(l_pres, _DF3_ROUND_PRESSURE)
+            l_columns['battery'] = l_rows['battery'].astype(np.int64)
+        return l_columns
+
+# -------------------------------------------------------------------------------
+    @staticmethod
+    def load_capture(*,
+        filename,
+        df=_df5.DF,
+        mfid=MFID
+    ):
+        """
+        Collects the payloads of the dataformat from the btsnoop or hcidump text capture (see ruuvitag_replay)
+        Returns (payloads uint8 array (N, DATALEN), times float64 array, macs uint64 array)
+        """
+        ruuvitag_batch._require()
+        l_datalen = _DECODERS[df].DATALEN
+        l_payloads = bytearray()
+        l_times = []
+        l_macs = []
+        with open(filename, 'rb') as l_file:
+            l_map = mmap.mmap(l_file.fileno(), 0, access=mmap.ACCESS_READ)
+            try:
+                l_frames = ruuvitag_replay._btsnoop_frames if l_map[:len(BTSNOOP_MAGIC)] == BTSNOOP_MAGIC else ruuvitag_replay._text_frames
+                for (l_ts, l_frame) in l_frames(data=l_map):
+                    for (_, _, l_addr, l_addata, _) in le_adv_reports(data=l_frame):
+                        for (l_mfid, l_mfdata) in manufacturer_data(addata=l_addata):
+                            if l_mfid == mfid and len(l_mfdata) >= l_datalen and l_mfdata[0] == df:
+                                l_payloads += l_mfdata[:l_datalen]
+                                l_times.append(l_ts if l_ts is not None else float('nan'))
+                                l_macs.append(int.from_bytes(l_addr, 'little'))
+            finally:
+                try:
+                    l_map.close()
+                except BufferError:
+                    # frame views still referring to the map, closed when released
+                    pass
+        l_payloads = np.frombuffer(bytes(l_payloads), dtype=np.uint8).reshape(-1, l_datalen)
+        logger.info(f'>>> filename:{filename} df:{df} payloads:{len(l_payloads)}')
+        return (l_payloads, np.asarray(l_times, dtype=np.float64), np.asarray(l_macs, dtype=np.uint64))
@@ -3,13 +3,47 @@
 # Name:         ruuvitag_decode - decoding ruuvitag data
 # Copyright:    (c) 2019 TK
 # Licence:      MIT
+#
+# Decoders are kept in a 256 slot table indexed by the dataformat byte, one
+# stateless decoder instance per dataformat. Unknown dataformats are rejected
+# with the table lookup.
+#
+# Built-in decoders: DF3, DF5, DF8 (AES optional, see ruuvitag_df8). More decoders are registered with register() or
+# installed as plugins with the entry point group 'aioruuvitag.decoders', eg.
+#   entry_points={'aioruuvitag.decoders': ['ruuviair = mysensors.ruuviair:ruuviair_decoder']}
+# Plugin is a class with DF (dataformat byte) and
+#   decode(self, *, mfdata, minmax, tagadjustsment[, fields]) returning dict or None
+# dict must contain '_df', values are forwarded as the tag fields.
+# Decoder with fields keyword argument decodes only the requested fields
+# (projection), fields are passed to the other decoders untouched.
+#
+# Decoded, invalid (None) counts and decode time are kept per dataformat.
 # -------------------------------------------------------------------------------
 import logging
 logger = logging.getLogger('ruuvitag')
 
+import time
+import inspect
+
 from .ruuvitag_df3 import ruuvitag_df3 as _df3
 from .ruuvitag_df5 import ruuvitag_df5 as _df5
 from .ruuvitag_df8 import ruuvitag_df8 as _df8
+from .ruuvitag_misc import hex_string
+
+try:
+    from importlib.metadata import entry_points as _entry_points
+except ImportError:     # python < 3.8
+    try:
+        import pkg_resources as _pkg_resources
+    except ImportError:
+        _pkg_resources = None
+    _entry_points = None
+
+ENTRY_POINT_GROUP = 'aioruuvitag.decoders'
+# decoded, invalid, decode time (ns)
+_STATS_DECODED  = 0
+_STATS_INVALID  = 1
+_STATS_NS       = 2
 
 # -------------------------------------------------------------------------------
 class ruuvitag_decode():
@@ -19,71 +53,142 @@ class ruuvitag_decode():
     DF_3 = _df3.DF
     DF_5 = _df5.DF
     DF_8 = _df8.DF
+    # dataformat: (decoder, [decoded, invalid, ns], decoder supports fields) or None
+    _table = [None] * 256
+    _unknown = 0
 # -------------------------------------------------------------------------------
     @staticmethod
-    def decode(*, mfdata, minmax, tagadjustsment):
-        """ 
-        Decodes received rawdata with the correct decoder based on the dataformat 
-        Returns json
+    def decode(*, mfdata, minmax, tagadjustsment, fields=None):
         """
+        Decodes received rawdata with the decoder of the dataformat
+        fields - fields used by the consumers (default: None - all), decoder may leave out the other fields
+        Returns dict or None
+        """
+        if not mfdata:
+            return None
+        l_entry = ruuvitag_decode._table[mfdata[0]]
+        if not l_entry:
+            ruuvitag_decode._unknown += 1
+            return None
+        (l_decoder, l_stats, l_projects) = l_entry
+        l_start = time.perf_counter_ns()
         try:
-            l_decoder = ruuvitag_decode._decoder(mfdata=mfdata)
-            if l_decoder:
-                return l_decoder.decode(mfdata=mfdata, minmax=minmax, tagadjustsment=tagadjustsment)
+            if fields is not None and l_projects:
+                l_datas = l_decoder.decode(mfdata=mfdata, minmax=minmax, tagadjustsment=tagadjustsment, fields=fields)
             else:
-                return None
+                l_datas = l_decoder.decode(mfdata=mfdata, minmax=minmax, tagadjustsment=tagadjustsment)
         except ValueError:
-            logger.error(f'>>> ValueError: mdata:{mfdata}')
+            logger.error(f'''>>> ValueError: mfdata:{hex_string(data=mfdata, filler='')}''')
+            l_datas = None
         except:
             logger.exception(f'*** exception')
-        return None
-
-    # @staticmethod
-    # def _tagdata(*, rawdata):
-    #     """ 
-    #     Checks received data/dataformat from rawdata
-    #     Returns decoder class and tagdata
-    #     """
-    #     if not rawdata:
-    #         return (None, None)
+            l_datas = None
+        l_stats[_STATS_NS] += time.perf_counter_ns() - l_start
+        l_stats[_STATS_DECODED if l_datas else _STATS_INVALID] += 1
+        return l_datas
 
-    #     try:
-    #         if _df3.DATAFORMAT in rawdata:
-    #             l_start = rawdata.index(_df3.DATAFORMAT) + len(_df3.DATAFORMAT)-2
-    #             return (_df3(), rawdata[l_start:])
+# -------------------------------------------------------------------------------
+    @staticmethod
+    def decoder(*, df):
+        """
+        Returns registered decoder of the dataformat or None
+        """
+        l_entry = ruuvitag_decode._table[df]
+        return l_entry[0] if l_entry else None
 
-    #         if _df5.DATAFORMAT in rawdata:
-    #             l_start = rawdata.index(_df5.DATAFORMAT) + len(_df5.DATAFORMAT)-2
-    #             return (_df5(), rawdata[l_start:])
+# -------------------------------------------------------------------------------
+    @staticmethod
+    def register(*, decoder):
+        """
+        Registers decoder instance for its dataformat (decoder.DF), replaces the previous one
+        """
+        l_df = int(decoder.DF)
+        if not 0 <= l_df <= 0xFF:
+            raise ValueError(f'dataformat:{l_df} not a byte')
+        if not callable(getattr(decoder, 'decode', None)):
+            raise ValueError(f'dataformat:{l_df} decoder:{decoder} has no decode')
+        l_previous = ruuvitag_decode._table[l_df]
+        if l_previous:
+            logger.warning(f'>>> dataformat:{l_df} decoder:{l_previous[0]} replaced by:{decoder}')
+        try:
+            l_projects = 'fields' in inspect.signature(decoder.decode).parameters
+        except ValueError:
+            l_projects = False
+        ruuvitag_decode._table[l_df] = (decoder, [0, 0, 0], l_projects)
 
-    #         if _df8.DATAFORMAT in rawdata:
-    #             l_start = rawdata.index(_df8.DATAFORMAT) + len(_df8.DATAFORMAT)-2
-    #             return (_df8(), rawdata[l_start:])
+# -------------------------------------------------------------------------------
+    @staticmethod
+    def unregister(*, df):
+        ruuvitag_decode._table[df] = None
 
-    #     except ValueError:
-    #         logger.error(f'>>> ValueError: rawdata:{rawdata}')
-    #     except:
-    #         logger.exception(f'*** exception')
+# -------------------------------------------------------------------------------
+    @staticmethod
+    def dataformats():
+        """ Returns registered dataformats """
+        return [l_df for l_df, l_entry in enumerate(ruuvitag_decode._table) if l_entry]
 
-    #     return (None, None)
+# -------------------------------------------------------------------------------
+    @staticmethod
+    def _plugins():
+        if _entry_points:
+            l_eps = _entry_points()
+            return l_eps.select(group=ENTRY_POINT_GROUP) if hasattr(l_eps, 'select') else l_eps.get(ENTRY_POINT_GROUP, [])
+        if _pkg_resources:
+            return _pkg_resources.iter_entry_points(ENTRY_POINT_GROUP)
+        return []
 
+# -------------------------------------------------------------------------------
     @staticmethod
-    def _decoder(*, mfdata):
-        """ 
-        Returns decoder class
+    def load_plugins():
         """
-        if not mfdata:
-            return None
+        Registers the decoders of the installed plugins
+        Returns count of the registered decoders
+        """
+        l_cnt = 0
         try:
-            l_df = mfdata[0]
-            if l_df == _df3.DF:
-                return _df3()
-            if l_df == _df5.DF:
-                return _df5()
-            if l_df == _df8.DF:
-                return None
-                # return _df8()
+            l_plugins = list(ruuvitag_decode._plugins())
         except:
-            pass
-        return None
-    
+            logger.exception(f'*** {ENTRY_POINT_GROUP}')
+            return l_cnt
+        for l_plugin in l_plugins:
+            try:
+                ruuvitag_decode.register(decoder=l_plugin.load()())
+                logger.info(f'>>> plugin:{l_plugin.name} registered')
+                l_cnt += 1
+            except:
+                logger.exception(f'*** plugin:{l_plugin.name}')
+        return l_cnt
+
+# -------------------------------------------------------------------------------
+    @staticmethod
+    def stats():
+        """
+        Returns decode statistics per dataformat since the previous reset
+        unknown - payloads of not registered dataformats
+        """
+        l_stats = {}
+        for (l_df, l_entry) in enumerate(ruuvitag_decode._table):
+            if l_entry:
+                (l_decoded, l_invalid, l_ns) = l_entry[1]
+                l_cnt = l_decoded + l_invalid
+                l_stats[l_df] = {
+                    'decoded': l_decoded,
+                    'invalid': l_invalid,
+                    'avg_us': round(l_ns/l_cnt/1000, 2) if l_cnt else 0
+                }
+        l_stats['unknown'] = ruuvitag_decode._unknown
+        return l_stats
+
+# -------------------------------------------------------------------------------
+    @staticmethod
+    def reset_stats():
+        for l_entry in ruuvitag_decode._table:
+            if l_entry:
+                l_entry[1][:] = [0, 0, 0]
+        ruuvitag_decode._unknown = 0
+
+# built-in decoders are stateless apart from the cached limits and DF8 cipher contexts
+ruuvitag_decode.register(decoder=_df3())
+ruuvitag_decode.register(decoder=_df5())
+ruuvitag_decode.register(decoder=_df8())
+ruuvitag_decode.load_plugins()
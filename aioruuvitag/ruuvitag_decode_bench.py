@@ -0,0 +1,212 @@
+# coding=utf-8
+# !/usr/bin/python3
+# Name:         ruuvitag_decode_bench - decoder golden test and micro-benchmark
+# Copyright:    (c) 2020 TK
+# Licence:      MIT
+#
+# python3 -m aioruuvitag.ruuvitag_decode_bench [packets]
+#
+# Checks the decoders against the golden corpus (ruuvitag_decode_golden.json),
+# every result must be identical to the recorded one, value and type, also
+# the projected result (FIELDS) must have the recorded values of its fields. Corpus
+# covers random and edge payloads of DF3 and DF5 with MINMAX and ADJUSTMENT
+# variants, invalid ones are recorded as None.
+# Then reports decode time per packet. With numpy installed the golden corpus
+# is checked with the batch decoder too (valid mask and values) and the batch
+# decode time per packet is reported.
+# With AES installed DF8 payloads are encrypted with the default and per tag
+# keys and checked after decoding, DF8 decrypt + decode and rejection of
+# corrupted (CRC8) packets are reported against DF5.
+# Projected decode (only FIELDS of the measurements) is reported too.
+# -------------------------------------------------------------------------------
+import os
+import sys
+import json
+import time
+import logging
+
+from .ruuvitag_decode import ruuvitag_decode
+from .ruuvitag_batch import ruuvitag_batch
+from .ruuvitag_df8 import ruuvitag_df8
+from .ruuvitag_misc import int_to_mac
+
+GOLDEN = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'ruuvitag_decode_golden.json')
+PACKETS = {
+    'df5': bytes.fromhex('0516EC5238C574FCE4FD8CFFEC99769A6221CBD71826DAB4'),
+    'df3': bytes.fromhex('03291A1ECE1EFC18F94202CA0B53')
+}
+MINMAX = {
+    'temperature': {'min': -50.0, 'max': 100.0},
+    'humidity': {'min': 0, 'max': 100},
+    'pressure': {'min': 900, 'max': 1100}
+}
+ADJUSTMENT = {'temperature': 1.5}
+BATCH_ADJUSTMENT = {'CB:D7:18:26:DA:B4': ADJUSTMENT}
+# temperature 29.34, humidity 52.62, pressure 1005.48, power info, movement counter, sequence number
+# fields of a typical measurement (FIELDS, DELTA, MAXDELTA)
+FIELDS = frozenset(('_df', 'tagname', 'temperature', 'humidity', 'pressure', 'battery'))
+DF8_FIELDS = (0x16EC, 0x5238, 0xC574, 0x9976, 0x9A, 0x6221)
+DF8_MAC = 0xCBD71826DAB4
+DF8_KEY = '000102030405060708090a0b0c0d0e0f'
+
+# -------------------------------------------------------------------------------
+def _same(*, result, expected):
+    """ Compares value and type, json keeps int and float apart """
+    if type(result) is not type(expected):
+        return False
+    if isinstance(expected, dict):
+        return result.keys() == expected.keys() and all(_same(result=result[l_key], expected=expected[l_key]) for l_key in expected)
+    return result == expected
+
+# -------------------------------------------------------------------------------
+def golden():
+    """ Returns count of the cases which differ from the golden corpus """
+    with open(GOLDEN) as l_file:
+        l_golden = json.load(l_file)
+    l_failed = 0
+    for l_case in l_golden['cases']:
+        l_result = ruuvitag_decode.decode(
+            mfdata=bytes.fromhex(l_case['mfdata']),
+            minmax=l_golden['minmax'][l_case['minmax']],
+            tagadjustsment=l_golden['adjustment'][l_case['adjustment']]
+        )
+        if not _same(result=l_result, expected=l_case['result']):
+            l_failed += 1
+            print(f'''FAILED mfdata:{l_case['mfdata']} minmax:{l_case['minmax']} adjustment:{l_case['adjustment']}''')
+            print(f'''   expected:{l_case['result']}''')
+            print(f'''   result:  {l_result}''')
+        # projected decode gives the same fields and rejects the same payloads
+        l_result = ruuvitag_decode.decode(
+            mfdata=bytes.fromhex(l_case['mfdata']),
+            minmax=l_golden['minmax'][l_case['minmax']],
+            tagadjustsment=l_golden['adjustment'][l_case['adjustment']],
+            fields=FIELDS
+        )
+        l_expected = {l_key: l_value for l_key, l_value in l_case['result'].items() if l_key in FIELDS} if l_case['result'] else None
+        if not _same(result=l_result, expected=l_expected):
+            l_failed += 1
+            print(f'''FAILED projected mfdata:{l_case['mfdata']} minmax:{l_case['minmax']} adjustment:{l_case['adjustment']}''')
+            print(f'''   expected:{l_expected}''')
+            print(f'''   result:  {l_result}''')
+    print(f'''golden: {len(l_golden['cases'])} cases {l_failed} failed''')
+    return l_failed
+
+# -------------------------------------------------------------------------------
+def golden_batch():
+    """
+    Returns count of the cases where the batch decoder differs from the golden corpus
+    Every case gets own mac so its adjustment is the per tag adjustment of the batch
+    """
+    with open(GOLDEN) as l_file:
+        l_golden = json.load(l_file)
+    l_groups = {}
+    for (l_idx, l_case) in enumerate(l_golden['cases']):
+        l_mfdata = bytes.fromhex(l_case['mfdata'])
+        for l_df in (3, 5):
+            l_datalen = ruuvitag_batch._DATALEN(df=l_df)
+            if len(l_mfdata) >= l_datalen and l_mfdata[0] == l_df:
+                l_groups.setdefault((l_df, l_case['minmax']), []).append((l_idx, l_mfdata[:l_datalen], l_case))
+    l_failed = 0
+    l_cnt = 0
+    for ((l_df, l_minmax), l_cases) in l_groups.items():
+        l_adjustment = {int_to_mac(l_idx): l_golden['adjustment'][l_case['adjustment']] for (l_idx, _, l_case) in l_cases if l_golden['adjustment'][l_case['adjustment']]}
+        l_columns = ruuvitag_batch.decode(
+            payloads=b''.join(l_mfdata for (_, l_mfdata, _) in l_cases),
+            macs=[l_idx for (l_idx, _, _) in l_cases],
+            df=l_df,
+            minmax=l_golden['minmax'][l_minmax],
+            adjustment=l_adjustment
+        )
+        for (l_row, (l_idx, l_mfdata, l_case)) in enumerate(l_cases):
+            l_cnt += 1
+            l_expected = l_case['result']
+            l_ok = bool(l_columns['valid'][l_row]) == (l_expected is not None)
+            if l_ok and l_expected:
+                for (l_key, l_value) in l_expected.items():
+                    if l_key in l_columns and l_columns[l_key][l_row] != l_value:
+                        l_ok = False
+            if not l_ok:
+                l_failed += 1
+                print(f'''FAILED batch mfdata:{l_case['mfdata']} minmax:{l_case['minmax']} adjustment:{l_case['adjustment']}''')
+                print(f'''   expected:{l_expected}''')
+                print(f'''   result:  { {l_key: l_column[l_row] for l_key, l_column in l_columns.items()} }''')
+    print(f'golden batch: {l_cnt} cases {l_failed} failed')
+    return l_failed
+
+# -------------------------------------------------------------------------------
+def df8():
+    """
+    Returns count of the DF8 checks which failed
+    Payload encrypted with PASSWORD and with a per tag key decodes to the DF5 values of the same fields,
+    corrupted payload is discarded by CRC8
+    """
+    l_expected = ruuvitag_decode.decode(mfdata=PACKETS['df5'], minmax={}, tagadjustsment=None)
+    l_expected = {l_key: l_value for l_key, l_value in l_expected.items() if not l_key.startswith('acceleration')}
+    l_expected['_df'] = ruuvitag_df8.DF
+    l_decoder = ruuvitag_df8()
+    l_default = ruuvitag_df8.encrypt(key=ruuvitag_df8.PASSWORD, fields=DF8_FIELDS, mac=DF8_MAC)
+    l_tagkey = ruuvitag_df8.encrypt(key=DF8_KEY, fields=DF8_FIELDS, mac=DF8_MAC)
+    l_corrupted = l_default[:5] + bytes((l_default[5] ^ 0x01,)) + l_default[6:]
+    l_checks = [
+        ('default key', l_decoder.decode(mfdata=l_default, minmax={}, tagadjustsment=None), l_expected),
+        ('corrupted', l_decoder.decode(mfdata=l_corrupted, minmax={}, tagadjustsment=None), None)
+    ]
+    l_decoder.set_keys(keys={'CB:D7:18:26:DA:B4': DF8_KEY})
+    l_checks.append(('tag key', l_decoder.decode(mfdata=l_tagkey, minmax={}, tagadjustsment=None), l_expected))
+    l_failed = 0
+    for (l_name, l_result, l_check) in l_checks:
+        if not _same(result=l_result, expected=l_check):
+            l_failed += 1
+            print(f'FAILED df8 {l_name}')
+            print(f'   expected:{l_check}')
+            print(f'   result:  {l_result}')
+    print(f'df8: {len(l_checks)} checks {l_failed} failed')
+    return l_failed
+
+# -------------------------------------------------------------------------------
+def _measure_batch(*, name, mfdata, minmax, adjustment, packets):
+    l_payloads = mfdata * packets
+    l_start = time.perf_counter()
+    ruuvitag_batch.decode(payloads=l_payloads, minmax=minmax, adjustment=adjustment)
+    l_us = (time.perf_counter()-l_start)*1000000/packets
+    print(f'{name:30s} {l_us:8.3f} us/packet')
+
+# -------------------------------------------------------------------------------
+def _measure(*, name, mfdata, minmax, adjustment, packets, fields=None):
+    l_decode = ruuvitag_decode.decode
+    l_start = time.perf_counter()
+    for _ in range(packets):
+        l_decode(mfdata=mfdata, minmax=minmax, tagadjustsment=adjustment, fields=fields)
+    l_us = (time.perf_counter()-l_start)*1000000/packets
+    print(f'{name:30s} {l_us:8.2f} us/packet')
+
+# -------------------------------------------------------------------------------
+if __name__ == '__main__':
+    l_packets = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    # invalid corpus payloads are logged by the decoders
+    logging.disable(logging.CRITICAL)
+
+    if golden():
+        sys.exit(1)
+    if ruuvitag_batch.available() and golden_batch():
+        sys.exit(1)
+    l_packets_all = dict(PACKETS)
+    if ruuvitag_df8.available():
+        if df8():
+            sys.exit(1)
+        l_df8 = ruuvitag_df8.encrypt(key=ruuvitag_df8.PASSWORD, fields=DF8_FIELDS, mac=DF8_MAC)
+        l_packets_all['df8'] = l_df8
+        l_packets_all['df8 bad crc'] = l_df8[:17] + bytes((l_df8[17] ^ 0xFF,)) + l_df8[18:]
+    else:
+        print('df8: AES not installed')
+    print(f'packets: {l_packets}')
+    for (l_name, l_mfdata) in l_packets_all.items():
+        _measure(name=l_name, mfdata=l_mfdata, minmax={}, adjustment=None, packets=l_packets)
+        _measure(name=f'{l_name} minmax+adjustment', mfdata=l_mfdata, minmax=MINMAX, adjustment=ADJUSTMENT, packets=l_packets)
+        _measure(name=f'{l_name} projected', mfdata=l_mfdata, minmax=MINMAX, adjustment=ADJUSTMENT, packets=l_packets, fields=FIELDS)
+    if ruuvitag_batch.available():
+        for (l_name, l_mfdata) in PACKETS.items():
+            _measure_batch(name=f'{l_name} batch', mfdata=l_mfdata, minmax={}, adjustment=None, packets=l_packets)
+            _measure_batch(name=f'{l_name} batch minmax+adj', mfdata=l_mfdata, minmax=MINMAX, adjustment=BATCH_ADJUSTMENT, packets=l_packets)
+    else:
+        print('batch: numpy not installed')
@@ -4,15 +4,20 @@
 # Copyright:    (c) 2019 TK
 # Licence:      MIT
 # data format:  https://github.com/ruuvi/ruuvi-sensor-protocols
+#
+# whole payload is unpacked with one precompiled struct, MINMAX limits are
+# resolved once per configuration
 # -------------------------------------------------------------------------------
 import logging
 logger = logging.getLogger('ruuvitag')
 
 import math
+import struct
 from .ruuvitag_misc import (
-    twos_complement,
-    rshift,
-    get_field_adjustment
+    get_field_adjustment,
+    get_field_limits,
+    get_field_projection,
+    hex_string
 )
 
 _DF = 3
@@ -23,120 +28,114 @@ ROUND_VOLTAGE = 2
 ROUND_TXPOWER = 0
 ROUND_ACCELERATION = 3
 
+# humidity, temperature (sign + integer), temperature fraction, pressure, acceleration x y z, battery
+_FORMAT = struct.Struct('>xBBBHhhhH')
+# field, default min, default max
+_LIMITS = (
+    ('humidity', 0, 100.0),
+    ('temperature', -127.99, 127.99),
+    ('pressure', 500, 1155.36)
+)
+# fields decoded only if requested, _df, humidity, temperature and pressure are
+# always decoded and checked against the limits
+_OPTIONAL = (
+    'acceleration', 'acceleration_x', 'acceleration_y', 'acceleration_z', 'battery'
+)
+
 # -------------------------------------------------------------------------------
 class ruuvitag_df3(object):
     DATAFORMAT = 'FF990403'
     DATALEN = 14
     DF = _DF
+    LIMITS = _LIMITS
 
 # -------------------------------------------------------------------------------
-    def _temperature(self, *, mfdata, minmax, tagadjustsment):
-        """ Temperature in celcius: -127.99 °C to +127.99 °C in 0.01 °C increments """
-        l_min = -127.99
-        l_max = 127.99
-        if minmax:
-            try:
-                l_min = minmax['min']
-                l_max = minmax['max']
-            except:
-                logger.debug(f'>>> minmax not defined: {minmax}')
-
-        l_temperature = (mfdata[2] & ~(1 << 7)) + (mfdata[3] / 100)
-        if ((mfdata[2] >> 7) & 1):
-            l_temperature *= -1
-        l_temperature += get_field_adjustment('temperature', tagadjustsment)    
-        
-        if l_temperature < l_min or l_temperature > l_max:
-            l_txt = f'''Temperature out of limits: value:{l_temperature} min:{l_min} max:{l_max} adjustment:{get_field_adjustment('humidity', tagadjustsment)}'''
-            logger.warning(f'>>> {l_txt}')
-            raise ValueError(l_txt)
-        return round(l_temperature, ROUND_TEMPERATURE)
+    def __init__(self):
+        self._minmax = None
+        self._limits = None
+        self._fields = None
+        self._projection = None
 
 # -------------------------------------------------------------------------------
-    def _humidity(self, *, mfdata, minmax, tagadjustsment):
-        """ Humidity in %: 0.0 % to 100.0 % in 0.5 % increments """
-        l_min = 0
-        l_max = 100.0
-        if minmax:
-            try:
-                l_min = minmax['min']
-                l_max = minmax['max']
-            except:
-                logger.debug(f'>>> minmax not defined: {minmax}')
-
-        l_humidity = round((mfdata[1] * 0.5), 1)
-        l_humidity += get_field_adjustment('humidity', tagadjustsment)
-        if l_humidity < l_min or l_humidity > l_max:
-            l_txt = f'''Humidity out of limits: value:{l_humidity} min:{l_min} max:{l_max} adjustment:{get_field_adjustment('humidity', tagadjustsment)}'''
-            logger.warning(f'>>> {l_txt}')
-            raise ValueError(l_txt)
-        return round(l_humidity, ROUND_HUMIDITY)
+    def _get_limits(self, *, minmax):
+        """ Returns (hum min, hum max, temp min, temp max, pres min, pres max), cached per minmax """
+        if minmax is not self._minmax:
+            self._limits = tuple(l_limit for (l_field, l_min, l_max) in _LIMITS for l_limit in get_field_limits(minmax, l_field, l_min, l_max))
+            self._minmax = minmax
+        return self._limits
 
 # -------------------------------------------------------------------------------
-    def _pressure(self, *, mfdata, minmax, tagadjustsment):
-        """ Atmospheric Pressure in hPa; 500 hPa to 1155.36 hPa in 0.01 hPa increments """
-        l_min = 500
-        l_max = 1155.36
-        if minmax:
-            try:
-                l_min = minmax['min']
-                l_max = minmax['max']
-            except:
-                logger.debug(f'>>> minmax not defined: {minmax}')
-
-        l_pressure = (mfdata[4] << 8) + mfdata[5] + 50000
-        l_pressure = round((l_pressure / 100), 3)
-        l_pressure += get_field_adjustment('pressure', tagadjustsment)
-        if l_pressure < l_min or l_pressure > l_max:
-            l_txt = f'''Pressure out of limits: value:{l_pressure} min:{l_min} max:{l_max} adjustment:{get_field_adjustment('humidity', tagadjustsment)}'''
-            logger.warning(f'>>> {l_txt}')
-            raise ValueError(l_txt)
-        return round(l_pressure, ROUND_PRESSURE)
+    def _get_projection(self, *, fields):
+        """ Returns booleans of the _OPTIONAL fields, cached per fields """
+        if fields is not self._fields:
+            self._projection = get_field_projection(fields, _OPTIONAL)
+            self._fields = fields
+        return self._projection
 
 # -------------------------------------------------------------------------------
-    def _acceleration(self, *, mfdata):
-        """ Acceleration in mG's: -32000 to 32000 (mG), however the sensor on RuuviTag supports only 16 G max (2 G in default configuration) """
-        l_acc_x = round(twos_complement((mfdata[6] << 8) + mfdata[7], 16), ROUND_ACCELERATION)
-        l_acc_y = round(twos_complement((mfdata[8] << 8) + mfdata[9], 16), ROUND_ACCELERATION)
-        l_acc_z = round(twos_complement((mfdata[10] << 8) + mfdata[11], 16), ROUND_ACCELERATION)
-        return (l_acc_x, l_acc_y, l_acc_z)
+    def decode(self, *, mfdata, minmax, tagadjustsment, fields=None):
+        """
+        Humidity in %: 0.0 % to 100.0 % in 0.5 % increments
+        Temperature in celcius: -127.99 °C to +127.99 °C in 0.01 °C increments
+        Atmospheric Pressure in hPa; 500 hPa to 1155.36 hPa in 0.01 hPa increments
+        Acceleration in mG's: -32000 to 32000 (mG)
+        Battery Voltage in mV: 0 mV to 65536 mV in 1 mV increments, practically 1800 ... 3600 mV
+        fields - decoded fields (default: None - all), the limits are checked also if not requested
+        """
+        try:
+            if len(mfdata) >= ruuvitag_df3.DATALEN:
+                (l_hum, l_temp, l_temp_frac, l_pres, l_acc_x, l_acc_y, l_acc_z, l_battery) = _FORMAT.unpack_from(mfdata)
+                (l_hum_min, l_hum_max, l_temp_min, l_temp_max, l_pres_min, l_pres_max) = self._get_limits(minmax=minmax)
 
-# -------------------------------------------------------------------------------
-    def _battery(self, *, mfdata):
-        """ Battery Voltage in mV: 0 mV to 65536 mV in 1 mV increments, practically 1800 ... 3600 mV """
-        return round((mfdata[12] << 8) + mfdata[13], ROUND_VOLTAGE)
+                l_humidity = round((l_hum * 0.5), 1) + get_field_adjustment('humidity', tagadjustsment)
+                if l_humidity < l_hum_min or l_humidity > l_hum_max:
+                    raise ValueError(f'Humidity out of limits: value:{l_humidity} min:{l_hum_min} max:{l_hum_max}')
+                l_temperature = (l_temp & 0x7F) + (l_temp_frac / 100)
+                if l_temp & 0x80:
+                    l_temperature *= -1
+                l_temperature += get_field_adjustment('temperature', tagadjustsment)
+                if l_temperature < l_temp_min or l_temperature > l_temp_max:
+                    raise ValueError(f'Temperature out of limits: value:{l_temperature} min:{l_temp_min} max:{l_temp_max}')
+                l_pressure = round((l_pres + 50000) / 100, 3) + get_field_adjustment('pressure', tagadjustsment)
+                if l_pressure < l_pres_min or l_pressure > l_pres_max:
+                    raise ValueError(f'Pressure out of limits: value:{l_pressure} min:{l_pres_min} max:{l_pres_max}')
 
-# -------------------------------------------------------------------------------
-    # def _rssi(self, *, mfdata):
-    #     """ rssi is last byte of the hcidump --raw output """
-    #     try:
-    #         l_unsigned = mfdata[14] & 0xFF
-    #         return l_unsigned-256 if l_unsigned>127 else l_unsigned
-    #     except:
-    #         return None
+                if fields is None:
+                    return {
+                        '_df': _DF,
+                        'humidity': round(l_humidity, ROUND_HUMIDITY),
+                        'temperature': round(l_temperature, ROUND_TEMPERATURE),
+                        'pressure': round(l_pressure, ROUND_PRESSURE),
+                        'acceleration': round(math.sqrt(l_acc_x * l_acc_x + l_acc_y * l_acc_y + l_acc_z * l_acc_z), ROUND_ACCELERATION),
+                        'acceleration_x': l_acc_x,
+                        'acceleration_y': l_acc_y,
+                        'acceleration_z': l_acc_z,
+                        'battery': l_battery
+                    }
 
-# -------------------------------------------------------------------------------
-    def decode(self, *, mfdata, minmax, tagadjustsment):
-        try:
-            if len(mfdata) >= ruuvitag_df3.DATALEN:
-                l_acc_x, l_acc_y, l_acc_z = self._acceleration(mfdata=mfdata)
-                return {
+                (l_acc, l_x, l_y, l_z, l_bat) = self._get_projection(fields=fields)
+                l_datas = {
                     '_df': _DF,
-                    'humidity': self._humidity(mfdata=mfdata, minmax=minmax.get('humidity', None), tagadjustsment=tagadjustsment),
-                    'temperature': self._temperature(mfdata=mfdata, minmax=minmax.get('temperature', None), tagadjustsment=tagadjustsment),
-                    'pressure': self._pressure(mfdata=mfdata, minmax=minmax.get('pressure', None), tagadjustsment=tagadjustsment),
-                    'acceleration': round(math.sqrt(l_acc_x * l_acc_x + l_acc_y * l_acc_y + l_acc_z * l_acc_z), ROUND_ACCELERATION),
-                    'acceleration_x': l_acc_x,
-                    'acceleration_y': l_acc_y,
-                    'acceleration_z': l_acc_z,
-                    'battery': self._battery(mfdata=mfdata)
+                    'humidity': round(l_humidity, ROUND_HUMIDITY),
+                    'temperature': round(l_temperature, ROUND_TEMPERATURE),
+                    'pressure': round(l_pressure, ROUND_PRESSURE)
                 }
+                if l_acc:
+                    l_datas['acceleration'] = round(math.sqrt(l_acc_x * l_acc_x + l_acc_y * l_acc_y + l_acc_z * l_acc_z), ROUND_ACCELERATION)
+                if l_x:
+                    l_datas['acceleration_x'] = l_acc_x
+                if l_y:
+                    l_datas['acceleration_y'] = l_acc_y
+                if l_z:
+                    l_datas['acceleration_z'] = l_acc_z
+                if l_bat:
+                    l_datas['battery'] = l_battery
+                return l_datas
             else:
-                logger.error(f'>>> Data too short: len:{len(mfdata)} mfdata:{mfdata}')
-        except ValueError:
-            logger.warning(f'>>> ValueError: mfdata:{mfdata}')
+                logger.error(f'''>>> Data too short: len:{len(mfdata)} mfdata:{hex_string(data=mfdata, filler='')}''')
+        except ValueError as l_e:
+            logger.warning(f'''>>> ValueError: {l_e} adjustment:{tagadjustsment} mfdata:{hex_string(data=mfdata, filler='')}''')
         except:
-            logger.exception(f'*** exception mfdata not valid: {mfdata}')
+            logger.exception(f'''*** exception mfdata not valid: {hex_string(data=mfdata, filler='')}''')
 
         return None
-
@@ -5,30 +5,47 @@
 # Licence:      MIT
 #
 # data format:  https://github.com/ruuvi/ruuvi-sensor-protocols
-# 
-# data format         0         
+#
+# data format         0
 # temperature         1-2       -32767 ... 32767    0.005 degrees
 # humidity            3-4       0 ... 40000         0.0025% (0...163.83)
 # pressure            5-6       0 ... 65535         1Pa (offset -50000)
-# power info          7-8       
+# power info          7-8
 # movement counter    9-10      0 ... 65534
 # sequence number     11-12     0 ... 65534
 # reserved            13-16     reserved for future use
-# crc                 17        CRC8
-# mac                 18-23     48bit MAC address        
+# crc                 17        CRC8 of the encrypted bytes 1-16
+# mac                 18-23     48bit MAC address
 # rssi                24        -127 ... 127 last byte of the data stream
 #
-# TODO: NOT YET IMPLEMENTED
+# Bytes 1-16 are encrypted with AES-128 ECB, the key is per tag (KEYS) or the
+# default PASSWORD. CRC8 (polynomial 0x07) is checked before decrypting, corrupted
+# frames are discarded without touching the cipher. Cipher contexts are expanded
+# once per key and reused for every packet of the tag.
+# AES is optional: cryptography or pycryptodome, available() tells if installed.
 # -------------------------------------------------------------------------------
 import logging
 logger = logging.getLogger('ruuvitag')
 
-import math
+import struct
+
+try:
+    from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
+    from cryptography.hazmat.backends import default_backend
+    _AES = 'cryptography'
+except ImportError:
+    try:
+        from Crypto.Cipher import AES
+        _AES = 'pycryptodome'
+    except ImportError:
+        _AES = None
 
 from .ruuvitag_misc import (
-    twos_complement,
-    rshift,
-    get_field_adjustment
+    get_field_adjustment,
+    get_field_limits,
+    get_field_projection,
+    hex_string,
+    mac_to_int
 )
 
 _DF = 8
@@ -37,164 +54,232 @@ ROUND_HUMIDITY = 4
 ROUND_PRESSURE = 2
 ROUND_VOLTAGE = 3
 ROUND_TXPOWER = 0
+# temperature, humidity, pressure, power info, movement counter, sequence number (decrypted bytes 1-16)
+_FORMAT = struct.Struct('>hHHHHH4x')
+_TAGID = ':'.join(['{:02X}'] * 6).format
+# field, default min, default max
+_LIMITS = (
+    ('humidity', 0, 100.0),
+    ('temperature', -163.840, 163.830),
+    ('pressure', 500, 1155.36)
+)
+# fields decoded only if requested, _df, humidity, temperature and pressure are
+# always decoded and checked against the limits
+_OPTIONAL = (
+    'tx_power', 'battery', 'movement_counter', 'sequence_number', 'tagid'
+)
+_CRC_POLYNOMIAL = 0x07
+
+# -------------------------------------------------------------------------------
+def _crc8_table():
+    l_table = []
+    for l_byte in range(256):
+        l_crc = l_byte
+        for _ in range(8):
+            l_crc = ((l_crc << 1) ^ _CRC_POLYNOMIAL) & 0xFF if l_crc & 0x80 else (l_crc << 1) & 0xFF
+        l_table.append(l_crc)
+    return bytes(l_table)
+_CRC8_TABLE = _crc8_table()
+
+# -------------------------------------------------------------------------------
+def crc8(data):
+    """ CRC8 polynomial 0x07, initial value 0x00 """
+    l_crc = 0
+    for l_byte in data:
+        l_crc = _CRC8_TABLE[l_crc ^ l_byte]
+    return l_crc
 
 # -------------------------------------------------------------------------------
 class ruuvitag_df8(object):
     DATAFORMAT = 'FF990408'
     DATALEN = 24
     DF = _DF
+    LIMITS = _LIMITS
     PASSWORD = 0x5275757669636f6d5275757669546167   # "RuuvicomRuuviTag"
 
 # -------------------------------------------------------------------------------
-    def _temperature(self, *, mfdata, minmax, tagadjustsment):
-        """ Temperature in 0.005 degrees. """
-        if mfdata[1:2] == 0x7FFF:
-            return None
-
-        l_min = -163.840
-        l_max = 163.830
-        if minmax:
-            try:
-                l_min = minmax['min']
-                l_max = minmax['max']
-            except:
-                logger.debug(f'>>> minmax not defined: {minmax}')
-
-        l_temperature = twos_complement((mfdata[1] << 8) + mfdata[2], 16) / 200
-        l_temperature += get_field_adjustment('temperature', tagadjustsment)
-        if l_temperature < l_min or l_temperature > l_max:
-            l_txt = f'''Temperature out of limits: value:{l_temperature} min:{l_min} max:{l_max} adjustment:{get_field_adjustment('humidity', tagadjustsment)}'''
-            logger.warning(f'>>> {l_txt}')
-            raise ValueError(l_txt)
-        return round(l_temperature, ROUND_TEMPERATURE)
-
-# -------------------------------------------------------------------------------
-    def _humidity(self, *, mfdata, minmax, tagadjustsment):
-        """ Humidity (16bit unsigned) in 0.0025% (0-163.83% range, though realistically 0-100%). """
-        if mfdata[3:4] == 0xFFFF:
-            return None
-
-        l_min = 0
-        l_max = 100.0
-        if minmax:
-            try:
-                l_min = minmax['min']
-                l_max = minmax['max']
-            except:
-                logger.debug(f'>>> minmax not defined: {minmax}')
-
-        l_humidity = ((mfdata[3] & 0xFF) << 8 | mfdata[4] & 0xFF) / 400
-        l_humidity += get_field_adjustment('humidity', tagadjustsment)
-        if l_humidity < l_min or l_humidity > l_max:
-            l_txt = f'''Humidity out of limits: value:{l_humidity} min:{l_min} max:{l_max} adjustment:{get_field_adjustment('humidity', tagadjustsment)}'''
-            logger.warning(f'>>> {l_txt}')
-            raise ValueError(l_txt)
-        return round(l_humidity, ROUND_TEMPERATURE)
-
-# -------------------------------------------------------------------------------
-    def _pressure(self, *, mfdata, minmax, tagadjustsment):
-        """ Pressure (16bit unsigned) in 1 Pa units, with offset of -50 000 Pa. """
-        if mfdata[5:6] == 0xFFFF:
-            return None
-
-        l_min = 500
-        l_max = 1155.36
-        if minmax:
-            try:
-                l_min = minmax['min']
-                l_max = minmax['max']
-            except:
-                logger.debug(f'>>> minmax not defined: {minmax}')
-
-        l_pressure = ((mfdata[5] & 0xFF) << 8 | mfdata[6] & 0xFF) + 50000
-        l_pressure = round((l_pressure / 100), 3)
-        l_pressure += get_field_adjustment('pressure', tagadjustsment)
-        if l_pressure < l_min or l_pressure > l_max:
-            l_txt = f'''Pressure out of limits: value:{l_pressure} min:{l_min} max:{l_max} adjustment:{get_field_adjustment('humidity', tagadjustsment)}'''
-            logger.warning(f'>>> {l_txt}')
-            raise ValueError(l_txt)
-        return round(l_pressure, ROUND_PRESSURE)
-
-# -------------------------------------------------------------------------------
-    def _powerinfo(self, *, mfdata):
+    def __init__(self, *, keys=None):
         """
-        Power info (11+5bit unsigned), first 11 bits is the battery voltage above 1.6V, 
-        in millivolts (1.6V to 3.646V range). Last 5 bits unsigned are the TX power above -40dBm, 
-        in 2dBm steps. (-40dBm to +20dBm range).        
+        keys - per tag AES keys {'D2:C2:5E:F0:11:D1': '5275757669636f6d5275757669546167'} (default: None - PASSWORD)
+            key is 32 hex digits, 16 character string or 128bit int
         """
-        l_power_info = (mfdata[7] & 0xFF) << 8 | (mfdata[8] & 0xFF)
-        l_battery_voltage = rshift(l_power_info, 5) + 1600
-        l_tx_power = (l_power_info & 0b11111) * 2 - 40
+        self._minmax = None
+        self._limits = None
+        self._fields = None
+        self._projection = None
+        # decrypt function per key (bytes) and per tag (mac int)
+        self._ciphers = {}
+        self._tags = {}
+        self._default = None
+        if _AES:
+            self._default = self._decryptor(key=ruuvitag_df8.PASSWORD)
+        else:
+            logger.info(f'>>> DF8 not decoded: AES not installed (pip3 install cryptography)')
+        self.set_keys(keys=keys)
 
-        if rshift(l_power_info, 5) == 0b11111111111:
-            l_battery_voltage = None
-        if (l_power_info & 0b11111) == 0b11111:
-            l_tx_power = None
-
-        return (round(l_battery_voltage, ROUND_VOLTAGE), round(l_tx_power, ROUND_TXPOWER))
+# -------------------------------------------------------------------------------
+    @staticmethod
+    def available():
+        """ Returns True if AES (cryptography or pycryptodome) is installed """
+        return _AES is not None
 
 # -------------------------------------------------------------------------------
-    def _battery(self, *, mfdata):
-        """ Battery Voltage in mV: 1600 mV to 3647 mV in 1 mV increments, practically 1800 ... 3600 mV """
-        return self._powerinfo(mfdata=mfdata)[0]
+    @staticmethod
+    def _key_bytes(*, key):
+        """ Returns 16 byte AES-128 key, raises ValueError if not valid """
+        if isinstance(key, int):
+            return key.to_bytes(16, 'big')
+        if isinstance(key, str):
+            if len(key) == 32:
+                return bytes.fromhex(key)
+            if len(key) == 16:
+                return key.encode('latin-1')
+        if isinstance(key, (bytes, bytearray)) and len(key) == 16:
+            return bytes(key)
+        raise ValueError(f'invalid key: 32 hex digits, 16 characters or 128bit int required')
 
 # -------------------------------------------------------------------------------
-    def _txpower(self, *, mfdata):
-        """ Ruuvitag transmitting power: -40 dBm to +22 dBm in 2 dBm increments """
-        return self._powerinfo(mfdata=mfdata)[1]
+    @staticmethod
+    def _cipher(*, key):
+        """ Returns (encrypt, decrypt) functions of the expanded key """
+        l_key = ruuvitag_df8._key_bytes(key=key)
+        if _AES == 'cryptography':
+            l_cipher = Cipher(algorithms.AES(l_key), modes.ECB(), backend=default_backend())
+            # ECB contexts have no state between blocks, update() of full blocks is reusable
+            return (l_cipher.encryptor().update, l_cipher.decryptor().update)
+        if _AES == 'pycryptodome':
+            l_cipher = AES.new(l_key, AES.MODE_ECB)
+            return (l_cipher.encrypt, l_cipher.decrypt)
+        raise RuntimeError('AES not installed (pip3 install cryptography)')
 
 # -------------------------------------------------------------------------------
-    def _movementcounter(self, *, mfdata):
-        """ Movement counter (16 bit unsigned), incremented by motion detection interrupts from accelerometer """
-        return (mfdata[9] & 0xFF) << 8 | mfdata[10] & 0xFF
+    def _decryptor(self, *, key):
+        """ Returns decrypt function of the key, expanded once per key """
+        l_key = ruuvitag_df8._key_bytes(key=key)
+        l_decrypt = self._ciphers.get(l_key, None)
+        if not l_decrypt:
+            l_decrypt = ruuvitag_df8._cipher(key=l_key)[1]
+            self._ciphers[l_key] = l_decrypt
+        return l_decrypt
 
 # -------------------------------------------------------------------------------
-    def _sequencenumber(self, *, mfdata):
-        """ Measurement sequence number (16bit unsigned), each time a measurement is taken, 
-        this is incremented by one, used for measurement de-duplication (depending on the transmit interval, 
-        multiple packets with the same measurements can be sent, and there may be measurements that never were sent)
-        """
-        return (mfdata[11] & 0xFF) << 8 | mfdata[12] & 0xFF
+    def set_keys(self, *, keys):
+        """ Sets the per tag keys, tags without own key use PASSWORD """
+        if not _AES:
+            if keys:
+                logger.warning(f'>>> DF8 KEYS ignored: AES not installed (pip3 install cryptography)')
+            return
+        self._tags = {}
+        if keys:
+            for (l_mac, l_key) in keys.items():
+                try:
+                    self._tags[mac_to_int(l_mac)] = self._decryptor(key=l_key)
+                except ValueError as l_e:
+                    logger.error(f'>>> KEYS mac:{l_mac} ignored: {l_e}')
+        logger.debug(f'>>> DF8 keys:{len(self._tags)} ciphers:{len(self._ciphers)}')
 
 # -------------------------------------------------------------------------------
-    def _crc(self, *, mfdata):
-        """ CRC8, used to check for correct decryption """
-        return mfdata[17] & 0xFF
+    @staticmethod
+    def encrypt(*, key, fields, mac):
+        """
+        Returns DF8 payload of the fields, for the emulators and the benchmarks
+        fields - (temperature, humidity, pressure, power info, movement counter, sequence number) raw values
+        mac - 48bit mac int
+        """
+        l_encrypted = ruuvitag_df8._cipher(key=key)[0](_FORMAT.pack(*fields))
+        return bytes((_DF,)) + l_encrypted + bytes((crc8(l_encrypted),)) + mac.to_bytes(6, 'big')
 
 # -------------------------------------------------------------------------------
-    def _tagid(self, *, mfdata):
-        """ 48bit MAC address """
-        return ':'.join('{:02X}'.format(x) for x in mfdata[18:24])
+    def _get_limits(self, *, minmax):
+        """ Returns (hum min, hum max, temp min, temp max, pres min, pres max), cached per minmax """
+        if minmax is not self._minmax:
+            self._limits = tuple(l_limit for (l_field, l_min, l_max) in _LIMITS for l_limit in get_field_limits(minmax, l_field, l_min, l_max))
+            self._minmax = minmax
+        return self._limits
 
 # -------------------------------------------------------------------------------
-    def _rssi(self, *, mfdata):
-        """ rssi is last byte of the hcidump --raw output """
-        try:
-            l_unsigned = mfdata[24] & 0xFF
-            return l_unsigned-256 if l_unsigned>127 else l_unsigned
-        except:
-            return None
+    def _get_projection(self, *, fields):
+        """ Returns booleans of the _OPTIONAL fields, cached per fields """
+        if fields is not self._fields:
+            self._projection = get_field_projection(fields, _OPTIONAL)
+            self._fields = fields
+        return self._projection
 
 # -------------------------------------------------------------------------------
-    def decode(self, *, mfdata, minmax, tagadjustsment):
+    def decode(self, *, mfdata, minmax, tagadjustsment, fields=None):
+        """
+        Temperature in celcius: -163.840 °C to +163.830 °C in 0.005 °C increments
+        Humidity in %: 0.0 % to 100 % in 0.0025 % increments
+        Atmospheric Pressure in hPa; 500 hPa to 1155.36 hPa in 0.01 hPa increments
+        Power info (11+5bit unsigned), battery voltage above 1.6V in mV and tx power above -40dBm in 2dBm steps,
+        all ones is not available and the packet is discarded
+        Movement counter (16bit unsigned), sequence number (16bit unsigned), 48bit MAC address
+        Packets with wrong CRC8 are discarded before decrypting
+        fields - decoded fields (default: None - all), the limits and power info are checked also if not requested
+        """
         try:
             if len(mfdata) >= ruuvitag_df8.DATALEN:
-                return {
+                if not self._default:
+                    return None
+                l_encrypted = mfdata[1:17]
+                if crc8(l_encrypted) != mfdata[17]:
+                    # corrupted frames are common with weak signal, discarded without formatting
+                    if logger.isEnabledFor(logging.DEBUG):
+                        logger.debug(f'''>>> CRC8 mismatch mfdata:{hex_string(data=mfdata, filler='')}''')
+                    return None
+                l_mac = mfdata[18:24]
+                l_decrypt = self._tags.get(int.from_bytes(l_mac, 'big'), self._default)
+                (l_temp, l_hum, l_pres, l_power, l_move, l_seq) = _FORMAT.unpack(l_decrypt(l_encrypted))
+                (l_hum_min, l_hum_max, l_temp_min, l_temp_max, l_pres_min, l_pres_max) = self._get_limits(minmax=minmax)
+
+                l_humidity = l_hum / 400 + get_field_adjustment('humidity', tagadjustsment)
+                if l_humidity < l_hum_min or l_humidity > l_hum_max:
+                    raise ValueError(f'Humidity out of limits: value:{l_humidity} min:{l_hum_min} max:{l_hum_max}')
+                l_temperature = l_temp / 200 + get_field_adjustment('temperature', tagadjustsment)
+                if l_temperature < l_temp_min or l_temperature > l_temp_max:
+                    raise ValueError(f'Temperature out of limits: value:{l_temperature} min:{l_temp_min} max:{l_temp_max}')
+                l_pressure = round((l_pres + 50000) / 100, 3) + get_field_adjustment('pressure', tagadjustsment)
+                if l_pressure < l_pres_min or l_pressure > l_pres_max:
+                    raise ValueError(f'Pressure out of limits: value:{l_pressure} min:{l_pres_min} max:{l_pres_max}')
+                if (l_power >> 5) == 0b11111111111 or (l_power & 0b11111) == 0b11111:
+                    raise ValueError(f'Power info not available: {l_power:04X}')
+
+                if fields is None:
+                    return {
+                        '_df': _DF,
+                        'humidity': round(l_humidity, ROUND_HUMIDITY),
+                        'temperature': round(l_temperature, ROUND_TEMPERATURE),
+                        'pressure': round(l_pressure, ROUND_PRESSURE),
+                        'tx_power': (l_power & 0b11111) * 2 - 40,
+                        'battery': (l_power >> 5) + 1600,
+                        'movement_counter': l_move,
+                        'sequence_number': l_seq,
+                        'tagid': _TAGID(*l_mac)
+                    }
+
+                (l_txp, l_bat, l_mov, l_sq, l_tag) = self._get_projection(fields=fields)
+                l_datas = {
                     '_df': _DF,
-                    'humidity': self._humidity(mfdata=mfdata, minmax=minmax.get('humidity', None), tagadjustsment=tagadjustsment),
-                    'temperature': self._temperature(mfdata=mfdata, minmax=minmax.get('temperature', None), tagadjustsment=tagadjustsment),
-                    'pressure': self._pressure(mfdata=mfdata, minmax=minmax.get('pressure', None), tagadjustsment=tagadjustsment),
-                    'tx_power': self._txpower(mfdata=mfdata),
-                    'battery': self._battery(mfdata=mfdata),
-                    'movement_counter': self._movementcounter(mfdata=mfdata),
-                    'sequence_number': self._sequencenumber(mfdata=mfdata),
-                    'tagid': self._tagid(mfdata=mfdata)
+                    'humidity': round(l_humidity, ROUND_HUMIDITY),
+                    'temperature': round(l_temperature, ROUND_TEMPERATURE),
+                    'pressure': round(l_pressure, ROUND_PRESSURE)
                 }
+                if l_txp:
+                    l_datas['tx_power'] = (l_power & 0b11111) * 2 - 40
+                if l_bat:
+                    l_datas['battery'] = (l_power >> 5) + 1600
+                if l_mov:
+                    l_datas['movement_counter'] = l_move
+                if l_sq:
+                    l_datas['sequence_number'] = l_seq
+                if l_tag:
+                    l_datas['tagid'] = _TAGID(*l_mac)
+                return l_datas
             else:
-                logger.error(f'>>> Data too short: len:{len(mfdata)} mfdata:{mfdata}')
-        except ValueError:
-            logger.warning(f'>>> ValueError: mfdata:{mfdata}')
+                logger.error(f'''>>> Data too short: len:{len(mfdata)} mfdata:{hex_string(data=mfdata, filler='')}''')
+        except ValueError as l_e:
+            logger.warning(f'''>>> ValueError: {l_e} adjustment:{tagadjustsment} mfdata:{hex_string(data=mfdata, filler='')}''')
         except:
-            logger.exception(f'*** exception mfdata not valid: {mfdata}')
-        
-        return None
\ No newline at end of file
+            logger.exception(f'''*** exception mfdata not valid: {hex_string(data=mfdata, filler='')}''')
+
+        return None
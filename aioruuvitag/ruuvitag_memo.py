@@ -0,0 +1,85 @@
+# coding=utf-8
+# !/usr/bin/python3
+# Name:         ruuvitag_memo - last decoded payload per tag
+# Copyright:    (c) 2020 TK
+# Licence:      MIT
+#
+# Ruuvitag sends the same payload until the next measurement. The last raw
+# payload and its decoded fields are kept per tag, identical payload reuses
+# the decoded fields without decoding. Invalid payloads are kept too (None).
+# MINMAX and ADJUSTMENT do not change while running, so the decoded fields
+# depend only on the payload. Cached fields are read-only, they are shared
+# by the ruuvitag_samples of the tag, time, rssi and tagname are sample slots.
+# Table is bounded, least recently heard tag is evicted when it is full.
+# -------------------------------------------------------------------------------
+from collections import OrderedDict
+from types import MappingProxyType
+
+# ===============================================================================
+class ruuvitag_memo(object):
+# -------------------------------------------------------------------------------
+    def __init__(self, *,
+        maxsize=1024
+    ):
+        """
+        maxsize - max number of tags in the memo (Default: 1024)
+        """
+        if maxsize < 1:
+            raise ValueError(f'invalid maxsize:{maxsize}')
+        self._maxsize = maxsize
+        self._table = OrderedDict()     # mac int: (payload, decoded fields or None)
+        self._stats = self._new_stats()
+
+# -------------------------------------------------------------------------------
+    def __repr__(self):
+        return f'ruuvitag_memo size:{len(self._table)}/{self._maxsize}'
+
+# -------------------------------------------------------------------------------
+    def _new_stats(self):
+        return {
+            'hits': 0,          # payloads not decoded
+            'misses': 0,        # payloads decoded
+            'evicted': 0        # tags evicted from the full table
+        }
+
+# -------------------------------------------------------------------------------
+    def stats(self):
+        """ Returns statistics since the previous reset, hit_ratio 0.0 ... 1.0 """
+        l_stats = dict(self._stats)
+        l_cnt = l_stats['hits'] + l_stats['misses']
+        l_stats['hit_ratio'] = round(l_stats['hits'] / l_cnt, 3) if l_cnt else 0.0
+        l_stats['size'] = len(self._table)
+        return l_stats
+
+# -------------------------------------------------------------------------------
+    def reset_stats(self):
+        self._stats = self._new_stats()
+
+# -------------------------------------------------------------------------------
+    def get(self, *, mac, mfdata):
+        """
+        Returns (True, decoded fields) if mfdata is the same as the previous payload of the tag,
+        otherwise (False, None)
+        """
+        l_entry = self._table.get(mac, None)
+        if l_entry and l_entry[0] == mfdata:
+            self._table.move_to_end(mac)
+            self._stats['hits'] += 1
+            return (True, l_entry[1])
+        self._stats['misses'] += 1
+        return (False, None)
+
+# -------------------------------------------------------------------------------
+    def put(self, *, mac, mfdata, datas):
+        """
+        Stores the decoded fields of the payload as the last of the tag
+        Returns read-only view of the fields or None
+        """
+        l_datas = MappingProxyType(datas) if datas else None
+        l_table = self._table
+        l_table[mac] = (bytes(mfdata), l_datas)
+        l_table.move_to_end(mac)
+        if len(l_table) > self._maxsize:
+            l_table.popitem(last=False)
+            self._stats['evicted'] += 1
+        return l_datas
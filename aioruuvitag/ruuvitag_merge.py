@@ -0,0 +1,177 @@
+# coding=utf-8
+# !/usr/bin/python3
+# Name:         ruuvitag_merge - merges bledata streams of several adapters
+# Copyright:    (c) 2020 TK
+# Licence:      MIT
+#
+# Same advertisement is received by every adapter in range. First copy is held
+# for the hold period, copies received meanwhile replace it if they have better
+# rssi. After the hold period the best copy is forwarded.
+# Copies are identified by (mac, DF5 sequence number), other formats by
+# (mac, manufacturer data). Copies received within the hold period after the
+# forward are late copies and dropped, later ones are new advertisements (DF3
+# payload repeats while the measurement doesn't change).
+# Forwarded keys and per device counters are bounded, least recently heard tag
+# is evicted when they are full.
+# -------------------------------------------------------------------------------
+import logging
+logger = logging.getLogger('ruuvitag')
+
+import time
+from collections import OrderedDict
+
+from .ruuvitag_misc import int_to_mac
+from .ruuvitag_seqtable import df5_seq
+
+# ===============================================================================
+class ruuvitag_merge(object):
+# -------------------------------------------------------------------------------
+    def __init__(self, *,
+        callback,
+        hold=0.2,
+        maxsize=1024
+    ):
+        """
+        callback - async callback(bledatas=[BLEData]) called with the merged bledatas (Required)
+        hold - seconds to wait copies from the other adapters (Default: 0.2)
+        maxsize - max number of tags in the forwarded keys and per device counters (Default: 1024)
+        """
+        if not callback:
+            raise ValueError(f'callback is None')
+        if maxsize < 1:
+            raise ValueError(f'invalid maxsize:{maxsize}')
+        self._callback = callback
+        self._hold = hold
+        self._maxsize = maxsize
+        self._pending = {}              # (mac, key): [deadline, bledata, device]
+        self._emitted = OrderedDict()   # mac: (key, expires) of the last forwarded, expiry order
+        self._stats = self._new_stats()
+
+# -------------------------------------------------------------------------------
+    def __repr__(self):
+        return f'ruuvitag_merge hold:{self._hold}sec pending:{len(self._pending)} emitted:{len(self._emitted)}/{self._maxsize}'
+
+# -------------------------------------------------------------------------------
+    @property
+    def hold(self):
+        return self._hold
+
+# -------------------------------------------------------------------------------
+    def _new_stats(self):
+        return {
+            'forwarded': 0,                             # merged bledatas forwarded
+            'duplicates': 0,                            # copies dropped
+            'evicted': 0,                               # tags evicted from the full per device counters
+            'devices': {}                               # device: OrderedDict {mac: [received, forwarded]}
+        }
+
+# -------------------------------------------------------------------------------
+    def stats(self):
+        """
+        Returns merge statistics since the previous reset
+        devices - {device: {mac string: {'received': n, 'forwarded': n}}}
+        """
+        return {
+            'forwarded': self._stats['forwarded'],
+            'duplicates': self._stats['duplicates'],
+            'evicted': self._stats['evicted'],
+            'devices': {
+                l_device: {int_to_mac(l_mac): {'received': l_cnt[0], 'forwarded': l_cnt[1]} for l_mac, l_cnt in l_tags.items()}
+                for l_device, l_tags in self._stats['devices'].items()
+            }
+        }
+
+# -------------------------------------------------------------------------------
+    def reset_stats(self):
+        self._stats = self._new_stats()
+
+# -------------------------------------------------------------------------------
+    def _counters(self, *, device, mac):
+        """ Returns [received, forwarded] of the mac received by the device """
+        l_tags = self._stats['devices'].get(device, None)
+        if l_tags is None:
+            l_tags = self._stats['devices'][device] = OrderedDict()
+        l_cnt = l_tags.get(mac, None)
+        if l_cnt is None:
+            l_cnt = l_tags[mac] = [0, 0]
+            if len(l_tags) > self._maxsize:
+                l_tags.popitem(last=False)
+                self._stats['evicted'] += 1
+        else:
+            l_tags.move_to_end(mac)
+        return l_cnt
+
+# -------------------------------------------------------------------------------
+    def _forwarded(self, *, mac, key, now):
+        """ Remembers key of the forwarded, expired and least recently forwarded are evicted """
+        l_emitted = self._emitted
+        l_emitted[mac] = (key, now + self._hold)
+        l_emitted.move_to_end(mac)
+        while l_emitted:
+            (l_mac, (_, l_expires)) = next(iter(l_emitted.items()))
+            if l_expires > now and len(l_emitted) <= self._maxsize:
+                break
+            del l_emitted[l_mac]
+
+# -------------------------------------------------------------------------------
+    @staticmethod
+    def _key(*, mfdata):
+        l_seq = df5_seq(mfdata=mfdata)
+        return bytes(mfdata) if l_seq is None else l_seq
+
+# -------------------------------------------------------------------------------
+    async def put(self, *, bledata, device):
+        """ Single bledata from the device """
+        await self.put_batch(bledatas=[bledata], device=device)
+
+# -------------------------------------------------------------------------------
+    async def put_batch(self, *, bledatas, device):
+        """
+        Bledatas from the device, bledatas may refer to the collector's receive buffer
+        and are copied if held
+        """
+        l_now = time.monotonic()
+        l_deadline = l_now + self._hold
+        for l_bledata in bledatas:
+            l_mac = l_bledata.macint
+            l_mfdata = l_bledata.mfdata()
+            if l_mac is None or not l_mfdata:
+                continue
+            self._counters(device=device, mac=l_mac)[0] += 1
+            l_key = self._key(mfdata=l_mfdata)
+            l_emitted = self._emitted.get(l_mac, None)
+            if l_emitted is not None and l_emitted[0] == l_key and l_emitted[1] > l_now:
+                # late copy of the already forwarded
+                self._stats['duplicates'] += 1
+                continue
+            l_entry = self._pending.get((l_mac, l_key), None)
+            if l_entry is None:
+                self._pending[(l_mac, l_key)] = [l_deadline, l_bledata.copy(), device]
+            else:
+                self._stats['duplicates'] += 1
+                if (l_bledata.rssi or -128) > (l_entry[1].rssi or -128):
+                    l_entry[1] = l_bledata.copy()
+                    l_entry[2] = device
+
+# -------------------------------------------------------------------------------
+    async def flush(self, *, now=None, force=False):
+        """
+        Forwards the held bledatas whose hold period has expired
+        """
+        l_now = time.monotonic() if now is None else now
+        l_out = []
+        # insertion order is the deadline order
+        for l_key, (l_deadline, l_bledata, l_device) in list(self._pending.items()):
+            if l_deadline > l_now and not force:
+                break
+            del self._pending[l_key]
+            self._forwarded(mac=l_key[0], key=l_key[1], now=l_now)
+            self._counters(device=l_device, mac=l_key[0])[1] += 1
+            l_out.append(l_bledata)
+
+        if l_out:
+            self._stats['forwarded'] += len(l_out)
+            try:
+                await self._callback(bledatas=l_out)
+            except:
+                logger.exception(f'>>> exception')
@@ -0,0 +1,114 @@
+# coding=utf-8
+# !/usr/bin/python3
+# Name:         ruuvitag_merge_test - adapter stream merge checks
+# Copyright:    (c) 2020 TK
+# Licence:      MIT
+#
+# python3 -m aioruuvitag.ruuvitag_merge_test
+#
+# - copies: best rssi copy of the advertisement is forwarded once, copies
+#   received within the hold period after the forward are dropped
+# - repeat: DF3 payload (and DF5 sequence number) repeated after the hold
+#   period is forwarded again, like the single adapter path does
+# - bounded: forwarded keys and per device counters keep at most maxsize tags
+# Exits with 1 if a check fails.
+# -------------------------------------------------------------------------------
+import sys
+import asyncio
+
+from .ble_data import BLEData
+from .ruuvitag_merge import ruuvitag_merge
+
+HOLD = 0.05
+MFID = 0x0499
+DF3 = bytes.fromhex('03291A1ECE1EFC18F94202CA0B53')
+DF5 = bytes.fromhex('0516EC5238C574FCE4FD8CFFEC99769A6221CBD71826DAB4')
+
+# -------------------------------------------------------------------------------
+def _bledata(*, mac, mfdata, rssi=-70):
+    return BLEData(macraw=mac.to_bytes(6, 'little'), rssi=rssi, mfid=MFID, mfdata=mfdata)
+
+# -------------------------------------------------------------------------------
+def _merge(**kwargs):
+    """ Returns (merge, forwarded bledatas) """
+    l_out = []
+
+    async def _callback(*, bledatas):
+        l_out.extend(bledatas)
+
+    return (ruuvitag_merge(callback=_callback, hold=HOLD, **kwargs), l_out)
+
+# -------------------------------------------------------------------------------
+async def _copies():
+    (l_merge, l_out) = _merge()
+    await l_merge.put_batch(bledatas=[_bledata(mac=1, mfdata=DF3, rssi=-80)], device='hci0')
+    await l_merge.put_batch(bledatas=[_bledata(mac=1, mfdata=DF3, rssi=-60)], device='hci1')
+    await l_merge.flush(force=True)
+    assert [l_bledata.rssi for l_bledata in l_out] == [-60], f'forwarded:{len(l_out)}'
+    # late copy from the third adapter
+    await l_merge.put_batch(bledatas=[_bledata(mac=1, mfdata=DF3, rssi=-50)], device='hci2')
+    await l_merge.flush(force=True)
+    assert len(l_out) == 1, f'late copy forwarded'
+    l_stats = l_merge.stats()
+    assert l_stats['duplicates'] == 2 and l_stats['forwarded'] == 1, f'stats:{l_stats}'
+    assert l_stats['devices']['hci1']['00:00:00:00:00:01'] == {'received': 1, 'forwarded': 1}, f'stats:{l_stats}'
+
+# -------------------------------------------------------------------------------
+async def _repeat():
+    for l_mfdata in (DF3, DF5):
+        (l_merge, l_out) = _merge()
+        for l_idx in range(3):
+            await l_merge.put_batch(bledatas=[_bledata(mac=2, mfdata=l_mfdata)], device='hci0')
+            await l_merge.flush(force=True)
+            await asyncio.sleep(HOLD*1.5)
+        assert len(l_out) == 3, f'df:{l_mfdata[0]} forwarded:{len(l_out)}'
+
+# -------------------------------------------------------------------------------
+async def _bounded():
+    (l_merge, l_out) = _merge(maxsize=8)
+    for l_mac in range(100):
+        await l_merge.put_batch(bledatas=[_bledata(mac=l_mac, mfdata=DF3)], device='hci0')
+        await l_merge.put_batch(bledatas=[_bledata(mac=l_mac, mfdata=DF3)], device='hci1')
+        await l_merge.flush(force=True)
+    assert len(l_out) == 100, f'forwarded:{len(l_out)}'
+    assert len(l_merge._emitted) <= 8, f'emitted:{len(l_merge._emitted)}'
+    l_stats = l_merge.stats()
+    assert all(len(l_tags) <= 8 for l_tags in l_stats['devices'].values()), f'devices:{[len(l_tags) for l_tags in l_stats["devices"].values()]}'
+    assert l_stats['evicted'] == 2*(100-8), f'evicted:{l_stats["evicted"]}'
+    # expired keys are evicted by the next forward
+    await asyncio.sleep(HOLD*1.5)
+    await l_merge.put_batch(bledatas=[_bledata(mac=1000, mfdata=DF3)], device='hci0')
+    await l_merge.flush(force=True)
+    assert len(l_merge._emitted) == 1, f'emitted:{len(l_merge._emitted)}'
+
+# -------------------------------------------------------------------------------
+def _run(*, coro):
+    l_loop = asyncio.new_event_loop()
+    try:
+        l_loop.run_until_complete(coro)
+    finally:
+        l_loop.close()
+
+# -------------------------------------------------------------------------------
+def test_copies():
+    _run(coro=_copies())
+
+# -------------------------------------------------------------------------------
+def test_repeat():
+    _run(coro=_repeat())
+
+# -------------------------------------------------------------------------------
+def test_bounded():
+    _run(coro=_bounded())
+
+# -------------------------------------------------------------------------------
+if __name__ == '__main__':
+    l_failed = 0
+    for (l_name, l_test) in (('copies', test_copies), ('repeat', test_repeat), ('bounded', test_bounded)):
+        try:
+            l_test()
+            print(f'{l_name}: ok')
+        except AssertionError as l_e:
+            l_failed += 1
+            print(f'FAILED {l_name}: {l_e}')
+    sys.exit(1 if l_failed else 0)
@@ -45,7 +45,41 @@ def get_field_adjustment(field, tagadjustsment):
     if not tagadjustsment:
         return 0
     try:
-        return tagadjustsment[field]
+        return tagadjustsment.get(field, 0)
     except:
         return 0
-    return 0        
+
+# -------------------------------------------------------------------------------
+def get_field_limits(minmax, field, default_min, default_max):
+    """ Returns (min, max) of the field from the MINMAX configuration or the defaults """
+    l_min = default_min
+    l_max = default_max
+    l_minmax = minmax.get(field, None)
+    if l_minmax:
+        try:
+            l_min = l_minmax['min']
+            l_max = l_minmax['max']
+        except:
+            pass
+    return (l_min, l_max)
+
+# -------------------------------------------------------------------------------
+def get_field_projection(fields, optional):
+    """ Returns tuple of booleans, True if the optional field is in the fields (None: all fields) """
+    if fields is None:
+        return tuple(True for _ in optional)
+    return tuple(l_field in fields for l_field in optional)
+
+# -------------------------------------------------------------------------------
+def mac_to_int(mac):
+    """ 'AA:BB:CC:DD:EE:FF' --> 48bit int, raises ValueError if not valid """
+    l_mac = mac.replace(':', '').replace('-', '')
+    if len(l_mac) != 12:
+        raise ValueError(f'invalid mac:{mac}')
+    return int(l_mac, 16)
+
+# -------------------------------------------------------------------------------
+def int_to_mac(value):
+    """ 48bit int --> 'AA:BB:CC:DD:EE:FF' """
+    l_hex = '{:012X}'.format(value)
+    return ':'.join(l_hex[i:i+2] for i in range(0, 12, 2))
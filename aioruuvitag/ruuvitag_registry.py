@@ -0,0 +1,106 @@
+# coding=utf-8
+# !/usr/bin/python3
+# Name:         ruuvitag_registry - configured ruuvitags keyed by 48bit mac int
+# Copyright:    (c) 2020 TK
+# Licence:      MIT
+# -------------------------------------------------------------------------------
+import logging
+logger = logging.getLogger('ruuvitag')
+
+from .ruuvitag_misc import mac_to_int, int_to_mac
+
+# ===============================================================================
+class ruuvitag_registry(object):
+    """
+    Built once at startup from the TAGS, WHTLIST, BLKLIST and ADJUSTMENT configuration
+    All lookups are done with the 48bit mac int parsed from the received frame
+    mac strings are rendered only when needed (sinks, logging)
+    """
+# -------------------------------------------------------------------------------
+    def __init__(self, *,
+        tags=None,
+        whtlist=None,
+        blklist=None,
+        adjustment=None,
+        whtlist_from_tags=True
+    ):
+        """
+        tags - ruuvitag mac/name mapping {'D2:C2:5E:F0:11:D1': '102bedroom'}
+        whtlist - ble mac whitelist ['D2:C2:5E:F0:11:D1']
+        blklist - ble mac blacklist ['D2:C2:5E:F0:11:D1']
+        adjustment - tag value adjustments {'D2:C2:5E:F0:11:D1': {'temperature': 1.0}}
+        whtlist_from_tags - use tags as whitelist in case whtlist not given
+        """
+        self._tags = {l_mac: l_name for l_mac, l_name in self._macdict(items=tags, name='TAGS')}
+        self._adjustment = {l_mac: l_adj for l_mac, l_adj in self._macdict(items=adjustment, name='ADJUSTMENT')}
+        self._whtlist = frozenset(self._macset(items=whtlist, name='WHTLIST'))
+        self._blklist = frozenset(self._macset(items=blklist, name='BLKLIST'))
+        if not self._whtlist and self._tags and whtlist_from_tags:  # if no whtlist generate it from the tags if exists
+            self._whtlist = frozenset(self._tags.keys())
+            logger.info(f'>>> whitelist from tags')
+
+# -------------------------------------------------------------------------------
+    def __repr__(self):
+        return f'whtlist:{self._render(macs=self._whtlist)} blklist:{self._render(macs=self._blklist)} tags:{ {int_to_mac(l_mac): l_name for l_mac, l_name in self._tags.items()} }'
+
+# -------------------------------------------------------------------------------
+    @staticmethod
+    def _render(*, macs):
+        return [int_to_mac(l_mac) for l_mac in macs]
+
+# -------------------------------------------------------------------------------
+    @staticmethod
+    def _macdict(*, items, name):
+        if items:
+            for l_key, l_value in items.items():
+                try:
+                    yield (mac_to_int(l_key), l_value)
+                except ValueError:
+                    logger.error(f'>>> {name} invalid mac:{l_key} ignored')
+
+# -------------------------------------------------------------------------------
+    @staticmethod
+    def _macset(*, items, name):
+        if items:
+            for l_key in items:
+                try:
+                    yield mac_to_int(l_key)
+                except ValueError:
+                    logger.error(f'>>> {name} invalid mac:{l_key} ignored')
+
+# -------------------------------------------------------------------------------
+    @property
+    def tags(self):
+        """ {mac int: tagname} """
+        return self._tags
+
+# -------------------------------------------------------------------------------
+    @property
+    def whtlist(self):
+        """ frozenset of mac ints """
+        return self._whtlist
+
+# -------------------------------------------------------------------------------
+    @property
+    def blklist(self):
+        """ frozenset of mac ints """
+        return self._blklist
+
+# -------------------------------------------------------------------------------
+    def allowed(self, mac):
+        """ Checks mac lists """
+        if mac in self._blklist:
+            return False
+        if self._whtlist and mac not in self._whtlist:
+            return False
+        return True
+
+# -------------------------------------------------------------------------------
+    def tagname(self, mac):
+        """ Returns tagname or None """
+        return self._tags.get(mac, None)
+
+# -------------------------------------------------------------------------------
+    def adjustment(self, mac):
+        """ Returns tag value adjustments or None """
+        return self._adjustment.get(mac, None)
@@ -0,0 +1,171 @@
+# coding=utf-8
+# !/usr/bin/python3
+# Name:         ruuvitag_sample - immutable decoded sample of a ruuvitag
+# Copyright:    (c) 2020 TK
+# Licence:      MIT
+#
+# One record per accepted advertisement, passed from the collector to the
+# consumers by reference. Decoded fields are the read-only mapping of the
+# decoder (shared with the decode memo), mac, time, rssi and tagname are slots.
+# Sample reads like the former "datas" dict (sample['temperature'],
+# sample.get('tagname'), iteration), time string is formatted only when asked.
+#
+# outdata() returns the former {'mac': , 'datas': , 'calcs': , '_aioruuvitag': }
+# dict for the json string and the shm rings, from_outdata() builds the sample
+# back from it.
+# -------------------------------------------------------------------------------
+from collections.abc import Mapping
+from datetime import datetime as _dt, timezone as _tz
+from types import MappingProxyType
+
+from .ruuvitag_misc import mac_to_int
+
+TIMEFMT = '%Y-%m-%dT%H:%M:%S.%f%z'
+
+# ===============================================================================
+class ruuvitag_sample(Mapping):
+    __slots__ = ('_mac', '_time', '_timestr', '_rssi', '_tagname', '_fields', '_calcs', '_debug')
+# -------------------------------------------------------------------------------
+    def __init__(self, *,
+        mac,
+        fields,
+        time=None,
+        rssi=None,
+        tagname=None,
+        calcs=None,
+        debug=None,
+        timestr=None
+    ):
+        """
+        mac - 48bit mac int
+        fields - decoded fields (read-only mapping or dict not modified later)
+        time - receive time (epoch sec)
+        rssi - rssi dBm, 0 or None not included
+        tagname - configured name of the tag, empty not included
+        calcs - calculated fields not included in the fields (Default: None)
+        debug - "_aioruuvitag" debug data (Default: None)
+        timestr - formatted time, when time is not known (from_outdata)
+        """
+        self._mac = mac
+        self._fields = fields if isinstance(fields, MappingProxyType) else MappingProxyType(fields or {})
+        self._time = time
+        self._timestr = timestr
+        self._rssi = rssi if rssi else None
+        self._tagname = tagname if tagname else None
+        self._calcs = calcs
+        self._debug = debug
+
+# -------------------------------------------------------------------------------
+    def __repr__(self):
+        return f'ruuvitag_sample mac:{self._mac} datas:{dict(self)}'
+
+# -------------------------------------------------------------------------------
+    def __getitem__(self, key):
+        if key == 'tagname' and self._tagname is not None:
+            return self._tagname
+        if key == 'time' and (self._time is not None or self._timestr is not None):
+            return self.timestr
+        if key == 'rssi' and self._rssi is not None:
+            return self._rssi
+        return self._fields[key]
+
+# -------------------------------------------------------------------------------
+    def __iter__(self):
+        yield from self._fields
+        if self._tagname is not None:
+            yield 'tagname'
+        if self._time is not None or self._timestr is not None:
+            yield 'time'
+        if self._rssi is not None:
+            yield 'rssi'
+
+# -------------------------------------------------------------------------------
+    def __len__(self):
+        return len(self._fields) + (self._tagname is not None) + (self._time is not None or self._timestr is not None) + (self._rssi is not None)
+
+# -------------------------------------------------------------------------------
+    @property
+    def mac(self):
+        """ 48bit mac int """
+        return self._mac
+
+# -------------------------------------------------------------------------------
+    @property
+    def time(self):
+        """ receive time (epoch sec) or None """
+        return self._time
+
+# -------------------------------------------------------------------------------
+    @property
+    def timestr(self):
+        """ receive time formatted once ('2019-11-16T11:35:23.481096+0000') or None """
+        if self._timestr is None and self._time is not None:
+            self._timestr = _dt.utcfromtimestamp(self._time).replace(tzinfo=_tz.utc).strftime(TIMEFMT)
+        return self._timestr
+
+# -------------------------------------------------------------------------------
+    @property
+    def rssi(self):
+        return self._rssi
+
+# -------------------------------------------------------------------------------
+    @property
+    def tagname(self):
+        return self._tagname
+
+# -------------------------------------------------------------------------------
+    @property
+    def fields(self):
+        """ decoded fields, read-only """
+        return self._fields
+
+# -------------------------------------------------------------------------------
+    @property
+    def calcs(self):
+        return self._calcs
+
+# -------------------------------------------------------------------------------
+    @property
+    def debug(self):
+        return self._debug
+
+# -------------------------------------------------------------------------------
+    def without_time(self):
+        """ Returns copy without the receive time """
+        return ruuvitag_sample(mac=self._mac, fields=self._fields, rssi=self._rssi, tagname=self._tagname, calcs=self._calcs, debug=self._debug)
+
+# -------------------------------------------------------------------------------
+    def outdata(self):
+        """ Returns outdata dict {'mac': , 'datas': [, 'calcs': ][, '_aioruuvitag': ]} """
+        l_outdata = {'mac': self._mac, 'datas': dict(self)}
+        if self._calcs is not None:
+            l_outdata['calcs'] = self._calcs
+        if self._debug is not None:
+            l_outdata['_aioruuvitag'] = self._debug
+        return l_outdata
+
+# -------------------------------------------------------------------------------
+    def asdict(self):
+        """ Same as outdata(), used by ruuvigw_codec """
+        return self.outdata()
+
+# -------------------------------------------------------------------------------
+    @staticmethod
+    def from_outdata(outdata):
+        """ Returns sample of the outdata dict (json string or shm ring), mac string accepted for compatibility """
+        l_mac = outdata['mac']
+        if isinstance(l_mac, str):
+            l_mac = mac_to_int(l_mac)
+        l_datas = dict(outdata['datas'])
+        l_tagname = l_datas.pop('tagname', None)
+        l_timestr = l_datas.pop('time', None)
+        l_rssi = l_datas.pop('rssi', None)
+        return ruuvitag_sample(
+            mac=l_mac,
+            fields=l_datas,
+            rssi=l_rssi,
+            tagname=l_tagname,
+            calcs=outdata.get('calcs', None),
+            debug=outdata.get('_aioruuvitag', None),
+            timestr=l_timestr
+        )
@@ -0,0 +1,85 @@
+# coding=utf-8
+# !/usr/bin/python3
+# Name:         ruuvitag_seqtable - last DF5 sequence number per tag
+# Copyright:    (c) 2020 TK
+# Licence:      MIT
+#
+# Ruuvitag rebroadcasts the same measurement until the next measurement is
+# taken. DF5 sequence number is read straight from the manufacturer data, so
+# rebroadcasts are suppressed before decoding.
+# Table is bounded, least recently heard tag is evicted when it is full.
+# -------------------------------------------------------------------------------
+from collections import OrderedDict
+
+DF5_FORMAT          = 5
+DF5_SEQ_OFFSET      = 16        # sequence number (2 bytes, big endian) in the manufacturer data
+SEQ_NOT_AVAILABLE   = 0xFFFF
+
+# -------------------------------------------------------------------------------
+def df5_seq(*, mfdata):
+    """ Returns DF5 sequence number from the manufacturer data or None """
+    if len(mfdata) > DF5_SEQ_OFFSET+1 and mfdata[0] == DF5_FORMAT:
+        l_seq = (mfdata[DF5_SEQ_OFFSET] << 8) | mfdata[DF5_SEQ_OFFSET+1]
+        if l_seq != SEQ_NOT_AVAILABLE:
+            return l_seq
+    return None
+
+# ===============================================================================
+class ruuvitag_seqtable(object):
+# -------------------------------------------------------------------------------
+    def __init__(self, *,
+        maxsize=1024
+    ):
+        """
+        maxsize - max number of tags in the table (Default: 1024)
+        """
+        if maxsize < 1:
+            raise ValueError(f'invalid maxsize:{maxsize}')
+        self._maxsize = maxsize
+        self._table = OrderedDict()     # mac int: sequence number
+        self._stats = self._new_stats()
+
+# -------------------------------------------------------------------------------
+    def __repr__(self):
+        return f'ruuvitag_seqtable size:{len(self._table)}/{self._maxsize}'
+
+# -------------------------------------------------------------------------------
+    def _new_stats(self):
+        return {
+            'suppressed': 0,    # rebroadcasts suppressed
+            'evicted': 0        # tags evicted from the full table
+        }
+
+# -------------------------------------------------------------------------------
+    def stats(self):
+        """ Returns statistics since the previous reset """
+        l_stats = dict(self._stats)
+        l_stats['size'] = len(self._table)
+        return l_stats
+
+# -------------------------------------------------------------------------------
+    def reset_stats(self):
+        self._stats = self._new_stats()
+
+# -------------------------------------------------------------------------------
+    def duplicate(self, *, mac, mfdata):
+        """
+        Returns True if mfdata has the same sequence number as the previous one of the tag
+        Data without sequence number (DF3, DF5 not available) is never duplicate
+        """
+        l_seq = df5_seq(mfdata=mfdata)
+        if l_seq is None:
+            return False
+
+        l_table = self._table
+        if l_table.get(mac, None) == l_seq:
+            l_table.move_to_end(mac)
+            self._stats['suppressed'] += 1
+            return True
+
+        l_table[mac] = l_seq
+        l_table.move_to_end(mac)
+        if len(l_table) > self._maxsize:
+            l_table.popitem(last=False)
+            self._stats['evicted'] += 1
+        return False
@@ -10,7 +10,8 @@ import logging
 logger = logging.getLogger('bleak_scanner')
 
 import asyncio
-import queue
+import time
+from collections import OrderedDict
 
 from .scanner_bledevice import BLEDevice
 # import scanner_bluezdbus_defs as defs
@@ -40,8 +41,32 @@ DEVICE_INTERFACE = "org.bluez.Device1"
 # GATT_DESCRIPTOR_INTERFACE = "org.bluez.GattDescriptor1"
 
 QUEUE_SIZE = 100
+DEVICE_TTL = 300.0          # sec, devices not heard within are forgotten
+MAX_DEVICES = 1000          # least recently heard devices are forgotten above
+SWEEP_INTERVAL = 10.0       # sec, ttl check interval
 ###############################################################################
 
+# -----------------------------------------------------------------------------
+def new_stats():
+    return {
+        'messages': 0,      # PropertiesChanged and InterfacesAdded messages
+        'forwarded': 0,     # devices put to the outqueue
+        'unchanged': 0,     # messages without manufacturer data change (rssi only)
+        'overflow': 0,      # oldest devices dropped from the full outqueue
+        'evicted': 0,       # devices forgotten by ttl, max devices or InterfacesRemoved
+        'devices': 0        # devices tracked
+    }
+
+# -----------------------------------------------------------------------------
+def _mfdata_changed(old, new, mfids):
+    """Returns True if accepted manufacturer data differs from the previous"""
+    for mfid, value in new.items():
+        if mfids and mfid not in mfids:
+            continue
+        if not old or old.get(mfid) != value:
+            return True
+    return False
+
 # -----------------------------------------------------------------------------
 def _filter_on_device(objs):
     for path, interfaces in objs.items():
@@ -91,75 +116,123 @@ async def scanner(
     outqueue: asyncio.Queue,
     stopevent: asyncio.Event,
     device: str = 'hci0',
+    mfids: list = None,
+    stats: dict = None,
+    device_ttl: float = DEVICE_TTL,
+    max_devices: int = MAX_DEVICES,
     **kwargs
 ):
     """Perform a continuous Bluetooth LE Scan
     Args:
         loop: async event loop
-        outqueue:  outgoing queue
+        outqueue:  outgoing queue, oldest device is dropped if it is full
         stopevent: stop event
         device: bluetooth device
+        mfids: manufacturer ids whose data change forwards the device (None - all)
+        stats: dict updated with the counters of new_stats()
+        device_ttl: sec to keep the devices not heard
+        max_devices: max tracked devices
 
+    Device properties are updated in place, device is forwarded only when
+    its manufacturer data changed (not on rssi only updates).
     """
-    logger.info(f'>>> scanner:linux device:{device}')
+    logger.info(f'>>> scanner:linux device:{device} ttl:{device_ttl} max_devices:{max_devices}')
 
-    q = queue.Queue(QUEUE_SIZE)
-    devices = {}
+    if stats is None:
+        stats = new_stats()
+    # path: [last heard, props], least recently heard first
+    devices = OrderedDict()
     cached_devices = {}
     rules = list()
 
 # -----------------------------------------------------------------------------
-    def queue_put(msg_path):
+    def evict(msg_path):
+        if devices.pop(msg_path, None):
+            stats['evicted'] += 1
+
+# -----------------------------------------------------------------------------
+    def evict_expired():
+        expired = time.monotonic() - device_ttl
+        while devices:
+            msg_path, (heard, _) = next(iter(devices.items()))
+            if heard >= expired:
+                break
+            evict(msg_path)
+        stats['devices'] = len(devices)
+
+# -----------------------------------------------------------------------------
+    def get_props(msg_path):
+        """Returns properties of the device, marks it as the most recently heard"""
+        entry = devices.get(msg_path)
+        if entry:
+            entry[0] = time.monotonic()
+            devices.move_to_end(msg_path)
+            return entry[1]
+        props = dict(cached_devices.pop(msg_path, {}))
+        devices[msg_path] = [time.monotonic(), props]
+        while len(devices) > max_devices:
+            evict(next(iter(devices)))
+        stats['devices'] = len(devices)
+        return props
+
+# -----------------------------------------------------------------------------
+    def queue_put(msg_path, props):
         try:
-            if msg_path in devices:
-                props = devices[msg_path]
-                name, address, _, _ = _device_info(msg_path, props)
-                # logger.debug(f'>>> {name} {path} {address}')
-                if q and address:
-                    q.put(BLEDevice(
-                        address,
-                        name,
-                        {"path": msg_path, "props": props},
-                        uuids=props.get("UUIDs", []),
-                        manufacturer_data=props.get("ManufacturerData", {})
-                    ))
+            name, address, _, _ = _device_info(msg_path, props)
+            # logger.debug(f'>>> {name} {path} {address}')
+            if outqueue and address:
+                data = BLEDevice(
+                    address,
+                    name,
+                    {"path": msg_path, "props": dict(props)},
+                    uuids=props.get("UUIDs", []),
+                    manufacturer_data=props.get("ManufacturerData", {})
+                )
+                try:
+                    outqueue.put_nowait(data)
+                except asyncio.QueueFull:
+                    outqueue.get_nowait()
+                    outqueue.put_nowait(data)
+                    stats['overflow'] += 1
+                stats['forwarded'] += 1
         except:
             logger.exception(f'>>> exception')
 
+# -----------------------------------------------------------------------------
+    def update(msg_path, changed):
+        stats['messages'] += 1
+        props = get_props(msg_path)
+        old_mdata = props.get("ManufacturerData")
+        props.update(changed)
+        mdata = changed.get("ManufacturerData")
+        if mdata and _mfdata_changed(old_mdata, mdata, mfids):
+            queue_put(msg_path, props)
+        else:
+            stats['unchanged'] += 1
+
 # -----------------------------------------------------------------------------
     def parse_msg(message):
         if message.member == "InterfacesAdded":
             logger.debug(f'>>> {message.member} {message.path}:{message.body}')
 
             msg_path = message.body[0]
-            try:
-                device_interface = message.body[1].get("org.bluez.Device1", {})
-            except Exception as e:
-                raise e
-            # store device
-            devices[msg_path] = ({**devices[msg_path], **device_interface} if msg_path in devices else device_interface)
-
-            # put BLEDevice object to the queue
-            logger.debug(f'>>> InterfacesAdded body:{msg_path}')
-            queue_put(msg_path)
+            device_interface = message.body[1].get(DEVICE_INTERFACE)
+            if device_interface is not None:
+                update(msg_path, device_interface)
         elif message.member == "PropertiesChanged":
             logger.debug(f'>>> {message.member} {message.path}:{message.body}')
             msg_path = message.path
             iface, changed, _ = message.body
             if iface != DEVICE_INTERFACE:
                 return
-
-            # store changed info
-            if msg_path not in devices and msg_path in cached_devices:
-               devices[msg_path] = cached_devices[msg_path]
-            devices[msg_path] = ({**devices[msg_path], **changed} if msg_path in devices else changed)
-
-            # put BLEDevice object to the queue
-            logger.debug(f'>>> PropertiesChanged body:{msg_path}')
-            queue_put(msg_path)
+            update(msg_path, changed)
         elif message.member == "InterfacesRemoved":
             logger.debug(f'>>> {message.member} {message.path}:{message.body}')
-            return
+            msg_path = message.body[0]
+            if DEVICE_INTERFACE in message.body[1]:
+                evict(msg_path)
+                cached_devices.pop(msg_path, None)
+                stats['devices'] = len(devices)
         else:
             msg_path = message.path
             logger.warning(
@@ -227,18 +300,15 @@ async def scanner(
             destination="org.bluez",
         ).asFuture(loop)
 
-        # Run Communication loop
+        # Devices are put to the outqueue by parse_msg, loop only forgets the old ones
         while not stopevent.is_set():
             try:
-                l_data = q.get_nowait()
-                if l_data and outqueue:
-                    await outqueue.put(l_data)
-            except queue.Empty:
-                try:
-                    await asyncio.sleep(0.1)
-                except asyncio.CancelledError:
-                    logger.warning(f'>>> CancelledError')
-                    break
+                await asyncio.wait_for(stopevent.wait(), SWEEP_INTERVAL)
+            except asyncio.TimeoutError:
+                evict_expired()
+            except asyncio.CancelledError:
+                logger.warning(f'>>> CancelledError')
+                break
             except:
                 logger.exception(f'>>> exception')
                 break
@@ -123,10 +123,10 @@ class influx_aioclient(_mixinQueue):
                     if self._dbcon:
                         l_item = await self.queue_get(inqueue=self._inqueue)
                         if l_item:
-                            if isinstance(l_item, dict):
-                                l_dict = l_item
-                            else:
+                            if isinstance(l_item, (str, bytes)):
                                 l_dict = json.loads(l_item)
+                            else:   # dict or ruuvi_item
+                                l_dict = l_item
                             try:
                                 l_func = l_dict['func']
                                 if l_func not in self._funcs:   # unknown func -> execute_default
@@ -452,6 +452,7 @@ class influx_aioclient(_mixinQueue):
                 if item.get('resend', None):
                     logger.debug(f'{self._name} jobid:{l_jobid} resending item:{item}')
                 # await self._dbcon.write(data=l_json, precision='s', rp=self._policy_name)
+                # ruuvi_points serialise themselves (to_lineprotocol), dicts by aioinflux
                 await self._dbcon.write(data=l_json, rp=self._policy_name)
                 logger.debug(f'{self._name} jobid:{l_jobid}')
                 return True
@@ -486,7 +487,11 @@ class influx_aioclient(_mixinQueue):
                 # rebuffer unsent data by putting it back to the queue
             if (l_rebuffer or l_reconnect) and _def.INFLUX_REBUFFER:
                 if self._inqueue:
-                    item['resend'] = True
+                    # ruuvi_item is shared by the sinks, rebuffered as a copy
+                    if hasattr(item, 'for_resend'):
+                        item = item.for_resend()
+                    else:
+                        item['resend'] = True
                     await self.queue_put(outqueue=self._inqueue, data=item)
                     logger.debug(f'{self._name} jobid:{l_jobid} rebuffer data:{item}')
 
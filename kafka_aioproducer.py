@@ -135,7 +135,7 @@ class kafka_aioproducer():
                     partition=partition,
                     timestamp_ms=timestamp_ms
                 )
-                logger.debug(f'{self._name} topic:{l_obj.topic:20} key:{key.decode():20} partition:{l_obj.partition}:{l_obj.offset}')
+                logger.debug(f'{self._name} topic:{l_obj.topic:20} key:{key} partition:{l_obj.partition}:{l_obj.offset}')
                 return True
             except asyncio.CancelledError:
                 logger.warning(f'''{self._name} CancelledError''')
@@ -451,10 +451,10 @@ class mqtt_aioclient(_mixinQueue):
                     # inqueue
                     l_item = await self.queue_get(inqueue=self._inqueue)
                     if l_item:
-                        if isinstance(l_item, dict):
-                            l_dict = l_item
-                        else:
+                        if isinstance(l_item, (str, bytes)):
                             l_dict = json.loads(l_item)
+                        else:   # dict or ruuvi_item
+                            l_dict = l_item
                         try:
                             l_func = l_dict['func']
                             if l_func not in self._funcs:   # unknown func -> execute_default
@@ -566,7 +566,10 @@ class mqtt_aioclient(_mixinQueue):
             l_rebuffer = True
 
         if (self._inqueue and l_rebuffer) and _def.MQTT_REBUFFER:
-            item['resend'] = True
+            if hasattr(item, 'for_resend'):
+                item = item.for_resend()
+            else:
+                item['resend'] = True
             await self.queue_put(outqueue=self._inqueue, data=item)
             logger.debug(f'{self._name} jobid:{l_jobid} rebuffer data:{item}')
 
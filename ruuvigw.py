@@ -29,6 +29,7 @@ import traceback
 from contextlib import suppress
 from json import JSONDecodeError
 from datetime import datetime as _dt, timedelta as _td
+import multiprocessing
 from multiprocessing import cpu_count
 
 from apscheduler.schedulers.asyncio import AsyncIOScheduler as _scheduler
@@ -36,6 +37,7 @@ from apscheduler.events import EVENT_ALL
 
 from mixinSchedulerEvent import mixinSchedulerEvent
 from ruuvigw_dataclasses import procItem, procDict
+from ruuvigw_ring import shm_ring, ring_queue, shard_queue
 from ruuvigw_config import config_reader as _config
 from ruuvigw_aioclient import ruuvi_aioclient as _ruuvi
 from ruuvigw_influx import ruuvi_influx as _influx
@@ -57,6 +59,9 @@ _CFGFILE = _def.CFGFILE
 # ==============================================================================
 class main_class(mixinSchedulerEvent):
     SLEEP_TIME = 1.0
+    SUPERVISE_INTERVAL = 1
+    STATS_INTERVAL = 60
+    WORKER_JOIN_TIMEOUT = 5.0
     _run = True
 #-------------------------------------------------------------------------------
     def __init__(self, *,
@@ -120,6 +125,22 @@ class main_class(mixinSchedulerEvent):
         # )
         self._loop = None
         self._tag = None
+
+        # process topology: collector, ruuvi and every sink in own process, connected by shm rings
+        self._topology = l_common.get('topology', _def.COMMON_TOPOLOGY)
+        if self._topology == 'process' and not hasattr(os, 'fork'):
+            logger.warning(f'topology:{self._topology} not supported by the platform, using single')
+            self._topology = 'single'
+        l_ruuvi = self._cfgh.get_cfg(section=_def.KEY_RUUVI) or {}
+        if self._topology != 'process' and l_ruuvi.get('shards', _def.RUUVI_SHARDS) > 1:
+            logger.warning(f'''[{_def.KEY_RUUVI}] shards:{l_ruuvi.get('shards')} requires topology:process, using one''')
+        self._worker = None         # component run by this worker process
+        self._components = {}       # component name: start method
+        self._bases = {}            # component name: configured name (ruuvi shards share it)
+        self._rings = {}            # consumer name: {producer name: shm_ring}
+        self._restarts = {}         # component name: [restarts, last start]
+        self._stopping = False
+        self._ring_stats = {}
         # self._fbqueue = asyncio.Queue(maxsize=_def.COMMON_FBQUEUE_SIZE)
 
 #-------------------------------------------------------------------------------
@@ -143,14 +164,17 @@ class main_class(mixinSchedulerEvent):
             logger.warning('registering signals failed')
             pass
 
-        l_influx = self._start_influx()
-        l_mqtt = self._start_mqtt()
-        l_kafka = self._start_kafka()
-        if not l_influx and not l_mqtt and not l_kafka:
-            self._run = False
-            logger.critical(f'Starting INFLUX, MQTT and KAFKA failed. Check logs and configuration !')
-        self._run = self._start_ruuvi()
-        self._run = self._start_ruuvitag()
+        if self._topology == 'process':
+            self._run = self._start_workers()
+        else:
+            l_influx = self._start_influx()
+            l_mqtt = self._start_mqtt()
+            l_kafka = self._start_kafka()
+            if not l_influx and not l_mqtt and not l_kafka:
+                self._run = False
+                logger.critical(f'Starting INFLUX, MQTT and KAFKA failed. Check logs and configuration !')
+            self._run = self._start_ruuvi()
+            self._run = self._start_ruuvitag()
         if self._run:
             try:
                 self._loop.run_forever()
@@ -163,9 +187,241 @@ class main_class(mixinSchedulerEvent):
                 self._scheduler.shutdown()
                 logger.info(f'shutdown tasks')
                 self._shutdown()
+                self._shutdown_workers()
 
         logger.info(f'stopped:{str(_dt.now())}')
 
+#-------------------------------------------------------------------------------
+    def _runs_here(self, *, name):
+        """ Returns True if the component is started in this process """
+        return (self._worker is None) or (self._bases.get(self._worker, self._worker) == name)
+
+#-------------------------------------------------------------------------------
+    def _new_queue(self, *, name, maxsize):
+        """ Returns input queue of the component, in the worker process the shm ring(s) of it """
+        if self._worker:
+            return ring_queue(rings=list(self._rings[self._worker].values()))
+        return asyncio.Queue(maxsize=maxsize)
+
+#-------------------------------------------------------------------------------
+    def _get_components(self):
+        """
+        Returns enabled components {name: start method}, sinks first
+        Ruuvi with shards > 1 is one component per shard: name#0, name#1, ...
+        """
+        l_components = {}
+        self._bases = {}
+        for (l_key, l_default_name, l_default_enable, l_start) in (
+            (_def.KEY_INFLUX, _def.INFLUX_NAME, _def.INFLUX_ENABLE, self._start_influx),
+            (_def.KEY_MQTT, _def.MQTT_NAME, _def.MQTT_ENABLE, self._start_mqtt),
+            (_def.KEY_KAFKA_PRODUCER, _def.KAFKA_NAME, _def.KAFKA_ENABLE, self._start_kafka)
+        ):
+            for l_cfg in (self._cfgh.get_cfg(section=l_key) or []):
+                if l_cfg.get('enable', l_default_enable):
+                    l_components[l_cfg.get('name', l_default_name)] = l_start
+        l_ruuvi = self._cfgh.get_cfg(section=_def.KEY_RUUVI)
+        if l_ruuvi:
+            l_name = l_ruuvi.get('name', _def.RUUVI_NAME)
+            l_shards = int(l_ruuvi.get('shards', _def.RUUVI_SHARDS))
+            if l_shards > 1:
+                for l_idx in range(l_shards):
+                    l_components[f'{l_name}#{l_idx}'] = self._start_ruuvi
+                    self._bases[f'{l_name}#{l_idx}'] = l_name
+            else:
+                l_components[l_name] = self._start_ruuvi
+        l_ruuvitag = self._cfgh.get_cfg(section=_def.KEY_RUUVITAG)
+        if l_ruuvitag:
+            l_components[l_ruuvitag.get('name', _def.RUUVITAG_NAME)] = self._start_ruuvitag
+        for l_name in l_components.keys():
+            self._bases.setdefault(l_name, l_name)
+        return l_components
+
+#-------------------------------------------------------------------------------
+    def _get_rings(self):
+        """ Returns all shm rings """
+        return [l_ring for l_rings in self._rings.values() for l_ring in l_rings.values()]
+
+#-------------------------------------------------------------------------------
+    def _start_workers(self):
+        """
+        Starts every component in its own process
+        Rings are created before the workers are forked, one per producer and consumer
+        so every ring has a single producer. Ruuvi shards get the samples of their
+        own tags, sinks have a ring from every shard.
+        """
+        logger.debug('enter')
+
+        if not self._run:
+            return False
+
+        l_common = self._cfgh.get_cfg(section=_def.KEY_COMMON)
+        l_size = int(l_common.get('ring_size', _def.COMMON_RING_SIZE)) * 1024
+        self._components = self._get_components()
+        l_tags = [l_name for (l_name, l_start) in self._components.items() if l_start == self._start_ruuvitag]
+        l_ruuvis = [l_name for (l_name, l_start) in self._components.items() if l_start == self._start_ruuvi]
+        for (l_name, l_start) in self._components.items():
+            if l_start == self._start_ruuvitag:
+                continue
+            l_producers = (l_tags if l_start == self._start_ruuvi else l_ruuvis) or ['']
+            self._rings[l_name] = {
+                l_producer: shm_ring(name=(f'{l_name}<{l_producer}' if len(l_producers) > 1 else l_name), size=l_size)
+                for l_producer in l_producers
+            }
+        logger.info(f'topology:{self._topology} rings:{[l_ring.name for l_ring in self._get_rings()]} size:{l_size}')
+
+        for l_name in self._components.keys():
+            self._restarts[l_name] = [0, 0.0]
+            self._start_worker(name=l_name)
+
+        for (l_jobid, l_func, l_interval) in (
+            ('workers_supervise', self._do_supervise, self.SUPERVISE_INTERVAL),
+            ('workers_stats', self._do_ring_stats, self.STATS_INTERVAL)
+        ):
+            try:
+                self._scheduler.add_job(
+                    l_func,
+                    'interval',
+                    seconds = l_interval,
+                    kwargs = {
+                        'jobid': l_jobid
+                    },
+                    id = l_jobid,
+                    replace_existing = True,
+                    max_instances = 1,
+                    coalesce = True,
+                    next_run_time = _dt.now()+_td(seconds=l_interval)
+                )
+                logger.info(f'jobid:{l_jobid} scheduled')
+            except:
+                logger.exception(f'*** jobid:{l_jobid}')
+
+        return bool(self._procs.procs)
+
+#-------------------------------------------------------------------------------
+    def _start_worker(self, *, name):
+        try:
+            l_proc = multiprocessing.get_context('fork').Process(
+                target=self._worker_main,
+                kwargs={'name': name},
+                name=name,
+                daemon=True
+            )
+            l_proc.start()
+            self._restarts[name][1] = time.monotonic()
+            l_rings = self._rings.get(name, None)
+            self._procs.add(name, procItem(proc=l_proc, queue=ring_queue(rings=list(l_rings.values())) if l_rings else None, task=None))
+            logger.info(f'worker:{name} pid:{l_proc.pid} started')
+        except:
+            logger.exception(f'*** worker:{name}')
+
+#-------------------------------------------------------------------------------
+    def _worker_main(self, *, name):
+        """
+        Worker process, runs one component in its own loop
+        Queues of the other components are the shm rings this worker produces to,
+        ruuvi shards are behind one shard_queue routing by mac
+        """
+        # forked from the running parent loop, its signal wakeup fd is shared
+        signal.set_wakeup_fd(-1)
+        for l_signame in ('SIGINT', 'SIGTERM'):
+            signal.signal(getattr(signal, l_signame), signal.SIG_DFL)
+
+        self._worker = name
+        self._loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self._loop)
+        l_common = self._cfgh.get_cfg(section=_def.KEY_COMMON)
+        self._scheduler = _scheduler(
+            event_loop = self._loop,
+            max_instances = l_common.get('scheduler_instances', _def.COMMON_SCHEDULER_INSTANCES)
+        )
+        self._scheduler.add_listener(self._job_event, mask=EVENT_ALL)
+        self._procs = procDict()
+        l_outqueues = {}
+        for (l_name, l_rings) in self._rings.items():
+            if l_name != name and name in l_rings:
+                l_outqueues.setdefault(self._bases[l_name], []).append(ring_queue(rings=[l_rings[name]]))
+        for (l_name, l_queues) in l_outqueues.items():
+            l_queue = l_queues[0] if len(l_queues) == 1 else shard_queue(queues=l_queues)
+            self._procs.add(l_name, procItem(proc=None, queue=l_queue, task=None))
+        for l_signame in ('SIGINT', 'SIGTERM'):
+            self._loop.add_signal_handler(
+                getattr(signal, l_signame),
+                functools.partial(self._stop, l_signame)
+            )
+
+        logger.info(f'worker:{name} pid:{os.getpid()} starting')
+        self._scheduler.start()
+        if self._components[name]():
+            try:
+                self._loop.run_forever()
+            except (KeyboardInterrupt, SystemExit):
+                logger.warning(f'worker:{name} KeyboardInterrupt/SystemExit')
+            except:
+                logger.exception(f'worker:{name} exception')
+            finally:
+                self._scheduler.shutdown()
+                self._shutdown()
+        else:
+            logger.critical(f'worker:{name} start failed')
+            sys.exit(1)
+        logger.info(f'worker:{name} stopped')
+
+#-------------------------------------------------------------------------------
+    async def _do_supervise(self, *,
+        jobid
+    ):
+        """
+        Restarts crashed workers, restart_delay sec after the previous start at the earliest
+        """
+        if self._stopping:
+            return
+        l_common = self._cfgh.get_cfg(section=_def.KEY_COMMON)
+        l_delay = l_common.get('restart_delay', _def.COMMON_RESTART_DELAY)
+        for (l_name, l_item) in list(self._procs.procs.items()):
+            l_proc = l_item.proc
+            if not l_proc or l_proc.is_alive():
+                continue
+            l_restart = self._restarts[l_name]
+            if (time.monotonic() - l_restart[1]) < l_delay:
+                continue
+            l_restart[0] += 1
+            logger.error(f'jobid:{jobid} worker:{l_name} pid:{l_proc.pid} exitcode:{l_proc.exitcode} restart:{l_restart[0]}')
+            l_proc.join(timeout=0)
+            self._start_worker(name=l_name)
+
+#-------------------------------------------------------------------------------
+    async def _do_ring_stats(self, *,
+        jobid
+    ):
+        """
+        Logs ring statistics since the previous stats interval
+        dropped are records the producer could not write because the consumer did not keep up
+        """
+        for (l_name, l_rings) in self._rings.items():
+            for l_ring in l_rings.values():
+                l_stats = l_ring.stats()
+                l_prev = self._ring_stats.get(l_ring.name, {})
+                self._ring_stats[l_ring.name] = l_stats
+                logger.info(f'''jobid:{jobid} ring:{l_ring.name} written:{l_stats['written']-l_prev.get('written', 0)} read:{l_stats['read']-l_prev.get('read', 0)} dropped:{l_stats['dropped']-l_prev.get('dropped', 0)} pending:{l_stats['pending']} used:{l_stats['used']}/{l_stats['size']} restarts:{self._restarts[l_name][0]}''')
+
+#-------------------------------------------------------------------------------
+    def _shutdown_workers(self):
+        """ Stops the worker processes """
+        if self._worker or self._topology != 'process':
+            return
+        self._stopping = True
+        l_procs = [l_item.proc for l_item in self._procs.procs.values() if l_item.proc]
+        for l_proc in l_procs:
+            if l_proc.is_alive():
+                logger.info(f'stop worker:{l_proc.name} pid:{l_proc.pid}')
+                l_proc.terminate()
+        for l_proc in l_procs:
+            l_proc.join(timeout=self.WORKER_JOIN_TIMEOUT)
+            if l_proc.is_alive():
+                logger.warning(f'kill worker:{l_proc.name} pid:{l_proc.pid}')
+                l_proc.kill()
+                l_proc.join()
+
 #-------------------------------------------------------------------------------
     def _stop(self, signame):
         logger.info(f'signame:{signame}')
@@ -187,9 +443,11 @@ class main_class(mixinSchedulerEvent):
         if l_influxs:
             for l_influx in l_influxs:
                 l_name = l_influx.get('name', _def.INFLUX_NAME)
+                if not self._runs_here(name=l_name):
+                    continue
                 if l_influx.get('enable', _def.INFLUX_ENABLE):
                     try:
-                        l_inqueue = asyncio.Queue(maxsize=l_influx.get('queue_size', _def.INFLUX_QUEUE_SIZE))
+                        l_inqueue = self._new_queue(name=l_name, maxsize=l_influx.get('queue_size', _def.INFLUX_QUEUE_SIZE))
                         l_proc = _influx(
                             cfg = l_influx,
                             hostname = l_common.get('hostname', _def.COMMON_HOSTNAME),
@@ -223,9 +481,11 @@ class main_class(mixinSchedulerEvent):
         if l_mqtts:
             for l_mqtt in l_mqtts:
                 l_name = l_mqtt.get('name', _def.MQTT_NAME)
+                if not self._runs_here(name=l_name):
+                    continue
                 if l_mqtt.get('enable', _def.MQTT_ENABLE):
                     try:
-                        l_inqueue = asyncio.Queue(maxsize=l_mqtt.get('queue_size', _def.MQTT_QUEUE_SIZE))
+                        l_inqueue = self._new_queue(name=l_name, maxsize=l_mqtt.get('queue_size', _def.MQTT_QUEUE_SIZE))
                         l_proc = _mqtt(
                             cfg = l_mqtt,
                             hostname = l_common.get('hostname', _def.COMMON_HOSTNAME),
@@ -259,9 +519,11 @@ class main_class(mixinSchedulerEvent):
         if l_kafkas:
             for l_kafka in l_kafkas:
                 l_name = l_kafka.get('name', _def.KAFKA_NAME)
+                if not self._runs_here(name=l_name):
+                    continue
                 if l_kafka.get('enable', _def.KAFKA_ENABLE):
                     try:
-                        l_inqueue = asyncio.Queue(maxsize=l_kafka.get('queue_size', _def.KAFKA_QUEUE_SIZE))
+                        l_inqueue = self._new_queue(name=l_name, maxsize=l_kafka.get('queue_size', _def.KAFKA_QUEUE_SIZE))
                         l_proc = _kafka(
                             loop = self._loop,
                             cfg = l_kafka,
@@ -299,7 +561,7 @@ class main_class(mixinSchedulerEvent):
                 logger.debug(f'outqueues:{l_outqueues}')
                 try:
                     l_name = l_ruuvi.get('name', _def.RUUVI_NAME)
-                    l_inqueue = asyncio.Queue(maxsize=l_ruuvi.get('queue_size', _def.RUUVI_QUEUE_SIZE))
+                    l_inqueue = self._new_queue(name=l_name, maxsize=l_ruuvi.get('queue_size', _def.RUUVI_QUEUE_SIZE))
                     l_proc = _ruuvi(
                         cfg = l_ruuvi,
                         hostname = l_common.get('hostname', _def.COMMON_HOSTNAME),
@@ -344,6 +606,7 @@ class main_class(mixinSchedulerEvent):
                     whtlist = l_ruuvitag.get('WHTLIST', None),
                     blklist = l_ruuvitag.get('BLKLIST', None),
                     adjustment = l_ruuvitag.get('ADJUSTMENT', None),
+                    keys = l_ruuvitag.get('KEYS', None),
                     tags = l_ruuvitag.get('TAGS', None),
                     sample_interval = l_ruuvitag.get('sample_interval', _def.RUUVITAG_SAMPLE_INTERVAL),
                     calc = l_ruuvitag.get('calc', _def.RUUVITAG_CALC),
@@ -353,7 +616,35 @@ class main_class(mixinSchedulerEvent):
                     device_reset = l_ruuvitag.get('device_reset', _def.RUUVITAG_DEVICE_RESET),
                     whtlist_from_tags = l_ruuvitag.get('whtlist_from_tags', _def.RUUVITAG_WHTLIST_FROM_TAGS),
                     minmax = l_ruuvitag.get('MINMAX', _def.RUUVITAG_MINMAX),
-                    device = l_ruuvitag.get('device', _def.RUUVITAG_DEVICE)
+                    device = l_ruuvitag.get('device', _def.RUUVITAG_DEVICE),
+                    recv_batch = l_ruuvitag.get('recv_batch', _def.RUUVITAG_RECV_BATCH),
+                    ingest_thread = l_ruuvitag.get('ingest_thread', _def.RUUVITAG_INGEST_THREAD),
+                    ingest_ring = l_ruuvitag.get('ingest_ring', _def.RUUVITAG_INGEST_RING),
+                    bpf_filter = l_ruuvitag.get('bpf_filter', _def.RUUVITAG_BPF_FILTER),
+                    bpf_whtlist = l_ruuvitag.get('bpf_whtlist', _def.RUUVITAG_BPF_WHTLIST),
+                    accept_list = l_ruuvitag.get('accept_list', _def.RUUVITAG_ACCEPT_LIST),
+                    scan_type = l_ruuvitag.get('scan_type', _def.RUUVITAG_SCAN_TYPE),
+                    scan_interval = l_ruuvitag.get('scan_interval', _def.RUUVITAG_SCAN_INTERVAL),
+                    scan_window = l_ruuvitag.get('scan_window', _def.RUUVITAG_SCAN_WINDOW),
+                    scan_adaptive = l_ruuvitag.get('scan_adaptive', _def.RUUVITAG_SCAN_ADAPTIVE),
+                    devices = l_ruuvitag.get('devices', _def.RUUVITAG_DEVICES),
+                    merge_hold = l_ruuvitag.get('merge_hold', _def.RUUVITAG_MERGE_HOLD),
+                    seq_dedup = l_ruuvitag.get('seq_dedup', _def.RUUVITAG_SEQ_DEDUP),
+                    seq_table_size = l_ruuvitag.get('seq_table_size', _def.RUUVITAG_SEQ_TABLE_SIZE),
+                    memo_size = l_ruuvitag.get('memo_size', _def.RUUVITAG_MEMO_SIZE),
+                    fields = self._cfgh.decode_fields(),
+                    record = l_ruuvitag.get('record', _def.RUUVITAG_RECORD),
+                    record_size = l_ruuvitag.get('record_size', _def.RUUVITAG_RECORD_SIZE),
+                    record_files = l_ruuvitag.get('record_files', _def.RUUVITAG_RECORD_FILES),
+                    replay_file = l_ruuvitag.get('replay_file', _def.RUUVITAG_REPLAY_FILE),
+                    replay_speed = l_ruuvitag.get('replay_speed', _def.RUUVITAG_REPLAY_SPEED),
+                    replay_loops = l_ruuvitag.get('replay_loops', _def.RUUVITAG_REPLAY_LOOPS),
+                    synth_tags = l_ruuvitag.get('synth_tags', _def.RUUVITAG_SYNTH_TAGS),
+                    synth_rate = l_ruuvitag.get('synth_rate', _def.RUUVITAG_SYNTH_RATE),
+                    synth_df3 = l_ruuvitag.get('synth_df3', _def.RUUVITAG_SYNTH_DF3),
+                    synth_rebroadcasts = l_ruuvitag.get('synth_rebroadcasts', _def.RUUVITAG_SYNTH_REBROADCASTS),
+                    # samples are passed by reference (ring encodes sample.asdict()), no json between the tasks
+                    outsample = True
                 )
                 # start ruuvitag task
                 l_task = self._loop.create_task(l_proc.run())
@@ -17,8 +17,10 @@ from collections import defaultdict
 
 from mixinQueue import mixinAioQueue as _mixinQueue
 from mixinSchedulerEvent import mixinSchedulerEvent
-from aioruuvitag.ruuvitag_misc import get_ms as _get_ms
+from aioruuvitag.ruuvitag_misc import get_ms as _get_ms, int_to_mac
 from aioruuvitag.ruuvitag_calc import ruuvitag_calc as _tagcalc
+from aioruuvitag.ruuvitag_sample import ruuvitag_sample
+from ruuvigw_item import ruuvi_item, ruuvi_point
 import ruuvigw_defaults as _def
 
 #===============================================================================
@@ -201,13 +203,13 @@ class ruuvi_aioclient(_mixinQueue, mixinSchedulerEvent):
                         if abs(l_now-l_lasttime) > self._write_lastdata_int:
                             if not self._write_lastdata_cnt or l_xcnt < self._write_lastdata_cnt:
                                 # if write_lastdata_cnt forver or l_xcnt < write_lastdata_cnt 
-                                if 'time' in l_datas: # delete time from datas - will be set to utcnow byt _get_json
-                                    del l_datas['time'] 
-                                l_fdata = json.dumps({
-                                    'func': self._func,
-                                    'jobid': f'{l_measurname}_lastdata',
-                                    'json': await self._get_json(measur=l_measur, mac=l_mac, datas=l_datas, reason='lastdata:'+str(l_xcnt), lasttime=l_lasttime)
-                                })
+                                # sample without time - will be set to utcnow by _get_json
+                                l_datas = l_datas.without_time()
+                                l_fdata = ruuvi_item(
+                                    func=self._func,
+                                    jobid=f'{l_measurname}_lastdata',
+                                    json=await self._get_json(measur=l_measur, mac=l_mac, datas=l_datas, reason='lastdata:'+str(l_xcnt), lasttime=l_lasttime)
+                                )
                                 await self._update_lastdata(measur=l_measur, mac=l_mac, xtime=(l_lasttime + self._write_lastdata_int), datas=l_datas, reason='lastdata', xcnt=(l_xcnt+1)) # ycnt=0
                                 await self._queue_output(measur=l_measur, datas=l_fdata)
                                 logger.debug(f'{self._name} {l_measurname} {l_mac} {l_tagname} cnt:{l_xcnt} data:{l_fdata}')
@@ -413,24 +415,21 @@ class ruuvi_aioclient(_mixinQueue, mixinSchedulerEvent):
             logger.debug(f'{self._name} {l_measurname} {mac} {l_tagname} fields empty')
             return None
 
-        l_debugs = await self._get_debugs(measur=measur, mac=mac, reason=reason, datas=datas, tagdatas=tagdatas, lasttime=lasttime)
-        if l_debugs:
-            l_fields = {**l_fields, **l_debugs}
-        l_calcs = await self._get_calcs(measur=measur, mac=mac, datas=datas)
-        if l_calcs:
-            l_fields = {**l_fields, **l_calcs}
+        # l_fields is a new dict, updated in place
+        l_fields.update(await self._get_debugs(measur=measur, mac=mac, reason=reason, datas=datas, tagdatas=tagdatas, lasttime=lasttime))
+        l_fields.update(await self._get_calcs(measur=measur, mac=mac, datas=datas))
 
         l_json = [
-            {
-                "measurement": measur.get('name', _def.RUUVI_NAME),
-                "tags": {
-                    "mac": mac,
+            ruuvi_point(
+                measurement=measur.get('name', _def.RUUVI_NAME),
+                tags={
+                    "mac": int_to_mac(mac),
                     "name": l_tagname,
                     "dataFormat": str(self._field_value(measur=measur, field='_df', datas=datas)),
                     "hostname": self._hostname
                 },
-                "fields": l_fields
-            }
+                fields=l_fields
+            )
         ]
 
         logger.debug(f'{self._name} {l_measurname} {mac} {l_tagname} json:{l_json}')
@@ -443,21 +442,25 @@ class ruuvi_aioclient(_mixinQueue, mixinSchedulerEvent):
             return
 
         try:
-            l_dict = json.loads(indata)
-            l_mac = l_dict['mac']
-            l_datas = l_dict['datas']
-            l_tagdatas = l_dict.get('_aioruuvitag', None)
+            # ruuvitag_sample by reference, dict from the shm ring of the process topology, json string from the older collectors
+            if isinstance(indata, ruuvitag_sample):
+                l_datas = indata
+            else:
+                l_datas = ruuvitag_sample.from_outdata(indata if isinstance(indata, dict) else json.loads(indata))
+            l_mac = l_datas.mac
+            l_tagdatas = l_datas.debug
             l_tagname = l_datas['tagname']
             for l_measur in self._meas:
                 l_measurname = l_measur.get('name', _def.RUUVI_NAME)
                 logger.debug(f'{self._name} {l_measurname} {l_mac} {l_tagname} datas:{l_datas}')
                 (l_status, l_reason, l_lasttime) = await self._is_diff(measur=l_measur, mac=l_mac, datas=l_datas)
                 if l_status:
-                    l_fdata = {
-                        'func': self._func,
-                        'jobid': l_measurname,
-                        'json': await self._get_json(measur=l_measur, mac=l_mac, datas=l_datas, reason=l_reason, tagdatas=l_tagdatas, lasttime=l_lasttime)
-                    }
+                    # one immutable item shared by the sinks of the measurement
+                    l_fdata = ruuvi_item(
+                        func=self._func,
+                        jobid=l_measurname,
+                        json=await self._get_json(measur=l_measur, mac=l_mac, datas=l_datas, reason=l_reason, tagdatas=l_tagdatas, lasttime=l_lasttime)
+                    )
                     await self._queue_output(measur=l_measur, datas=l_fdata)
                     logger.debug(f'{self._name} {l_measurname} {l_mac} {l_tagname} fdata:{l_fdata}')
                 # else:
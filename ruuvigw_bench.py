@@ -0,0 +1,749 @@
+# coding=utf-8
+# !/usr/bin/python3
+# Name:         ruuvigw_bench - end-to-end throughput and latency benchmark
+# Copyright:    (c) 2020 TK
+# Licence:      MIT
+#
+# python3 ruuvigw_bench.py [--collector synth|replay|emulator] [--tags 2000] [--rate 1000] [--duration 60] [--output bench.json]
+#
+# Runs the real main_class pipeline
+#   collector --> aioruuvitag_ble --> ruuvi_aioclient --> ruuvi_influx / ruuvi_mqtt / ruuvigw_kafka
+# against in-process stand-ins listening on the loopback:
+#   bench_influx    InfluxDB 1.x HTTP API (/ping, /query, /write)
+#   bench_mqtt      MQTT 3.1.1 broker (qos 0, 1 and 2 publish, subscribe, ping)
+#   bench_kafka     Kafka broker (ApiVersions, Metadata v0-v1, Produce v0-v2)
+# Packets come from the synth collector (virtual tags), the replay collector
+# (btsnoop or hcidump capture) or the socket collector with the emulated HCI
+# device (virtual tags, Linux).
+#
+# Radio-to-sink latency is the time from the reception of the advertisement
+# (the 'time' field of the sample) to the arrival of the sample at the stand-in.
+# The stand-ins run in the same process, cpu time includes them.
+# Measurement starts after the warmup (sinks connected, queues filled).
+# Results are written as json (--output, default stdout), everything else
+# goes to stderr.
+# -------------------------------------------------------------------------------
+import os
+import re
+import sys
+import json
+import time
+import socket
+import struct
+import asyncio
+import argparse
+import platform
+import tempfile
+import contextlib
+from datetime import datetime as _dt
+
+try:
+    import resource
+except ImportError:     # Windows
+    resource = None
+
+from aiohttp import web
+
+# defaults print the log config file name, results json is the only stdout output
+with contextlib.redirect_stdout(sys.stderr):
+    import ruuvigw_defaults as _def
+from aioruuvitag.ruuvitag_misc import int_to_mac
+from aioruuvitag.aioruuvitag_synth import SYNTH_MAC_BASE
+from aioruuvitag.aioruuvitag_replay import ruuvitag_replay
+from aioruuvitag.ruuvitag_decode import ruuvitag_decode
+
+BENCH_HOST          = '127.0.0.1'
+BENCH_SINKS         = ['influx', 'mqtt', 'kafka']
+
+MQTT_CONNECT        = 1
+MQTT_PUBLISH        = 3
+MQTT_PUBREL         = 6
+MQTT_SUBSCRIBE      = 8
+MQTT_UNSUBSCRIBE    = 10
+MQTT_PINGREQ        = 12
+MQTT_DISCONNECT     = 14
+
+KAFKA_PRODUCE       = 0
+KAFKA_METADATA      = 3
+KAFKA_API_VERSIONS  = 18
+KAFKA_APIS          = {                 # api key: (min version, max version)
+    KAFKA_PRODUCE:      (0, 2),
+    KAFKA_METADATA:     (0, 1),
+    KAFKA_API_VERSIONS: (0, 0)
+}
+KAFKA_NODE_ID       = 0
+
+# -------------------------------------------------------------------------------
+def _listen_socket():
+    """ Returns socket bound to the free loopback port """
+    l_sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    l_sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    l_sock.bind((BENCH_HOST, 0))
+    return l_sock
+
+# -------------------------------------------------------------------------------
+def _percentiles(*, values):
+    """ Returns p50/p99/max (ms) of the latencies (sec) """
+    if not values:
+        return {'count': 0, 'p50': None, 'p99': None, 'max': None}
+    l_sorted = sorted(values)
+    l_last = len(l_sorted) - 1
+    return {
+        'count': len(l_sorted),
+        'p50': round(l_sorted[int(round(0.50 * l_last))] * 1000, 3),
+        'p99': round(l_sorted[int(round(0.99 * l_last))] * 1000, 3),
+        'max': round(l_sorted[l_last] * 1000, 3)
+    }
+
+# ===============================================================================
+class bench_sink(object):
+    """ Counts the received samples and their radio-to-sink latency """
+    _time_re = re.compile(rb'time(?:=|"\s*:\s*)"([0-9T:.+\-]+)"')
+# -------------------------------------------------------------------------------
+    def __init__(self, *, name):
+        self.name = name
+        self.port = None
+        self._server = None
+        self.reset()
+
+# -------------------------------------------------------------------------------
+    def reset(self):
+        self.samples = 0        # payloads with the sample time
+        self.other = 0          # other payloads (announcements, lwt, ...)
+        self.latencies = []
+
+# -------------------------------------------------------------------------------
+    def _sample(self, *, payload):
+        l_now = time.time()
+        l_match = self._time_re.search(payload)
+        if not l_match:
+            self.other += 1
+            return
+        try:
+            l_ts = _dt.strptime(l_match.group(1).decode(), _def.RUUVI_TIMEFMT).timestamp()
+        except ValueError:
+            self.other += 1
+            return
+        self.samples += 1
+        self.latencies.append(l_now - l_ts)
+
+# -------------------------------------------------------------------------------
+    def stats(self, *, elapsed):
+        return {
+            'port': self.port,
+            'samples': self.samples,
+            'samples_per_sec': round(self.samples / elapsed, 1),
+            'other': self.other,
+            'latency_ms': _percentiles(values=self.latencies)
+        }
+
+# -------------------------------------------------------------------------------
+    async def _start_server(self, *, handler):
+        l_sock = _listen_socket()
+        self.port = l_sock.getsockname()[1]
+        self._server = await asyncio.start_server(handler, sock=l_sock)
+
+# -------------------------------------------------------------------------------
+    async def stop(self):
+        if self._server:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+# ===============================================================================
+class bench_influx(bench_sink):
+    """ InfluxDB 1.x HTTP API stand-in """
+# -------------------------------------------------------------------------------
+    def __init__(self, *, name, database):
+        super().__init__(name=name)
+        self._database = database
+        self._runner = None
+
+# -------------------------------------------------------------------------------
+    async def start(self):
+        l_app = web.Application()
+        l_app.router.add_route('*', '/ping', self._ping)
+        l_app.router.add_route('*', '/query', self._query)
+        l_app.router.add_route('POST', '/write', self._write)
+        self._runner = web.AppRunner(l_app, access_log=None)
+        await self._runner.setup()
+        l_sock = _listen_socket()
+        self.port = l_sock.getsockname()[1]
+        await web.SockSite(self._runner, l_sock).start()
+
+# -------------------------------------------------------------------------------
+    async def stop(self):
+        if self._runner:
+            await self._runner.cleanup()
+            self._runner = None
+
+# -------------------------------------------------------------------------------
+    async def _ping(self, request):
+        return web.Response(status=204, headers={'X-Influxdb-Version': 'ruuvigw_bench'})
+
+# -------------------------------------------------------------------------------
+    async def _query(self, request):
+        l_query = request.query.get('q', None)
+        if l_query is None:
+            l_query = (await request.post()).get('q', '')
+        l_query = l_query.strip().upper()
+        if l_query.startswith('SHOW DATABASES'):
+            l_series = [{'name': 'databases', 'columns': ['name'], 'values': [[self._database]]}]
+        elif l_query.startswith('SHOW RETENTION POLICIES'):
+            l_series = [{'columns': ['name', 'duration', 'shardGroupDuration', 'replicaN', 'default'], 'values': [['autogen', '0s', '168h0m0s', 1, True]]}]
+        else:
+            l_series = None
+        l_result = {'statement_id': 0}
+        if l_series:
+            l_result['series'] = l_series
+        return web.json_response({'results': [l_result]})
+
+# -------------------------------------------------------------------------------
+    async def _write(self, request):
+        for l_line in (await request.read()).splitlines():
+            if l_line:
+                self._sample(payload=l_line)
+        return web.Response(status=204)
+
+# ===============================================================================
+class bench_mqtt(bench_sink):
+    """ MQTT 3.1.1 broker stand-in, publishes are acknowledged and counted, not routed """
+# -------------------------------------------------------------------------------
+    async def start(self):
+        await self._start_server(handler=self._client)
+
+# -------------------------------------------------------------------------------
+    async def _client(self, reader, writer):
+        try:
+            while True:
+                l_hdr = (await reader.readexactly(1))[0]
+                l_len = 0
+                l_mult = 1
+                while True:
+                    l_byte = (await reader.readexactly(1))[0]
+                    l_len += (l_byte & 0x7F) * l_mult
+                    l_mult *= 128
+                    if not l_byte & 0x80:
+                        break
+                l_body = await reader.readexactly(l_len) if l_len else b''
+                l_type = l_hdr >> 4
+                if l_type == MQTT_PUBLISH:
+                    l_qos = (l_hdr >> 1) & 0x03
+                    l_off = 2 + ((l_body[0] << 8) | l_body[1])
+                    l_pid = l_body[l_off:l_off+2]
+                    if l_qos:
+                        l_off += 2
+                    self._sample(payload=l_body[l_off:])
+                    if l_qos == 1:
+                        writer.write(b'\x40\x02' + l_pid)       # PUBACK
+                    elif l_qos == 2:
+                        writer.write(b'\x50\x02' + l_pid)       # PUBREC
+                elif l_type == MQTT_PUBREL:
+                    writer.write(b'\x70\x02' + l_body[:2])      # PUBCOMP
+                elif l_type == MQTT_CONNECT:
+                    writer.write(b'\x20\x02\x00\x00')           # CONNACK accepted
+                elif l_type == MQTT_SUBSCRIBE:
+                    l_granted = bytearray()
+                    l_off = 2
+                    while l_off + 2 < len(l_body):
+                        l_off += 2 + ((l_body[l_off] << 8) | l_body[l_off+1])
+                        l_granted.append(l_body[l_off] & 0x03)
+                        l_off += 1
+                    writer.write(bytes([0x90, 2+len(l_granted)]) + l_body[:2] + l_granted)     # SUBACK
+                elif l_type == MQTT_UNSUBSCRIBE:
+                    writer.write(b'\xb0\x02' + l_body[:2])      # UNSUBACK
+                elif l_type == MQTT_PINGREQ:
+                    writer.write(b'\xd0\x00')                   # PINGRESP
+                elif l_type == MQTT_DISCONNECT:
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+# ===============================================================================
+class bench_kafka(bench_sink):
+    """
+    Kafka broker stand-in, single node, every topic has one partition
+    Advertised api versions make the client to use 0.10.0 protocol (message format v1)
+    """
+# -------------------------------------------------------------------------------
+    def __init__(self, *, name):
+        super().__init__(name=name)
+        self._topics = {}       # topic: next offset
+
+# -------------------------------------------------------------------------------
+    async def start(self):
+        await self._start_server(handler=self._client)
+
+# -------------------------------------------------------------------------------
+    @staticmethod
+    def _string(*, value):
+        if value is None:
+            return struct.pack('>h', -1)
+        l_value = value.encode()
+        return struct.pack('>h', len(l_value)) + l_value
+
+# -------------------------------------------------------------------------------
+    @staticmethod
+    def _read_string(*, data, offset):
+        (l_len,) = struct.unpack_from('>h', data, offset)
+        offset += 2
+        if l_len < 0:
+            return (None, offset)
+        return (bytes(data[offset:offset+l_len]).decode(), offset+l_len)
+
+# -------------------------------------------------------------------------------
+    def _api_versions(self, *, version, body):
+        l_out = [struct.pack('>hi', 0, len(KAFKA_APIS))]
+        for l_key, (l_min, l_max) in KAFKA_APIS.items():
+            l_out.append(struct.pack('>hhh', l_key, l_min, l_max))
+        return b''.join(l_out)
+
+# -------------------------------------------------------------------------------
+    def _metadata(self, *, version, body):
+        (l_cnt,) = struct.unpack_from('>i', body, 0)
+        l_off = 4
+        for _ in range(max(l_cnt, 0)):
+            (l_topic, l_off) = self._read_string(data=body, offset=l_off)
+            self._topics.setdefault(l_topic, 0)
+
+        l_out = [struct.pack('>ii', 1, KAFKA_NODE_ID), self._string(value=BENCH_HOST), struct.pack('>i', self.port)]
+        if version >= 1:
+            l_out.append(self._string(value=None))                  # rack
+            l_out.append(struct.pack('>i', KAFKA_NODE_ID))          # controller
+        l_out.append(struct.pack('>i', len(self._topics)))
+        for l_topic in self._topics:
+            l_out.append(struct.pack('>h', 0))
+            l_out.append(self._string(value=l_topic))
+            if version >= 1:
+                l_out.append(b'\x00')                               # is_internal
+            l_out.append(struct.pack('>ihiiiii', 1, 0, 0, KAFKA_NODE_ID, 1, KAFKA_NODE_ID, 1))
+            l_out.append(struct.pack('>i', KAFKA_NODE_ID))
+        return b''.join(l_out)
+
+# -------------------------------------------------------------------------------
+    def _message_set(self, *, data):
+        """ Counts messages (format v0/v1) of the message set, returns count """
+        l_cnt = 0
+        l_off = 0
+        l_len = len(data)
+        while l_off + 12 <= l_len:
+            (_, l_size) = struct.unpack_from('>qi', data, l_off)
+            l_off += 12
+            l_msg = data[l_off:l_off+l_size]
+            l_off += l_size
+            if len(l_msg) < l_size or l_size < 14:
+                break
+            (_, l_magic, l_attr) = struct.unpack_from('>iBB', l_msg, 0)
+            l_moff = 6 + (8 if l_magic >= 1 else 0)
+            (l_klen,) = struct.unpack_from('>i', l_msg, l_moff)
+            l_moff += 4 + max(l_klen, 0)
+            (l_vlen,) = struct.unpack_from('>i', l_msg, l_moff)
+            l_moff += 4
+            if l_attr & 0x07 or l_vlen < 0:
+                self.other += 1         # compressed wrapper or null value
+            else:
+                self._sample(payload=l_msg[l_moff:l_moff+l_vlen])
+            l_cnt += 1
+        return l_cnt
+
+# -------------------------------------------------------------------------------
+    def _produce(self, *, version, body):
+        (l_acks, _, l_tcnt) = struct.unpack_from('>hii', body, 0)
+        l_off = 10
+        l_out = [struct.pack('>i', l_tcnt)]
+        for _ in range(l_tcnt):
+            (l_topic, l_off) = self._read_string(data=body, offset=l_off)
+            (l_pcnt,) = struct.unpack_from('>i', body, l_off)
+            l_off += 4
+            l_out.append(self._string(value=l_topic))
+            l_out.append(struct.pack('>i', l_pcnt))
+            for _ in range(l_pcnt):
+                (l_partition, l_size) = struct.unpack_from('>ii', body, l_off)
+                l_off += 8
+                l_cnt = self._message_set(data=body[l_off:l_off+l_size])
+                l_off += l_size
+                l_offset = self._topics.get(l_topic, 0)
+                self._topics[l_topic] = l_offset + l_cnt
+                l_out.append(struct.pack('>ihq', l_partition, 0, l_offset))
+                if version >= 2:
+                    l_out.append(struct.pack('>q', -1))             # log append time
+        if version >= 1:
+            l_out.append(struct.pack('>i', 0))                      # throttle time
+        return (l_acks, b''.join(l_out))
+
+# -------------------------------------------------------------------------------
+    async def _client(self, reader, writer):
+        try:
+            while True:
+                (l_size,) = struct.unpack('>i', await reader.readexactly(4))
+                l_request = memoryview(await reader.readexactly(l_size))
+                (l_key, l_version, l_correlation) = struct.unpack_from('>hhi', l_request, 0)
+                (_, l_off) = self._read_string(data=l_request, offset=8)    # client id
+                l_body = l_request[l_off:]
+                if l_key == KAFKA_PRODUCE:
+                    (l_acks, l_resp) = self._produce(version=l_version, body=l_body)
+                    if not l_acks:
+                        continue
+                elif l_key == KAFKA_METADATA:
+                    l_resp = self._metadata(version=l_version, body=l_body)
+                elif l_key == KAFKA_API_VERSIONS:
+                    l_resp = self._api_versions(version=l_version, body=l_body)
+                else:
+                    # not advertised, client should not send
+                    break
+                writer.write(struct.pack('>ii', len(l_resp)+4, l_correlation) + l_resp)
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+# ===============================================================================
+class ruuvigw_bench(object):
+    QUEUE_SAMPLE_INTERVAL   = 0.005     # sec
+# -------------------------------------------------------------------------------
+    def __init__(self, *, args):
+        self._args = args
+        self._loop = asyncio.get_event_loop()
+        self._sinks = {}
+        if 'influx' in args.sinks:
+            self._sinks['bench_influx'] = bench_influx(name='bench_influx', database='ruuvi_bench')
+        if 'mqtt' in args.sinks:
+            self._sinks['bench_mqtt'] = bench_mqtt(name='bench_mqtt')
+        if 'kafka' in args.sinks:
+            self._sinks['bench_kafka'] = bench_kafka(name='bench_kafka')
+        if not self._sinks:
+            raise ValueError(f'no sinks:{args.sinks}')
+
+        self._main = None
+        self._collector = None
+        self._ruuvitag = None
+        self._sampler = None
+        self._reset()
+
+# -------------------------------------------------------------------------------
+    def _reset(self):
+        """ Starts the measurement period """
+        self._packets = 0
+        self._highwater = {}
+        self._start = time.monotonic()
+        self._cpu = time.process_time()
+        for l_sink in self._sinks.values():
+            l_sink.reset()
+        if self._collector and hasattr(self._collector, 'stats'):
+            # collector statistics of the warmup are not reported
+            if hasattr(self._collector, 'reset_stats'):
+                self._collector.reset_stats()
+            else:
+                self._collector._stats = self._collector._new_stats()
+        ruuvitag_decode.reset_stats()
+        if self._ruuvitag and self._ruuvitag._memo:
+            self._ruuvitag._memo.reset_stats()
+        if self._ruuvitag and self._ruuvitag._ingest_thread:
+            self._collector.reset_ingest_stats()
+            self._ruuvitag._pipeline_stats = self._ruuvitag._new_pipeline_stats()
+
+# -------------------------------------------------------------------------------
+    def _tags(self):
+        """
+        Returns TAGS of the packet source, samples of the unnamed tags are not written
+        replay: macs of the manufacturer data found in the capture
+        """
+        if self._args.collector in ('synth', 'emulator'):
+            l_macs = [SYNTH_MAC_BASE + l_idx for l_idx in range(self._args.tags)]
+        else:
+            l_replay = ruuvitag_replay(loop=self._loop, callback=self._count_bledata, filename=self._args.replay)
+            l_macs = set()
+            with open(self._args.replay, 'rb') as l_fh:
+                l_data = l_fh.read()
+            for (_, l_frame) in l_replay._frames(data=l_data):
+                for l_bledata in l_replay._parse_data(data=l_frame):
+                    l_macs.add(l_bledata.macint)
+            l_macs = sorted(l_macs)
+        return {int_to_mac(l_mac): f'bench{l_idx}' for l_idx, l_mac in enumerate(l_macs)}
+
+# -------------------------------------------------------------------------------
+    def _config(self):
+        """ Returns gateway configuration pointing to the stand-ins """
+        l_args = self._args
+        l_measurement = {
+            'name': 'ruuvi_bench',
+            'calcs': l_args.calc,
+            'OUTPUT': list(self._sinks.keys())
+        }
+        if l_args.no_delta:
+            l_measurement['DELTA'] = {}
+        if l_args.fields:
+            l_measurement['FIELDS'] = {l_field: l_field for l_field in l_args.fields}
+        l_cfg = {
+            'COMMON': {
+                'hostname': 'bench',
+                'topology': l_args.topology
+            },
+            'RUUVI': {
+                'queue_size': l_args.queue_size,
+                'shards': l_args.shards,
+                'MEASUREMENTS': [l_measurement]
+            },
+            'RUUVITAG': {
+                'collector': l_args.collector,
+                'sample_interval': l_args.sample_interval,
+                'whtlist_from_tags': False,
+                'TAGS': self._tags(),
+                'synth_tags': l_args.tags,
+                'synth_rate': l_args.rate,
+                'synth_df3': l_args.df3,
+                'synth_rebroadcasts': l_args.rebroadcasts,
+                'replay_file': l_args.replay,
+                'replay_speed': l_args.speed,
+                'replay_loops': 0,
+                'ingest_thread': l_args.ingest_thread
+            }
+        }
+        if 'bench_influx' in self._sinks:
+            l_cfg[_def.KEY_INFLUX] = [{
+                'name': 'bench_influx',
+                'host': BENCH_HOST,
+                'port': self._sinks['bench_influx'].port,
+                'database': 'ruuvi_bench',
+                'queue_size': l_args.queue_size
+            }]
+        if 'bench_mqtt' in self._sinks:
+            l_cfg[_def.KEY_MQTT] = [{
+                'name': 'bench_mqtt',
+                'client_id': 'bench',
+                'host': BENCH_HOST,
+                'port': self._sinks['bench_mqtt'].port,
+                'topic': 'bench/ruuvi',
+                'qos': l_args.qos,
+                'fulljson': True,       # sample time is needed for the latency
+                'queue_size': l_args.queue_size
+            }]
+        if 'bench_kafka' in self._sinks:
+            l_cfg[_def.KEY_KAFKA_PRODUCER] = [{
+                'name': 'bench_kafka',
+                'client_id': 'bench',
+                'bootstrap_servers': f'{BENCH_HOST}:{self._sinks["bench_kafka"].port}',
+                'PUBTOPIC': ['ruuvi_bench'],
+                'queue_size': l_args.queue_size
+            }]
+        return l_cfg
+
+# -------------------------------------------------------------------------------
+    def _logconfig(self):
+        """ Returns logger configuration, log goes to stderr """
+        return {
+            'version': 1,
+            'disable_existing_loggers': False,
+            'formatters': {
+                'basic': {
+                    'format': '[%(asctime)s.%(msecs)03d %(levelname)-8.8s] %(name)-10.10s %(funcName)-20.20s %(message)s',
+                    'datefmt': '%Y-%m-%d %H:%M:%S'
+                }
+            },
+            'handlers': {
+                'console': {
+                    'class': 'logging.StreamHandler',
+                    'formatter': 'basic',
+                    'stream': 'ext://sys.stderr'
+                }
+            },
+            'root': {
+                'level': self._args.loglevel,
+                'handlers': ['console']
+            }
+        }
+
+# -------------------------------------------------------------------------------
+    def _count_bledata(self, *, func):
+        async def _wrapper(*, bledata):
+            self._packets += 1
+            return await func(bledata=bledata)
+        return _wrapper
+
+# -------------------------------------------------------------------------------
+    def _count_bledatas(self, *, func):
+        async def _wrapper(*, bledatas):
+            self._packets += len(bledatas)
+            return await func(bledatas=bledatas)
+        return _wrapper
+
+# -------------------------------------------------------------------------------
+    def _count_ingest(self, *, func):
+        def _wrapper(*, bledata):
+            self._packets += 1
+            return func(bledata=bledata)
+        return _wrapper
+
+# -------------------------------------------------------------------------------
+    def _instrument(self):
+        """
+        Called when the loop starts, pipeline tasks are created but not yet run
+        Counts the bledatas the collector delivers and starts the queue sampling
+        process topology: collector runs in the worker process, packets are not counted
+        """
+        l_item = self._main._procs.get(_def.RUUVITAG_NAME)
+        if l_item and hasattr(l_item.proc, '_collector'):
+            self._ruuvitag = l_item.proc
+            self._collector = l_item.proc._collector
+            if getattr(self._collector, '_ingest', None):
+                self._collector._ingest = self._count_ingest(func=self._collector._ingest)
+            if getattr(self._collector, '_callback', None):
+                self._collector._callback = self._count_bledata(func=self._collector._callback)
+            if getattr(self._collector, '_batch_callback', None):
+                self._collector._batch_callback = self._count_bledatas(func=self._collector._batch_callback)
+        self._sampler = self._loop.create_task(self._sample_queues())
+
+# -------------------------------------------------------------------------------
+    async def _sample_queues(self):
+        try:
+            while True:
+                for l_name, l_item in self._main._procs.procs.items():
+                    if l_item.queue is not None:
+                        l_size = l_item.queue.qsize()
+                        if l_size > self._highwater.get(l_name, 0):
+                            self._highwater[l_name] = l_size
+                await asyncio.sleep(ruuvigw_bench.QUEUE_SAMPLE_INTERVAL)
+        except asyncio.CancelledError:
+            pass
+
+# -------------------------------------------------------------------------------
+    def _stop(self):
+        self._elapsed = time.monotonic() - self._start
+        self._cpu = time.process_time() - self._cpu
+        self._results = self._get_results()
+        if self._sampler:
+            self._sampler.cancel()
+        self._loop.stop()
+
+# -------------------------------------------------------------------------------
+    @staticmethod
+    def _rss_mb():
+        try:
+            with open('/proc/self/statm') as l_fh:
+                return round(int(l_fh.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 1048576, 1)
+        except:
+            return None
+
+# -------------------------------------------------------------------------------
+    def _get_results(self):
+        l_elapsed = max(self._elapsed, 0.000001)
+        l_sinks = {l_name: l_sink.stats(elapsed=l_elapsed) for l_name, l_sink in self._sinks.items()}
+        l_latencies = []
+        for l_sink in self._sinks.values():
+            l_latencies.extend(l_sink.latencies)
+        l_samples = sum(l_sink.samples for l_sink in self._sinks.values())
+        l_queues = {}
+        for l_name, l_item in self._main._procs.procs.items():
+            if l_item.queue is not None:
+                l_queues[l_name] = {
+                    'maxsize': l_item.queue.maxsize,
+                    'high_water': self._highwater.get(l_name, 0)
+                }
+        l_collector = {}
+        if self._collector and hasattr(self._collector, 'stats'):
+            l_collector = self._collector.stats()
+        l_ingest = {}
+        if self._ruuvitag and self._ruuvitag._ingest_thread:
+            l_ingest = self._ruuvitag.stats()
+
+        return {
+            'benchmark': 'ruuvigw_bench',
+            'version': _def.VERSION,
+            'timestamp': _dt.utcnow().strftime(_def.RUUVI_TIMEFMT),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'parameters': vars(self._args),
+            'elapsed_sec': round(l_elapsed, 3),
+            'packets': self._packets,
+            'packets_per_sec': round(self._packets / l_elapsed, 1),
+            'collector': l_collector,
+            'ingest': l_ingest,
+            'decode': ruuvitag_decode.stats(),
+            'memo': self._ruuvitag._memo.stats() if self._ruuvitag and self._ruuvitag._memo else {},
+            'rings': {l_ring.name: l_ring.stats() for l_ring in self._main._get_rings()},
+            'samples': l_samples,
+            'samples_per_sec': round(l_samples / l_elapsed, 1),
+            'latency_ms': _percentiles(values=l_latencies),
+            'sinks': l_sinks,
+            'queues': l_queues,
+            'cpu_sec': round(self._cpu, 3),
+            'cpu_pct': round(100.0 * self._cpu / l_elapsed, 1),
+            'rss_mb': self._rss_mb(),
+            'max_rss_mb': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1) if resource else None
+        }
+
+# -------------------------------------------------------------------------------
+    def run(self):
+        """ Runs the benchmark, returns results dict """
+        for l_sink in self._sinks.values():
+            self._loop.run_until_complete(l_sink.start())
+
+        l_tmpdir = tempfile.mkdtemp(prefix='ruuvigw_bench_')
+        l_cfgfile = os.path.join(l_tmpdir, 'ruuvigw.json')
+        l_logfile = os.path.join(l_tmpdir, 'ruuvigw_logging.json')
+        with open(l_cfgfile, 'w') as l_fh:
+            json.dump(self._config(), l_fh, indent=2)
+        with open(l_logfile, 'w') as l_fh:
+            json.dump(self._logconfig(), l_fh, indent=2)
+
+        self._results = None
+        try:
+            # gateway prints the configuration to stdout
+            with contextlib.redirect_stdout(sys.stderr):
+                from ruuvigw import main_class
+                self._main = main_class(config_file=l_cfgfile, logconfig_file=l_logfile)
+                self._loop.call_soon(self._instrument)
+                self._loop.call_later(self._args.warmup, self._reset)
+                self._loop.call_later(self._args.warmup + self._args.duration, self._stop)
+                self._main.main_func()
+        finally:
+            for l_sink in self._sinks.values():
+                self._loop.run_until_complete(l_sink.stop())
+            for l_file in (l_cfgfile, l_logfile):
+                with contextlib.suppress(OSError):
+                    os.remove(l_file)
+            with contextlib.suppress(OSError):
+                os.rmdir(l_tmpdir)
+
+        return self._results
+
+# ------------------------------------------------------------------------------
+if __name__ == '__main__':
+    l_parser = argparse.ArgumentParser(prog='ruuvigw_bench.py', description=f'{_def.LONG_PROGRAM_NAME} {_def.VERSION} benchmark')
+    l_parser.add_argument('--collector', help='packet source (default: synth)', choices=['synth', 'replay', 'emulator'], default='synth')
+    l_parser.add_argument('--tags', help='synth, emulator: virtual tags (default: 100)', type=int, default=100)
+    l_parser.add_argument('--rate', help='synth, emulator: advertisements/sec of all tags (default: 100)', type=float, default=100.0)
+    l_parser.add_argument('--df3', help='synth, emulator: share of DF3 tags (default: 0.0)', type=float, default=0.0)
+    l_parser.add_argument('--rebroadcasts', help='synth, emulator: advertisements per measurement (default: 2)', type=int, default=2)
+    l_parser.add_argument('--replay', help='replay: btsnoop or hcidump capture', type=str, default=None)
+    l_parser.add_argument('--speed', help='replay: 0 as fast as possible, N times the captured rate (default: 0)', type=float, default=0.0)
+    l_parser.add_argument('--topology', help='single or process (default: single)', choices=['single', 'process'], default='single')
+    l_parser.add_argument('--shards', help='ruuvi processes with --topology process (default: 1)', type=int, default=1)
+    l_parser.add_argument('--ingest-thread', help='emulator: socket read, parse and decode in a dedicated thread', action='store_true', dest='ingest_thread')
+    l_parser.add_argument('--sinks', help=f'comma separated sinks (default: {",".join(BENCH_SINKS)})', type=lambda x: [s.strip() for s in x.split(',') if s.strip()], default=BENCH_SINKS)
+    l_parser.add_argument('--qos', help='mqtt qos (default: 1)', type=int, choices=[0, 1, 2], default=1)
+    l_parser.add_argument('--queue-size', help='size of the pipeline queues (default: 100)', type=int, default=100, dest='queue_size')
+    l_parser.add_argument('--sample-interval', help='per tag sample interval sec (default: 1.0)', type=float, default=1.0, dest='sample_interval')
+    l_parser.add_argument('--no-delta', help='write every sample, no DELTA filtering', action='store_true', dest='no_delta')
+    l_parser.add_argument('--calc', help='do calculations', action='store_true')
+    l_parser.add_argument('--fields', help='comma separated measurement FIELDS, decoders leave out the others (default: all fields)', type=lambda x: [s.strip() for s in x.split(',') if s.strip()], default=None)
+    l_parser.add_argument('--warmup', help='seconds before the measurement (default: 10)', type=float, default=10.0)
+    l_parser.add_argument('--duration', help='measurement seconds (default: 60)', type=float, default=60.0)
+    l_parser.add_argument('--loglevel', help='log level (default: WARNING)', type=str, default='WARNING')
+    l_parser.add_argument('--output', help='results json file, - for stdout (default: -)', type=str, default='-')
+    l_args = l_parser.parse_args()
+
+    if l_args.collector == 'replay' and not l_args.replay:
+        l_parser.error('--replay required with the replay collector')
+
+    l_results = ruuvigw_bench(args=l_args).run()
+    if not l_results:
+        print('*** benchmark failed', file=sys.stderr)
+        sys.exit(1)
+    if l_args.output == '-':
+        print(json.dumps(l_results, indent=2))
+    else:
+        with open(l_args.output, 'w') as l_fh:
+            json.dump(l_results, l_fh, indent=2)
@@ -0,0 +1,189 @@
+# coding=utf-8
+#-------------------------------------------------------------------------------
+# Name:        ruuvigw_codec.py
+# Purpose:     compact binary records between the ruuvigw processes
+# Copyright:   (c) 2020 TK
+# Licence:     MIT
+#
+# Encodes the samples (ruuvitag --> ruuvi) and the sink items (ruuvi --> sinks)
+# as tagged binary records. Known dict keys are sent as one byte ids, numbers
+# as the smallest fitting struct type. Values decode to the same python types
+# json would give (tuples become lists).
+#
+# Both ends are forked from the same gateway, so KEYS needs no versioning.
+# Append new keys to the end of KEYS.
+#-------------------------------------------------------------------------------
+import struct
+
+KEYS = (
+    # sample
+    'mac', 'datas', 'calcs', '_aioruuvitag',
+    '_df', 'humidity', 'temperature', 'pressure', 'acceleration',
+    'acceleration_x', 'acceleration_y', 'acceleration_z', 'tx_power', 'battery',
+    'movement_counter', 'sequence_number', 'tagid', 'rssi', 'tagname', 'time',
+    'equilibriumVaporPressure', 'absoluteHumidity', 'dewPoint', 'airDensity',
+    'blklist', 'count', 'interval', 'recvtime',
+    # sink item
+    'func', 'jobid', 'json', 'measurement', 'tags', 'fields', 'name', 'dataFormat', 'hostname',
+    'debugReason', 'debugCount', 'debugInterval', 'debugTagCount', 'debugTagInterval', 'debugTagRecvTime'
+)
+KEY_INLINE = 0xFF
+_KEYID = {l_key: l_idx for l_idx, l_key in enumerate(KEYS)}
+
+T_NONE      = 0x00
+T_TRUE      = 0x01
+T_FALSE     = 0x02
+T_INT8      = 0x03
+T_INT16     = 0x04
+T_INT32     = 0x05
+T_INT64     = 0x06
+T_FLOAT     = 0x07
+T_STR8      = 0x08
+T_STR16     = 0x09
+T_LIST      = 0x0A
+T_DICT      = 0x0B
+
+_B = struct.Struct('<B')
+_H = struct.Struct('<H')
+_TB = struct.Struct('<Bb')
+_TH = struct.Struct('<Bh')
+_TI = struct.Struct('<Bi')
+_TQ = struct.Struct('<Bq')
+_TD = struct.Struct('<Bd')
+_TLEN8 = struct.Struct('<BB')
+_TLEN16 = struct.Struct('<BH')
+
+# ------------------------------------------------------------------------------
+def _encode_str(*, value, out):
+    l_raw = value.encode('utf-8')
+    l_len = len(l_raw)
+    if l_len < 0x100:
+        out += _TLEN8.pack(T_STR8, l_len)
+    elif l_len < 0x10000:
+        out += _TLEN16.pack(T_STR16, l_len)
+    else:
+        raise ValueError(f'string too long:{l_len}')
+    out += l_raw
+
+# ------------------------------------------------------------------------------
+def _encode_int(*, value, out):
+    if -0x80 <= value < 0x80:
+        out += _TB.pack(T_INT8, value)
+    elif -0x8000 <= value < 0x8000:
+        out += _TH.pack(T_INT16, value)
+    elif -0x80000000 <= value < 0x80000000:
+        out += _TI.pack(T_INT32, value)
+    else:
+        out += _TQ.pack(T_INT64, value)
+
+# ------------------------------------------------------------------------------
+def _encode(*, value, out):
+    l_type = type(value)
+    if l_type is float:
+        out += _TD.pack(T_FLOAT, value)
+    elif l_type is int:
+        _encode_int(value=value, out=out)
+    elif l_type is str:
+        _encode_str(value=value, out=out)
+    elif l_type is dict:
+        if len(value) >= 0x10000:
+            raise ValueError(f'dict too long:{len(value)}')
+        out += _TLEN16.pack(T_DICT, len(value))
+        for l_key, l_value in value.items():
+            l_id = _KEYID.get(l_key)
+            if l_id is not None:
+                out += _B.pack(l_id)
+            else:
+                l_raw = str(l_key).encode('utf-8')
+                if len(l_raw) >= 0x100:
+                    raise ValueError(f'key too long:{l_key}')
+                out += _TLEN8.pack(KEY_INLINE, len(l_raw))
+                out += l_raw
+            _encode(value=l_value, out=out)
+    elif l_type is list or l_type is tuple:
+        if len(value) >= 0x10000:
+            raise ValueError(f'list too long:{len(value)}')
+        out += _TLEN16.pack(T_LIST, len(value))
+        for l_value in value:
+            _encode(value=l_value, out=out)
+    elif value is None:
+        out += _B.pack(T_NONE)
+    elif value is True:
+        out += _B.pack(T_TRUE)
+    elif value is False:
+        out += _B.pack(T_FALSE)
+    elif isinstance(value, int):
+        _encode_int(value=int(value), out=out)
+    elif isinstance(value, float):
+        out += _TD.pack(T_FLOAT, float(value))
+    elif hasattr(value, 'asdict'):
+        # ruuvitag_sample, ruuvi_item, ruuvi_point
+        _encode(value=value.asdict(), out=out)
+    else:
+        raise ValueError(f'type not supported:{l_type}')
+
+# ------------------------------------------------------------------------------
+def encode(value):
+    """ Returns binary record of the value (dict, list, str, int, float, bool, None or object with asdict()) """
+    l_out = bytearray()
+    _encode(value=value, out=l_out)
+    return bytes(l_out)
+
+# ------------------------------------------------------------------------------
+def _decode(*, data, pos):
+    l_tag = data[pos]
+    pos += 1
+    if l_tag == T_FLOAT:
+        return (struct.unpack_from('<d', data, pos)[0], pos+8)
+    if l_tag == T_INT8:
+        return (struct.unpack_from('<b', data, pos)[0], pos+1)
+    if l_tag == T_INT16:
+        return (struct.unpack_from('<h', data, pos)[0], pos+2)
+    if l_tag == T_STR8:
+        l_end = pos + 1 + data[pos]
+        return (str(data[pos+1:l_end], 'utf-8'), l_end)
+    if l_tag == T_DICT:
+        l_cnt = _H.unpack_from(data, pos)[0]
+        pos += 2
+        l_dict = {}
+        for _ in range(l_cnt):
+            l_id = data[pos]
+            pos += 1
+            if l_id == KEY_INLINE:
+                l_end = pos + 1 + data[pos]
+                l_key = str(data[pos+1:l_end], 'utf-8')
+                pos = l_end
+            else:
+                l_key = KEYS[l_id]
+            (l_dict[l_key], pos) = _decode(data=data, pos=pos)
+        return (l_dict, pos)
+    if l_tag == T_LIST:
+        l_cnt = _H.unpack_from(data, pos)[0]
+        pos += 2
+        l_list = []
+        for _ in range(l_cnt):
+            (l_value, pos) = _decode(data=data, pos=pos)
+            l_list.append(l_value)
+        return (l_list, pos)
+    if l_tag == T_INT32:
+        return (struct.unpack_from('<i', data, pos)[0], pos+4)
+    if l_tag == T_INT64:
+        return (struct.unpack_from('<q', data, pos)[0], pos+8)
+    if l_tag == T_STR16:
+        l_end = pos + 2 + _H.unpack_from(data, pos)[0]
+        return (str(data[pos+2:l_end], 'utf-8'), l_end)
+    if l_tag == T_NONE:
+        return (None, pos)
+    if l_tag == T_TRUE:
+        return (True, pos)
+    if l_tag == T_FALSE:
+        return (False, pos)
+    raise ValueError(f'unknown tag:{l_tag:#04x} pos:{pos-1}')
+
+# ------------------------------------------------------------------------------
+def decode(data):
+    """ Returns value of the binary record (bytes or memoryview) """
+    (l_value, l_pos) = _decode(data=data, pos=0)
+    if l_pos != len(data):
+        raise ValueError(f'trailing data:{len(data)-l_pos} bytes')
+    return l_value
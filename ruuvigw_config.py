@@ -50,6 +50,35 @@ class config_reader(object):
             return None
         return None
 
+# -------------------------------------------------------------------------------
+    def decode_fields(self):
+        """
+        Returns union of the ruuvitag fields used by the RUUVI MEASUREMENTS (FIELDS, DELTA, MAXDELTA, tagname, _df)
+        and the calculations, sorted list
+        None - all fields are needed: measurement without FIELDS or the ruuvitags are not sent to the RUUVI
+        """
+        l_ruuvitag = self.get_cfg(section=_def.KEY_RUUVITAG)
+        l_ruuvi = self.get_cfg(section=_def.KEY_RUUVI)
+        if not l_ruuvitag or not l_ruuvi:
+            return None
+        if l_ruuvitag.get('ruuviname', _def.RUUVITAG_RUUVINAME) != l_ruuvi.get('name', _def.RUUVI_NAME):
+            return None
+
+        l_fields = {'_df', 'tagname'}
+        l_calc_fields = {'temperature', 'humidity', 'pressure'}
+        if l_ruuvitag.get('calc', _def.RUUVITAG_CALC):
+            l_fields |= l_calc_fields
+        for l_meas in l_ruuvi.get('MEASUREMENTS', []):
+            l_meafields = l_meas.get('FIELDS', None)
+            if not l_meafields:
+                return None
+            l_fields |= set(l_meafields.keys())
+            l_fields |= set(l_meas.get('DELTA', _def.RUUVI_DELTA).keys())
+            l_fields |= set(l_meas.get('MAXDELTA', _def.RUUVI_MAXDELTA).keys())
+            if l_meas.get('calcs', _def.RUUVI_CALCS):
+                l_fields |= l_calc_fields
+        return sorted(l_fields)
+
 # ------------------------------------------------------------------------------
     def _readjson(self, *,
         configfile
@@ -93,6 +122,9 @@ class config_reader(object):
         l_ruuvi = l_cfg.get(_def.KEY_RUUVI, None)
         if not l_ruuvi:
             raise ValueError(f'[{_def.KEY_RUUVI}] configuration required')
+        l_shards = l_ruuvi.get('shards', _def.RUUVI_SHARDS)
+        if not isinstance(l_shards, int) or l_shards < 1:
+            raise ValueError(f'[{_def.KEY_RUUVI}] shards:{l_shards} must be int >= 1')
 
         # RUUVITAG
         l_ruuvitag = l_cfg.get(_def.KEY_RUUVITAG, None)
@@ -113,6 +145,9 @@ class config_reader(object):
             l_hostname = socket.getfqdn().split('.', 1)[0]
             l_common['hostname'] = l_hostname
             l_common['hostname_resolved'] = True
+        l_topology = l_common.get('topology', _def.COMMON_TOPOLOGY)
+        if l_topology not in _def.COMMON_TOPOLOGIES:
+            raise ValueError(f'[{_def.KEY_COMMON}] topology:{l_topology} not in {_def.COMMON_TOPOLOGIES}')
 
         # print(f'common:{l_common}')
         return l_common
@@ -404,6 +439,11 @@ class config_reader(object):
                     print (f'nameserver[{l_idx}]:          {l_nameserver}')
             else:
                 print (f'nameserver:             using system dns server')
+            l_topology = l_common.get('topology', _def.COMMON_TOPOLOGY)
+            print (f'topology:               {l_topology}')
+            if l_topology == 'process':
+                print (f'''   ring size:           {l_common.get('ring_size', _def.COMMON_RING_SIZE)} KB''')
+                print (f'''   restart delay:       {l_common.get('restart_delay', _def.COMMON_RESTART_DELAY)} sec''')
             print ('')
 
         l_influxs = self.get_cfg(section=_def.KEY_INFLUX)
@@ -543,6 +583,37 @@ class config_reader(object):
             print ('sample interval:        {0:.1f} sec'.format(l_ruuvitag.get('sample_interval', _def.RUUVITAG_SAMPLE_INTERVAL)))
             print ('device timeout:         {0:.1f} sec'.format(l_ruuvitag.get('device_timeout', _def.RUUVITAG_DEVICE_TIMEOUT)))
             print ('restart ble device:     {0:s}'.format(str(l_ruuvitag.get('device_reset', _def.RUUVITAG_DEVICE_RESET))))
+            print ('receive batch:          {0:d}'.format(l_ruuvitag.get('recv_batch', _def.RUUVITAG_RECV_BATCH)))
+            l_ingest = l_ruuvitag.get('ingest_thread', _def.RUUVITAG_INGEST_THREAD)
+            print ('ingest thread:          {0:s}'.format(str(l_ingest)))
+            if l_ingest:
+                print ('   ingest ring:         {0:d} batches'.format(l_ruuvitag.get('ingest_ring', _def.RUUVITAG_INGEST_RING)))
+            print ('kernel bpf filter:      {0:s}'.format(str(l_ruuvitag.get('bpf_filter', _def.RUUVITAG_BPF_FILTER))))
+            print ('   bpf whitelist:       {0:s}'.format(str(l_ruuvitag.get('bpf_whtlist', _def.RUUVITAG_BPF_WHTLIST))))
+            print ('controller accept list: {0:s}'.format(str(l_ruuvitag.get('accept_list', _def.RUUVITAG_ACCEPT_LIST))))
+            print ('scan type:              {0:s}'.format(l_ruuvitag.get('scan_type', _def.RUUVITAG_SCAN_TYPE)))
+            print ('scan interval/window:   {0:.1f}/{1:.1f} ms'.format(l_ruuvitag.get('scan_interval', _def.RUUVITAG_SCAN_INTERVAL), l_ruuvitag.get('scan_window', _def.RUUVITAG_SCAN_WINDOW)))
+            print ('adaptive scan:          {0:s}'.format(str(l_ruuvitag.get('scan_adaptive', _def.RUUVITAG_SCAN_ADAPTIVE))))
+            l_devices = l_ruuvitag.get('devices', _def.RUUVITAG_DEVICES)
+            if l_devices:
+                print ('devices:                {0:s}'.format(', '.join(l_devices)))
+                print ('   merge hold:          {0:.2f} sec'.format(l_ruuvitag.get('merge_hold', _def.RUUVITAG_MERGE_HOLD)))
+            print ('suppress rebroadcasts:  {0:s}'.format(str(l_ruuvitag.get('seq_dedup', _def.RUUVITAG_SEQ_DEDUP))))
+            print ('   sequence table size: {0:d}'.format(l_ruuvitag.get('seq_table_size', _def.RUUVITAG_SEQ_TABLE_SIZE)))
+            print ('decode memo size:       {0:d}'.format(l_ruuvitag.get('memo_size', _def.RUUVITAG_MEMO_SIZE)))
+            l_record = l_ruuvitag.get('record', _def.RUUVITAG_RECORD)
+            if l_record:
+                print ('record btsnoop:         {0:s}'.format(l_record))
+                print ('   rotate:              {0} MB, {1} files'.format(l_ruuvitag.get('record_size', _def.RUUVITAG_RECORD_SIZE), l_ruuvitag.get('record_files', _def.RUUVITAG_RECORD_FILES)))
+            l_replay = l_ruuvitag.get('replay_file', _def.RUUVITAG_REPLAY_FILE)
+            if l_replay:
+                print ('replay capture:         {0:s}'.format(l_replay))
+                print ('   speed/loops:         {0}/{1}'.format(l_ruuvitag.get('replay_speed', _def.RUUVITAG_REPLAY_SPEED) or 'max', l_ruuvitag.get('replay_loops', _def.RUUVITAG_REPLAY_LOOPS) or 'forever'))
+            if l_ruuvitag.get('collector', _def.RUUVITAG_COLLECTOR).startswith(('synth', 'emulator')):
+                print ('synthetic tags:         {0:d}'.format(l_ruuvitag.get('synth_tags', _def.RUUVITAG_SYNTH_TAGS)))
+                print ('   rate:                {0:.1f} /sec'.format(l_ruuvitag.get('synth_rate', _def.RUUVITAG_SYNTH_RATE)))
+                print ('   df3 share:           {0:.2f}'.format(l_ruuvitag.get('synth_df3', _def.RUUVITAG_SYNTH_DF3)))
+                print ('   rebroadcasts:        {0:d}'.format(l_ruuvitag.get('synth_rebroadcasts', _def.RUUVITAG_SYNTH_REBROADCASTS)))
             l_calc = l_ruuvitag.get('calc', _def.RUUVITAG_CALC)
             print ('do calculations:        {0:s}'.format(str(l_calc)))
             if l_calc:
@@ -595,6 +666,13 @@ class config_reader(object):
                         l_tag = ''
                         
                 print('')
+            l_keys = l_ruuvitag.get('KEYS', None)
+            if l_keys:
+                print ('DF8 KEYS TAG MAC')
+                print ('-'*(_def.SEPARATOR_LENGTH))
+                for l_item in l_keys:
+                    print ('{0}'.format(l_item))
+                print ('')
             # l_minmax = l_ruuvitag.get('MINMAX', _def.RUUVITAG_MINMAX)
             # if l_minmax:
             #     print ('MINMAX                 MIN      MAX')
@@ -610,6 +688,7 @@ class config_reader(object):
             print ('RUUVI: {0}'.format(l_ruuvi.get('name', _def.RUUVI_NAME)))
             print ('-'*_def.SEPARATOR_LENGTH)
             print ('max interval:           {0:.1f}'.format(l_ruuvi.get('max_interval', _def.RUUVI_MAX_INTERVAL)))
+            print (f'''shards:                 {l_ruuvi.get('shards', _def.RUUVI_SHARDS)}''')
             # print ('write lastdata int:  {0:d} s'.format(l_ruuvi.get('write_lastdata_int', _def.RUUVI_WRITE_LASTDATA_INT)))
             # print ('write lastdata cnt:  {0:d}'.format(l_ruuvi.get('write_lastdata_cnt', _def.RUUVI_WRITE_LASTDATA_CNT)))
 
@@ -35,6 +35,10 @@ COMMON_SCHEDULER_INSTANCES = 50
 COMMON_FBQUEUE_SIZE = 10
 COMMON_NAMESERVERS = []
 COMMON_HOSTNAME = '' 
+COMMON_TOPOLOGY = 'single'
+COMMON_TOPOLOGIES = ['single', 'process']
+COMMON_RING_SIZE = 1024             # KB
+COMMON_RESTART_DELAY = 5.0          # sec
 
 # INFLUX
 INFLUX_ENABLE = True
@@ -155,6 +159,7 @@ RUUVI_WRITE_LASTDATA_DIFF = 10.0
 RUUVI_WRITE_LASTDATA_DELAY = 10.0
 RUUVI_WRITE_LASTDATA_CNT = 40
 RUUVI_QUEUE_SIZE = 100
+RUUVI_SHARDS = 1
 RUUVI_DEBUG = False
 RUUVI_PRECISION = 2
 RUUVI_ROUND = {
@@ -203,6 +208,31 @@ RUUVITAG_DEVICE_TIMEOUT = 10.0
 # RUUVITAG_SUDO = False
 RUUVITAG_DEVICE_RESET = False
 RUUVITAG_WHTLIST_FROM_TAGS = True
+RUUVITAG_RECV_BATCH = 0
+RUUVITAG_INGEST_THREAD = False
+RUUVITAG_INGEST_RING = 1024
+RUUVITAG_BPF_FILTER = False
+RUUVITAG_BPF_WHTLIST = False
+RUUVITAG_ACCEPT_LIST = False
+RUUVITAG_SCAN_TYPE = 'active'
+RUUVITAG_SCAN_INTERVAL = 10.0
+RUUVITAG_SCAN_WINDOW = 10.0
+RUUVITAG_SCAN_ADAPTIVE = False
+RUUVITAG_DEVICES = []
+RUUVITAG_MERGE_HOLD = 0.2
+RUUVITAG_SEQ_DEDUP = True
+RUUVITAG_SEQ_TABLE_SIZE = 1024
+RUUVITAG_MEMO_SIZE = 1024
+RUUVITAG_RECORD = None
+RUUVITAG_RECORD_SIZE = 10
+RUUVITAG_RECORD_FILES = 5
+RUUVITAG_REPLAY_FILE = None
+RUUVITAG_REPLAY_SPEED = 0
+RUUVITAG_REPLAY_LOOPS = 1
+RUUVITAG_SYNTH_TAGS = 100
+RUUVITAG_SYNTH_RATE = 100.0
+RUUVITAG_SYNTH_DF3 = 0.0
+RUUVITAG_SYNTH_REBROADCASTS = 2
 # RUUVITAG_MINMAX = {
 #     "temperature": {
 #         "min": -50.0,
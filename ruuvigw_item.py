@@ -0,0 +1,177 @@
+# coding=utf-8
+#-------------------------------------------------------------------------------
+# Name:        ruuvigw_item.py
+# Purpose:     immutable ruuvi sink items
+# Copyright:   (c) 2020 TK
+# Licence:     MIT
+#
+# ruuvi_aioclient puts one ruuvi_item per measurement to the sink queues, the
+# same item is shared by all the sinks of the measurement (passed by
+# reference, not copied). Items read like the former dicts
+# (item['json'], item.get('jobid'), point['tags']['name']).
+#
+# Each point serialises once per format and caches the result:
+#   json(fields_only=False)     - mqtt fulljson / kafka value
+#   json(fields_only=True)      - mqtt fields without 'time'
+#   to_lineprotocol()           - influx (aioinflux calls it for the objects having it)
+# Sinks must not modify the items, for_resend() returns the rebuffered copy.
+#-------------------------------------------------------------------------------
+import json
+from collections.abc import Mapping
+
+# ==================================================================================
+class ruuvi_point(Mapping):
+    __slots__ = ('_measurement', '_tags', '_fields', '_json', '_fjson', '_line')
+    _keys = ('measurement', 'tags', 'fields')
+#-------------------------------------------------------------------------------
+    def __init__(self, *,
+        measurement,
+        tags,
+        fields
+    ):
+        """
+            measurement - name of the measurement
+            tags - dict of the tags
+            fields - dict of the fields (owned by the point, not modified later)
+        """
+        self._measurement = measurement
+        self._tags = tags
+        self._fields = fields
+        self._json = None
+        self._fjson = None
+        self._line = None
+
+#-------------------------------------------------------------------------------
+    def __repr__(self):
+        return f'ruuvi_point {self.asdict()}'
+
+#-------------------------------------------------------------------------------
+    def __getitem__(self, key):
+        if key == 'measurement':
+            return self._measurement
+        if key == 'tags':
+            return self._tags
+        if key == 'fields':
+            return self._fields
+        raise KeyError(key)
+
+#-------------------------------------------------------------------------------
+    def __iter__(self):
+        return iter(ruuvi_point._keys)
+
+#-------------------------------------------------------------------------------
+    def __len__(self):
+        return len(ruuvi_point._keys)
+
+#-------------------------------------------------------------------------------
+    def asdict(self):
+        return {'measurement': self._measurement, 'tags': self._tags, 'fields': self._fields}
+
+#-------------------------------------------------------------------------------
+    def json(self, *, fields_only=False):
+        """
+        Returns utf-8 json of the point (bytes), serialised once
+            fields_only - only the fields without 'time'
+        """
+        if fields_only:
+            if self._fjson is None:
+                self._fjson = json.dumps({l_key: l_value for l_key, l_value in self._fields.items() if l_key != 'time'}).encode()
+            return self._fjson
+        if self._json is None:
+            self._json = json.dumps(self.asdict()).encode()
+        return self._json
+
+#-------------------------------------------------------------------------------
+    def to_lineprotocol(self):
+        """ Returns influx line protocol of the point (bytes), serialised once """
+        if self._line is None:
+            from aioinflux.serialization.mapping import serialize
+            self._line = serialize(self.asdict())
+        return self._line
+
+#-------------------------------------------------------------------------------
+    @staticmethod
+    def from_dict(point):
+        if isinstance(point, ruuvi_point):
+            return point
+        return ruuvi_point(measurement=point.get('measurement', None), tags=point.get('tags', {}), fields=point.get('fields', {}))
+
+# ==================================================================================
+class ruuvi_item(Mapping):
+    __slots__ = ('_func', '_jobid', '_json', '_resend')
+    _keys = ('func', 'jobid', 'json', 'resend')
+#-------------------------------------------------------------------------------
+    def __init__(self, *,
+        func,
+        jobid,
+        json,
+        resend=False
+    ):
+        """
+            func - sink function ('execute_ruuvi')
+            jobid - measurement name / lastdata jobid
+            json - ruuvi_points (tuple) or None
+            resend - rebuffered item (Default: False)
+        """
+        self._func = func
+        self._jobid = jobid
+        self._json = tuple(json) if json is not None else None
+        self._resend = resend
+
+#-------------------------------------------------------------------------------
+    def __repr__(self):
+        return f'ruuvi_item func:{self._func} jobid:{self._jobid} resend:{self._resend} json:{self._json}'
+
+#-------------------------------------------------------------------------------
+    def __getitem__(self, key):
+        if key == 'func':
+            return self._func
+        if key == 'jobid':
+            return self._jobid
+        if key == 'json':
+            return self._json
+        if key == 'resend' and self._resend:
+            return self._resend
+        raise KeyError(key)
+
+#-------------------------------------------------------------------------------
+    def __iter__(self):
+        yield 'func'
+        yield 'jobid'
+        yield 'json'
+        if self._resend:
+            yield 'resend'
+
+#-------------------------------------------------------------------------------
+    def __len__(self):
+        return 4 if self._resend else 3
+
+#-------------------------------------------------------------------------------
+    def asdict(self):
+        """ dict of the item, used by ruuvigw_codec """
+        l_dict = {
+            'func': self._func,
+            'jobid': self._jobid,
+            'json': [l_point.asdict() for l_point in self._json] if self._json is not None else None
+        }
+        if self._resend:
+            l_dict['resend'] = self._resend
+        return l_dict
+
+#-------------------------------------------------------------------------------
+    def for_resend(self):
+        """ Returns copy of the item marked as resend, cached payloads of the points are kept """
+        return ruuvi_item(func=self._func, jobid=self._jobid, json=self._json, resend=True)
+
+#-------------------------------------------------------------------------------
+    @staticmethod
+    def from_dict(item):
+        """ Returns ruuvi_item of the item dict (json string or shm ring), ruuvi_item returned as is """
+        if isinstance(item, ruuvi_item):
+            return item
+        l_json = item.get('json', None)
+        if l_json is not None:
+            if not isinstance(l_json, (list, tuple)):
+                l_json = [l_json]
+            l_json = [ruuvi_point.from_dict(l_point) for l_point in l_json]
+        return ruuvi_item(func=item.get('func', None), jobid=item.get('jobid', None), json=l_json, resend=item.get('resend', False))
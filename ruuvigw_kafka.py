@@ -8,7 +8,6 @@
 import logging
 logger = logging.getLogger('kafka')
 
-import copy
 import json
 import time
 import asyncio
@@ -16,6 +15,7 @@ from string import Template
 
 from mixinQueue import mixinAioQueue as _mixinQueue
 from kafka_aioproducer import kafka_aioproducer as _producer
+from ruuvigw_item import ruuvi_item
 import ruuvigw_defaults as _def
 
 # ==================================================================================
@@ -102,7 +102,7 @@ class ruuvigw_kafka(_producer, _mixinQueue):
                 l_item = await self.queue_get(inqueue=self._inqueue)
                 if super().is_connected():
                     if l_item:
-                        l_item = l_item if isinstance(l_item, dict) else json.loads(l_item)
+                        l_item = json.loads(l_item) if isinstance(l_item, (str, bytes)) else l_item
                         for l_topic in self._cfg.get('PUBTOPIC', _def.KAFKA_PUBTOPIC):
                             if await self._execute_ruuvi(
                                 topic=l_topic,
@@ -159,18 +159,16 @@ class ruuvigw_kafka(_producer, _mixinQueue):
             logger.error(f'{self._name} item: {item}')
             return False
 
-        item = copy.deepcopy(item)
         logger.debug(f'{self._name} topic:{topic} type:{type(item)} item:{item}')
 
         try:
-            l_json = item['json']
-            if not isinstance(l_json, list):
-                l_json = [l_json]
+            # item is shared with the other sinks, not modified
+            l_json = ruuvi_item.from_dict(item)['json'] or ()
             for l_item in l_json:
                 l_topic = self._substitute(template=topic, values=l_item)
                 if await self.send(
                     topic=l_topic, 
-                    value=str(l_item).replace('\'', '\"'),
+                    value=l_item.json(fields_only=False),
                     key=self._substitute(template=key, values=l_item)
                 ):
                     return True
@@ -8,11 +8,11 @@
 import logging
 logger = logging.getLogger('mqtt')
 
-import copy
 import asyncio
 from collections import defaultdict
 
 from mqtt_aioclient import mqtt_aioclient as _mqtt
+from ruuvigw_item import ruuvi_item
 import ruuvigw_defaults as _def
 
 # ==================================================================================
@@ -180,57 +180,28 @@ class ruuvi_mqtt(_mqtt):
             if not item:
                 logger.error(f'{self._name} topic:{topic} item: {item}')
                 return
-            item = copy.deepcopy(item)
+            # item is shared with the other sinks, not modified, payloads are cached by the points
+            item = ruuvi_item.from_dict(item)
             logger.debug(f'{self._name} type:{type(item)}')
 
             l_heartbeat = False
             try:
                 l_jobid = item.get('jobid', None)
-                l_json = item['json']
-                if isinstance(l_json, list):
-                    for l_item in l_json:
-                        l_topic = topic + '/' + l_item['tags']['name']
-                        if await self._ruuvi_announce(item=l_item, topic=l_topic):
-                            await asyncio.sleep(self._anndelay)
-                        l_payload = None
-                        if not self._cfg.get('fulljson', _def.MQTT_FULLJSON):
-                            l_payload = l_item['fields']
-                            try:
-                                del l_payload['time']
-                            except:
-                                pass
-                        else:
-                            l_payload = l_item
-
-                        if not await self._publish(
-                            topic=l_topic, 
-                            payload=str(l_payload).replace('\'', '\"').encode(),
-                            qos=self._cfg.get('qos', _def.MQTT_QOS),
-                            retain=self._cfg.get('retain', _def.MQTT_RETAIN)
-                        ):
-                            logger.warning(f'{self._name} jobid:{l_jobid} publish failed topic:{l_topic} payload:{l_payload}')
-                        else:
-                            l_heartbeat = True
-                else:
-                    l_topic = topic + '/' + l_json['tags']['name']
+                l_fields_only = not self._cfg.get('fulljson', _def.MQTT_FULLJSON)
+                for l_item in item['json'] or ():
+                    l_topic = topic + '/' + l_item['tags']['name']
                     if await self._ruuvi_announce(item=l_item, topic=l_topic):
                         await asyncio.sleep(self._anndelay)
-                    l_payload = None
-                    if not self._cfg.get('fulljson', _def.MQTT_FULLJSON):
-                        l_payload = l_json
-                        try:
-                            del l_payload['time']
-                        except:
-                            pass
-                    else:
-                        l_payload = l_json
+                    # fields without 'time' or the full point
+                    l_payload = l_item.json(fields_only=l_fields_only)
+
                     if not await self._publish(
                         topic=l_topic, 
-                        payload=str(l_payload).replace('\'', '\"').encode(),
+                        payload=l_payload,
                         qos=self._cfg.get('qos', _def.MQTT_QOS),
                         retain=self._cfg.get('retain', _def.MQTT_RETAIN)
                     ):
-                        logger.warning(f'{self._name} jobid:{l_jobid} publish failed topic:{topic} payload:{l_payload}')
+                        logger.warning(f'{self._name} jobid:{l_jobid} publish failed topic:{l_topic} payload:{l_payload}')
                     else:
                         l_heartbeat = True
             except asyncio.CancelledError:
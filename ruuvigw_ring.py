@@ -0,0 +1,401 @@
+# coding=utf-8
+#-------------------------------------------------------------------------------
+# Name:        ruuvigw_ring.py
+# Purpose:     shared memory ring buffers between the ruuvigw processes
+# Copyright:   (c) 2020 TK
+# Licence:     MIT
+#
+# shm_ring is a single producer / single consumer ring of length prefixed
+# records in shared memory. Producer owns the head, consumer the tail. Records
+# which do not fit are dropped and counted by the producer. Ring is created by
+# the parent before the workers are forked and survives worker restarts,
+# restarted consumer continues from its tail.
+#
+# Ordering: plain stores to the shared memory are not ordered between the
+# processes on weakly ordered CPUs (ARM, the Raspberry Pi), and 64bit header
+# words may be torn on 32bit ones. The header (head, tail, waiting, counters)
+# is therefore read and written only under the ring lock, whose acquire and
+# release are memory barriers:
+# - producer copies the record in, then publishes the head under the lock,
+#   so a consumer seeing the head sees the record bytes
+# - consumer copies the records out, then publishes the tail under the lock,
+#   so the producer reuses the space only after it has been read
+# - waiting flag and the head are checked under the same lock, no lost wakeup
+# Record bytes are copied outside the lock, only the header stores are locked.
+# A worker killed while holding the lock would leave it held, the lock is
+# taken over after LOCK_TIMEOUT.
+#
+# Consumer is woken up through a pipe, producer writes to it only if the
+# consumer has announced it is waiting, ie. once per batch.
+#
+# ring_queue adapts the ring to the asyncio.Queue methods the components use
+# (put, put_nowait, get, qsize), records are encoded with ruuvigw_codec.
+# Consumer with several producers (sharded ruuvi) has one ring per producer and
+# reads all of them, every ring keeps its own order.
+#
+# shard_queue routes the samples to the ruuvi shards by mac, every sample of a
+# tag goes through the same ring and the same shard.
+#-------------------------------------------------------------------------------
+import logging
+logger = logging.getLogger('ruuvigw')
+
+import os
+import struct
+import asyncio
+import multiprocessing
+from collections import deque
+
+import ruuvigw_codec as _codec
+
+# ==============================================================================
+class shm_ring(object):
+    HEADER_SIZE         = 64
+    # head, tail, waiting, written, read, dropped
+    HEADER              = struct.Struct('<QQQQQQ')
+    OFFSET_HEAD         = 0
+    OFFSET_TAIL         = 8
+    OFFSET_WAITING      = 16
+    OFFSET_WRITTEN      = 24
+    OFFSET_READ         = 32
+    OFFSET_DROPPED      = 40
+    U64                 = struct.Struct('<Q')
+    LEN                 = struct.Struct('<I')
+    LOCK_TIMEOUT        = 1.0       # sec, lock held longer is taken over (holder killed)
+# ------------------------------------------------------------------------------
+    def __init__(self, *,
+        name,
+        size=1048576
+    ):
+        """
+        name - name of the consumer
+        size - ring size in bytes
+        """
+        if size < 1024:
+            raise ValueError(f'{name} ring size:{size} < 1024')
+        self._name = name
+        self._size = int(size)
+        self._shm = multiprocessing.RawArray('B', shm_ring.HEADER_SIZE + self._size)
+        self._mv = memoryview(self._shm).cast('B')
+        self._data = self._mv[shm_ring.HEADER_SIZE:]
+        self._lock = multiprocessing.Lock()
+        (self._rfd, self._wfd) = os.pipe()
+        os.set_blocking(self._rfd, False)
+        os.set_blocking(self._wfd, False)
+
+# ------------------------------------------------------------------------------
+    def __repr__(self):
+        return f'shm_ring name:{self._name} size:{self._size}'
+
+# ------------------------------------------------------------------------------
+    @property
+    def name(self):
+        return self._name
+
+# ------------------------------------------------------------------------------
+    @property
+    def size(self):
+        return self._size
+
+# ------------------------------------------------------------------------------
+    @property
+    def fileno(self):
+        """ Readable when the producer has woken up the consumer """
+        return self._rfd
+
+# ------------------------------------------------------------------------------
+    def _get(self, *, offset):
+        return shm_ring.U64.unpack_from(self._mv, offset)[0]
+
+# ------------------------------------------------------------------------------
+    def _set(self, *, offset, value):
+        shm_ring.U64.pack_into(self._mv, offset, value)
+
+# ------------------------------------------------------------------------------
+    def _acquire(self):
+        """
+        Acquires the ring lock, lock left held by a killed worker is taken over
+        Taken over lock is released by the caller as usual, which makes it usable again
+        """
+        if not self._lock.acquire(timeout=shm_ring.LOCK_TIMEOUT):
+            logger.error(f'*** {self._name} ring lock taken over')
+
+# ------------------------------------------------------------------------------
+    def _copy_in(self, *, pos, data):
+        l_len = len(data)
+        l_first = min(l_len, self._size - pos)
+        self._data[pos:pos+l_first] = data[:l_first]
+        if l_first < l_len:
+            self._data[:l_len-l_first] = data[l_first:]
+
+# ------------------------------------------------------------------------------
+    def _copy_out(self, *, pos, length):
+        l_first = min(length, self._size - pos)
+        if l_first == length:
+            return bytes(self._data[pos:pos+length])
+        return bytes(self._data[pos:pos+l_first]) + bytes(self._data[:length-l_first])
+
+# ------------------------------------------------------------------------------
+    def write(self, *, data):
+        """
+        Writes record to the ring (producer)
+        Returns False if the record was dropped because the ring is full
+        """
+        l_need = shm_ring.LEN.size + len(data)
+        self._acquire()
+        try:
+            l_head = self._get(offset=shm_ring.OFFSET_HEAD)
+            l_tail = self._get(offset=shm_ring.OFFSET_TAIL)
+            if (l_head - l_tail + l_need) > self._size:
+                self._set(offset=shm_ring.OFFSET_DROPPED, value=self._get(offset=shm_ring.OFFSET_DROPPED)+1)
+                return False
+        finally:
+            self._lock.release()
+
+        self._copy_in(pos=(l_head % self._size), data=shm_ring.LEN.pack(len(data)) + data)
+        # head is published only after the record is complete, release orders the record before it
+        self._acquire()
+        try:
+            self._set(offset=shm_ring.OFFSET_HEAD, value=l_head+l_need)
+            self._set(offset=shm_ring.OFFSET_WRITTEN, value=self._get(offset=shm_ring.OFFSET_WRITTEN)+1)
+            l_wakeup = bool(self._get(offset=shm_ring.OFFSET_WAITING))
+            if l_wakeup:
+                self._set(offset=shm_ring.OFFSET_WAITING, value=0)
+        finally:
+            self._lock.release()
+        if l_wakeup:
+            try:
+                os.write(self._wfd, b'\x01')
+            except (BlockingIOError, InterruptedError):
+                pass
+        return True
+
+# ------------------------------------------------------------------------------
+    def read(self):
+        """
+        Reads all records from the ring (consumer)
+        Returns list of records
+        """
+        l_records = []
+        self._acquire()
+        try:
+            l_head = self._get(offset=shm_ring.OFFSET_HEAD)
+            l_tail = self._get(offset=shm_ring.OFFSET_TAIL)
+        finally:
+            self._lock.release()
+        while l_tail < l_head:
+            l_pos = l_tail % self._size
+            (l_len,) = shm_ring.LEN.unpack(self._copy_out(pos=l_pos, length=shm_ring.LEN.size))
+            l_records.append(self._copy_out(pos=((l_pos + shm_ring.LEN.size) % self._size), length=l_len))
+            l_tail += shm_ring.LEN.size + l_len
+        if l_records:
+            # tail is published only after the records are copied out
+            self._acquire()
+            try:
+                self._set(offset=shm_ring.OFFSET_TAIL, value=l_tail)
+                self._set(offset=shm_ring.OFFSET_READ, value=self._get(offset=shm_ring.OFFSET_READ)+len(l_records))
+            finally:
+                self._lock.release()
+        return l_records
+
+# ------------------------------------------------------------------------------
+    def waiting(self):
+        """
+        Announces that the consumer is going to wait for the wakeup (consumer)
+        Returns False if records arrived meanwhile and the consumer should not wait
+        """
+        self._acquire()
+        try:
+            if self._get(offset=shm_ring.OFFSET_HEAD) != self._get(offset=shm_ring.OFFSET_TAIL):
+                return False
+            self._set(offset=shm_ring.OFFSET_WAITING, value=1)
+            return True
+        finally:
+            self._lock.release()
+
+# ------------------------------------------------------------------------------
+    def clear_wakeup(self):
+        """ Reads wakeup bytes from the pipe (consumer) """
+        try:
+            while os.read(self._rfd, 64):
+                pass
+        except (BlockingIOError, InterruptedError):
+            pass
+
+# ------------------------------------------------------------------------------
+    def pending(self):
+        """ Returns records written but not yet read """
+        self._acquire()
+        try:
+            return self._get(offset=shm_ring.OFFSET_WRITTEN) - self._get(offset=shm_ring.OFFSET_READ)
+        finally:
+            self._lock.release()
+
+# ------------------------------------------------------------------------------
+    def stats(self):
+        """ Returns ring counters since the ring was created """
+        self._acquire()
+        try:
+            (l_head, l_tail, _, l_written, l_read, l_dropped) = shm_ring.HEADER.unpack_from(self._mv, 0)
+        finally:
+            self._lock.release()
+        return {
+            'size': self._size,
+            'used': l_head - l_tail,
+            'written': l_written,
+            'read': l_read,
+            'pending': l_written - l_read,
+            'dropped': l_dropped
+        }
+
+# ==============================================================================
+class ring_queue(object):
+    """
+    asyncio.Queue like view to the shm_ring(s)
+    Producer does not wait, records are dropped if the ring is full
+    """
+    WAIT_TIMEOUT = 0.1
+    _memo = (None, None)
+# ------------------------------------------------------------------------------
+    def __init__(self, *,
+        rings
+    ):
+        """
+        rings - list of shm_ring, producer writes to the first one, consumer reads all
+        """
+        if not rings:
+            raise ValueError('rings missing')
+        self._rings = list(rings)
+        self._ring = self._rings[0]
+        self._items = deque()
+        self._event = None
+
+# ------------------------------------------------------------------------------
+    def __repr__(self):
+        return f'ring_queue rings:{self._rings}'
+
+# ------------------------------------------------------------------------------
+    @property
+    def maxsize(self):
+        return sum(l_ring.size for l_ring in self._rings)
+
+# ------------------------------------------------------------------------------
+    def qsize(self):
+        return sum(l_ring.pending() for l_ring in self._rings) + len(self._items)
+
+# ------------------------------------------------------------------------------
+    @staticmethod
+    def _encode(data):
+        """ Same item put to several rings (ruuvi outputs) is encoded once """
+        (l_data, l_raw) = ring_queue._memo
+        if data is not l_data:
+            l_raw = _codec.encode(data)
+            ring_queue._memo = (data, l_raw)
+        return l_raw
+
+# ------------------------------------------------------------------------------
+    def put_nowait(self, data):
+        self._ring.write(data=self._encode(data))
+
+# ------------------------------------------------------------------------------
+    async def put(self, data):
+        self.put_nowait(data)
+
+# ------------------------------------------------------------------------------
+    def _wakeup(self, ring):
+        ring.clear_wakeup()
+        self._event.set()
+
+# ------------------------------------------------------------------------------
+    def _read(self):
+        for l_ring in self._rings:
+            for l_record in l_ring.read():
+                try:
+                    self._items.append(_codec.decode(l_record))
+                except:
+                    logger.exception(f'*** {l_ring.name}')
+
+# ------------------------------------------------------------------------------
+    def _waiting(self):
+        """ Announces waiting to every ring, returns False if any of them got records """
+        l_wait = True
+        for l_ring in self._rings:
+            if not l_ring.waiting():
+                l_wait = False
+        return l_wait
+
+# ------------------------------------------------------------------------------
+    async def get(self):
+        if not self._event:
+            self._event = asyncio.Event()
+            for l_ring in self._rings:
+                asyncio.get_event_loop().add_reader(l_ring.fileno, self._wakeup, l_ring)
+        while not self._items:
+            self._read()
+            if self._items:
+                break
+            if self._waiting():
+                self._event.clear()
+                # timeout covers a wakeup lost between the processes
+                try:
+                    await asyncio.wait_for(self._event.wait(), ring_queue.WAIT_TIMEOUT)
+                except asyncio.TimeoutError:
+                    pass
+        return self._items.popleft()
+
+# ------------------------------------------------------------------------------
+    def get_nowait(self):
+        if not self._items:
+            raise asyncio.QueueEmpty()
+        return self._items.popleft()
+
+# ==============================================================================
+class shard_queue(object):
+    """
+    Routes the items to the shard queues by the mac of the item
+    Same mac goes always to the same shard, so the order of a tag is kept
+    """
+# ------------------------------------------------------------------------------
+    def __init__(self, *,
+        queues,
+        key='mac'
+    ):
+        """
+        queues - list of ring_queue, one per shard
+        key - item key to shard by (int)
+        """
+        if not queues:
+            raise ValueError('queues missing')
+        self._queues = list(queues)
+        self._key = key
+
+# ------------------------------------------------------------------------------
+    def __repr__(self):
+        return f'shard_queue key:{self._key} shards:{len(self._queues)}'
+
+# ------------------------------------------------------------------------------
+    @property
+    def maxsize(self):
+        return sum(l_queue.maxsize for l_queue in self._queues)
+
+# ------------------------------------------------------------------------------
+    def qsize(self):
+        return sum(l_queue.qsize() for l_queue in self._queues)
+
+# ------------------------------------------------------------------------------
+    def shard(self, data):
+        """ Returns shard index of the item (dict key or attribute of ruuvitag_sample) """
+        try:
+            l_value = getattr(data, self._key, None)
+            if l_value is None:
+                l_value = data[self._key]
+            return l_value % len(self._queues)
+        except (TypeError, KeyError):
+            return 0
+
+# ------------------------------------------------------------------------------
+    def put_nowait(self, data):
+        self._queues[self.shard(data)].put_nowait(data)
+
+# ------------------------------------------------------------------------------
+    async def put(self, data):
+        self.put_nowait(data)
@@ -0,0 +1,177 @@
+# coding=utf-8
+#-------------------------------------------------------------------------------
+# Name:        ruuvigw_sample_bench.py
+# Purpose:     sample record micro-benchmark
+# Copyright:   (c) 2020 TK
+# Licence:     MIT
+#
+# python3 ruuvigw_sample_bench.py [samples]
+#
+# Compares the per sample cost of the collector --> ruuvi --> sinks handoff:
+#   dict  - outdata dict + json string to ruuvi, json.loads, {**} merges of the
+#           fields, deepcopy + str().replace per mqtt/kafka, influx dict serialised
+#   sample - ruuvitag_sample and ruuvi_item passed by reference, payloads
+#           serialised once per sink format (json, fields json, line protocol)
+# Decoding and the ruuvi delta checks are the same for both and left out.
+# Reports us/sample of the whole path and bytes/sample held by the queues
+# (collector record, sink item) measured with tracemalloc.
+# Payloads of both paths are checked to carry the same values.
+#-------------------------------------------------------------------------------
+import sys
+import copy
+import json
+import time
+import tracemalloc
+from datetime import datetime as _dt, timezone as _tz
+from types import MappingProxyType
+
+from aioinflux.serialization.mapping import serialize as _serialize
+
+from aioruuvitag.ruuvitag_decode import ruuvitag_decode
+from aioruuvitag.ruuvitag_sample import ruuvitag_sample, TIMEFMT
+from aioruuvitag.ruuvitag_calc import ruuvitag_calc as _tagcalc
+from aioruuvitag.ruuvitag_misc import int_to_mac
+from ruuvigw_item import ruuvi_item, ruuvi_point
+
+MFDATA = bytes.fromhex('0516EC5238C574FCE4FD8CFFEC99769A6221CBD71826DAB4')
+MAC = 0xCBD71826DAB4
+TAGNAME = '102livingroom'
+RSSI = -68
+MEASUREMENT = 'ruuvi'
+HOSTNAME = 'bench'
+
+# -------------------------------------------------------------------------------
+def _fields(*, datas):
+    """ ruuvi_aioclient._get_fields without FIELDS, returns new dict """
+    l_fields = {l_key: datas[l_key] for l_key in datas if datas[l_key]}
+    l_fields['time'] = datas['time']
+    return l_fields
+
+# -------------------------------------------------------------------------------
+def _debugs():
+    return {'debugReason': 'max_interval', 'debugCount': 1, 'debugInterval': 1000}
+
+# -------------------------------------------------------------------------------
+def _tags(*, datas):
+    return {'mac': int_to_mac(MAC), 'name': datas['tagname'], 'dataFormat': str(datas['_df']), 'hostname': HOSTNAME}
+
+# -------------------------------------------------------------------------------
+def dict_collector(*, decoded, rtime):
+    l_datas = dict(decoded)
+    l_datas['tagname'] = TAGNAME
+    l_datas['time'] = _dt.utcfromtimestamp(rtime).replace(tzinfo=_tz.utc).strftime(TIMEFMT)
+    l_datas['rssi'] = RSSI
+    return json.dumps({'mac': MAC, 'datas': l_datas})
+
+# -------------------------------------------------------------------------------
+def dict_ruuvi(*, indata):
+    l_datas = json.loads(indata)['datas']
+    l_fields = _fields(datas=l_datas)
+    l_fields = {**l_fields, **_debugs()}
+    l_calcs = {}
+    _tagcalc.calc(datas=l_datas, out=l_calcs)
+    l_fields = {**l_fields, **l_calcs}
+    return {
+        'func': 'execute_ruuvi',
+        'jobid': MEASUREMENT,
+        'json': [{'measurement': MEASUREMENT, 'tags': _tags(datas=l_datas), 'fields': l_fields}]
+    }
+
+# -------------------------------------------------------------------------------
+def dict_sinks(*, item):
+    l_out = []
+    # mqtt
+    l_item = copy.deepcopy(item)
+    for l_point in l_item['json']:
+        l_payload = l_point['fields']
+        del l_payload['time']
+        l_out.append(str(l_payload).replace('\'', '\"').encode())
+    # kafka
+    l_item = copy.deepcopy(item)
+    for l_point in l_item['json']:
+        l_out.append(str(l_point).replace('\'', '\"').encode())
+    # influx
+    l_out.append(_serialize(item['json'][0]))
+    return l_out
+
+# -------------------------------------------------------------------------------
+def sample_collector(*, decoded, rtime):
+    return ruuvitag_sample(mac=MAC, fields=decoded, time=rtime, rssi=RSSI, tagname=TAGNAME)
+
+# -------------------------------------------------------------------------------
+def sample_ruuvi(*, indata):
+    l_fields = _fields(datas=indata)
+    l_fields.update(_debugs())
+    l_calcs = {}
+    _tagcalc.calc(datas=indata, out=l_calcs)
+    l_fields.update(l_calcs)
+    return ruuvi_item(
+        func='execute_ruuvi',
+        jobid=MEASUREMENT,
+        json=[ruuvi_point(measurement=MEASUREMENT, tags=_tags(datas=indata), fields=l_fields)]
+    )
+
+# -------------------------------------------------------------------------------
+def sample_sinks(*, item):
+    l_out = []
+    for l_point in item['json']:
+        l_out.append(l_point.json(fields_only=True))
+        l_out.append(l_point.json(fields_only=False))
+    l_out.append(item['json'][0].to_lineprotocol())
+    return l_out
+
+PATHS = {
+    'dict': (dict_collector, dict_ruuvi, dict_sinks),
+    'sample': (sample_collector, sample_ruuvi, sample_sinks)
+}
+
+# -------------------------------------------------------------------------------
+def check(*, decoded):
+    """ Returns count of the sink payloads differing between the paths """
+    l_rtime = time.time()
+    l_payloads = {}
+    for (l_name, (l_collector, l_ruuvi, l_sinks)) in PATHS.items():
+        l_payloads[l_name] = l_sinks(item=l_ruuvi(indata=l_collector(decoded=decoded, rtime=l_rtime)))
+    l_failed = 0
+    for (l_idx, (l_dict, l_sample)) in enumerate(zip(l_payloads['dict'], l_payloads['sample'])):
+        # line protocol is the same, json compared as values
+        l_same = (l_dict == l_sample) if l_idx == len(l_payloads['dict'])-1 else (json.loads(l_dict) == json.loads(l_sample))
+        if not l_same:
+            l_failed += 1
+            print(f'FAILED payload:{l_idx}')
+            print(f'   dict:  {l_dict}')
+            print(f'   sample:{l_sample}')
+    print(f'payloads: {len(l_payloads["dict"])} checks {l_failed} failed')
+    return l_failed
+
+# -------------------------------------------------------------------------------
+def _measure(*, name, decoded, samples):
+    (l_collector, l_ruuvi, l_sinks) = PATHS[name]
+    l_rtime = time.time()
+    l_start = time.perf_counter()
+    for _ in range(samples):
+        l_sinks(item=l_ruuvi(indata=l_collector(decoded=decoded, rtime=l_rtime)))
+    l_us = (time.perf_counter()-l_start)*1000000/samples
+
+    # records held by the queues
+    tracemalloc.start()
+    l_base = tracemalloc.get_traced_memory()[0]
+    l_records = [l_collector(decoded=decoded, rtime=l_rtime) for _ in range(samples)]
+    l_record_bytes = (tracemalloc.get_traced_memory()[0]-l_base)/samples
+    l_base = tracemalloc.get_traced_memory()[0]
+    l_items = [l_ruuvi(indata=l_record) for l_record in l_records]
+    l_item_bytes = (tracemalloc.get_traced_memory()[0]-l_base)/samples
+    tracemalloc.stop()
+    del l_records, l_items
+    print(f'{name:10s} {l_us:8.2f} us/sample   record:{l_record_bytes:7.0f} bytes   item:{l_item_bytes:7.0f} bytes')
+
+# -------------------------------------------------------------------------------
+if __name__ == '__main__':
+    l_samples = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    # memo keeps the decoded fields read-only
+    l_decoded = MappingProxyType(ruuvitag_decode.decode(mfdata=MFDATA, minmax={}, tagadjustsment=None))
+
+    if check(decoded=l_decoded):
+        sys.exit(1)
+    for l_name in PATHS:
+        _measure(name=l_name, decoded=l_decoded, samples=l_samples)